@@ -5,14 +5,25 @@
 import csv
 import json
 from datetime import datetime
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Union
 from collections import defaultdict,OrderedDict
 # 1. 安装依赖：pip install openai （若使用其他模型，替换为对应 SDK，如 qianfan-sdk）
 from openai import OpenAI
 import os
 from os.path import join
-import statistics
 import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from tx_store import load_address_table
+from next_hop import TOKEN_WHITELIST  # 白名单集合（包含常见合约地址，小写）
+from token_amount import FRAC_SCALE, format_amount, split_exact, sum_limbs, group_sum, ge, to_float, resolve_overflow
+from token_amount import topk as topk_amounts
+from verdict import parse_verdict
+from address_mapping_store import get_mapping_store
+from verdict_cache import cache_key, get_verdict_cache, normalize_prompt
+from prompt_renderer import PROMPT_TOKEN_BUDGET, PROMPT_MAX_ROWS, render_analysis, count_tokens, get_prompt_stats
 
 
 # --------------------------
@@ -27,20 +38,13 @@ BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 
 
 TARGET_ADDRESS = None  # 可以手动提前指定
+LARGE_TRANSFER_THRESHOLD = 1000  # 大额交易标准（代币单位）
 
 def check_contract_address(row: Dict) -> bool:
     """检查合约地址是否在白名单中，若在则返回 true，反之返回 false（跳过该交易）"""
-    # 白名单集合（包含常见合约地址）
-    #转化为小写
-    whitelist = {"0xdac17f958d2ee523a2206206994597c13d831ec7",  # USDT
-                    "0xd5f7838f5c461feff7fe49ea5ebaf7728bb0adfa",  # mETH
-                    "0xae7ab96520de3a18e5e111b5eaab095312d7fe84",  # stETH
-                    "0xe6829d9a7ee3040e1276fa75293bde931859e8fa",  # cmETH  
-                    "0x0000000000000000000000000000000000000000"   # 0x0 ETH
-                }
     contract_address = row["contract_address"].strip().lower()
     
-    if contract_address and contract_address in whitelist:
+    if contract_address and contract_address in TOKEN_WHITELIST:
         return True  # 在白名单中，保留该交易
     else:
         # print(f"过滤交易，合约地址不在白名单中: {contract_address}")
@@ -48,37 +52,26 @@ def check_contract_address(row: Dict) -> bool:
 
 
 # --------------------------
-# 1. 读取 CSV 交易数据
+# 1. 读取交易数据（列式交易存储）
 # --------------------------
-def read_blockchain_csv(file_path: str) -> List[Dict]:
-    """读取 CSV 文件，返回结构化的交易数据列表"""
-    transactions = []
-    # 打开 CSV 文件（encoding 适配中文/特殊字符，errors 忽略不可读字符）
-    with open(file_path, mode="r", encoding="utf-8", errors="ignore") as f:
-        # 用 csv.DictReader 自动将表头作为字典键
-        csv_reader = csv.DictReader(f)
-        # 遍历每一行交易数据，转换数据类型并添加到列表
-        for row in csv_reader:
-            if row["value"] == '0':
-                continue  # 跳过零值交易
-            # 检查合约地址是否在白名单中
-            if check_contract_address(row) is False:
-                continue 
-            # 转换数值类型（原始 CSV 读取的是字符串，需转为int/float）
-            processed_row = {
-                "address_from": row["address_from"].strip(),  # 转出地址
-                "address_to": row["address_to"].strip(),  # 转入地址
-                "block_number": int(row["block_number"]),  # 区块号
-                "contract_address": row["contract_address"].strip(),  # 合约地址
-                "decimals": int(row["decimals"]),  # 代币小数位
-                "hash": row["hash"].strip(),  # 交易哈希
-                "symbol": row["symbol"].strip(),  # 代币符号
-                "timestamp": int(row["timestamp"]),  # 时间戳
-                "token_id": row["token_id"].strip() if row["token_id"] else "",  # NFT 代币ID（可为空）
-                "value": int(row["value"])  # 原始金额（未格式化）
-            }
-            transactions.append(processed_row)
-    print(f"成功读取 CSV 文件，共 {len(transactions)} 条交易数据")
+def read_blockchain_table(target_address: str, eventname: str = "bybit", depth: Optional[int] = None) -> pa.Table:
+    """从交易存储读取目标地址的交易（列式表，已过滤零值和非白名单交易）"""
+    table = load_address_table(target_address, eventname, depth, nonzero=True)
+    # 检查合约地址是否在白名单中（整列过滤）
+    whitelist = pa.array(sorted(TOKEN_WHITELIST), pa.string())
+    return table.filter(pc.is_in(table.column("contract_address").cast(pa.string()), value_set=whitelist))
+
+
+def read_blockchain_transfers(target_address: str, eventname: str = "bybit", depth: Optional[int] = None) -> List[Dict]:
+    """从交易存储读取目标地址的交易，返回结构化的交易数据列表（已过滤零值和非白名单交易）"""
+    table = read_blockchain_table(target_address, eventname, depth)
+    transactions = table.select([
+        "address_from", "address_to", "block_number", "contract_address", "decimals",
+        "hash", "symbol", "timestamp", "token_id", "value", "amount_int", "amount_frac", "value_overflow"
+    ]).to_pylist()
+    for tx in transactions:
+        tx["value"] = int(tx["value"])  # 原始金额（未格式化），Decimal 转精确整数
+    print(f"成功读取交易数据，共 {len(transactions)} 条交易数据")
     return transactions
 
 
@@ -89,9 +82,9 @@ def format_token_amount(original_value: int, decimals: int) -> str:
     """将原始代币金额（如 20000000000000000000000000）转为可读格式（如 20000.0 HACKER）"""
     if decimals == 0:
         return f"{original_value}"
-    # 按小数位转换（避免科学计数法，保留6位小数方便阅读）
-    readable_amount = original_value / (10 ** decimals)
-    return f"{readable_amount:,.6f}"
+    # 按小数位精确转换（整数运算，截断保留6位小数方便阅读）
+    amount_int, amount_frac = split_exact(original_value, decimals)
+    return format_amount(amount_int, amount_frac, places=6, thousands=True)
 
 
 def format_time(timestamp: int) -> str:
@@ -100,312 +93,209 @@ def format_time(timestamp: int) -> str:
 
 
 #下面的两个函数用于保存和加载地址映射表，保证一个事件的地址映射表唯一，并保存在本地便于事后复盘
+# 映射表存放在 address_mapping_store（SQLite，编号原子分配，多进程安全），JSON 仅作导出
 
-# 映射表缓存（可选：避免重复读磁盘）
-_MAPPING_CACHE = {}
 def _load_address_mapping(eventname: str) -> OrderedDict:
-    #"""加载指定事件的地址映射表，若不存在则创建空表"""
-    global _MAPPING_CACHE
-
-    if eventname in _MAPPING_CACHE:
-        return _MAPPING_CACHE[eventname]
-
-    filename = f"address_mapping_{eventname}.json"
-    mapping = OrderedDict()
-    readpath = os.path.join("D:/FORGE2/BlockchainSpider-master/blockscan_data", filename)
-    if os.path.exists(readpath):
-            try:
-                with open(readpath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                    # 确保 data 是字典
-                    if not isinstance(data, dict):
-                        print(f"Warning: {filename} is not a JSON object, got {type(data)}. Creating new mapping.")
-                        return mapping  # 返回空 OrderedDict
-
-                    # 安全地提取并排序 items
-                    valid_items = []
-
-                    for addr, info in data.items():
-                        try:
-                            mapped_id = info["mapped_id"]  # 如 "[Addr-1]"
-                            if len(mapped_id.split('-')) < 2:
-                                print(f"Skipping invalid key format (no dash): {addr_lower}")
-                                continue
-                            # 去掉括号和前缀
-                            if mapped_id.startswith("[Addr-") and mapped_id.endswith("]"):
-                                id_num = int(mapped_id.split('-')[1].strip(']'))  # 提取 1, 2, 3...
-                                valid_items.append((addr, info, id_num))
-                            else:
-                                print(f"Skipping invalid mapped_id format: {mapped_id}")
-                        except (ValueError, IndexError, KeyError) as e:
-                            print(f"Error parsing mapped_id for {addr}: {e}")
-                            continue
-
-                    # 按 ID 排序并重建 mapping
-                    valid_items.sort(key=lambda x: x[2])  # 按 id_num 排序
-                    for addr_lower, info, _ in valid_items:
-                        mapping[addr_lower] = info
-
-            except json.JSONDecodeError as e:
-                print(f"Warning: JSON decode error in {filename}, creating new mapping. Error: {e}")
-            except Exception as e:
-                print(f"Warning: Unexpected error loading {filename}: {e}")
-    _MAPPING_CACHE[eventname] = mapping
-    return mapping
-
-
-def _save_address_mapping(eventname: str, mapping: OrderedDict):
-    """保存映射表到本地文件"""
-    global _MAPPING_CACHE
-
-    filename = f"address_mapping_{eventname}.json"
-    writepath = os.path.join("D:/FORGE2/BlockchainSpider-master/blockscan_data", filename)
+    """读取指定事件的完整地址映射表（按编号排序）"""
+    return get_mapping_store().load(eventname)
+
+
+def _save_address_mapping(eventname: str, mapping: OrderedDict = None):
+    """把映射表导出为本地 JSON 文件（映射在分配时已写入映射库，这里只用于复盘）"""
     try:
-        with open(writepath, 'w', encoding='utf-8') as f:
-            json.dump(mapping, f, ensure_ascii=False, indent=2)
-        _MAPPING_CACHE[eventname] = mapping.copy()  # 缓存副本
+        get_mapping_store().export_json(eventname)
     except Exception as e:
-        print(f"Error saving mapping file {filename}: {e}")
+        print(f"Error saving mapping file address_mapping_{eventname}.json: {e}")
+
+
+def _transfer_frame(transactions: Union[pa.Table, List[Dict]]) -> pd.DataFrame:
+    """交易（列式表或字典列表）转为分析所需的列；溢出截断的金额以 value 列为准（整数部分不截断）"""
+    columns = ["address_from", "address_to", "symbol", "timestamp", "amount_int", "amount_frac"]
+    exact = ["value", "decimals", "value_overflow"]
+    if isinstance(transactions, pa.Table):
+        names = set(transactions.column_names)
+        df = transactions.select(columns + [c for c in exact if c in names]).to_pandas()
+    else:
+        df = pd.DataFrame(transactions)
+        df = df.reindex(columns=columns + [c for c in exact if c in df.columns])
+    df = resolve_overflow(df)
+    for col in ("address_from", "address_to", "symbol"):
+        df[col] = df[col].astype(str)
+    return df
+
+
+def _amount_stats(whole: np.ndarray, frac: np.ndarray) -> Dict:
+    """一组金额的均值/中位数/标准差/大额占比（向量化，不构造 Python 列表）"""
+    n = len(whole)
+    if n == 0:
+        return {}
+    w, f = sum_limbs(whole, frac)
+    amounts = to_float(whole, frac)
+    stats = {
+        "avg": round((w * FRAC_SCALE + f) / n / FRAC_SCALE, 6),  # 精确总额求均值
+        "median": round(float(np.median(amounts)), 6),
+        # 大额交易占比（>1000 单位，精确比较）
+        "large_ratio": round(int(np.count_nonzero(ge(whole, frac, LARGE_TRANSFER_THRESHOLD))) / n, 3),
+    }
+    if n > 1:
+        stats["std"] = round(float(np.std(amounts, ddof=1)), 6)
+    return stats
+
 
+def _token_totals(symbols: np.ndarray, whole: np.ndarray, frac: np.ndarray) -> Dict[str, float]:
+    """按代币精确求和（按代币首次出现的顺序）"""
+    if len(symbols) == 0:
+        return {}
+    sums = group_sum(pd.DataFrame({"symbol": symbols, "amount_int": whole, "amount_frac": frac}), ["symbol"])
+    exact = {s: int(w) * FRAC_SCALE + int(f)
+             for s, w, f in zip(sums["symbol"], sums["amount_int"], sums["amount_frac"])}
+    return {s: exact[s] / FRAC_SCALE for s in pd.unique(symbols)}
 
-def analyze_transaction_flow(transactions: List[Dict], target_addr: str, eventname: str, topk: int) -> Dict:
+
+def analyze_transaction_flow(transactions: Union[pa.Table, List[Dict]], target_addr: str, eventname: str, topk: int,
+                             features: Optional[Dict] = None) -> Dict:
     """
     分析核心地址的交易流向：统计转入/转出记录、关联地址、金额等
     扩展支持：
       - 节点拓扑结构（出入度、邻居分布）
       - 交易行为统计（频次、金额分布、大额占比、时间模式）
-      - 标签信息预留字段
+      - 标签信息和邻域特征（features，由 graph_features 按批在交易图上计算，没有时为空）
       - 地址映射以压缩 prompt 长度
+    按列向量化计算（不为每笔交易构造字典），只格式化展示的 topk 条交易；
+    transactions 可以是交易存储的列式表，也可以是 read_blockchain_transfers 返回的字典列表
     """
-    # 地址映射系统（保持一致性）
-    address_mapping = _load_address_mapping(eventname)
-    addr_counter = len(address_mapping) + 1
-
-    def get_mapped_address(addr: str) -> str:
-        nonlocal addr_counter
-        addr_lower = addr.lower()
-        if addr_lower not in address_mapping:
-            mapped = f"[Addr-{addr_counter}]"
-            address_mapping[addr_lower] = {
-                "mapped_id": mapped,
-                "original": addr
+    target_addr_lower = target_addr.lower()
+
+    df = _transfer_frame(transactions)
+    n = len(df)
+    from_orig = df["address_from"].to_numpy(object)
+    to_orig = df["address_to"].to_numpy(object)
+    from_addr = df["address_from"].str.lower().to_numpy(object)
+    to_addr = df["address_to"].str.lower().to_numpy(object)
+    symbols = df["symbol"].to_numpy(object)
+    timestamps = df["timestamp"].to_numpy(np.int64)
+    whole = df["amount_int"].to_numpy(object if df["amount_int"].dtype == object else np.int64)
+    frac = df["amount_frac"].to_numpy(np.int64)
+
+    # 地址映射（保持一致性）：按交易顺序（核心地址最先，每笔先 from 后 to）为新地址分配编号，一次批量写入映射库
+    new_addresses = [target_addr]
+    if n > 0:
+        interleaved = np.empty(2 * n, dtype=object)
+        interleaved[0::2] = from_addr
+        interleaved[1::2] = to_addr
+        original = np.empty(2 * n, dtype=object)
+        original[0::2] = from_orig
+        original[1::2] = to_orig
+        first = ~pd.Index(interleaved).duplicated(keep='first')
+        new_addresses.extend(original[first])
+    address_mapping = get_mapping_store().map_addresses(eventname, new_addresses)
+
+    # 判断交易方向
+    is_incoming = to_addr == target_addr_lower
+    is_outgoing = from_addr == target_addr_lower
+    in_from = from_addr[is_incoming]
+    out_to = to_addr[is_outgoing]
+
+    # 拓扑结构（映射编号与小写地址一一对应，直接按地址去重计数）
+    in_degree = len(pd.unique(in_from))
+    out_degree = len(pd.unique(out_to))
+    unique_counterparties = len(pd.unique(np.concatenate([in_from, out_to])))
+
+    # 时间范围（用于频率计算）
+    total_incoming = int(np.count_nonzero(is_incoming))
+    total_outgoing = int(np.count_nonzero(is_outgoing))
+    in_frequency = out_frequency = 0.0
+    times = timestamps[is_incoming | is_outgoing]
+    if len(times) > 0:
+        duration_days = max((int(times.max()) - int(times.min())) / (24 * 3600), 1)  # 至少1天
+        in_frequency = round(total_incoming / duration_days, 3)
+        out_frequency = round(total_outgoing / duration_days, 3)
+
+    # 金额统计
+    in_stats = _amount_stats(whole[is_incoming], frac[is_incoming])
+    out_stats = _amount_stats(whole[is_outgoing], frac[is_outgoing])
+
+    # === 保留 topk 大额交易（按金额降序，相等时保持原顺序），只格式化这 k 条 ===
+    def top_rows(mask: np.ndarray, addr_col: np.ndarray, addr_key: str) -> List[Dict]:
+        rows = np.flatnonzero(mask)
+        rows = rows[topk_amounts(whole[rows], frac[rows], topk)] if topk > 0 else rows[:0]
+        return [
+            {
+                addr_key: address_mapping[addr_col[i]],
+                "token_symbol": symbols[i],
+                "readable_amount": format_amount(whole[i], frac[i], places=6, strip=True),
+                "transaction_time": format_time(int(timestamps[i]))
             }
-            addr_counter += 1
-        return address_mapping[addr_lower]["mapped_id"]
+            for i in rows
+        ]
 
-    # 初始化结果结构
     analysis_result = {
-        "target_address": get_mapped_address(target_addr),
+        "target_address": address_mapping[target_addr_lower],
         "original_target_address": target_addr,  # 保留原始地址用于溯源
-        "total_transactions": len(transactions),
-        "total_incoming": 0,
-        "total_outgoing": 0,
-        "incoming_transactions": [],
-        "outgoing_transactions": [],
-        "related_addresses": set(),
-        "total_token_types": set(),
+        "total_transactions": n,
+        "total_incoming": total_incoming,
+        "total_outgoing": total_outgoing,
+        "incoming_transactions": top_rows(is_incoming, from_addr, "from_address"),
+        "outgoing_transactions": top_rows(is_outgoing, to_addr, "to_address"),
+        "total_token_types": [str(s) for s in pd.unique(symbols)],  # 按首次出现顺序，保证 Prompt 稳定
 
         # 拓扑结构特征
-        "in_degree": 0,                    # 转入交易来源地址数量（独立地址数）
-        "out_degree": 0,                   # 转出交易去向地址数量
-        "in_out_ratio": 0.0,               # 出入度比值
-        "unique_counterparties": 0,        # 总交互地址数（in + out 去重）
+        "in_degree": in_degree,                        # 转入交易来源地址数量（独立地址数）
+        "out_degree": out_degree,                      # 转出交易去向地址数量
+        "in_out_ratio": round(out_degree / in_degree, 3) if in_degree > 0 else float('inf'),  # 出入度比值
+        "unique_counterparties": unique_counterparties,  # 总交互地址数（in + out 去重）
 
         # 交易行为统计
-        "total_in_value": defaultdict(float),   # 按代币统计总转入额
-        "total_out_value": defaultdict(float),  # 按代币统计总转出额
-        "all_in_amounts": [],              # 所有转入金额（数值）
-        "all_out_amounts": [],             # 所有转出金额（数值）
-        "transaction_times": [],           # 所有交易时间戳
-        "token_decimals": {},              # 记录各代币精度，用于计算
-
-        # 衍生统计量（后续计算）
-        "avg_in_amount": 0.0,
-        "avg_out_amount": 0.0,
-        "std_in_amount": 0.0,
-        "std_out_amount": 0.0,
-        "median_in_amount": 0.0,
-        "median_out_amount": 0.0,
-        "in_transaction_frequency": 0.0,   # 每天平均转入次数
-        "out_transaction_frequency": 0.0,  # 每天平均转出次数
-        "large_transfer_threshold": "1000", # 大额标准
-        "large_incoming_ratio": 0.0,       # 大额转入占比（笔数）
-        "large_outgoing_ratio": 0.0,       # 大额转出占比（笔数）
-
-        # 标签信息（预留，可集成外部标签服务）
-        "labels": []
+        "total_in_value": _token_totals(symbols[is_incoming], whole[is_incoming], frac[is_incoming]),    # 按代币统计总转入额
+        "total_out_value": _token_totals(symbols[is_outgoing], whole[is_outgoing], frac[is_outgoing]),  # 按代币统计总转出额
+
+        # 衍生统计量
+        "avg_in_amount": in_stats.get("avg", 0.0),
+        "avg_out_amount": out_stats.get("avg", 0.0),
+        "std_in_amount": in_stats.get("std", 0.0),
+        "std_out_amount": out_stats.get("std", 0.0),
+        "median_in_amount": in_stats.get("median", 0.0),
+        "median_out_amount": out_stats.get("median", 0.0),
+        "in_transaction_frequency": in_frequency,      # 每天平均转入次数
+        "out_transaction_frequency": out_frequency,    # 每天平均转出次数
+        "large_transfer_threshold": str(LARGE_TRANSFER_THRESHOLD),  # 大额标准
+        "large_incoming_ratio": in_stats.get("large_ratio", 0.0),   # 大额转入占比（笔数）
+        "large_outgoing_ratio": out_stats.get("large_ratio", 0.0),  # 大额转出占比（笔数）
+
+        # 标签信息（标签库中该地址自身的标签）
+        "labels": list(features.get("labels", [])) if features else []
     }
+    if features:
+        # 2 跳邻域特征（已标记黑客地址的资金占比、交易所暴露、扇入扇出熵等）
+        analysis_result["neighborhood_features"] = {k: v for k, v in features.items() if k != "labels"}
+    return analysis_result
 
-    # 用于统计的变量
-    incoming_from_addrs: Set[str] = set()  # 转入来源地址集合（映射后）
-    outgoing_to_addrs: Set[str] = set()    # 转出去向地址集合（映射后）
-    target_addr_lower = target_addr.lower()
-
-    # 临时存储原始交易数据用于排序
-    raw_incoming = []
-    raw_outgoing = []
-
-    for tx in transactions:
-
-        from_addr_orig = tx["address_from"]
-        to_addr_orig = tx["address_to"]
-        from_addr = from_addr_orig.lower()
-        to_addr = to_addr_orig.lower()
-        symbol = tx["symbol"]
-        decimals = int(tx.get("decimals", 18))
-        raw_value = float(tx["value"])
-        cleaned = format_token_amount(tx["value"], decimals).replace(',', '')
-        readable_amount = float(cleaned)
-        timestamp = tx["timestamp"]
-
-        # 记录代币精度
-        analysis_result["token_decimals"][symbol] = decimals
-
-        # 获取映射地址
-        from_mapped = get_mapped_address(from_addr_orig)
-        to_mapped = get_mapped_address(to_addr_orig)
-
-        # 判断交易方向
-        is_incoming = (to_addr == target_addr_lower)
-        is_outgoing = (from_addr == target_addr_lower)
-
-        if is_incoming:
-            analysis_result["total_incoming"] += 1
-            analysis_result["total_in_value"][symbol] += readable_amount
-            analysis_result["all_in_amounts"].append(readable_amount)
-            analysis_result["transaction_times"].append(timestamp)
-            raw_incoming.append({
-                "from_address": from_mapped,
-                "token_symbol": symbol,
-                "readable_amount": readable_amount,
-                "transaction_time": format_time(timestamp),
-                "original_amount_str": f"{readable_amount:.6f}".rstrip('0').rstrip('.')
-            })
-            #analysis_result["incoming_transactions"].append(incoming_tx)
-            analysis_result["related_addresses"].add(from_mapped)
-            incoming_from_addrs.add(from_mapped)
-
-        if is_outgoing:
-            analysis_result["total_outgoing"] += 1
-            analysis_result["total_out_value"][symbol] += readable_amount
-            analysis_result["all_out_amounts"].append(readable_amount)
-            analysis_result["transaction_times"].append(timestamp)
-            raw_outgoing.append({
-                "to_address": to_mapped,
-                "token_symbol": symbol,
-                "readable_amount": readable_amount,
-                "transaction_time": format_time(timestamp),
-                "original_amount_str": f"{readable_amount:.6f}".rstrip('0').rstrip('.')
-            })
-            #analysis_result["outgoing_transactions"].append(outgoing_tx)
-            analysis_result["related_addresses"].add(to_mapped)
-            outgoing_to_addrs.add(to_mapped)
-
-        # 统计涉及的代币类型
-        analysis_result["total_token_types"].add(symbol)
-    #只保留
-
-    # === 排序并保留 topk 大额交易 ===
-    # 按金额降序排列，保留最多 topk 条
-    raw_incoming.sort(key=lambda x: x["readable_amount"], reverse=True)
-    raw_outgoing.sort(key=lambda x: x["readable_amount"], reverse=True)
-
-    # 填充最终的交易列表（只保留 topk 条，并格式化金额）
-    analysis_result["incoming_transactions"] = [
-        {
-            "from_address": item["from_address"],
-            "token_symbol": item["token_symbol"],
-            "readable_amount": item["original_amount_str"],
-            "transaction_time": item["transaction_time"]
-        }
-        for item in raw_incoming[:topk]
-    ]
 
-    analysis_result["outgoing_transactions"] = [
-        {
-            "to_address": item["to_address"],
-            "token_symbol": item["token_symbol"],
-            "readable_amount": item["original_amount_str"],
-            "transaction_time": item["transaction_time"]
-        }
-        for item in raw_outgoing[:topk]
-    ]
-
-    # === 第二阶段：计算衍生特征 ===
+# --------------------------
+# 3. 构建大模型 Prompt（核心：清晰传递判断依据）
+# --------------------------
+SAVE_PROMPT_INPUT = False  # 调试用：把完整分析结果写入 LLM_result/<地址>_input_analysis.json（每次调用都写盘）
 
-    # 拓扑结构
-    analysis_result["in_degree"] = len(incoming_from_addrs)
-    analysis_result["out_degree"] = len(outgoing_to_addrs)
-    analysis_result["unique_counterparties"] = len(analysis_result["related_addresses"])
-    analysis_result["in_out_ratio"] = (
-        round(analysis_result["out_degree"] / analysis_result["in_degree"], 3)
-        if analysis_result["in_degree"] > 0 else float('inf')
-    )
 
-    # 时间范围（用于频率计算）
-    if analysis_result["transaction_times"]:
-        min_time = min(analysis_result["transaction_times"])
-        max_time = max(analysis_result["transaction_times"])
-        duration_days = max((max_time - min_time) / (24 * 3600), 1)  # 至少1天
-        analysis_result["in_transaction_frequency"] = round(analysis_result["total_incoming"] / duration_days, 3)
-        analysis_result["out_transaction_frequency"] = round(analysis_result["total_outgoing"] / duration_days, 3)
-    else:
-        duration_days = 1
-
-    # 金额统计（转入）
-    if analysis_result["all_in_amounts"]:
-        amounts = analysis_result["all_in_amounts"]
-        analysis_result["avg_in_amount"] = round(statistics.mean(amounts), 6)
-        analysis_result["median_in_amount"] = round(statistics.median(amounts), 6)
-        if len(amounts) > 1:
-            analysis_result["std_in_amount"] = round(statistics.stdev(amounts), 6)
-        # 大额交易占比（>1000 单位）
-        large_in_count = sum(1 for amt in amounts if amt >= 1000)
-        analysis_result["large_incoming_ratio"] = round(large_in_count / len(amounts), 3)
-
-    # 金额统计（转出）
-    if analysis_result["all_out_amounts"]:
-        amounts = analysis_result["all_out_amounts"]
-        analysis_result["avg_out_amount"] = round(statistics.mean(amounts), 6)
-        analysis_result["median_out_amount"] = round(statistics.median(amounts), 6)
-        if len(amounts) > 1:
-            analysis_result["std_out_amount"] = round(statistics.stdev(amounts), 6)
-        large_out_count = sum(1 for amt in amounts if amt >= 1000)
-        analysis_result["large_outgoing_ratio"] = round(large_out_count / len(amounts), 3)
-
-    # 转换为列表以便序列化
-    analysis_result["related_addresses"] = list(analysis_result["related_addresses"])
-    analysis_result["total_token_types"] = list(analysis_result["total_token_types"])
-
-    # 保存更新的地址映射
-    _save_address_mapping(eventname, address_mapping)
-    analysis_result2 = analysis_result
-    del analysis_result2["related_addresses"]
-    del analysis_result2["all_in_amounts"]
-    del analysis_result2["all_out_amounts"]
-    del analysis_result2["transaction_times"]
-    del analysis_result2["token_decimals"]
-
-    return analysis_result2
+def build_money_laundering_prompt(analysis_result: Dict, budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    构建判断洗钱地址的 Prompt，包含交易分析结果和判断要求
+    分析结果由 prompt_renderer 压缩（统计量为紧凑 JSON、交易为表格），写入的交易行数按整条 Prompt 的 token 预算取舍
+    """
+    if SAVE_PROMPT_INPUT:
+        save_path = "G:/RiskTagger/LLM_result/" + analysis_result['original_target_address'] + "_input_analysis.json"
+        with open(save_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(analysis_result, ensure_ascii=False, indent=2))
 
+    target_address = analysis_result['target_address']
+    overhead = count_tokens(_detect_prompt(target_address, ""))
+    formatted_analysis, _ = render_analysis(analysis_result, max(budget - overhead, 0))
+    return _detect_prompt(target_address, formatted_analysis)
 
-# --------------------------
-# 3. 构建大模型 Prompt（核心：清晰传递判断依据）
-# --------------------------
-def build_money_laundering_prompt(analysis_result: Dict) -> str:
-    """构建判断洗钱地址的 Prompt，包含交易分析结果和判断要求"""
-    # 将分析结果转为格式化字符串（大模型更易读取）
-    formatted_analysis = json.dumps(analysis_result, ensure_ascii=False, indent=2)
-    
-    #print("################################################formatted_analysis",len(formatted_analysis))
-    #print("################################################formatted_analysis",formatted_analysis)
-    save_path = "G:/RiskTagger/LLM_result/" + analysis_result['original_target_address'] + "_input_analysis.json"
-    with open(save_path, "w", encoding="utf-8") as f:
-        f.write(formatted_analysis)
 
+def _detect_prompt(target_address: str, formatted_analysis: str) -> str:
     prompt = f"""
-1、You are a blockchain security analyst tasked with determining if the core address {analysis_result['target_address']} is suspected of money laundering using transaction data. Follow this structured process:  
+1、You are a blockchain security analyst tasked with determining if the core address {target_address} is suspected of money laundering using transaction data. Follow this structured process:  
 
 ### 1. Data Preparation  
 First, parse {formatted_analysis} to extract:  
@@ -438,7 +328,7 @@ Assess the address against these money-laundering-linked patterns, citing specif
 
 ### 4. Internal Reflection
 
-1、You are a blockchain security auditor tasked with reviewing and improving the money laundering suspicion analysis of the core address {analysis_result['target_address']}. Follow this structured reflection process. Only provide the final result.
+1、You are a blockchain security auditor tasked with reviewing and improving the money laundering suspicion analysis of the core address {target_address}. Follow this structured reflection process. Only provide the final result.
 
 #### 1. Analysis Logic Validation
 - Verify if the initial analysis covered all risk dimensions in the original framework (transaction patterns, fund flows, associated addresses, temporal signs). If any dimension was omitted, explain the potential impact .
@@ -480,42 +370,77 @@ Provide your findings in this JSON format:
 # --------------------------
 # 4. 调用大模型获取判断结果
 # --------------------------
-def call_openai_model(prompt: str, api_key: str, model_name: str, base_url: str) -> str:
+SYSTEM_PROMPT = "You are a professional blockchain money laundering detection analyst. Your judgment should be based on data and be logically rigorous, without making subjective assumptions."
+ASSISTANT_ACK = "Yes, I understand. I am a professional blockchain money laundering detection analyst and will analyze the provided data to detect money laundering activities based on data-driven and logically rigorous judgment, without making subjective assumptions."
+LLM_TEMPERATURE = 0.3  # 降低随机性，确保判断更严谨
+LLM_MAX_TOKENS = 2000  # 足够容纳详细分析结果
+LLM_RESPONSE_FORMAT = {"type": "json_object"}  # JSON 模式，回复按 verdict.parse_verdict 的格式解析
+
+
+def build_messages(prompt: str) -> List[Dict]:
+    """构造对话消息（同步与异步客户端共用）"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "assistant", "content": ASSISTANT_ACK},
+        {"role": "user", "content": prompt}
+    ]
+
+
+# 客户端缓存：同一进程内复用连接池，避免每次调用重新建立连接
+_CLIENT_CACHE = {}
+def _get_client(api_key: str, base_url: str) -> OpenAI:
+    key = (api_key, base_url)
+    if key not in _CLIENT_CACHE:
+        _CLIENT_CACHE[key] = OpenAI(api_key=api_key, base_url=base_url)
+    return _CLIENT_CACHE[key]
+
+
+def call_openai_model(prompt: str, api_key: str, model_name: str, base_url: str,
+                      max_tokens: int = LLM_MAX_TOKENS) -> str:
     """调用 OpenAI 大模型，获取洗钱判断结果"""
-    # 初始化客户端
-    client = OpenAI(api_key=api_key, base_url=BASE_URL)
+    client = _get_client(api_key, base_url)
+    get_prompt_stats().record(count_tokens(prompt))
     try:
-        # 发送请求（temperature=0.3 降低随机性，确保判断更严谨）
         response = client.chat.completions.create(
             model=model_name,
-            messages=[
-                {"role": "system", "content": "You are a professional blockchain money laundering detection analyst. Your judgment should be based on data and be logically rigorous, without making subjective assumptions."},
-                {"role": "assistant", "content": "Yes, I understand. I am a professional blockchain money laundering detection analyst and will analyze the provided data to detect money laundering activities based on data-driven and logically rigorous judgment, without making subjective assumptions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=2000  # 足够容纳详细分析结果
+            messages=build_messages(prompt),
+            temperature=LLM_TEMPERATURE,
+            max_tokens=max_tokens,
+            response_format=LLM_RESPONSE_FORMAT
         )
         # 提取大模型回复
         return response.choices[0].message.content.strip()
     except Exception as e:
-        return f"大模型调用失败：{str(e)}"
+        return f"{LLM_FAILED_PREFIX}：{str(e)}"
 
 
-# --------------------------
-# 5. 主函数（串联全流程）
-# --------------------------
-def llm_based_detect(target_address:str = TARGET_ADDRESS,eventname: str = "bybit") -> tuple[bool,str]:
-    # 步骤1：读取 CSV 数据
-    label = "unknown"
-    csv_path = "G:/RiskTagger/blockscan_data/"+target_address+"/AccountTransferItem.csv"
-    transactions = read_blockchain_csv(csv_path) # 对交易进行过滤及处理（过滤零交易和非白名单交易）
-    if not transactions:
+LLM_RESULT_PATH = "G:/RiskTagger/LLM_result/"
+LLM_FAILED_PREFIX = "大模型调用失败"
+
+
+def prepare_detect_prompt(target_address: str, eventname: str = "bybit", depth: Optional[int] = None,
+                          features: Optional[Dict] = None) -> Optional[str]:
+    """
+    读取交易并完成流向分析，返回大模型 Prompt（无交易数据时返回 None）；流水线中作为 CPU 阶段单独执行
+    features 为 pre_classifier.prepare_batch 按批计算的该地址邻域特征（可选）
+    """
+    prepared = prepare_detect_analysis(target_address, eventname, depth, features)
+    return prepared[0] if prepared is not None else None
+
+
+def prepare_detect_analysis(target_address: str, eventname: str = "bybit", depth: Optional[int] = None,
+                            features: Optional[Dict] = None) -> Optional[tuple[str, Dict]]:
+    """同 prepare_detect_prompt，同时返回流向分析结果（小账户批量判断时打包的就是它）"""
+    # 步骤1：读取交易数据（列式表，分析时不逐笔转为字典）
+    transactions = read_blockchain_table(target_address, eventname, depth) # 对交易进行过滤及处理（过滤零交易和非白名单交易）
+    print(f"成功读取交易数据，共 {transactions.num_rows} 条交易数据")
+    if transactions.num_rows == 0:
         print("未读取到交易数据，程序终止")
-        return [False,label]
+        return None
 
     # 步骤2：分析核心地址的交易流向
-    tx_analysis = analyze_transaction_flow(transactions, target_address, eventname=eventname, topk=50)
+    tx_analysis = analyze_transaction_flow(transactions, target_address, eventname=eventname, topk=PROMPT_MAX_ROWS,
+                                           features=features)
 
     print("\n核心地址交易分析完成，概要信息：")
     print(f"- 核心地址：{tx_analysis['target_address']}")
@@ -527,7 +452,64 @@ def llm_based_detect(target_address:str = TARGET_ADDRESS,eventname: str = "bybit
     print(f"- 涉及代币类型：{tx_analysis['total_token_types']}")
     '''
     # 步骤3：构建大模型 Prompt，加入反思机制
-    prompt = build_money_laundering_prompt(tx_analysis)
+    return build_money_laundering_prompt(tx_analysis), tx_analysis
+
+
+def save_llm_result(target_address: str, response_text: str):
+    """保存大模型原始回复（便于复盘；ML_Detection.REUSE_ADDRESS_RESULT 打开时据此跳过已判断地址）"""
+    save_path = LLM_RESULT_PATH + target_address + ".txt"
+    with open(save_path, "w", encoding="utf-8") as f:
+        f.write(response_text)
+
+
+def verdict_key(prompt: str) -> str:
+    """判断缓存键：sha256(模型, temperature, 系统提示 + 归一化的 Prompt)，地址编号不影响命中"""
+    return cache_key(MODEL_NAME, LLM_TEMPERATURE, build_messages(normalize_prompt(prompt)))
+
+
+def cached_llm_verdict(target_address: str, prompt: str) -> Optional[tuple[bool,str]]:
+    """查询判断缓存，命中时把判断记录关联到该地址并返回 [是否洗钱, 标签]"""
+    cache = get_verdict_cache()
+    key = verdict_key(prompt)
+    hit = cache.get(key)
+    if hit is None:
+        return None
+    verdict, response_text = hit
+    cache.link(target_address, key)
+    if not os.path.exists(LLM_RESULT_PATH + target_address + ".txt"):
+        save_llm_result(target_address, response_text)
+    return [verdict.is_ml, verdict.label]
+
+
+def record_llm_verdict(target_address: str, prompt: str, response_text: str) -> tuple[bool,str]:
+    """保存大模型回复、解析为判断记录并写入判断缓存（调用失败、无法解析出可疑等级的回复不缓存）"""
+    save_llm_result(target_address, response_text)
+    verdict = parse_verdict(response_text)
+    if not response_text.startswith(LLM_FAILED_PREFIX):
+        cache = get_verdict_cache()
+        key = verdict_key(prompt)
+        if cache.put(key, MODEL_NAME, verdict, response_text):
+            cache.link(target_address, key)
+        else:
+            cache.unlink(target_address)
+    return [verdict.is_ml, verdict.label]
+
+
+# --------------------------
+# 5. 主函数（串联全流程）
+# --------------------------
+def llm_based_detect(target_address:str = TARGET_ADDRESS,eventname: str = "bybit", depth: Optional[int] = None,
+                     features: Optional[Dict] = None) -> tuple[bool,str]:
+    label = "unknown"
+    # 步骤1-3：读取交易、分析流向、构建 Prompt
+    prompt = prepare_detect_prompt(target_address, eventname, depth, features=features)
+    if prompt is None:
+        return [False,label]
+    # Prompt 未变化的地址直接使用缓存的判断结果
+    cached = cached_llm_verdict(target_address, prompt)
+    if cached is not None:
+        print("\n命中判断缓存，跳过大模型调用")
+        return cached
     # 步骤4：调用大模型并输出结果
     print("\n开始调用大模型进行洗钱判断...")
     response_text = call_openai_model(prompt, OPENAI_API_KEY, MODEL_NAME, BASE_URL)
@@ -535,30 +517,4 @@ def llm_based_detect(target_address:str = TARGET_ADDRESS,eventname: str = "bybit
     print("大模型判断结果：")
     print("=" * 50)
     #print(response_text)
-    save_path = "G:/RiskTagger/LLM_result/" + target_address + ".txt"
-    with open(save_path, "w", encoding="utf-8") as f:
-        f.write(response_text)
-
-    # 只提取“suspicion_level”之后的内容
-    start = response_text.find("suspicion_level")
-    if start == -1:
-        label = "unknown"
-    else:
-        # 截取结论后的一小段（比如100字符），避免扫描全文
-        conclusion_part = response_text[start:start + 35]
-        if "High" in conclusion_part or "high" in conclusion_part:
-            label = "high-ML"
-        elif "Medium" in conclusion_part or "medium" in conclusion_part:
-            label = "mid-ML"
-        elif "Low" in conclusion_part or "low" in conclusion_part:
-            label = "low-ML"
-        elif "No Suspicion" in conclusion_part or "no suspicion" in conclusion_part or "No suspicion" in conclusion_part:
-            label = "No Suspicion"
-        else:
-            label = "unknown"
-    if label != "unknown" and label != "No Suspicion":
-        return [True,label]
-    else:
-        return [False,label]
-
-    return [False,label]
+    return record_llm_verdict(target_address, prompt, response_text)
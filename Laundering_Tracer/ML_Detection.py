@@ -1,8 +1,15 @@
 import subprocess
 import os
 import re
-from typing import List, Optional, Tuple, Union
+import shutil
+import time
+import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union
 from  LLM_detection import llm_based_detect
+from verdict import parse_verdict
+from verdict_cache import get_verdict_cache
+from crawl_state import get_crawl_state
+from tx_store import csv_max_block, merge_transfer_csv
 
 # --------------------------
 # 函数默认参数配置（直接修改此处值，可改变函数默认输入）
@@ -30,11 +37,17 @@ DEFAULT_ENABLE = [  # 默认启用的中间件（ETH+ERC-20）
 ]
 DEFAULT_START_BLK = None  # 默认起始区块（None 表示从第一个区块开始）
 DEFAULT_END_BLK = None  # 默认结束区块（None 表示到最新区块）
-DEFAULT_MAX_PAGES = 1  # 默认每个中间件最大请求页数
+DEFAULT_MAX_PAGES = 10  # 默认每个中间件最大请求页数（页数 × 每页条数不能超过浏览器的 10000 条结果窗口）
 DEFAULT_MAX_PAGE_SIZE = 1000  # 默认每页最大交易数（最大值10000）
 DEFAULT_DEPTH = 1  # 默认爬取深度
+DEFAULT_INCREMENTAL = True  # 已有结果时增量爬取：只请求上次爬取的最高区块之后的交易
+DELTA_MIN_INTERVAL = 6 * 3600  # 距上次爬取不足该时间（秒）时不再增量爬取，直接使用已有结果
+
+SPIDER_PATH = 'D:/FORGE2/BlockchainSpider-master/'  # 改成自己BlockchainSpider的相关路径
 
 DEFAULT_EVENTNAME = "bybit"  # 默认事件名称
+# 是否按地址复用 LLM_result/<addr>.txt（不感知 Prompt 变化）；关闭时由 verdict_cache 按 Prompt 内容复用判断结果
+REUSE_ADDRESS_RESULT = False
 
 def run_blockscan_spider(
         # 必选参数：使用上述默认值，可直接修改默认值或调用时覆盖
@@ -52,7 +65,8 @@ def run_blockscan_spider(
         max_pages: Optional[int] = DEFAULT_MAX_PAGES,
         max_page_size: Optional[int] = DEFAULT_MAX_PAGE_SIZE,
         depth:Optional[int] = DEFAULT_DEPTH,
-        check_existing: bool = True # 是否检查已存在结果(LLM检测时不检查)
+        check_existing: bool = True, # 是否检查已存在结果(LLM检测时不检查)
+        incremental: bool = DEFAULT_INCREMENTAL
 ) -> bool:
     """
     调用 txs.blockscan 爬虫，收集指定地址的区块链交易数据（如 Etherscan 数据）。
@@ -71,6 +85,7 @@ def run_blockscan_spider(
     :param end_blk: 结束区块号（可选，None 表示到最新区块）
     :param max_pages: 每个中间件最大请求页数（可选）
     :param max_page_size: 每页最大交易数（可选，最大值10000）
+    :param incremental: 已有结果时是否增量爬取（从 crawl_state 记录的最高区块开始，新记录去重后追加）
 
     返回值：
     :return: 爬虫执行成功返回 True，失败返回 False
@@ -84,6 +99,7 @@ def run_blockscan_spider(
     target_addr = source  # 目标地址（与 source 保持一致，便于理解）
     # 如果存在则直接读取结果返回
     out_path = os.path.join(out, 'AccountTransferItem.csv')
+    delta_out = None  # 增量爬取时爬虫输出到单独目录，完成后合并
 
     if os.path.exists(out_path):
         # 读取结果并返回
@@ -96,8 +112,25 @@ def run_blockscan_spider(
                     print(f"ℹ️  提示：已存在爬虫结果，但结果为空，直接读取 -> {os.path.abspath(out_path)}")
                     return True
             else:
-                print(f"ℹ️  提示：已存在爬虫结果，直接读取 -> {os.path.abspath(out_path)}")
-                return True
+                state = get_crawl_state().get(source)
+                if state is None:
+                    # 增量爬取之前的结果：以文件中的最高区块和文件修改时间作为起点
+                    get_crawl_state().update(source, csv_max_block(out_path) or 0, rows=len(lines) - 1,
+                                             updated=os.path.getmtime(out_path))
+                    state = get_crawl_state().get(source)
+                if state.complete and not incremental:
+                    print(f"ℹ️  提示：已存在爬虫结果，直接读取 -> {os.path.abspath(out_path)}")
+                    return True
+                if state.complete and time.time() - state.updated < DELTA_MIN_INTERVAL:
+                    print(f"ℹ️  提示：已存在爬虫结果（{(time.time() - state.updated) / 3600:.1f} 小时前爬取），直接读取 -> {os.path.abspath(out_path)}")
+                    return True
+                if start_blk is None or start_blk < state.max_block:
+                    start_blk = state.max_block
+                delta_out = os.path.join(out, '_delta')
+                if state.complete:
+                    print(f"ℹ️  提示：已存在爬虫结果，从区块 {start_blk} 开始增量爬取")
+                else:
+                    print(f"ℹ️  提示：上次爬取不完整，从区块 {start_blk} 继续爬取")
     else:
         print(f"ℹ️  提示：未发现已存在结果,开始爬取")
         #return ##测试修改
@@ -136,7 +169,7 @@ def run_blockscan_spider(
         "-a", f"apikeys={apikeys_str}",
         "-a", f"endpoint={endpoint}",
         "-a", f"strategy={strategy}",
-        "-a", f"out={out}",
+        "-a", f"out={delta_out or out}",
         "-a", f"max_pages={max_pages}",
         "-a", f"max_page_size={max_page_size}",
         #"-a", f"depth={depth}"  # 设置为0表示只爬取当前地址
@@ -159,7 +192,6 @@ def run_blockscan_spider(
     full_cmd = base_cmd + cmd_params
     print(f"\nℹ️  即将执行爬虫命令：\n{' '.join(full_cmd)}\n")
 
-    os.chdir('D:/FORGE2/BlockchainSpider-master/')  # 改成自己BlockchainSpider的相关路径
     # --------------------------
     # 3. 执行爬虫并捕获结果 (带超时控制)
     # --------------------------
@@ -174,6 +206,7 @@ def run_blockscan_spider(
             # stderr=subprocess.STDOUT,
             text=True,
             encoding="utf-8",
+            cwd=SPIDER_PATH,  # 不用 os.chdir：工作目录是进程全局的，多线程爬取时会互相干扰
             timeout=timeout_seconds  # ⚠️ 添加超时限制
         )
         # 打印成功日志
@@ -182,6 +215,7 @@ def run_blockscan_spider(
         # print(process.stdout)
         # print("-" * 50)
         print(f"ℹ️  交易数据已保存至：{os.path.abspath(out)}")
+        _record_crawl(source, out_path, delta_out, complete=True)
         return True
     except subprocess.TimeoutExpired as e:
         # ⚠️ 命令执行超时，被中断
@@ -190,9 +224,10 @@ def run_blockscan_spider(
         #print("已捕获部分输出：")
         #print(e.output)  # 输出超时前已产生的内容
         #print("-" * 50)
-        # ✅ 继续执行后续代码（不报错）
-        print(f"ℹ️  爬取部分数据，继续处理后续逻辑...")
-        return True  # 或根据业务决定返回值
+        # 部分结果已合并保存，但记为未取全：返回 False（调度器会重试），下次从原区块继续爬取
+        print(f"⚠️  只爬取到部分数据，已记录为不完整")
+        _record_crawl(source, out_path, delta_out, complete=False)
+        return False
     except subprocess.CalledProcessError as e:
         # 命令执行失败（如 API 密钥无效、爬虫不存在）
         print("❌ 爬虫执行失败！错误信息：")
@@ -208,36 +243,41 @@ def run_blockscan_spider(
         print("❌ 异常原因参考：1. 未安装 Scrapy（执行 pip install scrapy）；2. 输出目录无写入权限；3. 爬虫未注册")
         return False
 
-def LLM_Addr_Detect(source: str = DEFAULT_SOURCE,eventname: str = DEFAULT_EVENTNAME) -> Tuple[bool,str]:
+def _record_crawl(source: str, out_path: str, delta_out: Optional[str], complete: bool):
+    """爬取结束后：增量结果去重合并进已有 CSV，并记录已爬取的最高区块"""
+    if delta_out is not None:
+        added, max_block = merge_transfer_csv(out_path, os.path.join(delta_out, 'AccountTransferItem.csv'))
+        shutil.rmtree(delta_out, ignore_errors=True)
+        print(f"ℹ️  增量爬取新增 {added} 条交易")
+    elif os.path.exists(out_path):
+        df = pd.read_csv(out_path, dtype=str, keep_default_na=False, encoding='utf-8')
+        added, max_block = len(df), csv_max_block(df)
+    else:
+        return
+    if not complete:
+        # 超时中断时结果不完整，且爬虫的输出顺序未知：不推进区块进度（下次仍从原区块开始，重复记录合并时去重）
+        get_crawl_state().update(source, 0, rows=added, complete=False)
+        return
+    if max_block is None:
+        max_block = 0
+    get_crawl_state().update(source, max_block, rows=added)
+
+def LLM_Addr_Detect(source: str = DEFAULT_SOURCE,eventname: str = DEFAULT_EVENTNAME, depth: Optional[int] = None,
+                    features: Optional[Dict] = None) -> Tuple[bool,str]:
     #如果存在LLM输出的txt文件，则直接读取结果返回
     label = "unknown"
 
     result_dir = "G:/RiskTagger/LLM_result"
     out_path = os.path.join(result_dir, source + '.txt')
-    if os.path.exists(out_path):
-        print(f"ℹ️  提示：已存在 LLM 结果，直接读取 -> {os.path.abspath(out_path)}")
-        with open(out_path, 'r', encoding='utf-8') as f:
-            response_text = f.read()
-        # 只提取“明确结论：”之后的内容
-            start = response_text.find("suspicion_level")
-        if start == -1:
-            label = "-1_unknown"
-        else:
-            # 截取结论后的一小段（比如100字符），避免扫描全文
-            conclusion_part = response_text[start:start + 35]
-            #print(f"conclusion_part: {conclusion_part}")
-            if "High" in conclusion_part or "high" in conclusion_part:
-                label = "high-ML"
-            elif "Medium" in conclusion_part or "medium" in conclusion_part:
-                label = "mid-ML"
-            elif "Low" in conclusion_part or "low" in conclusion_part:
-                label = "low-ML"
-            elif "No Suspicion" in conclusion_part or "no suspicion" in conclusion_part or "No suspicion" in conclusion_part:
-                label = "No Suspicion"
-        if label != "unknown" and label != "No Suspicion":
-            return [True,label]
-        else:
-            return [False,label]
+    if REUSE_ADDRESS_RESULT:
+        # 优先读取已解析的判断记录，没有时再解析旧的结果文件
+        verdict = get_verdict_cache().get_address(source)
+        if verdict is None and os.path.exists(out_path):
+            print(f"ℹ️  提示：已存在 LLM 结果，直接读取 -> {os.path.abspath(out_path)}")
+            with open(out_path, 'r', encoding='utf-8') as f:
+                verdict = parse_verdict(f.read())
+        if verdict is not None:
+            return [verdict.is_ml, verdict.label]
     
   
     # 直接调用（使用函数开头 DEFAULT_* 配置的默认值）
@@ -251,6 +291,6 @@ def LLM_Addr_Detect(source: str = DEFAULT_SOURCE,eventname: str = DEFAULT_EVENTN
         print("\n⚠️  爬虫任务失败，请检查默认参数配置或错误日志。")
         return [False,label]
 
-    return llm_based_detect(source,eventname=eventname)
+    return llm_based_detect(source,eventname=eventname,depth=depth,features=features)
 
 
@@ -2,17 +2,42 @@ from asyncio import sleep
 import sys
 sys.path.append('X')  # 改成自己ML_Detection的相关路径
 from csv2json_new1 import scrapy_data
-from classify_accounts2 import classify_accounts_parallel
+from classify_accounts2 import classify_accounts_parallel, classify_accounts_async
 from discover_address_token3 import accounts_bfs
+from tx_store import import_csv_tree
+from pipeline_scheduler import run_case
+from stream_tracer import run_stream
+from crawler_engine import USE_CRAWLER_ENGINE
 import time
+
+USE_SCHEDULER = True  # True: 使用持久化任务调度（可断点续跑，层间流水）；False: 原有逐层循环
+USE_STREAM = True     # 调度模式下使用流式追踪（爬取/分析/大模型/下一跳逐地址重叠执行，受大模型限速反压）
+USE_BEST_FIRST = False  # 调度模式下按优先级（金额、可疑等级、跳数）追踪，而不是逐层同等展开
+CRAWL_BUDGET = None     # 全局爬取次数预算（None 不限制），用完即停止，提高后可续跑
+LLM_BUDGET = None       # 全局大模型调用次数预算（None 不限制）
+
 if __name__ == '__main__':
     eventname = 'bybit'
     
+    if USE_SCHEDULER:
+        if USE_STREAM:
+            run_stream(eventName=eventname, max_depth=21, crawl_workers=10, analyze_workers=4, llm_in_flight=64,
+                       best_first=USE_BEST_FIRST, crawl_budget=CRAWL_BUDGET, llm_budget=LLM_BUDGET)
+        else:
+            run_case(eventName=eventname, max_depth=21, crawl_workers=10, classify_workers=8,
+                     best_first=USE_BEST_FIRST, crawl_budget=CRAWL_BUDGET, llm_budget=LLM_BUDGET)
+        sys.exit(0)
+    
     for depth in range(0,22):
         #break
         print('##################################Processing event:', eventname, 'at depth:', depth, '\n')
         scrapy_data(eventName=eventname, dep=depth)
+        # 将本层爬取的 CSV 导入列式交易存储，后续阶段统一从存储读取（抓取引擎已直接写入存储）
+        if not USE_CRAWLER_ENGINE:
+            import_csv_tree(eventName=eventname, depth=depth)
         #classify_accounts(eventName=eventname, depth=depth)
         # 使用并行版本，可以指定进程数
-        classify_accounts_parallel(eventName=eventname, depth=depth, max_workers=8)
+        #classify_accounts_parallel(eventName=eventname, depth=depth, max_workers=8)
+        # 异步版本：大模型请求在单进程内并发，吞吐量由 RPM/TPM 配额决定
+        classify_accounts_async(eventName=eventname, depth=depth, max_workers=8)
         accounts_bfs(eventName=eventname, depth=depth)
@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+###
+# 地址映射库：事件内 地址 -> [Addr-N] 的映射存放在 SQLite，只追加不改写
+# 新地址的编号在 BEGIN IMMEDIATE 事务内分配，多进程并发分类时编号不会冲突；
+# 每次分析只对本次出现的新地址批量写入一次，已分配的编号在进程内缓存（编号分配后不再变化，缓存不会过期）
+# 原来的 address_mapping_<event>.json 仍可导出用于复盘；首次使用某事件时自动导入已有 JSON
+
+MAPPING_PATH = 'D:/FORGE2/BlockchainSpider-master/blockscan_data'
+MAPPING_DB_PATH = os.path.join(MAPPING_PATH, 'address_mapping.sqlite')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS address_mapping (
+    event    TEXT    NOT NULL,
+    address  TEXT    NOT NULL,
+    id       INTEGER NOT NULL,
+    original TEXT    NOT NULL,
+    PRIMARY KEY (event, address),
+    UNIQUE (event, id)
+);
+"""
+
+
+def mapped_id(n: int) -> str:
+    return f"[Addr-{n}]"
+
+
+def mapping_json_path(eventname: str) -> str:
+    return os.path.join(MAPPING_PATH, f"address_mapping_{eventname}.json")
+
+
+class AddressMappingStore:
+    """地址映射库，线程安全；多进程通过 SQLite 事务分配编号"""
+
+    def __init__(self, db_path: str = MAPPING_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Dict[str, str]] = {}  # event -> {小写地址: mapped_id}
+        self._conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _ensure_event(self, event: str):
+        """首次使用某事件：若库中没有记录而存在旧 JSON，则导入"""
+        if event in self._cache:
+            return
+        has_rows = self._conn.execute('SELECT 1 FROM address_mapping WHERE event=? LIMIT 1', (event,)).fetchone()
+        if has_rows is None and os.path.exists(mapping_json_path(event)):
+            n = self._import_json(event, mapping_json_path(event))
+            print(f"已从 {mapping_json_path(event)} 导入 {n} 条地址映射")
+        self._cache[event] = {}  # 导入失败时不标记，下次使用时重试
+
+    def map_addresses(self, event: str, addresses: Iterable[str]) -> Dict[str, str]:
+        """
+        返回 {小写地址: mapped_id}；未映射的地址按传入顺序分配新编号（一次事务批量写入）
+        addresses 为原始地址（保留首次出现时的写法）
+        """
+        with self._lock:
+            self._ensure_event(event)
+            cache = self._cache[event]
+            result = {}
+            missing = OrderedDict()
+            for addr in addresses:
+                key = addr.lower()
+                if key in cache:
+                    result[key] = cache[key]
+                elif key not in missing:
+                    missing[key] = addr
+            if not missing:
+                return result
+
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 其他进程可能已分配过这些地址
+                keys = list(missing)
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    marks = ','.join('?' * len(chunk))
+                    for address, n in self._conn.execute(
+                            f'SELECT address, id FROM address_mapping WHERE event=? AND address IN ({marks})',
+                            [event] + chunk):
+                        cache[address] = mapped_id(n)
+                        del missing[address]
+                if missing:
+                    start = self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM address_mapping WHERE event=?',
+                                               (event,)).fetchone()[0] + 1
+                    rows = [(event, key, start + i, addr) for i, (key, addr) in enumerate(missing.items())]
+                    self._conn.executemany(
+                        'INSERT INTO address_mapping (event, address, id, original) VALUES (?, ?, ?, ?)', rows)
+                    for _, key, n, _ in rows:
+                        cache[key] = mapped_id(n)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            for key in keys:
+                result[key] = cache[key]
+            return result
+
+    def _import_json(self, event: str, path: str) -> int:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rows = []
+        for addr, info in data.items() if isinstance(data, dict) else []:
+            try:
+                n = int(info["mapped_id"].split('-')[1].strip(']'))
+            except (ValueError, IndexError, KeyError, AttributeError):
+                print(f"Skipping invalid mapped_id for {addr}")
+                continue
+            rows.append((event, addr.lower(), n, info.get("original", addr)))
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO address_mapping (event, address, id, original) VALUES (?, ?, ?, ?)', rows)
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def import_json(self, event: str, path: str = None) -> int:
+        """导入旧格式 JSON（已存在的地址或编号忽略）"""
+        with self._lock:
+            self._cache.pop(event, None)
+            return self._import_json(event, path or mapping_json_path(event))
+
+    def load(self, event: str) -> OrderedDict:
+        """按编号顺序读出完整映射（旧 JSON 的格式）"""
+        with self._lock:
+            self._ensure_event(event)
+            rows = self._conn.execute('SELECT address, id, original FROM address_mapping WHERE event=? ORDER BY id',
+                                      (event,)).fetchall()
+        return OrderedDict((address, {"mapped_id": mapped_id(n), "original": original})
+                           for address, n, original in rows)
+
+    def export_json(self, event: str, path: str = None) -> int:
+        """导出为 address_mapping_<event>.json（便于复盘），返回条数"""
+        mapping = self.load(event)
+        path = path or mapping_json_path(event)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(mapping, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return len(mapping)
+
+
+# 每个进程一个连接（进程池中 fork 出的子进程重新打开）
+_STORE = {}
+def get_mapping_store() -> AddressMappingStore:
+    pid = os.getpid()
+    if pid not in _STORE:
+        _STORE.clear()
+        _STORE[pid] = AddressMappingStore()
+    return _STORE[pid]
+
+
+def export_address_mapping(eventname: str) -> int:
+    n = get_mapping_store().export_json(eventname)
+    print(f"地址映射已导出：{n} 条 -> {mapping_json_path(eventname)}")
+    return n
+
+
+if __name__ == '__main__':
+    # python address_mapping_store.py <event> [import|export]
+    event = sys.argv[1] if len(sys.argv) > 1 else 'bybit'
+    action = sys.argv[2] if len(sys.argv) > 2 else 'export'
+    if action == 'import':
+        print(f"导入 {get_mapping_store().import_json(event)} 条")
+    else:
+        export_address_mapping(event)
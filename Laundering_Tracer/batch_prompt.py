@@ -0,0 +1,154 @@
+import asyncio
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from LLM_detection import record_llm_verdict, LLM_FAILED_PREFIX
+from prompt_renderer import count_tokens, render_analysis
+from verdict import DIMENSIONS, extract_json
+from best_first import LLM_CALL
+
+###
+# 小账户批量判断：交易很少的地址（SMALL_ACCOUNT_TXS 以内）不再各自带一份完整的系统提示和反思说明，
+# 多个地址的流向分析摘要（prompt_renderer 的紧凑格式）按 token 预算打包进同一个请求，回复为逐地址的判断数组
+# 校验每个地址恰好有一条判断（缺失、重复、无法解析的地址单独重试，使用该地址原本的单地址 Prompt）；
+# 批量得到的判断按该地址自己的单地址 Prompt 写入判断缓存（与 verdict_key(单地址 Prompt) 相同的键），
+# 同一地址摘要不变时，下次无论走单地址还是批量都能命中；批量 Prompt 含其他地址，作为键永远不会再次命中
+# 给出预算（best_first.TraceBudget）时，批量请求和缺失地址的单独重试都按实际请求计入大模型预算
+
+USE_BATCH_PROMPTS = True
+SMALL_ACCOUNT_TXS = 10          # 总交易数不超过该值的地址参与批量判断
+BATCH_MAX_ADDRESSES = 8         # 每个请求最多的地址数
+BATCH_TOKEN_BUDGET = 6000       # 每个请求的输入 token 预算
+BATCH_OUTPUT_TOKENS = 350       # 每个地址预留的输出 token
+
+# 一个待判断地址：(地址, 单地址 Prompt, 流向分析摘要)
+Item = Tuple[str, str, Dict]
+
+_HEADER = """You are a blockchain security analyst. For EACH core address below, determine whether it is suspected of money laundering, using only its transaction analysis. Each address is a small account with few transfers; judge every address independently.
+
+Assess four risk dimensions per address, citing concrete records (amounts, times, counterparties):
+a) transaction patterns: large or high-frequency transfers in short periods, just-below-threshold or round amounts, self-transfers/reversals;
+b) fund flows: pooling from many scattered addresses then quick dispersion, layering through intermediates, pass-through behaviour;
+c) associated addresses: links to known hackers or high-risk entities (see labels and neighborhood_features), mixers, fresh addresses;
+d) temporal & behavioral signs: odd timing, sudden activity spikes, activity conflicting with an ordinary user profile.
+Classify each as High/Medium/Low/No Suspicion. Weigh mitigating evidence; do not assume facts that are not in the data.
+
+Addresses ({count}); each block starts with "## <target_address>", then its statistics as JSON and its transaction tables (header once, one comma-separated row per transfer):
+{analyses}
+
+Return ONLY a JSON object with exactly one verdict per address, using the given target_address values:
+{{"verdicts": [{{"address": "<target_address>", "suspicion_level": "High/Medium/Low/No Suspicion", {dimensions}}}]}}"""
+
+
+def is_small(analysis: Optional[Dict]) -> bool:
+    return USE_BATCH_PROMPTS and analysis is not None and analysis.get('total_transactions', 0) <= SMALL_ACCOUNT_TXS
+
+
+def _summary_text(analysis: Dict) -> str:
+    return f"## {analysis['target_address']}\n" + render_analysis(analysis)[0]
+
+
+def pack_batches(items: Sequence[Item], budget: int = BATCH_TOKEN_BUDGET,
+                 max_addresses: int = BATCH_MAX_ADDRESSES) -> List[List[Item]]:
+    """按输入顺序贪心打包：每批的摘要 token 合计不超过预算（超出预算的单个地址自成一批）"""
+    overhead = count_tokens(_HEADER)
+    batches, current, used = [], [], overhead
+    for item in items:
+        cost = count_tokens(_summary_text(item[2]))
+        if current and (used + cost > budget or len(current) >= max_addresses):
+            batches.append(current)
+            current, used = [], overhead
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_prompt(items: Sequence[Item]) -> str:
+    dimensions = ', '.join(f'"{dim}": {{"result": "", "evidence": ""}}' for dim in DIMENSIONS)
+    return _HEADER.format(count=len(items), analyses='\n\n'.join(_summary_text(item[2]) for item in items),
+                          dimensions=dimensions)
+
+
+def batch_max_tokens(count: int) -> int:
+    return BATCH_OUTPUT_TOKENS * count + 200
+
+
+def parse_batch_response(response_text: str, ids: Sequence[str]) -> Dict[str, str]:
+    """
+    批量回复 -> {target_address: 该地址的判断 JSON 文本}（verdict.parse_verdict 可直接解析）
+    只返回恰好出现一次、且在本批中的地址；其余由调用方单独重试
+    """
+    if response_text.startswith(LLM_FAILED_PREFIX):
+        return {}
+    data = extract_json(response_text)
+    entries = data.get('verdicts') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return {}
+    wanted = set(ids)
+    found: Dict[str, List[dict]] = {}
+    for entry in entries:
+        if isinstance(entry, dict) and str(entry.get('address', '')).strip() in wanted:
+            found.setdefault(str(entry['address']).strip(), []).append(entry)
+    return {addr: json.dumps({k: v for k, v in found[addr][0].items() if k != 'address'}, ensure_ascii=False)
+            for addr in ids if len(found.get(addr, [])) == 1}
+
+
+def record_batch(items: Sequence[Item], response_text: str) -> Tuple[Dict[str, Tuple[bool, str]], List[Item]]:
+    """
+    保存批量回复中的逐地址判断（按各地址的单地址 Prompt 写入判断缓存），
+    返回 ({地址: (Is_ML, label)}, 需要单独重试的条目)
+    """
+    by_id = {item[2]['target_address']: item for item in items}
+    if len(by_id) < len(items):
+        # 摘要编号重复（不应出现），整批单独判断
+        return {}, list(items)
+    verdicts = parse_batch_response(response_text, list(by_id))
+    done, retry = {}, []
+    for target_id, item in by_id.items():
+        if target_id in verdicts:
+            Is_ML, label = record_llm_verdict(item[0], item[1], verdicts[target_id])
+            done[item[0]] = (Is_ML, label)
+        else:
+            retry.append(item)
+    return done, retry
+
+
+BUDGET_EXHAUSTED = 'error: 大模型预算已用完'
+
+
+async def classify_batches(client, items: Sequence[Item], budget=None) -> List[Tuple]:
+    """
+    异步批量判断（classify_accounts2 使用）：返回 [(addr, Is_ML, label, status)]，
+    批内缺失的地址用单地址 Prompt 重试；budget（best_first.TraceBudget）给出时每个请求先申请一次，
+    申请不到的地址状态为 BUDGET_EXHAUSTED
+    """
+    def allowed() -> bool:
+        return budget is None or budget.take(LLM_CALL, 1) > 0
+
+    async def run(batch: List[Item]) -> List[Tuple]:
+        if not allowed():
+            return [(addr, None, None, BUDGET_EXHAUSTED) for addr, _, _ in batch]
+        response_text = await client.complete(build_batch_prompt(batch), max_tokens=batch_max_tokens(len(batch)))
+        done, retry = record_batch(batch, response_text)
+        results = [(addr, Is_ML, label, 'success') for addr, (Is_ML, label) in done.items()]
+        for addr, prompt, _ in retry:
+            if not allowed():
+                results.append((addr, None, None, BUDGET_EXHAUSTED))
+                continue
+            single = await client.complete(prompt)
+            if single.startswith(LLM_FAILED_PREFIX):
+                results.append((addr, None, None, f'error: {single}'))
+            else:
+                Is_ML, label = record_llm_verdict(addr, prompt, single)
+                results.append((addr, Is_ML, label, 'success'))
+        return results
+
+    batches = pack_batches(items)
+    if batches:
+        print(f"小账户批量判断：{len(items)} 个地址打包为 {len(batches)} 个请求")
+    results = []
+    for part in await asyncio.gather(*(run(batch) for batch in batches)):
+        results.extend(part)
+    return results
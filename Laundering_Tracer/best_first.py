@@ -0,0 +1,89 @@
+import json
+import math
+import threading
+from typing import Dict, Optional
+
+from verdict import LEVEL_HIGH, LEVEL_MEDIUM, LEVEL_LOW, LEVEL_NONE, LEVEL_UNKNOWN, LEVEL_MISSING, LEVEL_LABELS
+
+###
+# 优先级驱动的追踪（best-first）：不再逐层同等展开，而是按优先级从任务库取任务
+# 下一跳的优先级 = 追踪金额（对数）+ 上一跳的大模型可疑等级 - 跳数惩罚，源地址最高；
+# 爬取、分类、下一跳计算的任务继承同一地址的优先级（task_store），每次取任务时优先级高的先执行
+# 全局预算：爬取次数按任务库中的尝试次数累计，大模型调用次数按实际发出的请求累计（任务库 counters 表），
+# 续跑时接着计；预算用完后停止取新任务，
+# 剩余任务留在任务库中（提高预算后续跑即可），因此任意预算下得到的都是该花费内价值最高的路径
+# best-first 模式下每个地址保留更多候选下一跳（BEST_FIRST_MAX_ADDRESSES），由优先级和预算决定实际展开哪些
+
+BEST_FIRST_MAX_ADDRESSES = 10      # 每个源地址最多保留的下一跳数（逐层模式为 3）
+BEST_FIRST_TOP_AMOUNT_RATIO = 0.2  # 每个源地址保留的大额交易比例（逐层模式为 0.05）
+
+AMOUNT_WEIGHT = 1.0   # 金额每增加 10 倍加的分数
+LEVEL_WEIGHT = 2.0    # 上一跳可疑等级的权重
+HOP_PENALTY = 0.5     # 每一跳扣的分数
+SEED_PRIORITY = 1e6   # 源地址（第 0 层）
+
+LLM_CALL = 'llm'      # 大模型请求的预算项（不是任务库中的阶段）
+
+# 可疑等级 -> 分数（未判断或判断失败按低可疑处理，避免整条路径被丢到最后）
+LEVEL_SCORES = {LEVEL_HIGH: 1.0, LEVEL_MEDIUM: 0.6, LEVEL_LOW: 0.3, LEVEL_UNKNOWN: 0.3, LEVEL_MISSING: 0.3,
+                LEVEL_NONE: 0.0}
+_LABEL_LEVELS = {label: level for level, label in LEVEL_LABELS.items()}
+
+
+def record_level(record: Optional[str]) -> str:
+    """分类任务的结果记录（JSON：Is_ML、label、status）对应的可疑等级"""
+    try:
+        label = json.loads(record).get('label') if record else None
+    except (ValueError, AttributeError):
+        label = None
+    return _LABEL_LEVELS.get(label, LEVEL_UNKNOWN)
+
+
+def hop_priority(amount: float, parent_level: str, depth: int) -> float:
+    """深度为 depth 的下一跳的优先级（amount 为上一跳转给它的金额，代币单位）"""
+    return (AMOUNT_WEIGHT * math.log10(1.0 + max(float(amount), 0.0)) +
+            LEVEL_WEIGHT * LEVEL_SCORES.get(parent_level, 0.0) - HOP_PENALTY * depth)
+
+
+class TraceBudget:
+    """
+    爬取与大模型调用的全局预算，线程安全；None 表示不限制
+    爬取的已用量从任务库的尝试次数初始化（包括失败重试），之后在内存中计数；
+    大模型（LLM_CALL）按实际发出的请求计：前置筛选、判断缓存命中不计，一个批量请求计一次，失败的请求同样计入；
+    该计数不对应任务，申请时同时写入任务库的 counters 表
+    """
+
+    def __init__(self, store, event: str, limits: Dict[str, Optional[int]]):
+        self.store = store
+        self.event = event
+        self.limits = dict(limits)
+        self.used = {stage: store.counter(event, stage) if stage == LLM_CALL else store.attempts(event, stage)
+                     for stage in self.limits}
+        self._lock = threading.Lock()
+
+    def take(self, stage: str, n: int) -> int:
+        """申请 n 次，返回实际批准的次数"""
+        limit = self.limits.get(stage)
+        with self._lock:
+            granted = n if limit is None else max(0, min(n, limit - self.used[stage]))
+            if stage in self.used:
+                self.used[stage] += granted
+        if stage == LLM_CALL and granted > 0:
+            self.store.bump(self.event, LLM_CALL, granted)
+        return granted
+
+    def refund(self, stage: str, n: int):
+        """批准后没有用掉的次数（任务库中没有那么多待执行任务）"""
+        if n > 0 and stage in self.used:
+            with self._lock:
+                self.used[stage] -= n
+            if stage == LLM_CALL:
+                self.store.bump(self.event, LLM_CALL, -n)
+
+    def exhausted(self, stage: str) -> bool:
+        limit = self.limits.get(stage)
+        return limit is not None and self.used[stage] >= limit
+
+    def report(self) -> str:
+        return ', '.join(f"{stage} {self.used[stage]}/{'∞' if limit is None else limit}"
+                         for stage, limit in self.limits.items())
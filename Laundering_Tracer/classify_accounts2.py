@@ -1,3 +1,4 @@
+import asyncio
 import pandas as pd
 import os
 from decimal import Decimal
@@ -8,7 +9,16 @@ import multiprocessing
 from tqdm import tqdm
 
 sys.path.append('XXXX')
-from ML_Detection import LLM_Addr_Detect
+from ML_Detection import LLM_Addr_Detect, REUSE_ADDRESS_RESULT
+from LLM_detection import (prepare_detect_analysis, cached_llm_verdict, record_llm_verdict,
+                           LLM_RESULT_PATH, LLM_FAILED_PREFIX)
+from verdict_cache import get_verdict_cache
+from address_mapping_store import export_address_mapping
+from llm_client import AsyncLLMClient, LLM_RPM, LLM_TPM, MAX_IN_FLIGHT
+from tx_store import has_address
+from pre_classifier import USE_PRE_CLASSIFIER, get_pre_classifier, prepare_batch
+from batch_prompt import is_small, classify_batches
+from prompt_renderer import get_prompt_stats
 
 def safe_move(src, dst, overwrite=True, rename=False):
     """原有的安全移动文件函数"""
@@ -45,20 +55,49 @@ def safe_move(src, dst, overwrite=True, rename=False):
 def process_single_address(args):
     """
     处理单个地址的包装函数，用于多进程
+    args 为 (addr, eventName, depth) 或 (addr, eventName, depth, features)，features 为该地址的邻域特征
     """
-    addr, blockchainspider_path, depth = args
-    file_name = os.path.join(addr, 'AccountTransferItem.csv')
-    file_path = os.path.join(blockchainspider_path, file_name)
+    addr, eventName, depth = args[:3]
+    features = args[3] if len(args) > 3 else None
     
-    if not os.path.exists(file_path):
+    if not has_address(addr, eventName, depth):
         return addr, None, None, "no_file"
     
     try:
-        Is_ML, label = LLM_Addr_Detect(addr)
+        Is_ML, label = LLM_Addr_Detect(addr, eventname=eventName, depth=depth, features=features)
         return addr, Is_ML, label, "success"
     except Exception as e:
         return addr, None, None, f"error: {str(e)}"
 
+def prepare_single_address(args):
+    """
+    分类的 CPU 部分（读取交易、流向分析、构建 Prompt），用于进程池
+    返回 (prompt, result, summary)：需要调用大模型时 result 为 None；否则 prompt 为 None，
+    result 同 process_single_address；summary 为小账户（batch_prompt.is_small）的流向分析结果，可与其他小账户打包判断，其余为 None
+    判断缓存命中（Prompt 未变化）时直接返回结果，不进入大模型阶段
+    args 同 process_single_address
+    """
+    addr, eventName, depth = args[:3]
+    features = args[3] if len(args) > 3 else None
+    
+    if not has_address(addr, eventName, depth):
+        return None, (addr, None, None, "no_file"), None
+    
+    if REUSE_ADDRESS_RESULT and (get_verdict_cache().get_address(addr) is not None
+                                 or os.path.exists(LLM_RESULT_PATH + addr + '.txt')):
+        # 已有大模型结果，直接读取
+        Is_ML, label = LLM_Addr_Detect(addr, eventname=eventName, depth=depth)
+        return None, (addr, Is_ML, label, "success"), None
+    
+    prepared = prepare_detect_analysis(addr, eventName, depth, features=features)
+    if prepared is None:
+        return None, (addr, False, "unknown", "success"), None
+    prompt, analysis = prepared
+    cached = cached_llm_verdict(addr, prompt)
+    if cached is not None:
+        return None, (addr, cached[0], cached[1], "success"), None
+    return prompt, None, (analysis if is_small(analysis) else None)
+
 def classify_accounts_parallel(eventName: str = 'bybit', depth: int = 0, max_workers: int = None):
     """
     并行处理版本的账户分类
@@ -74,32 +113,16 @@ def classify_accounts_parallel(eventName: str = 'bybit', depth: int = 0, max_wor
     print(f"使用 {max_workers} 个进程并行处理")
     
     src_addr_path = 'D:/FORGE2/XBlock/src_addr_token/'
-    blockchainspider_path = 'G:/RiskTagger/blockscan_data/'
 
-    large_path = 'D:/FORGE2/XBlock/all_data_large/'
-    if not os.path.exists(large_path):
-        os.makedirs(large_path)
-    raw_path = 'D:/FORGE2/XBlock/all_data_token/'
-    if not os.path.exists(raw_path):
-        os.makedirs(raw_path)
-    
-    # 读取现有数据
-    if os.path.exists(large_path + 'large_addr_info.csv'):
-        df_large_addr = pd.read_csv(large_path + 'large_addr_info.csv')
-    else:
-        df_large_addr = pd.DataFrame(columns=['address'])
-    
-    df_hacker = pd.read_csv('D:/FORGE2/XBlock/reference_list/accounts-hacker.csv')
-    
     # 读取当前层的源地址
     print("Classify accounts ing...")
     df_src = pd.read_csv(src_addr_path + eventName + '_source_addr' + str(depth) + '.csv')
     addresses = list(df_src['address'])
     
-    # 准备任务参数
-    tasks = [(addr, blockchainspider_path, depth) for addr in addresses]
-    
-    results = []
+    # 准备任务参数（特征表整层一次计算，前置筛选直接判定的地址不调用大模型）
+    features, resolved = prepare_batch(eventName, depth, addresses)
+    results = [(addr, *resolved[addr.lower()], "success") for addr in addresses if addr.lower() in resolved]
+    tasks = [(addr, eventName, depth, features.get(addr.lower())) for addr in addresses if addr.lower() not in resolved]
     
     # 使用进程池并行处理
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
@@ -119,11 +142,115 @@ def classify_accounts_parallel(eventName: str = 'bybit', depth: int = 0, max_wor
                 print(f"处理地址 {addr} 时发生异常: {str(e)}")
                 results.append((addr, None, None, f"exception: {str(e)}"))
     
+    if USE_PRE_CLASSIFIER:
+        print(get_pre_classifier().report())
+    save_classify_results(results, depth)
+    export_address_mapping(eventName)  # 导出地址映射 JSON 便于复盘
+    
+    print("✅ 所有账户分类完成")
+
+async def _classify_addresses_async(addresses, eventName: str, depth: int, max_workers: int,
+                                    rpm: int, tpm: int, max_in_flight: int):
+    client = AsyncLLMClient(rpm=rpm, tpm=tpm, max_in_flight=max_in_flight)
+    loop = asyncio.get_running_loop()
+    features, resolved = prepare_batch(eventName, depth, addresses)  # 特征表整层一次计算
+    gated = [(addr, *resolved[addr.lower()], "success") for addr in addresses if addr.lower() in resolved]
+    addresses = [addr for addr in addresses if addr.lower() not in resolved]
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        small = []  # 小账户 (addr, prompt, summary)，全部准备完后打包判断
+        
+        async def classify_one(addr):
+            try:
+                prompt, result, summary = await loop.run_in_executor(
+                    executor, prepare_single_address, (addr, eventName, depth, features.get(addr.lower())))
+                if result is not None:
+                    return result
+                if summary is not None:
+                    small.append((addr, prompt, summary))
+                    return None
+                response_text = await client.complete(prompt)
+                if response_text.startswith(LLM_FAILED_PREFIX):
+                    return addr, None, None, f"error: {response_text}"
+                Is_ML, label = record_llm_verdict(addr, prompt, response_text)
+                return addr, Is_ML, label, "success"
+            except Exception as e:
+                return addr, None, None, f"exception: {str(e)}"
+        
+        tasks = [asyncio.ensure_future(classify_one(addr)) for addr in addresses]
+        results = gated
+        for future in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="处理地址"):
+            result = await future
+            if result is not None:
+                results.append(result)
+        try:
+            results.extend(await classify_batches(client, small))
+        except Exception as e:
+            results.extend((addr, None, None, f"exception: {str(e)}") for addr, _, _ in small)
+    
+    client.report()
+    get_verdict_cache().report()
+    get_prompt_stats().report()
+    if USE_PRE_CLASSIFIER:
+        print(get_pre_classifier().report())
+    await client.close()
+    return results
+
+def classify_accounts_async(eventName: str = 'bybit', depth: int = 0, max_workers: int = None,
+                            rpm: int = LLM_RPM, tpm: int = LLM_TPM, max_in_flight: int = MAX_IN_FLIGHT):
+    """
+    异步版本的账户分类：流向分析在进程池中执行，大模型调用由单进程内的异步客户端并发完成，
+    吞吐量只受服务商 RPM/TPM 配额限制，而不是进程数
+    
+    Args:
+        eventName: 事件名称
+        depth: 层数
+        max_workers: 流向分析的进程数，默认使用CPU核心数
+        rpm: 每分钟请求数上限
+        tpm: 每分钟 token 数上限
+        max_in_flight: 同时在途的大模型请求数上限
+    """
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    
+    src_addr_path = 'D:/FORGE2/XBlock/src_addr_token/'
+    
+    print("Classify accounts ing...")
+    df_src = pd.read_csv(src_addr_path + eventName + '_source_addr' + str(depth) + '.csv')
+    addresses = list(df_src['address'])
+    
+    results = asyncio.run(_classify_addresses_async(addresses, eventName, depth, max_workers, rpm, tpm, max_in_flight))
+    
+    save_classify_results(results, depth)
+    export_address_mapping(eventName)  # 导出地址映射 JSON 便于复盘
+    
+    print("✅ 所有账户分类完成")
+
+def save_classify_results(results, depth: int):
+    """
+    把分类结果写入标签库：正常账户追加到 large_addr_info.csv，洗钱账户追加到 accounts-hacker.csv
+    
+    Args:
+        results: [(addr, Is_ML, label, status)]，即 process_single_address 的返回值
+        depth: 层数（写入 name_tag）
+    """
+    large_path = 'D:/FORGE2/XBlock/all_data_large/'
+    if not os.path.exists(large_path):
+        os.makedirs(large_path)
+    raw_path = 'D:/FORGE2/XBlock/all_data_token/'
+    if not os.path.exists(raw_path):
+        os.makedirs(raw_path)
+    
+    # 读取现有数据
+    if os.path.exists(large_path + 'large_addr_info.csv'):
+        df_large_addr = pd.read_csv(large_path + 'large_addr_info.csv')
+    else:
+        df_large_addr = pd.DataFrame(columns=['address'])
+    
+    df_hacker = pd.read_csv('D:/FORGE2/XBlock/reference_list/accounts-hacker.csv')
+    
     # 处理结果
     for addr, Is_ML, label, status in results:
-        file_name = os.path.join(addr, 'AccountTransferItem.csv')
-        file_path = os.path.join(blockchainspider_path, file_name)
-        
         if status == "no_file":
             print(f'地址 {addr} 无文件!!!')
             continue
@@ -156,8 +283,6 @@ def classify_accounts_parallel(eventName: str = 'bybit', depth: int = 0, max_wor
     
     with open('D:/FORGE2/XBlock/reference_list/accounts-hacker.csv', 'w', newline='', encoding='utf-8') as f:
         df_hacker.to_csv(f, index=None)
-    
-    print("✅ 所有账户分类完成")
 
 if __name__ == '__main__':
     classify_accounts_parallel('bybit', 0, max_workers=4)
\ No newline at end of file
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+###
+# 增量爬取状态：记录每个地址已爬取到的最高区块号，下次爬取从该区块开始（start_blk）
+# 区块边界上的交易可能只爬到一部分，因此从该区块本身（而不是下一个区块）开始，重复的记录在合并时按哈希去重
+# complete 记录上次爬取是否取全：未取全（请求数达到上限、爬虫超时）时 max_block 为续爬起点，
+# 下次爬取不受 DELTA_MIN_INTERVAL 限制，直接从该区块继续；partial_blocks 为单个区块内超出结果窗口、无法取全的区块数
+# scope 为爬取时下推的过滤条件（代币白名单、起始区块），空字符串表示未过滤；过滤条件不同的记录不能用于增量爬取
+
+CRAWL_STATE_PATH = 'G:/RiskTagger/crawl_state.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_state (
+    address   TEXT    PRIMARY KEY,
+    max_block INTEGER NOT NULL,
+    rows      INTEGER NOT NULL,
+    updated   REAL    NOT NULL,
+    complete  INTEGER NOT NULL DEFAULT 1,
+    partial_blocks INTEGER NOT NULL DEFAULT 0,
+    scope     TEXT    NOT NULL DEFAULT ''
+);
+"""
+
+
+class CrawlRecord(NamedTuple):
+    max_block: int
+    updated: float
+    complete: bool
+    partial_blocks: int
+    scope: str
+
+
+class CrawlState:
+    """每个地址的增量爬取进度，线程安全"""
+
+    def __init__(self, db_path: str = CRAWL_STATE_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        columns = [r[1] for r in self._conn.execute('PRAGMA table_info(crawl_state)').fetchall()]
+        if 'complete' not in columns:
+            # 旧库没有完整性记录，按已取全处理
+            self._conn.execute('ALTER TABLE crawl_state ADD COLUMN complete INTEGER NOT NULL DEFAULT 1')
+            self._conn.execute('ALTER TABLE crawl_state ADD COLUMN partial_blocks INTEGER NOT NULL DEFAULT 0')
+        if 'scope' not in columns:
+            self._conn.execute("ALTER TABLE crawl_state ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, address: str) -> Optional[CrawlRecord]:
+        """返回 CrawlRecord(已爬取的最高区块号, 上次爬取时间, 是否取全, 不完整区块数, 过滤条件)，未记录返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT max_block, updated, complete, partial_blocks, scope FROM crawl_state '
+                                     'WHERE address=?', (address.lower(),)).fetchone()
+        return CrawlRecord(int(row[0]), float(row[1]), bool(row[2]), int(row[3]), row[4]) if row is not None else None
+
+    def update(self, address: str, max_block: int, rows: int = 0, updated: Optional[float] = None,
+               complete: bool = True, partial_blocks: int = 0, scope: str = ''):
+        """
+        记录一次爬取：最高区块号只增不减，rows、partial_blocks 累加
+        complete=False 时 max_block 应为续爬起点（之前的区块已取全）；过滤条件变化时先 reset
+        """
+        updated = time.time() if updated is None else updated
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO crawl_state (address, max_block, rows, updated, complete, partial_blocks, scope) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(address) DO UPDATE SET max_block = MAX(max_block, excluded.max_block), '
+                'rows = rows + excluded.rows, updated = excluded.updated, complete = excluded.complete, '
+                'partial_blocks = partial_blocks + excluded.partial_blocks, scope = excluded.scope',
+                (address.lower(), int(max_block), int(rows), updated, int(complete), int(partial_blocks), scope))
+
+    def reset(self, address: str):
+        """删除地址的爬取进度（过滤条件变化后从头爬取）"""
+        with self._lock:
+            self._conn.execute('DELETE FROM crawl_state WHERE address=?', (address.lower(),))
+
+    def touch(self, address: str):
+        """爬取完成但没有新记录：只更新爬取时间"""
+        with self._lock:
+            self._conn.execute('UPDATE crawl_state SET updated=? WHERE address=?', (time.time(), address.lower()))
+
+
+# 每个进程一个连接
+_STATE = {}
+def get_crawl_state() -> CrawlState:
+    pid = os.getpid()
+    if pid not in _STATE:
+        _STATE.clear()
+        _STATE[pid] = CrawlState()
+    return _STATE[pid]
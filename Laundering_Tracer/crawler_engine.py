@@ -0,0 +1,330 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from ML_Detection import DEFAULT_APIKEYS, DEFAULT_OUT, DEFAULT_OUT_FIELDS, DEFAULT_INCREMENTAL, DELTA_MIN_INTERVAL
+from crawl_state import CrawlRecord, get_crawl_state
+from discover_address_token3 import event_time
+from fetch_backends import (CHAINS, DEFAULT_CHAIN, NATIVE_CONTRACT, ChainBackend, Coverage, canonical_address,
+                            make_backend, route)
+from key_pool import KeyPool
+from next_hop import TOKEN_WHITELISTS
+from tx_store import append_transfer_csv, frame_to_table, in_partition, merge_addresses, read_csv_or_empty
+
+###
+# 进程内抓取引擎：替代每个地址启动一次的 `scrapy crawl txs.blockscan` 子进程
+# 一个常驻事件循环线程，批量地址并发请求各链的区块浏览器 API（fetch_backends：每条链一个后端，
+# 各自的连接池、并发上限与密钥池），抓取后直接去重写入列式交易存储（tx_store），
+# 同时追加到原来的 AccountTransferItem.csv（跨事件复用、复盘）
+# 不再切换工作目录，可以在任意线程中调用
+#
+# 多链：每个地址按 fetch_backends.route 路由到一条或多条链（Tron 地址 -> Tron；0x 地址 -> 报告给出的 EVM 链，默认以太坊），
+# 同一地址的各条链、不同地址之间全部并发抓取，各链的记录合并写入同一个 (event, depth) 分区
+# 以太坊的 CSV 与 crawl_state 沿用原来的路径和键（<out>/<地址>、地址），其他链为 <out>/<链>/<地址> 和 <链>:<地址>
+#
+# 分段抓取（EVM 链）：浏览器每次查询最多返回 RESULT_WINDOW 条（page × offset 的上限），结果按区块升序
+# - 区间不设上限开始，大多数地址一次请求取全
+# - 返回满一个窗口：在最后一个区块处拆分区间，之前的区块已取全（保留），从该区块起继续，已取到的结果不丢弃
+# - 浏览器查询超时（区间过大）：区间减半；区间稀疏（不足窗口的 1/4）：下一段区间加倍
+# 每个地址每条链是否取全记入 crawl_state（请求数达到 MAX_RANGE_REQUESTS 时记为未取全，下次从断点继续）
+#
+# 过滤条件下推到查询中，只下载、存储、解析相关的转账：
+# - 起始区块：事件时间（discover_address_token3.event_time）前 EVENT_LOOKBACK 秒对应的区块（getblocknobytime）
+# - 代币白名单（next_hop.TOKEN_WHITELISTS，每条链各自的合约，没有配置的链只抓原生币）：原生币不在白名单时不请求 txlist；
+#   ERC-20 先不带合约做一次查询，一个窗口内取全（大多数地址）则在本地按白名单过滤，
+#   否则剩余区间按白名单合约逐个查询（contractaddress=）
+
+USE_CRAWLER_ENGINE = True  # False: 仍按地址调用 scrapy 子进程（ML_Detection.run_blockscan_spider）
+FLUSH_SIZE = 64            # 批量抓取时每抓完多少个地址写入一次存储（一个 part 文件）
+
+TOKEN_PUSHDOWN = True            # 只抓取白名单代币的转账
+EVENT_TIME_PUSHDOWN = True       # 只抓取事件时间之后（含回看窗口）的转账
+EVENT_LOOKBACK = 7 * 24 * 3600   # 事件前仍然抓取的时间（秒），覆盖攻击准备阶段的资金往来
+CRAWL_TOKENS = TOKEN_WHITELISTS if TOKEN_PUSHDOWN else None
+CRAWL_SINCE = event_time - EVENT_LOOKBACK if EVENT_TIME_PUSHDOWN else None
+
+# (链, 新记录及完整性)；近期已爬取过为 None，抓取失败为异常
+ChainResult = Tuple[str, Union[Tuple[pd.DataFrame, Coverage], None, BaseException]]
+
+
+class CrawlerEngine:
+    """常驻的异步抓取引擎，线程安全（各线程提交的任务都在同一个事件循环中执行）"""
+
+    def __init__(self, out: str = DEFAULT_OUT, out_fields: List[str] = DEFAULT_OUT_FIELDS, write_csv: bool = True,
+                 allowed_tokens: Optional[Dict[str, Iterable[str]]] = CRAWL_TOKENS, since: Optional[int] = CRAWL_SINCE,
+                 backends: Optional[Dict[str, ChainBackend]] = None):
+        """
+        :param allowed_tokens: 链名 -> 只抓取这些合约地址的转账（原生币为 NATIVE_CONTRACT），
+                               没有列出的链只抓原生币；None 表示不限制
+        :param since: 只抓取该时间戳之后的转账，None 表示从第一个区块开始
+        :param backends: 链名 -> 后端；未给出的链首次用到时按 fetch_backends.CHAINS 创建
+        """
+        self.out = out
+        self.out_fields = list(out_fields)
+        self.write_csv = write_csv
+        self.allowed_tokens = None if allowed_tokens is None else {
+            chain: {t.strip().lower() for t in tokens} for chain, tokens in allowed_tokens.items()}
+        self.since = since
+        self.backends: Dict[str, ChainBackend] = dict(backends or {})
+        self._shared_keys: Optional[KeyPool] = None  # 没有单独配置密钥的 EVM 链共用（Etherscan v2 按密钥限额）
+        self._store_lock = threading.Lock()  # 存储写入串行（分区缓存与 part 文件）
+        self.stats = {'addresses': 0, 'rows': 0, 'skipped': 0, 'incomplete': 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='crawler-engine', daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        async def close_all():
+            await asyncio.gather(*(b.close() for b in self.backends.values()))
+        self._run(close_all())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _backend(self, chain: str) -> ChainBackend:
+        """取（首次用到时创建）某条链的后端，连接池建在引擎的事件循环中"""
+        if chain not in self.backends:
+            if not CHAINS[chain].get('apikeys') and self._shared_keys is None:
+                self._shared_keys = KeyPool(DEFAULT_APIKEYS)
+            self.backends[chain] = make_backend(chain, self._shared_keys)
+        backend = self.backends[chain]
+        await backend.open()
+        return backend
+
+    def _tokens(self, chain: str) -> Optional[set]:
+        """该链下推的代币白名单，None 表示不限制"""
+        if self.allowed_tokens is None:
+            return None
+        return self.backends[chain].tokens(self.allowed_tokens.get(chain, {NATIVE_CONTRACT}))
+
+    def _scope(self, chain: str) -> str:
+        """下推的过滤条件（记入 crawl_state，条件不同的进度不能用于增量爬取）"""
+        parts = []
+        tokens = self._tokens(chain)
+        if tokens is not None:
+            parts.append('tokens=' + ','.join(sorted(tokens)))
+        if self.since is not None:
+            parts.append(f'since={self.since}')
+        return ';'.join(parts)
+
+    # ---------- 单个地址 ----------
+    def csv_path(self, address: str, chain: str = DEFAULT_CHAIN) -> str:
+        if chain == DEFAULT_CHAIN:
+            return os.path.join(self.out, address, 'AccountTransferItem.csv')
+        return os.path.join(self.out, chain, address, 'AccountTransferItem.csv')
+
+    @staticmethod
+    def state_key(address: str, chain: str = DEFAULT_CHAIN) -> str:
+        return address if chain == DEFAULT_CHAIN else f'{chain}:{address}'
+
+    def _start_position(self, address: str, chain: str) -> Optional[int]:
+        """增量起点：crawl_state 记录的进度；没有记录但已有 CSV 时以 CSV 为准（与 run_blockscan_spider 一致）"""
+        state = self._state(address, chain)
+        path = self.csv_path(address, chain)
+        if state is None and os.path.exists(path):
+            last = self.backends[chain].position(read_csv_or_empty(path))
+            if last is None:
+                return None
+            get_crawl_state().update(self.state_key(address, chain), last, updated=os.path.getmtime(path))
+            return last
+        return state.max_block if state is not None else None
+
+    def _state(self, address: str, chain: str) -> Optional[CrawlRecord]:
+        """可用于增量爬取的进度：未过滤的进度（全集）或过滤条件相同的进度；条件不同时清除"""
+        key = self.state_key(address, chain)
+        state = get_crawl_state().get(key)
+        if state is not None and state.scope not in ('', self._scope(chain)):
+            get_crawl_state().reset(key)
+            return None
+        return state
+
+    def _fresh(self, address: str, chain: str) -> bool:
+        """近期已取全（未取全的地址总是继续爬取）"""
+        state = self._state(address, chain)
+        return state is not None and state.complete and time.time() - state.updated < DELTA_MIN_INTERVAL
+
+    async def _fetch_chain(self, address: str, chain: str, incremental: bool, start_blk: Optional[int],
+                           end_blk: Optional[int]) -> Optional[Tuple[pd.DataFrame, Coverage]]:
+        """抓取一个地址在一条链上的新记录（AccountTransferItem.csv 的列）及其完整性；近期已爬取过时返回 None"""
+        backend = await self._backend(chain)
+        if incremental:
+            if self._fresh(address, chain):
+                self.stats['skipped'] += 1
+                return None
+            last = await asyncio.get_running_loop().run_in_executor(None, self._start_position, address, chain)
+            if last is not None and (start_blk is None or start_blk < last):
+                # 区块边界上的交易可能只爬到一部分，从该区块本身开始，重复记录按 DEDUP_KEY 去重
+                start_blk = last
+        rows, coverage = await backend.fetch_transfers(address, start_blk, end_blk,
+                                                       self._tokens(chain), self.since)
+        return pd.DataFrame(rows, columns=self.out_fields, dtype=str), coverage
+
+    async def _fetch_address(self, address: str, chains: Optional[Iterable[str]], incremental: bool,
+                             start_blk: Optional[int], end_blk: Optional[int]) -> List[ChainResult]:
+        """按路由在各条链上并发抓取一个地址（某条链失败不影响其他链）"""
+        targets = route(address, chains)
+        fetched = await asyncio.gather(*(self._fetch_chain(address, c, incremental, start_blk, end_blk)
+                                         for c in targets), return_exceptions=True)
+        return list(zip(targets, fetched))
+
+    def _store(self, eventName: str, depth: int, frames: Dict[str, List[ChainResult]]) -> Dict[str, int]:
+        """
+        一批地址的新记录写入 CSV 和交易存储（一次写入一个 part 文件），并记录 crawl_state（每条链的进度与是否取全）
+        返回 {地址: 存储中新增的记录数}
+        """
+        tables, progress = {}, {}
+        with self._store_lock:
+            for address, results in frames.items():
+                known = in_partition(eventName, depth, address)
+                parts = []
+                for chain, fetched in results:
+                    if isinstance(fetched, BaseException):
+                        continue
+                    path = self.csv_path(address, chain)
+                    if fetched is None:
+                        # 近期已爬取过：只确保该分区有这个地址（其他事件/层爬取的结果从 CSV 导入）
+                        if not known:
+                            parts.append(read_csv_or_empty(path))
+                        continue
+                    df, coverage = fetched
+                    if self.write_csv:
+                        rows, _ = append_transfer_csv(path, df)
+                        # 分区中还没有该地址时连同之前爬取的记录（CSV）一起导入
+                        parts.append(df if known else read_csv_or_empty(path))
+                    else:
+                        rows = len(df)
+                        parts.append(df)
+                    progress[(address, chain)] = (rows, self.backends[chain].position(df), coverage)
+                parts = [p for p in parts if len(p) > 0]
+                if parts or not known:
+                    tables[address] = frame_to_table(address, pd.concat(parts, ignore_index=True) if parts
+                                                     else pd.DataFrame(columns=self.out_fields))
+            added = merge_addresses(eventName, depth, tables)
+        for (address, chain), (rows, position, coverage) in progress.items():
+            if not coverage.complete:
+                # 未取全：只把进度推进到续爬起点
+                position = coverage.resume_block
+                self.stats['incomplete'] += 1
+            get_crawl_state().update(self.state_key(address, chain), position or 0, rows=rows,
+                                     complete=coverage.complete, partial_blocks=coverage.partial_blocks,
+                                     scope=self._scope(chain))
+        self.stats['addresses'] += len({address for address, _ in progress})
+        self.stats['rows'] += sum(added.values())
+        return {address: added.get(address.lower(), 0) for address in frames}
+
+    @staticmethod
+    def _error(results: List[ChainResult]) -> Optional[BaseException]:
+        errors = [fetched for _, fetched in results if isinstance(fetched, BaseException)]
+        return errors[0] if errors else None
+
+    # ---------- 同步接口 ----------
+    def crawl(self, address: str, eventName: str = 'bybit', depth: int = 0, incremental: bool = DEFAULT_INCREMENTAL,
+              start_blk: Optional[int] = None, end_blk: Optional[int] = None,
+              chains: Optional[Iterable[str]] = None) -> int:
+        """
+        抓取单个地址（chains 为报告给出的链，None 时按地址格式路由）并写入 (event, depth) 分区，返回新增记录数
+        任一条链失败时抛出异常（其他链的结果已写入，重试时增量爬取）
+        """
+        results = self._run(self._fetch_address(address, chains, incremental, start_blk, end_blk))
+        added = self._store(eventName, depth, {address: results})[address]
+        error = self._error(results)
+        if error is not None:
+            raise error
+        return added
+
+    def crawl_many(self, addresses: Iterable[str], eventName: str = 'bybit', depth: int = 0,
+                   incremental: bool = DEFAULT_INCREMENTAL,
+                   chains: Optional[Dict[str, List[str]]] = None) -> Dict[str, Union[int, Exception]]:
+        """
+        批量抓取（全部并发提交，由各链后端的并发上限控制在途请求数），每抓完 FLUSH_SIZE 个地址写入一次存储
+        chains 为 {地址: 链名列表}；返回 {地址: 新增记录数或异常}
+        """
+        addresses = list(dict.fromkeys(addresses))
+        chains = chains or {}
+        results: Dict[str, Union[int, Exception]] = {}
+        errors: Dict[str, BaseException] = {}
+        pending: Dict[str, List[ChainResult]] = {}
+
+        async def fetch(address):
+            try:
+                return address, await self._fetch_address(address, chains.get(address), incremental, None, None)
+            except Exception as e:
+                return address, e
+
+        async def flush(batch: Dict[str, List[ChainResult]]):
+            stored = await asyncio.get_running_loop().run_in_executor(None, self._store, eventName, depth, batch)
+            results.update(stored)
+
+        async def crawl_all():
+            for done in asyncio.as_completed([fetch(a) for a in addresses]):
+                address, fetched = await done
+                if isinstance(fetched, Exception):
+                    errors[address] = fetched
+                    continue
+                if self._error(fetched) is not None:
+                    errors[address] = self._error(fetched)  # 其他链的结果仍然写入
+                pending[address] = fetched
+                if len(pending) >= FLUSH_SIZE:
+                    batch = dict(pending)
+                    pending.clear()
+                    await flush(batch)
+            if pending:
+                await flush(dict(pending))
+
+        self._run(crawl_all())
+        results.update(errors)
+        return {a: results[a] for a in addresses}
+
+    def report_keys(self):
+        """各密钥池的利用率（共用密钥池的链只输出一次）"""
+        pools: Dict[int, Tuple[KeyPool, List[str]]] = {}
+        for chain, backend in self.backends.items():
+            pools.setdefault(id(backend.keys), (backend.keys, []))[1].append(chain)
+        for pool, chains in pools.values():
+            print(f"[{', '.join(chains)}]", end=' ')
+            pool.report()
+
+    def report(self) -> Dict:
+        requests = sum(b.stats['requests'] for b in self.backends.values())
+        retries = sum(b.stats['retries'] for b in self.backends.values())
+        print(f"抓取引擎：地址 {self.stats['addresses']}（近期已爬跳过 {self.stats['skipped']}，"
+              f"未取全 {self.stats['incomplete']}），"
+              f"请求 {requests}，重试 {retries}，新增交易 {self.stats['rows']}")
+        for backend in self.backends.values():
+            backend.report()
+        self.report_keys()
+        return dict(self.stats, requests=requests, retries=retries)
+
+
+# 每个进程一个引擎（一个事件循环线程，各链一个连接池）；多个爬取线程可能同时首次调用，加锁创建
+_ENGINE = {}
+_ENGINE_LOCK = threading.Lock()
+def get_crawler_engine() -> CrawlerEngine:
+    pid = os.getpid()
+    with _ENGINE_LOCK:
+        if pid not in _ENGINE:
+            _ENGINE.clear()
+            _ENGINE[pid] = CrawlerEngine()
+        return _ENGINE[pid]
+
+
+def crawl_addresses(addresses: Iterable[str], eventName: str = 'bybit', depth: int = 0,
+                    chains: Optional[Dict[str, List[str]]] = None) -> Dict[str, Union[int, Exception]]:
+    """批量抓取一层地址（Tron base58 地址先转换为十六进制），打印汇总"""
+    engine = get_crawler_engine()
+    start = time.time()
+    addresses = [canonical_address(a) for a in addresses]
+    chains = {canonical_address(a): c for a, c in (chains or {}).items()}
+    results = engine.crawl_many(addresses, eventName, depth, chains=chains)
+    failed = {a: r for a, r in results.items() if isinstance(r, Exception)}
+    for addr, e in failed.items():
+        print(f"❌ 抓取失败 {addr}: {e}")
+    print(f"抓取完成：成功 {len(results) - len(failed)}，失败 {len(failed)}，用时 {time.time() - start:.1f} 秒")
+    engine.report()
+    return results
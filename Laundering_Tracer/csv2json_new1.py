@@ -10,6 +10,8 @@ from tqdm import tqdm  # 添加进度条库
 
 sys.path.append('D:/FORGE2/BlockchainSpider-master/ML-Detection/')  # 改成自己ML_Detection的相关路径
 from ML_Detection import run_blockscan_spider
+from crawler_engine import USE_CRAWLER_ENGINE, crawl_addresses
+from fetch_backends import canonical_address
 
 
 # 1、从报告的 JSON 文件中提取 addresses 列表，并保存为 CSV 文件
@@ -22,18 +24,20 @@ def json_to_csv(eventName:str, dep:int=0):
     with open(json_file_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
-    # 2. 提取 attacker_addresses 列表（假设 findings 是列表，可能有多个事件）
+    # 2. 提取 attacker_addresses 列表（假设 findings 是列表，可能有多个事件），同时记录该 finding 涉及的链
     attacker_addresses = []
     for finding in data.get("findings", []):
-        attacker_addresses.extend(finding.get("attacker_addresses", []))
+        chains = "|".join(finding.get("chain", []) or [])
+        # Tron base58 地址转换为十六进制，之后各步骤按小写地址查找时与抓取结果一致
+        attacker_addresses.extend((canonical_address(addr), chains) for addr in finding.get("attacker_addresses", []))
 
-    # 3. 保存为 CSV 文件
+    # 3. 保存为 CSV 文件（chain 列供抓取引擎按链路由，多条链用 | 分隔）
     csv_file_path = "D:/FORGE2/XBlock/src_addr_token/" + eventName + "_source_addr" + str(dep) + ".csv"
     with open(csv_file_path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
-        writer.writerow(["address"])  # 写入表头
-        for addr in attacker_addresses:
-            writer.writerow([addr])
+        writer.writerow(["address", "chain"])  # 写入表头
+        for addr, chains in attacker_addresses:
+            writer.writerow([addr, chains])
 
     print(f"成功提取 {len(attacker_addresses)} 个攻击者地址并保存到 {csv_file_path}")
 
@@ -162,6 +166,15 @@ def scrapy_data(eventName:str='bybit',dep:int=0):
         json_to_csv(eventName, dep=dep)  # 只有dep=0时需要运行,将pdf报告中json文件中的源地址转换为csv文件
 
     '''新版本spider不知道是否可以直接用json，减少改动直接调用ML_Detection中的爬虫调用函数'''
+    if USE_CRAWLER_ENGINE:
+        # 进程内抓取引擎：整层地址一次提交，直接写入交易存储
+        csv_file = pd.read_csv('D:/FORGE2/XBlock/src_addr_token/' + eventName + '_source_addr' + str(dep) + '.csv',
+                               dtype=str, keep_default_na=False)
+        chains = None
+        if 'chain' in csv_file.columns:
+            chains = dict(zip(csv_file['address'], csv_file['chain'].str.split('|')))
+        crawl_addresses(csv_file['address'].tolist(), eventName=eventName, depth=dep, chains=chains)
+        return
     loop_crawl_parallel(eventName + '_source_addr' + str(dep))
     #csv_to_json(eventName + '_source_addr' + str(dep), types=types, eventName=eventName)
     #os.chdir('D:/FORGE2/BlockchainSpider')
@@ -0,0 +1,585 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+import sys
+from abc import abstractmethod
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import httpx
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../Key_Clue_Extractor'))  # core.base 所在路径
+from core.base import BaseFetcher
+from ML_Detection import DEFAULT_APIKEYS, DEFAULT_ENDPOINT, DEFAULT_OUT_FIELDS
+from key_pool import KeyPool
+from tx_store import append_transfer_csv, csv_max_block
+
+###
+# 多链抓取后端：每条链一个 ChainBackend（基于 Key_Clue_Extractor 的 core.base.BaseFetcher），
+# 各自持有并发上限（信号量）和密钥池（限速），由抓取引擎（crawler_engine）按地址路由、多链并发抓取
+# - EvmBackend：Etherscan v2 多链 API，按 chainid 区分（以太坊、BSC、Polygon、Arbitrum ...），
+#   区块区间分段抓取、代币白名单下推（原 crawler_engine 中的逻辑）
+# - TronBackend：TronGrid v1 API（TRX 与 TRC-20 转账），按时间戳与 fingerprint 分页
+# 新的非 EVM 链实现 ChainBackend 的 accepts / fetch_transfers / position 并用 register_backend 注册即可
+#
+# 路由：地址格式优先（Tron 地址只能在 Tron 上抓取）；0x 地址按报告 Finding.chain 给出的链（任务库中按事件记录，
+# 下一跳继承上一跳的链），没有记录时为以太坊
+# Tron 地址统一转换为小写十六进制（41 + 20 字节），与交易存储中按小写地址索引的约定一致
+# 各链原生币转账的合约地址统一记为 NATIVE_CONTRACT（0x0，与 next_hop 白名单一致），symbol 为该链的原生币
+
+REQUEST_TIMEOUT = 30.0
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0         # 网络错误的退避基数（秒）；限速由密钥池处理（key_pool）
+BACKEND_CONCURRENCY = 16   # 每个后端同时在途的请求数下限（按密钥池总限额放大，保证在途请求足以用满限额）
+RESULT_WINDOW = 10000      # 浏览器单次查询的结果上限
+MAX_RANGE_REQUESTS = 200   # 每个地址每类转账最多请求次数（约 200 万条），超过记为未取全
+LATEST_BLOCK = 99999999    # 不设上限时的 endblock
+
+NATIVE_CONTRACT = '0x0000000000000000000000000000000000000000'  # 原生币转账的合约地址（与 next_hop 白名单一致）
+
+TXLIST = 'txlist'    # ExternalTransfer
+TOKENTX = 'tokentx'  # Token20Transfer
+
+_NO_RECORDS = ('no transactions found', 'no records found')
+_RATE_LIMITED = ('rate limit', 'max calls per sec', 'frequency limit')
+_DAILY_LIMITED = ('daily', 'per day')
+_QUERY_TIMEOUT = ('timeout', 'smaller result')
+
+DEFAULT_CHAIN = 'ethereum'
+EVM = 'evm'
+TRON = 'tron'
+
+# 链名 -> 后端配置；apikeys 为空时 EVM 链共用 DEFAULT_APIKEYS（Etherscan v2 的密钥对所有链有效，限额按密钥计算，
+# 因此共用同一个密钥池）；concurrency 为空时按密钥池限额计算
+CHAINS: Dict[str, Dict] = {
+    'ethereum': {'kind': EVM, 'chainid': 1, 'native': 'ETH', 'decimals': 18},
+    'bsc': {'kind': EVM, 'chainid': 56, 'native': 'BNB', 'decimals': 18},
+    'polygon': {'kind': EVM, 'chainid': 137, 'native': 'POL', 'decimals': 18},
+    'arbitrum': {'kind': EVM, 'chainid': 42161, 'native': 'ETH', 'decimals': 18},
+    'optimism': {'kind': EVM, 'chainid': 10, 'native': 'ETH', 'decimals': 18},
+    'base': {'kind': EVM, 'chainid': 8453, 'native': 'ETH', 'decimals': 18},
+    'avalanche': {'kind': EVM, 'chainid': 43114, 'native': 'AVAX', 'decimals': 18},
+    'tron': {'kind': TRON, 'native': 'TRX', 'decimals': 6, 'endpoint': 'https://api.trongrid.io',
+             'apikeys': ['X'], 'rps': 10, 'concurrency': 8},
+}
+
+# 报告中的链名写法 -> CHAINS 的键
+CHAIN_ALIASES = {
+    'eth': 'ethereum', 'ethereum mainnet': 'ethereum', 'mainnet': 'ethereum',
+    'bnb': 'bsc', 'bnb chain': 'bsc', 'bnb smart chain': 'bsc', 'binance smart chain': 'bsc', 'bsc mainnet': 'bsc',
+    'matic': 'polygon', 'polygon pos': 'polygon',
+    'arbitrum one': 'arbitrum', 'arb': 'arbitrum',
+    'op': 'optimism', 'op mainnet': 'optimism',
+    'base mainnet': 'base',
+    'avax': 'avalanche', 'avalanche c-chain': 'avalanche',
+    'trx': 'tron', 'tron mainnet': 'tron',
+}
+
+_EVM_ADDRESS = re.compile(r'^0x[0-9a-fA-F]{40}$')
+_TRON_HEX = re.compile(r'^41[0-9a-fA-F]{40}$')
+_BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+class CrawlError(RuntimeError):
+    pass
+
+
+class RangeTooLarge(CrawlError):
+    """浏览器查询超时，需要缩小区块区间"""
+
+
+class Coverage(NamedTuple):
+    """一次抓取的完整性"""
+    complete: bool
+    resume_block: Optional[int]  # 未取全时的续爬起点（之前的位置已取全；Tron 为毫秒时间戳）
+    partial_blocks: int          # 单个区块内超过结果窗口、无法取全的区块数
+    requests: int
+
+    @staticmethod
+    def combine(parts: List['Coverage']) -> 'Coverage':
+        resume = [p.resume_block for p in parts if not p.complete]
+        return Coverage(not resume, min(resume) if resume else None,
+                        sum(p.partial_blocks for p in parts), sum(p.requests for p in parts))
+
+
+# ---------- 地址与链名 ----------
+def normalize_chain(name: str) -> Optional[str]:
+    """报告中的链名归一化为 CHAINS 的键，不支持的链返回 None"""
+    key = str(name).strip().lower()
+    key = CHAIN_ALIASES.get(key, key)
+    return key if key in CHAINS else None
+
+
+def tron_to_hex(address: str) -> Optional[str]:
+    """Tron base58 地址（T 开头）转换为小写十六进制（41 开头），校验失败返回 None"""
+    n = 0
+    for ch in address:
+        i = _BASE58.find(ch)
+        if i < 0:
+            return None
+        n = n * 58 + i
+    raw = n.to_bytes(25, 'big') if n.bit_length() <= 200 else b''
+    if len(raw) != 25 or raw[0] != 0x41:
+        return None
+    payload, checksum = raw[:21], raw[21:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        return None
+    return payload.hex()
+
+
+def is_evm_address(address: str) -> bool:
+    return bool(_EVM_ADDRESS.match(address))
+
+
+def is_tron_address(address: str) -> bool:
+    return bool(_TRON_HEX.match(address)) or (address.startswith('T') and tron_to_hex(address) is not None)
+
+
+def canonical_address(address: str) -> str:
+    """入队前统一地址写法：Tron base58 地址转换为十六进制（小写后仍可用于查询），其他地址不变"""
+    address = str(address).strip()
+    if address.startswith('T'):
+        return tron_to_hex(address) or address
+    return address
+
+
+def route(address: str, chains: Optional[Iterable[str]] = None) -> List[str]:
+    """地址应在哪些链上抓取：Tron 地址只在 Tron 上；0x 地址在给出的 EVM 链上，没有给出时为以太坊"""
+    if is_tron_address(address):
+        return [TRON]
+    if is_evm_address(address):
+        evm = [c for c in (normalize_chain(x) for x in chains or []) if c is not None and CHAINS[c]['kind'] == EVM]
+        return list(dict.fromkeys(evm)) or [DEFAULT_CHAIN]
+    raise CrawlError(f"地址 {address} 格式无效：不是 EVM（0x 开头）或 Tron 地址")
+
+
+# ---------- 后端 ----------
+class ChainBackend(BaseFetcher):
+    """
+    单条链的转账抓取后端：自己的并发上限与密钥池（限速）
+    抓取引擎在其事件循环中调用 open / fetch_transfers；单独使用时按 BaseFetcher.fetch(地址, 输出目录) 抓取全部转账
+    """
+    kind = ''
+
+    def __init__(self, chain: str, keys: KeyPool, concurrency: Optional[int] = None,
+                 max_requests: int = MAX_RANGE_REQUESTS):
+        super().__init__(chain)
+        self.chain = chain
+        self.keys = keys
+        self.concurrency = concurrency or max(BACKEND_CONCURRENCY, int(keys.rps * 2))
+        self.max_requests = max_requests
+        self.timeout = REQUEST_TIMEOUT
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.stats = {'requests': 0, 'retries': 0}
+
+    # ---------- 子类实现 ----------
+    @abstractmethod
+    def accepts(self, address: str) -> bool:
+        """地址格式是否属于该链"""
+
+    @abstractmethod
+    async def fetch_transfers(self, address: str, start: Optional[int], end: Optional[int],
+                              allowed_tokens: Optional[set] = None,
+                              since: Optional[int] = None) -> Tuple[List[Dict[str, str]], Coverage]:
+        """
+        抓取 [start, end] 区间（区块号或该链的进度位置）内的转账，返回 AccountTransferItem.csv 的行及完整性
+        :param allowed_tokens: 只抓取这些合约地址的转账（原生币为 NATIVE_CONTRACT），None 表示不限制
+        :param since: 只抓取该时间戳（秒）之后的转账
+        """
+
+    @abstractmethod
+    def position(self, df: pd.DataFrame) -> Optional[int]:
+        """记录中的最大进度位置（增量爬取的起点，与 fetch_transfers 的 start 同一单位），没有记录时返回 None"""
+
+    def tokens(self, allowed_tokens: Optional[Iterable[str]]) -> Optional[set]:
+        """白名单中属于该链的合约（原生币总是保留），None 表示不限制"""
+        if allowed_tokens is None:
+            return None
+        return {t.strip().lower() for t in allowed_tokens if t.strip().lower() == NATIVE_CONTRACT or self.accepts(t)}
+
+    # ---------- 连接 ----------
+    async def open(self):
+        """在调用方的事件循环中创建连接池与并发信号量"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout,
+                                             limits=httpx.Limits(max_connections=self.concurrency))
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client, self._slots = None, None
+
+    async def _get(self, url: str, params: Dict, headers: Optional[Dict] = None) -> Dict:
+        async with self._slots:
+            response = await self._client.get(url, params=params, headers=headers)
+        self.stats['requests'] += 1
+        return self._parse_response(response)
+
+    async def _backoff(self, attempt: int, error: str):
+        if attempt == MAX_RETRIES:
+            raise CrawlError(f"请求失败（已重试 {MAX_RETRIES} 次）：{error}")
+        self.stats['retries'] += 1
+        await asyncio.sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+
+    # ---------- BaseFetcher ----------
+    def _do_fetch(self, target: str, work_dir: str) -> Tuple[bool, str]:
+        rows, coverage = asyncio.run(self._fetch_once(canonical_address(target)))
+        path = self._save_result(rows, work_dir)
+        if not coverage.complete:
+            print(f"⚠️  {self.chain} {target} 未取全（请求数达到上限，续爬起点 {coverage.resume_block}）")
+        return True, path
+
+    async def _fetch_once(self, address: str) -> Tuple[List[Dict[str, str]], Coverage]:
+        await self.open()
+        try:
+            return await self.fetch_transfers(address, None, None)
+        finally:
+            await self.close()
+
+    def _parse_response(self, response: httpx.Response) -> Dict:
+        response.raise_for_status()
+        return response.json()
+
+    def _save_result(self, data: List[Dict[str, str]], work_dir: str) -> str:
+        path = os.path.join(work_dir, 'AccountTransferItem.csv')
+        append_transfer_csv(path, pd.DataFrame(data, columns=DEFAULT_OUT_FIELDS, dtype=str))
+        return path
+
+    def report(self) -> Dict:
+        print(f"  {self.chain}: 请求 {self.stats['requests']}，重试 {self.stats['retries']}，"
+              f"并发上限 {self.concurrency}，限额 {self.keys.rps:.0f} 次/秒")
+        return dict(self.stats)
+
+
+class EvmBackend(ChainBackend):
+    """Etherscan v2 多链 API（按 chainid 区分链）"""
+    kind = EVM
+
+    def __init__(self, chain: str, chainid: int, keys: KeyPool, endpoint: str = DEFAULT_ENDPOINT,
+                 native: str = 'ETH', decimals: int = 18, concurrency: Optional[int] = None,
+                 max_requests: int = MAX_RANGE_REQUESTS):
+        super().__init__(chain, keys, concurrency, max_requests)
+        # httpx 的 params 会替换 URL 中的查询串，端点自带的参数单独保存，每次请求带上（chainid 按链覆盖）
+        url = httpx.URL(endpoint)
+        self.endpoint = str(url.copy_with(query=None))
+        self.base_params = dict(url.params, chainid=str(chainid))
+        self.native = native
+        self.decimals = str(decimals)
+        self._since_blocks: Dict[int, int] = {}
+
+    def accepts(self, address: str) -> bool:
+        return is_evm_address(address)
+
+    def position(self, df: pd.DataFrame) -> Optional[int]:
+        return csv_max_block(df)
+
+    def _to_rows(self, action: str, items: List[Dict]) -> List[Dict[str, str]]:
+        """把 API 返回的记录转换为 AccountTransferItem.csv 的列"""
+        rows = []
+        for item in items:
+            if action == TXLIST:
+                if item.get('isError', '0') == '1':
+                    continue  # 失败交易没有实际转账
+                contract, symbol, decimals = NATIVE_CONTRACT, self.native, self.decimals
+            else:
+                contract, symbol, decimals = item.get('contractAddress', ''), item.get('tokenSymbol', ''), \
+                    item.get('tokenDecimal', '')
+            rows.append({
+                'hash': item.get('hash', ''),
+                'address_from': item.get('from', ''),
+                'address_to': item.get('to', ''),
+                'value': item.get('value', ''),
+                'timestamp': item.get('timeStamp', ''),
+                'block_number': item.get('blockNumber', ''),
+                'contract_address': contract,
+                'symbol': symbol,
+                'decimals': decimals,
+                'token_id': '',
+            })
+        return rows
+
+    async def _request(self, params: Dict) -> Union[List[Dict], str]:
+        for attempt in range(MAX_RETRIES + 1):
+            key = await self.keys.acquire()
+            params['apikey'] = key
+            try:
+                data = await self._get(self.endpoint, params)
+            except (httpx.TransportError, httpx.HTTPStatusError, ValueError) as e:
+                error = str(e)
+            else:
+                result = data.get('result')
+                message = f"{data.get('message', '')} {result if isinstance(result, str) else ''}".lower()
+                if any(m in message for m in _RATE_LIMITED):
+                    # 暂停该密钥，换一个密钥立即重试（等待由密钥池的令牌桶控制）
+                    self.keys.park(key, daily=any(m in message for m in _DAILY_LIMITED))
+                    if attempt == MAX_RETRIES:
+                        raise CrawlError(f"请求失败（已重试 {MAX_RETRIES} 次）：{message.strip()}")
+                    self.stats['retries'] += 1
+                    continue
+                self.keys.ok(key)
+                if str(data.get('status')) == '1' and result is not None:
+                    return result
+                if any(m in message for m in _NO_RECORDS):
+                    return []
+                if any(m in message for m in _QUERY_TIMEOUT):
+                    raise RangeTooLarge(f"API 查询超时：{message.strip()}")
+                raise CrawlError(f"API 返回错误：{message.strip()}")
+            await self._backoff(attempt, error)
+        return []
+
+    async def _since_start_block(self, since: Optional[int]) -> Optional[int]:
+        """since 对应的第一个区块（每个时间戳只查询一次）"""
+        if since is None:
+            return None
+        if since not in self._since_blocks:
+            params = dict(self.base_params, module='block', action='getblocknobytime',
+                          timestamp=since, closest='after')
+            self._since_blocks[since] = int(await self._request(params))
+        return self._since_blocks[since]
+
+    async def _fetch(self, action: str, address: str, start_blk: Optional[int], end_blk: Optional[int],
+                     contract: Optional[str] = None, max_requests: Optional[int] = None) -> Tuple[List[Dict], Coverage]:
+        """按区块区间分段抓取一个地址的一类转账（contract 不为空时只查该代币），直到取全或达到请求上限"""
+        max_requests = max_requests or self.max_requests
+        lo = start_blk or 0
+        hi_max = end_blk if end_blk is not None else LATEST_BLOCK
+        span = None  # None 表示区间不设上限
+        items, partial_blocks, requests = [], 0, 0
+        while lo <= hi_max:
+            if requests >= max_requests:
+                if max_requests == self.max_requests:
+                    print(f"⚠️  {self.chain} {address} 的 {action} 请求数达到上限 {max_requests}，"
+                          f"记为未取全（下次从区块 {lo} 继续）")
+                return self._to_rows(action, items), Coverage(False, lo, partial_blocks, requests)
+            hi = hi_max if span is None else min(hi_max, lo + span - 1)
+            params = dict(self.base_params, module='account', action=action, address=address,
+                          startblock=lo, endblock=hi, page=1, offset=RESULT_WINDOW, sort='asc')
+            if contract is not None:
+                params['contractaddress'] = contract
+            requests += 1
+            try:
+                batch = await self._request(params)
+            except RangeTooLarge:
+                if hi <= lo:
+                    raise
+                span = (hi - lo + 1) // 2
+                continue
+            if len(batch) < RESULT_WINDOW:
+                items.extend(batch)
+                if hi >= hi_max:
+                    break
+                lo = hi + 1
+                if len(batch) < RESULT_WINDOW // 4:
+                    span *= 2
+                continue
+            # 返回满一个窗口：最后一个区块可能只取到一部分
+            last = int(batch[-1].get('blockNumber', lo))
+            if last <= lo:
+                # 单个区块内的转账超过结果窗口，无法取全，记录后跳过该区块
+                print(f"⚠️  {self.chain} {address} 区块 {lo} 的 {action} 记录超过 {RESULT_WINDOW} 条，"
+                      f"只取到前 {RESULT_WINDOW} 条")
+                items.extend(batch)
+                partial_blocks += 1
+                lo += 1
+                continue
+            items.extend(b for b in batch if int(b.get('blockNumber', last)) < last)
+            lo = last
+        return self._to_rows(action, items), Coverage(True, None, partial_blocks, requests)
+
+    async def _fetch_tokens(self, address: str, start_blk: Optional[int], end_blk: Optional[int],
+                            allowed: Optional[set]) -> Tuple[List[Dict], Coverage]:
+        """ERC-20 转账：不限代币时直接抓取；限白名单时先试一个窗口，取不全再按合约逐个下推"""
+        if allowed is None:
+            return await self._fetch(TOKENTX, address, start_blk, end_blk)
+        contracts = sorted(allowed - {NATIVE_CONTRACT})
+        if not contracts:
+            return [], Coverage(True, None, 0, 0)
+        rows, probe = await self._fetch(TOKENTX, address, start_blk, end_blk, max_requests=1)
+        rows = [r for r in rows if r['contract_address'].strip().lower() in allowed]
+        if probe.complete:
+            return rows, probe
+        # 转账多的地址：试探窗口之前的区块已取全，剩余区间每个白名单合约单独查询
+        fetched = await asyncio.gather(*(self._fetch(TOKENTX, address, probe.resume_block, end_blk, contract=c)
+                                         for c in contracts))
+        coverage = Coverage.combine([c for _, c in fetched])
+        return rows + [r for part, _ in fetched for r in part], \
+            coverage._replace(requests=coverage.requests + probe.requests)
+
+    async def fetch_transfers(self, address: str, start: Optional[int], end: Optional[int],
+                              allowed_tokens: Optional[set] = None,
+                              since: Optional[int] = None) -> Tuple[List[Dict[str, str]], Coverage]:
+        since_block = await self._since_start_block(since)
+        if since_block is not None and (start is None or start < since_block):
+            start = since_block
+        jobs = [self._fetch_tokens(address, start, end, allowed_tokens)]
+        if allowed_tokens is None or NATIVE_CONTRACT in allowed_tokens:
+            jobs.append(self._fetch(TXLIST, address, start, end))
+        fetched = await asyncio.gather(*jobs)
+        return [row for rows, _ in fetched for row in rows], Coverage.combine([c for _, c in fetched])
+
+
+TRON_PAGE_SIZE = 200  # TronGrid 每页最大条数
+TRX_TRANSFER = 'TransferContract'
+
+
+class TronBackend(ChainBackend):
+    """
+    TronGrid v1 API：TRX 转账（/transactions 中的 TransferContract）与 TRC-20 转账（/transactions/trc20）
+    按 block_timestamp 升序、fingerprint 翻页；TRC-20 记录没有区块号，进度位置为毫秒时间戳
+    """
+    kind = TRON
+
+    def __init__(self, chain: str, keys: KeyPool, endpoint: str = 'https://api.trongrid.io', native: str = 'TRX',
+                 decimals: int = 6, concurrency: Optional[int] = None, max_requests: int = MAX_RANGE_REQUESTS):
+        super().__init__(chain, keys, concurrency, max_requests)
+        self.endpoint = endpoint.rstrip('/')
+        self.native = native
+        self.decimals = str(decimals)
+
+    def accepts(self, address: str) -> bool:
+        return is_tron_address(address)
+
+    def position(self, df: pd.DataFrame) -> Optional[int]:
+        if len(df) == 0 or 'timestamp' not in df.columns:
+            return None
+        ts = pd.to_numeric(df['timestamp'], errors='coerce').dropna()
+        return int(ts.max()) * 1000 if len(ts) > 0 else None
+
+    @staticmethod
+    def _hex(address: str) -> str:
+        return (tron_to_hex(address) or address).lower() if address else ''
+
+    def _trc20_rows(self, items: List[Dict]) -> List[Dict[str, str]]:
+        rows = []
+        for item in items:
+            token = item.get('token_info') or {}
+            rows.append({
+                'hash': item.get('transaction_id', ''),
+                'address_from': self._hex(item.get('from', '')),
+                'address_to': self._hex(item.get('to', '')),
+                'value': str(item.get('value', '')),
+                'timestamp': str(int(item.get('block_timestamp', 0)) // 1000),
+                'block_number': '',
+                'contract_address': self._hex(token.get('address', '')),
+                'symbol': token.get('symbol', ''),
+                'decimals': str(token.get('decimals', '')),
+                'token_id': '',
+            })
+        return rows
+
+    def _trx_rows(self, items: List[Dict]) -> List[Dict[str, str]]:
+        rows = []
+        for item in items:
+            ret = item.get('ret') or [{}]
+            contracts = (item.get('raw_data') or {}).get('contract') or []
+            if not contracts or contracts[0].get('type') != TRX_TRANSFER or \
+                    ret[0].get('contractRet', 'SUCCESS') != 'SUCCESS':
+                continue  # 只取成功的 TRX 转账（合约调用等不是转账）
+            value = (contracts[0].get('parameter') or {}).get('value') or {}
+            rows.append({
+                'hash': item.get('txID', ''),
+                'address_from': self._hex(value.get('owner_address', '')),
+                'address_to': self._hex(value.get('to_address', '')),
+                'value': str(value.get('amount', '')),
+                'timestamp': str(int(item.get('block_timestamp', 0)) // 1000),
+                'block_number': str(item.get('blockNumber', '')),
+                'contract_address': NATIVE_CONTRACT,
+                'symbol': self.native,
+                'decimals': self.decimals,
+                'token_id': '',
+            })
+        return rows
+
+    async def _request(self, path: str, params: Dict) -> Dict:
+        for attempt in range(MAX_RETRIES + 1):
+            key = await self.keys.acquire()
+            try:
+                data = await self._get(self.endpoint + path, params, headers={'TRON-PRO-API-KEY': key})
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code in (403, 429):
+                    self.keys.park(key)
+                    if attempt == MAX_RETRIES:
+                        raise CrawlError(f"请求失败（已重试 {MAX_RETRIES} 次）：{e}")
+                    self.stats['retries'] += 1
+                    continue
+                error = str(e)
+            except (httpx.TransportError, ValueError) as e:
+                error = str(e)
+            else:
+                self.keys.ok(key)
+                if data.get('success', True) is False:
+                    raise CrawlError(f"API 返回错误：{data.get('error', '')}")
+                return data
+            await self._backoff(attempt, error)
+        return {}
+
+    async def _walk(self, path: str, address: str, start: Optional[int], end: Optional[int], params: Dict,
+                    to_rows) -> Tuple[List[Dict[str, str]], Coverage]:
+        params = dict(params, limit=TRON_PAGE_SIZE, order_by='block_timestamp,asc')
+        if start is not None:
+            params['min_timestamp'] = start
+        if end is not None:
+            params['max_timestamp'] = end
+        rows, requests, last = [], 0, start
+        while True:
+            if requests >= self.max_requests:
+                print(f"⚠️  {self.chain} {address} 的 {path} 请求数达到上限 {self.max_requests}，"
+                      f"记为未取全（下次从时间戳 {last} 继续）")
+                return rows, Coverage(False, last or 0, 0, requests)
+            requests += 1
+            data = await self._request(path.format(address=address), params)
+            items = data.get('data') or []
+            rows.extend(to_rows(items))
+            if items:
+                # 同一毫秒的记录可能跨页：续爬从该时间戳本身开始，重复记录合并时去重
+                last = max(last or 0, max(int(i.get('block_timestamp', 0)) for i in items))
+            fingerprint = (data.get('meta') or {}).get('fingerprint')
+            if not fingerprint or not items:
+                return rows, Coverage(True, None, 0, requests)
+            params['fingerprint'] = fingerprint
+
+    async def fetch_transfers(self, address: str, start: Optional[int], end: Optional[int],
+                              allowed_tokens: Optional[set] = None,
+                              since: Optional[int] = None) -> Tuple[List[Dict[str, str]], Coverage]:
+        if since is not None and (start is None or start < since * 1000):
+            start = since * 1000
+        trc20 = '/v1/accounts/{address}/transactions/trc20'
+        confirmed = {'only_confirmed': 'true'}
+        if allowed_tokens is None:
+            jobs = [self._walk(trc20, address, start, end, confirmed, self._trc20_rows)]
+        else:
+            jobs = [self._walk(trc20, address, start, end, dict(confirmed, contract_address=c), self._trc20_rows)
+                    for c in sorted(allowed_tokens - {NATIVE_CONTRACT})]
+        if allowed_tokens is None or NATIVE_CONTRACT in allowed_tokens:
+            jobs.append(self._walk('/v1/accounts/{address}/transactions', address, start, end,
+                                   dict(confirmed, only_from='false'), self._trx_rows))
+        fetched = await asyncio.gather(*jobs)
+        return [row for rows, _ in fetched for row in rows], Coverage.combine([c for _, c in fetched])
+
+
+# ---------- 注册与创建 ----------
+_BACKEND_TYPES = {EVM: EvmBackend, TRON: TronBackend}
+
+
+def register_backend(kind: str, backend_type: type):
+    """注册新的链类型（CHAINS 中 kind 为该值的链用 backend_type 创建，参数为 chain、keys 和配置项）"""
+    _BACKEND_TYPES[kind] = backend_type
+
+
+def make_backend(chain: str, shared_keys: Optional[KeyPool] = None) -> ChainBackend:
+    """按 CHAINS 配置创建后端；没有单独配置密钥的 EVM 链使用 shared_keys（共用的 Etherscan 密钥池）"""
+    config = dict(CHAINS[chain])
+    kind = config.pop('kind')
+    apikeys = config.pop('apikeys', None)
+    rps = config.pop('rps', None)
+    if apikeys:
+        keys = KeyPool(apikeys) if rps is None else KeyPool(apikeys, rps=rps)
+    else:
+        keys = shared_keys or KeyPool(DEFAULT_APIKEYS)
+    if kind == EVM:
+        return EvmBackend(chain, config.pop('chainid'), keys, **config)
+    return _BACKEND_TYPES[kind](chain, keys, **config)
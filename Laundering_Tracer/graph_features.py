@@ -0,0 +1,316 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from label_index import (LabelIndex, build_label_index, LARGE_ADDR_FILE, REF_PATH, HACKER_FILE, LABEL_LARGE,
+                         LABEL_EXCHANGE, LABEL_WALLET, LABEL_HACKER)
+from next_hop import TOKEN_WHITELIST
+from tx_graph import TxGraph, update_graph
+from tx_store import load_sources_transfers
+
+###
+# 邻域特征：在案件的共享交易图（tx_graph）上为一批待分类地址一次性计算 2 跳特征，写入大模型 Prompt
+#   hacker_inflow_ratio        转入价值中来自 accounts-hacker.csv 地址的比例（1 跳）
+#   hacker_inflow_ratio_2hop   转入价值中上游再上一跳来自黑客地址的比例（2 跳，按价值比例传递）
+#   exchange_outflow_ratio     转出价值中流向 exchange-list.csv 地址的比例（1 跳 / 2 跳）
+#   exchange_inflow_ratio      转入价值中来自交易所的比例
+#   fan_in_entropy / fan_out_entropy  转入来源 / 转出去向按价值分布的熵（bit），越大越分散
+#   two_hop_neighbors / flagged_neighbors_2hop  2 跳内（不分方向）的地址数、其中带黑客标签的地址数
+# 金额先按 TOKEN_UNIT_VALUE 折算为同一价值单位（美元）再求和、求比例，不同代币的数量不直接相加
+# W[u, v] 为 u 转给 v 的价值之和，转入比例为 D_in^-1 W^T，转出比例为 D_out^-1 W
+# 增量计算：每个地址的转入 / 转出价值、来自黑客 / 交易所的价值、笔数、首末时间只对新追加的边累加；
+# 稀疏矩阵在新边超过 REBUILD_RATIO 时才重建（摊销 O(E)），其间的新边按地址挂在待合并列表中，
+# 一批地址只读取这批地址及其邻居的行；标签索引更换（每层写入分类结果后）时整体重建
+# 只使用已存储的交易（已爬取地址的交易），不额外爬取；地址自身的标签写入 Prompt 的 labels 字段
+# 特征表另含活跃度列（ACTIVITY_COLUMNS，Prompt 中已有同类统计，不重复写入），供 pre_classifier 使用
+
+USE_GRAPH_FEATURES = True
+
+FEATURE_COLUMNS = ['hacker_inflow_ratio', 'hacker_inflow_ratio_2hop', 'exchange_outflow_ratio',
+                   'exchange_outflow_ratio_2hop', 'exchange_inflow_ratio', 'fan_in_entropy', 'fan_out_entropy',
+                   'two_hop_neighbors', 'flagged_neighbors_2hop']
+ACTIVITY_COLUMNS = ['in_amount', 'out_amount', 'in_count', 'out_count', 'in_degree', 'out_degree', 'active_days']
+
+LABEL_NAMES = [(LABEL_HACKER, 'known_hacker'), (LABEL_EXCHANGE, 'exchange'), (LABEL_WALLET, 'wallet'),
+               (LABEL_LARGE, 'known_normal')]
+
+_LABEL_FILES = [LARGE_ADDR_FILE, REF_PATH + 'exchange-list.csv', REF_PATH + 'wallet-list.csv', HACKER_FILE]
+
+# 每单位代币的价值（美元，按案发时价格配置）；没有价格的代币不参与特征
+ETH_PRICE = 2700.0
+TOKEN_UNIT_VALUE = {"0xdac17f958d2ee523a2206206994597c13d831ec7": 1.0,        # USDT
+                    "0xd5f7838f5c461feff7fe49ea5ebaf7728bb0adfa": ETH_PRICE,  # mETH
+                    "0xae7ab96520de3a18e5e111b5eaab095312d7fe84": ETH_PRICE,  # stETH
+                    "0xe6829d9a7ee3040e1276fa75293bde931859e8fa": ETH_PRICE,  # cmETH
+                    "0x55d398326f99059ff775485246999027b3197955": 1.0,        # USDT (BSC)
+                    "41a614f803b6fd780986a42c78ec9c7f77e6ded13c": 1.0,        # USDT (Tron TRC-20)
+                    "0x0000000000000000000000000000000000000000": ETH_PRICE,  # 原生币（按 ETH 计，其他链需按该链价格）
+                    }
+REBUILD_RATIO = 0.25  # 待合并的新边超过矩阵中边数的该比例时重建稀疏矩阵
+
+# 逐地址累加的向量（价值为折算后的美元）
+_VECTORS = {'in_value': 0.0, 'out_value': 0.0, 'hacker_in': 0.0, 'exchange_in': 0.0, 'exchange_out': 0.0,
+            'in_count': 0, 'out_count': 0, 'first': np.iinfo(np.int64).max, 'last': np.iinfo(np.int64).min}
+
+
+class _FeatureState:
+    """某个交易图的特征状态：逐地址向量 + 稀疏矩阵（定期重建）+ 尚未并入矩阵的新边；在 graph.lock 内使用"""
+
+    def __init__(self, graph: TxGraph, index: LabelIndex, tokens: Optional[set]):
+        self.graph = graph
+        self.index = index
+        self.tokens = tokens
+        self.n = 0
+        self.seen = 0           # 已处理的图边数
+        self.flagged = 0        # 已查询标签的地址数
+        self.v = {name: np.full(0, fill, dtype=np.int64 if isinstance(fill, int) else np.float64)
+                  for name, fill in _VECTORS.items()}
+        self.flags = np.zeros(0, dtype=np.uint8)
+        self.units = np.zeros(0)
+        self.w = self.wt = sp.csr_matrix((0, 0))
+        self.base_edges = 0
+        self._clear_pending()
+
+    def _clear_pending(self):
+        self.p_src, self.p_dst, self.p_val = [], [], []
+        self.p_out, self.p_in = defaultdict(list), defaultdict(list)
+
+    def _grow(self, n: int):
+        if n > len(self.flags):
+            cap = max(n, 2 * len(self.flags), 1024)
+            for name, fill in _VECTORS.items():
+                grown = np.full(cap, fill, dtype=self.v[name].dtype)
+                grown[:len(self.v[name])] = self.v[name]
+                self.v[name] = grown
+            flags = np.zeros(cap, dtype=np.uint8)
+            flags[:len(self.flags)] = self.flags
+            self.flags = flags
+        if n > self.flagged:
+            self.flags[self.flagged:n] = self.index.lookup(self.graph.names(np.arange(self.flagged, n)))
+            self.flagged = n
+        self.n = n
+
+    def _values(self, token: np.ndarray, amount: np.ndarray) -> np.ndarray:
+        names = self.graph.token_names()
+        if len(names) != len(self.units):
+            self.units = np.array([TOKEN_UNIT_VALUE.get(c, 0.0) if self.tokens is None or c in self.tokens else 0.0
+                                   for c in names], dtype=np.float64)
+        return amount * self.units[token] if len(token) else np.zeros(0)
+
+    def update(self):
+        """处理图中新追加的边"""
+        src, dst, token, amount, ts = self.graph.edges()
+        self._grow(self.graph.num_nodes)
+        if len(src) == self.seen:
+            return
+        new = slice(self.seen, len(src))
+        value = self._values(token[new], amount[new])
+        keep = value > 0
+        s, d = src[new][keep].astype(np.int64), dst[new][keep].astype(np.int64)
+        value, t = value[keep], ts[new][keep]
+        self.seen = len(src)
+
+        v = self.v
+        hacker = ((self.flags & np.uint8(LABEL_HACKER)) != 0).astype(np.float64)
+        exchange = ((self.flags & np.uint8(LABEL_EXCHANGE)) != 0).astype(np.float64)
+        np.add.at(v['out_value'], s, value)
+        np.add.at(v['in_value'], d, value)
+        np.add.at(v['out_count'], s, 1)
+        np.add.at(v['in_count'], d, 1)
+        np.add.at(v['hacker_in'], d, value * hacker[s])
+        np.add.at(v['exchange_in'], d, value * exchange[s])
+        np.add.at(v['exchange_out'], s, value * exchange[d])
+        for nodes in (s, d):
+            np.minimum.at(v['first'], nodes, t)
+            np.maximum.at(v['last'], nodes, t)
+
+        if len(self.p_val) + len(value) > REBUILD_RATIO * self.base_edges:
+            self._rebuild()
+            return
+        offset = len(self.p_val)
+        for k, (u, w) in enumerate(zip(s.tolist(), d.tolist())):
+            self.p_out[u].append(offset + k)
+            self.p_in[w].append(offset + k)
+        self.p_src.extend(s.tolist())
+        self.p_dst.extend(d.tolist())
+        self.p_val.extend(value.tolist())
+
+    def _rebuild(self):
+        """用全部边重建 W / W^T，清空待合并的新边"""
+        src, dst, token, amount, _ = self.graph.edges()
+        value = self._values(token, amount)
+        keep = value > 0
+        self.w = sp.csr_matrix((value[keep], (src[keep], dst[keep])), shape=(self.n, self.n))
+        self.w.sum_duplicates()
+        self.wt = self.w.T.tocsr()
+        self.base_edges = int(keep.sum())
+        self._clear_pending()
+
+    def _rows(self, base: sp.csr_matrix, pending: Dict[int, List[int]], other: List[int],
+              nodes: np.ndarray) -> sp.csr_matrix:
+        """nodes 在 base 中的行加上待合并的新边，形状 (len(nodes), n)"""
+        inside = np.flatnonzero(nodes < base.shape[0])
+        sub = base[nodes[inside]].tocoo()
+        rows, cols, data = [inside[sub.row]], [sub.col], [sub.data]
+        for i, u in enumerate(nodes.tolist()):
+            positions = pending.get(u)
+            if positions:
+                rows.append(np.full(len(positions), i))
+                cols.append(np.array([other[k] for k in positions], dtype=np.int64))
+                data.append(np.array([self.p_val[k] for k in positions]))
+        m = sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(len(nodes), self.n))
+        m.sum_duplicates()
+        return m
+
+    def out_rows(self, nodes: np.ndarray) -> sp.csr_matrix:
+        return self._rows(self.w, self.p_out, self.p_dst, nodes)
+
+    def in_rows(self, nodes: np.ndarray) -> sp.csr_matrix:
+        return self._rows(self.wt, self.p_in, self.p_src, nodes)
+
+    def hacker_ratio(self, nodes: np.ndarray) -> np.ndarray:
+        return _ratio(self.v['hacker_in'][nodes], self.v['in_value'][nodes])
+
+    def exchange_out_ratio(self, nodes: np.ndarray) -> np.ndarray:
+        return _ratio(self.v['exchange_out'][nodes], self.v['out_value'][nodes])
+
+    def hacker(self, nodes: np.ndarray) -> np.ndarray:
+        return ((self.flags[nodes] & np.uint8(LABEL_HACKER)) != 0).astype(np.float64)
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    return np.divide(num, den, out=np.zeros(len(den)), where=den > 0)
+
+
+def _weighted(rows: sp.csr_matrix, at) -> np.ndarray:
+    """每行 Σ w(u, v)·at(v)（at 只在行中出现的列上求值）"""
+    weighted = rows.copy()
+    weighted.data = weighted.data * at(weighted.indices)
+    return np.asarray(weighted.sum(axis=1)).ravel()
+
+
+def _entropy(rows: sp.csr_matrix, totals: np.ndarray) -> np.ndarray:
+    """每行按价值分布的熵：H = log2(S) - Σ w·log2(w) / S"""
+    wlogw = rows.copy()
+    wlogw.data = wlogw.data * np.log2(np.maximum(wlogw.data, 1e-300))
+    weighted = np.asarray(wlogw.sum(axis=1)).ravel()
+    entropy = np.log2(np.maximum(totals, 1e-300)) - _ratio(weighted, totals)
+    return np.where(totals > 0, np.maximum(entropy, 0.0), 0.0)
+
+
+def address_labels(flags: int) -> List[str]:
+    return [name for bit, name in LABEL_NAMES if int(flags) & bit]
+
+
+def neighborhood_features(graph: TxGraph, addresses: List[str], index: LabelIndex,
+                          tokens: Optional[set] = TOKEN_WHITELIST) -> pd.DataFrame:
+    """一批地址的特征表（DataFrame，index 为小写地址，列为 FEATURE_COLUMNS、ACTIVITY_COLUMNS 和 labels）"""
+    addresses = list(dict.fromkeys(str(a).lower() for a in addresses))
+    df = pd.DataFrame(0.0, index=addresses, columns=FEATURE_COLUMNS + ACTIVITY_COLUMNS)
+    df['labels'] = [address_labels(f) for f in index.lookup(addresses)]
+    with graph.lock:
+        state = _feature_state(graph, index, tokens)
+        state.update()
+        ids = graph.ids(addresses).astype(np.int64)
+        known = ids >= 0
+        rows = ids[known]
+        if len(rows) == 0:
+            return df
+        features = _features(state, rows)
+    for name in FEATURE_COLUMNS + ACTIVITY_COLUMNS:
+        df.loc[known, name] = np.asarray(features[name], dtype=np.float64)
+    return df
+
+
+def _features(state: _FeatureState, rows: np.ndarray) -> Dict[str, np.ndarray]:
+    v = state.v
+    out_rows, in_rows = state.out_rows(rows), state.in_rows(rows)
+    in_sum, out_sum = v['in_value'][rows], v['out_value'][rows]
+    first, last = v['first'][rows], v['last'][rows]
+    features = {
+        'hacker_inflow_ratio': state.hacker_ratio(rows),
+        'hacker_inflow_ratio_2hop': _ratio(_weighted(in_rows, state.hacker_ratio), in_sum),
+        'exchange_outflow_ratio': state.exchange_out_ratio(rows),
+        'exchange_outflow_ratio_2hop': _ratio(_weighted(out_rows, state.exchange_out_ratio), out_sum),
+        'exchange_inflow_ratio': _ratio(v['exchange_in'][rows], in_sum),
+        'fan_in_entropy': _entropy(in_rows, in_sum),
+        'fan_out_entropy': _entropy(out_rows, out_sum),
+        'in_amount': in_sum,
+        'out_amount': out_sum,
+        'in_count': v['in_count'][rows],
+        'out_count': v['out_count'][rows],
+        'in_degree': in_rows.getnnz(axis=1),
+        'out_degree': out_rows.getnnz(axis=1),
+        'active_days': np.where(last >= first, (last - first) / 86400.0, 0.0),
+    }
+    # 2 跳可达集合（不含自身）：本批地址的邻居，加上邻居的邻居（只读取邻居的行）
+    adjacency = ((out_rows + in_rows) > 0).astype(np.float64).tocsr()
+    neighbors = np.unique(adjacency.indices)
+    local = sp.csr_matrix((adjacency.data, np.searchsorted(neighbors, adjacency.indices), adjacency.indptr),
+                          shape=(len(rows), len(neighbors)))
+    second = ((state.out_rows(neighbors) + state.in_rows(neighbors)) > 0).astype(np.float64)
+    reach = ((adjacency + local @ second) > 0).astype(np.float64).tocsr()
+    self_hit = np.asarray(reach[np.arange(len(rows)), rows]).ravel()
+    features['two_hop_neighbors'] = reach.getnnz(axis=1) - self_hit
+    features['flagged_neighbors_2hop'] = _weighted(reach, state.hacker) - self_hit * state.hacker(rows)
+    return features
+
+
+_CACHE = {}
+def _feature_state(graph: TxGraph, index: LabelIndex, tokens: Optional[set]) -> _FeatureState:
+    """同一张图、同一个标签索引复用特征状态（增量更新）；标签索引更换后重新开始"""
+    key = (id(graph), None if tokens is None else frozenset(tokens))
+    state = _CACHE.get(key)
+    if state is None or state.graph is not graph or state.index is not index:
+        _CACHE.clear()
+        state = _CACHE[key] = _FeatureState(graph, index, tokens)
+    return state
+
+
+# 特征阶段自己的标签索引：标签库文件更新（每层写入分类结果）后重建
+_INDEX = {}
+_INDEX_LOCK = threading.Lock()
+def get_feature_index() -> LabelIndex:
+    stamp = tuple(os.path.getmtime(f) if os.path.exists(f) else 0 for f in _LABEL_FILES)
+    with _INDEX_LOCK:
+        index, old = _INDEX.get(os.getpid(), (None, None))
+        if index is None or old != stamp:
+            if index is not None:
+                index.close()
+            index = build_label_index()
+            _INDEX.clear()
+            _INDEX[os.getpid()] = (index, stamp)
+        return index
+
+
+def batch_feature_table(eventName: str, depth: int, addresses: List[str]) -> pd.DataFrame:
+    """待分类地址的特征表：把这些地址的交易（及之前各层）追加到案件的交易图后一次性计算"""
+    graph = update_graph(eventName, depth, load_sources_transfers(eventName, depth, addresses))
+    return neighborhood_features(graph, addresses, get_feature_index())
+
+
+def feature_records(df: pd.DataFrame) -> Dict[str, Dict]:
+    """特征表 -> {小写地址: {特征名: 值, 'labels': [...]}}，作为 prepare_detect_prompt 的 features 参数"""
+    if not USE_GRAPH_FEATURES:
+        return {}
+    records = {}
+    for addr, row in df.iterrows():
+        record = {name: round(float(row[name]), 4) for name in FEATURE_COLUMNS}
+        for name in ('two_hop_neighbors', 'flagged_neighbors_2hop'):
+            record[name] = int(record[name])
+        record['labels'] = row['labels']
+        records[addr] = record
+    return records
+
+
+def batch_features(eventName: str, depth: int, addresses: List[str]) -> Dict[str, Dict]:
+    """待分类地址的邻域特征（Prompt 用），见 batch_feature_table / feature_records"""
+    if not USE_GRAPH_FEATURES or not addresses:
+        return {}
+    return feature_records(batch_feature_table(eventName, depth, addresses))
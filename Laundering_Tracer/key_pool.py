@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple, Union
+
+###
+# 区块浏览器 API 密钥池：每个 Etherscan v2 密钥一个令牌桶（每秒调用数）加每日配额计数，
+# 每次请求分配给当前令牌最多的可用密钥，总吞吐接近所有密钥限额之和；
+# 密钥返回限速响应时自动暂停（连续限速时暂停时间加倍，触发每日上限时暂停到 UTC 次日），
+# metrics() / report() 输出每个密钥的实时利用率
+# 只在抓取引擎的事件循环中使用（单线程），状态修改无需加锁
+
+KEY_RPS = 5                # 每个密钥每秒调用数（Etherscan 免费额度）
+KEY_DAILY_QUOTA = 100_000  # 每个密钥每日调用数
+KEY_LIMITS: Dict[str, Tuple[float, int]] = {}  # 个别密钥的 (每秒调用数, 每日调用数)，覆盖上面的默认值
+PARK_BASE = 1.0            # 限速后暂停时间（秒），连续限速时加倍
+PARK_MAX = 60.0
+UTILISATION_WINDOW = 60.0  # 利用率统计窗口（秒）
+
+
+class KeyPoolExhausted(RuntimeError):
+    pass
+
+
+def _utc_day() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def _seconds_to_utc_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+class ApiKey:
+    """单个密钥的令牌桶、每日配额与统计"""
+
+    def __init__(self, key: str, rps: float = KEY_RPS, daily_quota: int = KEY_DAILY_QUOTA):
+        self.key = key
+        self.rps = float(rps)
+        self.daily_quota = daily_quota
+        self.tokens = self.rps  # 桶容量为 1 秒的调用数
+        self.updated = time.monotonic()
+        self.day = _utc_day()
+        self.used_today = 0
+        self.parked_until = 0.0
+        self.strikes = 0  # 连续限速次数
+        self.calls = 0
+        self.rate_limited = 0
+        self.recent = deque()  # 统计窗口内的调用时间
+
+    @property
+    def name(self) -> str:
+        return self.key[:6] + '…' if len(self.key) > 6 else self.key
+
+    def refill(self, now: float):
+        self.tokens = min(self.rps, self.tokens + (now - self.updated) * self.rps)
+        self.updated = now
+        day = _utc_day()
+        if day != self.day:
+            self.day, self.used_today = day, 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.parked_until and self.used_today < self.daily_quota
+
+    def wait_time(self, now: float) -> float:
+        """距离该密钥可以发出下一个请求的时间"""
+        if self.used_today >= self.daily_quota:
+            return _seconds_to_utc_midnight()
+        return max(self.parked_until - now, (1.0 - self.tokens) / self.rps, 0.0)
+
+    def take(self, now: float):
+        self.tokens -= 1.0
+        self.used_today += 1
+        self.calls += 1
+        self.recent.append(now)
+
+    def utilisation(self, now: float) -> float:
+        while self.recent and self.recent[0] < now - UTILISATION_WINDOW:
+            self.recent.popleft()
+        return len(self.recent) / (self.rps * UTILISATION_WINDOW)
+
+
+class KeyPool:
+    """按令牌桶把请求分配到多个密钥"""
+
+    def __init__(self, apikeys: Union[str, List[str]], rps: float = KEY_RPS, daily_quota: int = KEY_DAILY_QUOTA):
+        if isinstance(apikeys, str):
+            apikeys = apikeys.split(',')
+        apikeys = [k.strip() for k in apikeys if k.strip()]
+        if not apikeys:
+            raise ValueError('API 密钥不能为空，至少需配置1个（修改 DEFAULT_APIKEYS）')
+        self.keys = [ApiKey(k, *KEY_LIMITS.get(k, (rps, daily_quota))) for k in dict.fromkeys(apikeys)]
+        self._by_key = {k.key: k for k in self.keys}
+        self.started = time.monotonic()
+
+    @property
+    def rps(self) -> float:
+        """所有密钥每秒调用数之和"""
+        return sum(k.rps for k in self.keys)
+
+    async def acquire(self) -> str:
+        """取一个可用密钥（扣除一个令牌）；全部密钥都在限速或暂停时等待，每日配额全部用完时抛出 KeyPoolExhausted"""
+        while True:
+            now = time.monotonic()
+            best: Optional[ApiKey] = None
+            for k in self.keys:
+                k.refill(now)
+                if k.available(now) and k.tokens >= 1.0 and (best is None or k.tokens > best.tokens):
+                    best = k
+            if best is not None:
+                best.take(now)
+                return best.key
+            if all(k.used_today >= k.daily_quota for k in self.keys):
+                raise KeyPoolExhausted('所有 API 密钥的每日配额已用完')
+            await asyncio.sleep(max(min(k.wait_time(now) for k in self.keys), 0.01))
+
+    def ok(self, key: str):
+        """请求未被限速"""
+        self._by_key[key].strikes = 0
+
+    def park(self, key: str, daily: bool = False):
+        """密钥返回限速响应：暂停一段时间（daily 为每日上限时暂停到 UTC 次日）"""
+        k = self._by_key[key]
+        now = time.monotonic()
+        k.rate_limited += 1
+        k.tokens = 0.0
+        if daily:
+            k.used_today = k.daily_quota
+            k.parked_until = now + _seconds_to_utc_midnight()
+            return
+        k.strikes += 1
+        k.parked_until = now + min(PARK_MAX, PARK_BASE * 2 ** (k.strikes - 1))
+
+    def metrics(self) -> List[Dict]:
+        now = time.monotonic()
+        return [{'key': k.name, 'rps': k.rps, 'calls': k.calls, 'rate_limited': k.rate_limited,
+                 'utilisation': k.utilisation(now), 'used_today': k.used_today, 'daily_quota': k.daily_quota,
+                 'parked': max(k.parked_until - now, 0.0)} for k in self.keys]
+
+    def report(self) -> List[Dict]:
+        metrics = self.metrics()
+        calls = sum(m['calls'] for m in metrics)
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        print(f"密钥池：{len(metrics)} 个密钥，限额 {self.rps:.0f} 次/秒，累计调用 {calls}（平均 {calls / elapsed:.1f} 次/秒）")
+        for m in metrics:
+            parked = f"，暂停 {m['parked']:.0f} 秒" if m['parked'] > 0 else ''
+            print(f"  {m['key']}: 利用率 {m['utilisation']:.0%}，调用 {m['calls']}，限速 {m['rate_limited']}，"
+                  f"今日 {m['used_today']}/{m['daily_quota']}{parked}")
+        return metrics
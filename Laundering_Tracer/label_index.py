@@ -0,0 +1,198 @@
+import hashlib
+from multiprocessing import shared_memory
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+###
+# 地址标签索引：把已知标签库（大额/交易所/钱包/黑客地址）构建为共享内存中的开放寻址哈希表
+# 键为 20 字节地址，值为标签位掩码；每层构建一次，ProcessPoolExecutor 的各进程按名称只读挂载，不复制
+# 查询整列向量化，期望 O(1) 探测
+
+LABEL_LARGE = 1         # large_addr_info.csv（已判为正常的账户）
+LABEL_EXCHANGE = 2      # exchange-list.csv
+LABEL_WALLET = 4        # wallet-list.csv
+LABEL_HACKER = 8        # accounts-hacker.csv
+LABEL_ANY = 0xFF
+
+LARGE_ADDR_FILE = 'D:/FORGE2/XBlock/all_data_large/large_addr_info.csv'
+REF_PATH = 'D:/FORGE2/XBlock/reference_list/'
+HACKER_FILE = REF_PATH + 'accounts-hacker.csv'
+
+_HEADER_BYTES = 16
+_MIX_1 = np.uint64(0x9E3779B97F4A7C15)
+_MIX_2 = np.uint64(0xC2B2AE3D27D4EB4F)
+_MIX_3 = np.uint64(0xFF51AFD7ED558CCD)
+
+
+def address_keys(addresses: Iterable[str]) -> np.ndarray:
+    """地址转 (n, 20) 的 uint8 键；非 0x 十六进制地址（如其他链）用 sha1 摘要代替"""
+    raw = []
+    for addr in addresses:
+        a = str(addr).strip().lower()
+        try:
+            if len(a) == 42 and a.startswith('0x'):
+                raw.append(bytes.fromhex(a[2:]))
+                continue
+        except ValueError:
+            pass
+        raw.append(hashlib.sha1(a.encode('utf-8')).digest())
+    if not raw:
+        return np.zeros((0, 20), dtype=np.uint8)
+    return np.frombuffer(b''.join(raw), dtype=np.uint8).reshape(-1, 20)
+
+
+def _split_keys(keys: np.ndarray):
+    k0 = keys[:, 0:8].copy().view(np.uint64).ravel()
+    k1 = keys[:, 8:16].copy().view(np.uint64).ravel()
+    k2 = keys[:, 16:20].copy().view(np.uint32).ravel().astype(np.uint64)
+    return k0, k1, k2
+
+
+def _hash(k0: np.ndarray, k1: np.ndarray, k2: np.ndarray) -> np.ndarray:
+    # 靓号地址前缀大量为 0，需混合全部 20 字节再取槽位
+    h = k0 ^ (k1 * _MIX_1) ^ (k2 * _MIX_2)
+    h = (h ^ (h >> np.uint64(33))) * _MIX_3
+    return h ^ (h >> np.uint64(29))
+
+
+class LabelIndex:
+    """共享内存中的地址标签哈希表（构建端 build，工作进程 attach）"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf, offset=0)
+        self.size = int(header[0])
+        self.count = int(header[1])
+        offset = _HEADER_BYTES
+        self.k0 = np.ndarray((self.size,), dtype=np.uint64, buffer=shm.buf, offset=offset)
+        offset += 8 * self.size
+        self.k1 = np.ndarray((self.size,), dtype=np.uint64, buffer=shm.buf, offset=offset)
+        offset += 8 * self.size
+        self.k2 = np.ndarray((self.size,), dtype=np.uint64, buffer=shm.buf, offset=offset)
+        offset += 8 * self.size
+        self.flags = np.ndarray((self.size,), dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self.mask = np.uint64(self.size - 1)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def build(cls, labels: Dict[int, Iterable[str]]) -> 'LabelIndex':
+        """labels: {标签位: 地址列表}，同一地址的多个标签按位或合并"""
+        key_parts, flag_parts = [], []
+        for flag, addresses in labels.items():
+            keys = address_keys(addresses)
+            key_parts.append(keys)
+            flag_parts.append(np.full(len(keys), flag, dtype=np.uint8))
+        keys = np.concatenate(key_parts) if key_parts else np.zeros((0, 20), dtype=np.uint8)
+        flags = np.concatenate(flag_parts) if flag_parts else np.zeros(0, dtype=np.uint8)
+
+        # 去重并合并标签位
+        if len(keys) > 0:
+            void = np.ascontiguousarray(keys).view(np.dtype((np.void, 20))).ravel()
+            uniq, inverse = np.unique(void, return_inverse=True)
+            merged = np.zeros(len(uniq), dtype=np.uint8)
+            np.bitwise_or.at(merged, inverse.ravel(), flags)
+            keys = uniq.view(np.uint8).reshape(-1, 20)
+            flags = merged
+
+        n = len(keys)
+        size = 1024
+        while size < 2 * n:  # 装载因子不超过 0.5
+            size *= 2
+        nbytes = _HEADER_BYTES + size * (8 * 3 + 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf, offset=0)
+        header[0] = size
+        header[1] = n
+        index = cls(shm, owner=True)
+        index.flags[:] = 0
+
+        # 向量化线性探测插入：每轮把空槽分配给落在该槽的第一个待插入键
+        k0, k1, k2 = _split_keys(keys)
+        slot = _hash(k0, k1, k2) & index.mask
+        pending = np.arange(n)
+        while len(pending) > 0:
+            cand = slot[pending]
+            _, first = np.unique(cand, return_index=True)
+            winners = pending[first]
+            free = index.flags[slot[winners]] == 0
+            placed = winners[free]
+            s = slot[placed]
+            index.k0[s] = k0[placed]
+            index.k1[s] = k1[placed]
+            index.k2[s] = k2[placed]
+            index.flags[s] = flags[placed]
+            done = np.zeros(n, dtype=bool)
+            done[placed] = True
+            pending = pending[~done[pending]]
+            # 未放入的键中，槽位已被占用的向后探测一格
+            occupied = index.flags[slot[pending]] != 0
+            slot[pending[occupied]] = (slot[pending[occupied]] + np.uint64(1)) & index.mask
+        return index
+
+    @classmethod
+    def attach(cls, name: str) -> 'LabelIndex':
+        try:
+            # 只读挂载，不登记到本进程的资源跟踪器（Python 3.13+）
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, owner=False)
+
+    def lookup(self, addresses: Iterable[str]) -> np.ndarray:
+        """返回每个地址的标签位掩码（未收录为 0）"""
+        keys = address_keys(addresses)
+        n = len(keys)
+        result = np.zeros(n, dtype=np.uint8)
+        if n == 0 or self.count == 0:
+            return result
+        k0, k1, k2 = _split_keys(keys)
+        slot = _hash(k0, k1, k2) & self.mask
+        active = np.arange(n)
+        while len(active) > 0:
+            s = slot[active]
+            f = self.flags[s]
+            hit = (f != 0) & (self.k0[s] == k0[active]) & (self.k1[s] == k1[active]) & (self.k2[s] == k2[active])
+            result[active[hit]] = f[hit]
+            # 命中或遇到空槽即结束，其余继续探测
+            keep = (f != 0) & ~hit
+            active = active[keep]
+            slot[active] = (slot[active] + np.uint64(1)) & self.mask
+        return result
+
+    def contains(self, addresses: Iterable[str], mask: int = LABEL_ANY) -> np.ndarray:
+        """地址是否带有 mask 中任一标签（布尔数组）"""
+        return (self.lookup(addresses) & np.uint8(mask)) != 0
+
+    def close(self):
+        self.k0 = self.k1 = self.k2 = self.flags = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _read_addresses(path: str, **kwargs) -> pd.Series:
+    df = pd.read_csv(path, **kwargs)
+    if 'address' not in df.columns:
+        return pd.Series([], dtype=str)
+    return df['address'].dropna().astype(str)
+
+
+def build_label_index(large_file: str = LARGE_ADDR_FILE, ref_path: str = REF_PATH,
+                      hacker_file: str = HACKER_FILE) -> LabelIndex:
+    """读取四个标签库文件并构建共享标签索引（每层调用一次）"""
+    hacker = pd.read_csv(hacker_file)
+    labels = {
+        LABEL_LARGE: _read_addresses(large_file, encoding='utf-8'),
+        LABEL_EXCHANGE: _read_addresses(ref_path + 'exchange-list.csv', encoding='utf-8'),
+        LABEL_WALLET: _read_addresses(ref_path + 'wallet-list.csv'),
+        LABEL_HACKER: hacker['address'].dropna().astype(str),
+    }
+    index = LabelIndex.build(labels)
+    print(f"标签索引构建完成：{index.count} 个地址，共享内存 {index.name}")
+    return index
@@ -0,0 +1,184 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from LLM_detection import (build_messages, OPENAI_API_KEY, MODEL_NAME, BASE_URL, LLM_TEMPERATURE,
+                           LLM_MAX_TOKENS, LLM_RESPONSE_FORMAT, LLM_FAILED_PREFIX)
+from prompt_renderer import count_tokens, get_prompt_stats
+
+###
+# 异步大模型客户端：单进程内一个 AsyncOpenAI（共享一个 HTTP 连接池），数百个请求同时在途
+# 并发只受服务商配额约束：每分钟请求数 (RPM) 与每分钟 token 数 (TPM) 两个令牌桶，
+# 429 / 5xx / 连接错误按指数退避加随机抖动重试（优先使用 Retry-After）
+# 请求前用 tiktoken 计数（prompt_renderer.count_tokens）预扣 TPM，响应后按 usage 校正；
+# 计数是 CPU 密集的同步调用，不在事件循环中执行：LLMClientThread.submit 在调用方线程中算好，
+# 直接 await complete 时放到默认线程池中算
+# 同步代码（调度器主循环、流式追踪的大模型分发线程）通过 LLMClientThread 共用同一个客户端：
+# 事件循环在后台线程中运行，submit 返回 concurrent.futures.Future，配额与重试与异步版本完全一致
+
+LLM_RPM = 600          # 每分钟请求数上限
+LLM_TPM = 1_000_000    # 每分钟 token 数上限
+MAX_IN_FLIGHT = 256    # 同时在途请求数上限
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0     # 退避基数（秒）
+BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    """异步令牌桶：容量为每分钟配额，按秒连续补充"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float = 1.0):
+        n = min(float(n), self.capacity)  # 超过桶容量的单个请求按满桶处理，避免永久等待
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def adjust(self, n: float):
+        """按实际用量校正（n>0 追加扣除，n<0 退还）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - n)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def prepare_request(prompt: str, max_tokens: int = LLM_MAX_TOKENS) -> Tuple[List[Dict], int]:
+    """对话消息和预扣的 token 数（输入 + max_tokens），同时计入 Prompt 统计"""
+    messages = build_messages(prompt)
+    prompt_tokens = count_tokens(prompt)
+    get_prompt_stats().record(prompt_tokens)
+    return messages, prompt_tokens + sum(count_tokens(m['content']) for m in messages[:-1]) + max_tokens
+
+
+class AsyncLLMClient:
+    """带 RPM/TPM 配额控制的异步大模型客户端"""
+
+    def __init__(self, api_key: str = OPENAI_API_KEY, model_name: str = MODEL_NAME, base_url: str = BASE_URL,
+                 rpm: int = LLM_RPM, tpm: int = LLM_TPM, max_in_flight: int = MAX_IN_FLIGHT,
+                 max_retries: int = MAX_RETRIES, timeout: float = 120.0):
+        self.model_name = model_name
+        self.max_retries = max_retries
+        # SDK 自带的重试不感知配额，统一由本类处理
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.stats = {'requests': 0, 'retries': 0, 'failed': 0, 'tokens': 0}
+
+    async def complete(self, prompt: str, temperature: float = LLM_TEMPERATURE, max_tokens: int = LLM_MAX_TOKENS,
+                       prepared: Optional[Tuple[List[Dict], int]] = None) -> str:
+        """
+        单次调用，返回回复文本；重试耗尽后返回以 LLM_FAILED_PREFIX 开头的错误文本（与同步版本一致）
+        prepared 为 prepare_request(prompt, max_tokens) 的结果，未给出时在线程池中计算
+        """
+        if prepared is None:
+            prepared = await asyncio.get_running_loop().run_in_executor(None, prepare_request, prompt, max_tokens)
+        messages, estimate = prepared
+        async with self.in_flight:
+            for attempt in range(self.max_retries + 1):
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimate)
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model_name, messages=messages,
+                        temperature=temperature, max_tokens=max_tokens,
+                        response_format=LLM_RESPONSE_FORMAT)
+                except Exception as e:
+                    if not _retryable(e) or attempt == self.max_retries:
+                        self.stats['failed'] += 1
+                        return f"{LLM_FAILED_PREFIX}：{str(e)}"
+                    self.stats['retries'] += 1
+                    self.tokens.adjust(-estimate)  # 失败请求退还预估 token
+                    delay = _retry_after(e)
+                    if delay is None:
+                        # 指数退避 + 全抖动，避免大量请求同时重试
+                        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                    await asyncio.sleep(delay)
+                    continue
+                self.stats['requests'] += 1
+                usage = getattr(response, 'usage', None)
+                if usage is not None and usage.total_tokens:
+                    self.stats['tokens'] += usage.total_tokens
+                    self.tokens.adjust(usage.total_tokens - estimate)
+                return (response.choices[0].message.content or '').strip()
+        return f"{LLM_FAILED_PREFIX}：重试次数耗尽"
+
+    async def complete_many(self, prompts: Sequence[str], **kwargs) -> List[str]:
+        """批量调用（全部并发提交，由配额与在途上限控制节奏），结果顺序与输入一致"""
+        return list(await asyncio.gather(*(self.complete(p, **kwargs) for p in prompts)))
+
+    async def close(self):
+        await self.client.close()
+
+    def report(self) -> Dict:
+        print(f"大模型调用：成功 {self.stats['requests']}，重试 {self.stats['retries']}，"
+              f"失败 {self.stats['failed']}，消耗 token {self.stats['tokens']}")
+        return dict(self.stats)
+
+
+class LLMClientThread:
+    """在后台线程的事件循环中运行 AsyncLLMClient，供同步代码（多线程）共用同一份配额与重试"""
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.client = asyncio.run_coroutine_threadsafe(self._create(kwargs), self.loop).result()
+
+    @staticmethod
+    async def _create(kwargs) -> AsyncLLMClient:
+        return AsyncLLMClient(**kwargs)  # 在事件循环内创建，锁和信号量绑定到该循环
+
+    def submit(self, prompt: str, **kwargs) -> Future:
+        """提交一次调用（不等待回复），参数同 AsyncLLMClient.complete；token 计数在调用方线程中完成"""
+        if kwargs.get('prepared') is None:
+            kwargs['prepared'] = prepare_request(prompt, kwargs.get('max_tokens', LLM_MAX_TOKENS))
+        return asyncio.run_coroutine_threadsafe(self.client.complete(prompt, **kwargs), self.loop)
+
+    def complete(self, prompt: str, **kwargs) -> str:
+        """阻塞调用，返回回复文本（失败时以 LLM_FAILED_PREFIX 开头）"""
+        return self.submit(prompt, **kwargs).result()
+
+    def report(self) -> Dict:
+        return self.client.report()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
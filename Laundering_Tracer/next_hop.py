@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from label_index import LabelIndex, LABEL_ANY
+from token_amount import ge, group_sum, resolve_overflow, to_float
+
+###
+# 批量下一跳选择：把一层所有源地址的交易放进同一个 DataFrame，
+# 白名单、最小金额、前 N% 大额、前 N 个地址、标签库过滤全部按源地址分组向量化完成
+# 结果与 discover_address_token3.process_single_address 的逐地址路径一致
+# 金额比较、排序、分组求和均使用精确整数分量 amount_int/amount_frac（见 token_amount），溢出截断的记录以 value 列为准
+
+NATIVE_TOKEN = "0x0000000000000000000000000000000000000000"  # 原生币转账的合约地址（fetch_backends.NATIVE_CONTRACT）
+
+# 各链的白名单合约地址（小写），键同 fetch_backends.CHAINS；没有单独配置的链只保留原生币（抓取时）
+TOKEN_WHITELISTS = {
+    'ethereum': {"0xdac17f958d2ee523a2206206994597c13d831ec7",  # USDT
+                 "0xd5f7838f5c461feff7fe49ea5ebaf7728bb0adfa",  # mETH
+                 "0xae7ab96520de3a18e5e111b5eaab095312d7fe84",  # stETH
+                 "0xe6829d9a7ee3040e1276fa75293bde931859e8fa",  # cmETH
+                 NATIVE_TOKEN},                                 # ETH
+    'bsc': {"0x55d398326f99059ff775485246999027b3197955",        # USDT (BEP-20)
+            NATIVE_TOKEN},                                       # BNB
+    'tron': {"41a614f803b6fd780986a42c78ec9c7f77e6ded13c",       # USDT (TRC-20，十六进制地址)
+             NATIVE_TOKEN},                                      # TRX
+}
+
+# 以太坊白名单：下一跳、流向分析、污点、邻域特征按以太坊的合约过滤（交易存储中的记录不带链）
+TOKEN_WHITELIST = TOKEN_WHITELISTS['ethereum']
+
+# 默认筛选参数（与逐地址并行路径一致）
+DEFAULT_MIN_AMOUNT = 10
+DEFAULT_MAX_ADDRESSES = 3
+DEFAULT_TOP_AMOUNT_RATIO = 0.05
+
+
+def select_next_hops(transfers: pd.DataFrame, label_index: LabelIndex,
+                     min_amount=DEFAULT_MIN_AMOUNT, max_addresses=DEFAULT_MAX_ADDRESSES,
+                     top_amount_ratio=DEFAULT_TOP_AMOUNT_RATIO) -> pd.DataFrame:
+    """
+    transfers: 一层所有源地址的交易（tx_store 读取，source 列为所属源地址，已过滤零值）
+    返回 DataFrame[source, address, amount_int, amount_frac, value_numeric]，每个源地址保留的下一跳交易
+    """
+    columns = ['source', 'address', 'amount_int', 'amount_frac', 'value_numeric']
+    empty = pd.DataFrame(columns=columns)
+    if len(transfers) == 0:
+        return empty
+
+    df = resolve_overflow(transfers)
+    df = df[['source', 'address_from', 'address_to', 'contract_address', 'amount_int', 'amount_frac']]
+    df = df[df['address_from'] == df['source']].copy()
+    df['row'] = np.arange(len(df))  # 原始顺序，用于稳定排序
+
+    # 没有任何白名单转出交易的源地址不向下扩展；有则保留其全部转出交易
+    whitelisted = df['contract_address'].isin(TOKEN_WHITELIST)
+    eligible = df.loc[whitelisted, 'source'].unique()
+    df = df[df['source'].isin(eligible)]
+    if len(df) == 0:
+        return empty
+
+    # === 金额筛选策略 ===
+    if min_amount is not None:
+        df = df[ge(df['amount_int'], df['amount_frac'], min_amount)]
+
+    if top_amount_ratio < 1.0 and len(df) > 0:
+        # 每个源地址按金额降序保留前 N% 的大额交易（至少 1 笔）
+        df = df.sort_values(['source', 'amount_int', 'amount_frac', 'row'], ascending=[True, False, False, True],
+                            kind='mergesort')
+        group_size = df.groupby('source', sort=False)['row'].transform('size')
+        keep_count = np.maximum(1, (group_size * top_amount_ratio).astype(int))
+        df = df[df.groupby('source', sort=False).cumcount() < keep_count]
+
+    # === 地址数量限制策略 ===
+    if max_addresses is not None and len(df) > 0:
+        totals = group_sum(df, ['source', 'address_to'])
+        totals = totals.sort_values(['source', 'amount_int', 'amount_frac', 'address_to'],
+                                    ascending=[True, False, False, True], kind='mergesort')
+        totals = totals[totals.groupby('source', sort=False).cumcount() < max_addresses]
+        df = df.merge(totals[['source', 'address_to']], on=['source', 'address_to'], how='inner')
+
+    # 标签库过滤
+    if len(df) > 0:
+        df = df[~label_index.contains(df['address_to'], LABEL_ANY)]
+
+    df = df.rename(columns={'address_to': 'address'})
+    df = df.assign(value_numeric=to_float(df['amount_int'], df['amount_frac']))
+    return df[columns].reset_index(drop=True)
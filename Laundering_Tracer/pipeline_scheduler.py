@@ -0,0 +1,375 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from task_store import TaskStore, TASK_DB_PATH, PENDING, RUNNING, DONE
+from tx_store import import_address, compact_partition, load_sources_transfers
+from label_index import build_label_index
+from next_hop import select_next_hops, DEFAULT_MAX_ADDRESSES
+from taint import TAINT_MODEL, select_tainted_hops, update_taint
+from ML_Detection import run_blockscan_spider
+from crawler_engine import USE_CRAWLER_ENGINE, get_crawler_engine
+from fetch_backends import canonical_address, normalize_chain
+from classify_accounts2 import prepare_single_address, save_classify_results
+from LLM_detection import record_llm_verdict, LLM_FAILED_PREFIX
+from llm_client import LLMClientThread, LLM_RPM, LLM_TPM, MAX_IN_FLIGHT
+from pre_classifier import USE_PRE_CLASSIFIER, get_pre_classifier, prepare_batch
+from csv2json_new1 import json_to_csv
+from address_mapping_store import export_address_mapping
+from visited_set import get_visited_set
+from best_first import (TraceBudget, hop_priority, record_level, BEST_FIRST_MAX_ADDRESSES,
+                        BEST_FIRST_TOP_AMOUNT_RATIO, SEED_PRIORITY, LLM_CALL)
+
+###
+# 追踪流水线调度器：把 RiskTagger 的逐层循环拆成 (depth, stage, address) 任务 DAG
+#   crawl(d, a) -> classify(d, a) -> expand(d, a) -> crawl(d+1, 下一跳)
+# 任务状态持久化在 SQLite（task_store），崩溃后直接续跑；
+# 某个地址的下一跳一算出来就入队下一层的爬取，不必等整层结束
+# 每层的收尾工作（合并存储分区、写标签库、写下一层地址文件）在该层全部任务结束后各执行一次
+# best_first=True 时按优先级（金额、可疑等级、跳数，见 best_first）取任务，crawl_budget / llm_budget 为全局预算
+# （llm_budget 按实际发出的大模型请求计，前置筛选和判断缓存命中不计），
+# 预算用完即停止（已完成的部分照常合并存储、写标签库），提高预算后可续跑
+# 多链：源地址文件的 chain 列（报告 Finding.chain，'|' 分隔）记入任务库，下一跳继承上一跳的链，爬取时按链路由
+# 分类任务按批计算特征表（graph_features），前置筛选（pre_classifier）能直接判定的地址不再调用大模型
+# taint.TAINT_MODEL 设置后，下一跳按污点金额选择（污点引擎在本进程内跨层累积交易图）
+# 分类任务的流向分析在进程池中执行，大模型调用统一经由本进程的 LLMClientThread（RPM/TPM 配额、退避重试），
+# 同时在途的大模型请求数由客户端的 max_in_flight 控制，而不是进程数
+
+SRC_ADDR_PATH = 'D:/FORGE2/XBlock/src_addr_token/'
+MAX_DEPTH = 21
+
+CRAWL = 'crawl'
+CLASSIFY = 'classify'
+EXPAND = 'expand'
+STAGES = [CRAWL, CLASSIFY, EXPAND]
+
+
+def _crawl_task(eventName: str, depth: int, addr: str, chains: Optional[List[str]] = None) -> str:
+    """爬取单个地址并导入交易存储（chains 为该地址记录的链，为空时按地址格式路由）"""
+    if USE_CRAWLER_ENGINE:
+        return str(get_crawler_engine().crawl(addr, eventName, depth, chains=chains or None))
+    if not run_blockscan_spider(addr):
+        raise RuntimeError('爬虫执行失败')
+    return str(import_address(eventName, depth, addr))
+
+
+class PipelineScheduler:
+    """持久化的 DAG 调度器，支持断点续跑"""
+
+    def __init__(self, eventName: str = 'bybit', max_depth: int = MAX_DEPTH, crawl_workers: int = 10,
+                 classify_workers: int = 8, expand_batch: int = 256, db_path: str = TASK_DB_PATH,
+                 best_first: bool = False, crawl_budget: Optional[int] = None, llm_budget: Optional[int] = None,
+                 llm_rpm: int = LLM_RPM, llm_tpm: int = LLM_TPM, llm_in_flight: int = MAX_IN_FLIGHT):
+        self.eventName = eventName
+        self.max_depth = max_depth
+        self.crawl_workers = crawl_workers
+        self.classify_workers = classify_workers
+        self.expand_batch = expand_batch
+        self.store = TaskStore(db_path)
+        self.label_index = None
+        self.best_first = best_first
+        self.budget = TraceBudget(self.store, eventName, {CRAWL: crawl_budget, LLM_CALL: llm_budget})
+        self.llm_limits = dict(rpm=llm_rpm, tpm=llm_tpm, max_in_flight=llm_in_flight)
+        self.llm = None
+        self._prompts: Dict[Tuple[int, str], str] = {}
+
+    # ---------- 入队 ----------
+    def seed(self):
+        """首次运行：读取第 0 层源地址并入队爬取任务（已有任务时跳过）"""
+        if self.store.has_tasks(self.eventName):
+            return
+        src_file = SRC_ADDR_PATH + self.eventName + '_source_addr0.csv'
+        if not os.path.exists(src_file):
+            json_to_csv(self.eventName, dep=0)
+        src = pd.read_csv(src_file, dtype=str, keep_default_na=False)
+        addresses = [canonical_address(a) for a in src['address']]
+        if 'chain' in src.columns:
+            self.store.set_chains(self.eventName, {
+                a: [c for c in (normalize_chain(x) for x in chains.split('|')) if c is not None]
+                for a, chains in zip(addresses, src['chain'])})
+        get_visited_set().claim(self.eventName, 0, addresses)
+        n = self.store.add(self.eventName, 0, CRAWL, addresses, priorities={a: SEED_PRIORITY for a in addresses})
+        print(f"入队第 0 层爬取任务 {n} 个")
+
+    def fresh_children(self, depth: int, children: List[str]) -> List[str]:
+        """需要入队下一层爬取的下一跳（超过最大层数或在之前的层出现过的地址跳过）"""
+        if depth + 1 > self.max_depth or not children:
+            return []
+        # 已访问集合记录每个地址首次出现的层（与逐层版本共用，同一层重复领取幂等，崩溃后重新展开仍能取回）；
+        # 任务库中已有的地址（旧任务库）同样跳过
+        children = get_visited_set().claim(self.eventName, depth + 1, children)
+        known = self.store.known(self.eventName, CRAWL, children)
+        return [c for c in children if c not in known]
+
+    # ---------- 阶段执行 ----------
+    def _exhausted(self, stage: str) -> bool:
+        """该阶段的预算已用完（分类任务看大模型请求预算）"""
+        return self.budget.exhausted(LLM_CALL if stage == CLASSIFY else stage)
+
+    def _claim(self, stage: str, limit: int) -> List[Tuple[int, str]]:
+        """在预算内取待执行任务（best-first 模式按优先级）"""
+        if stage == CLASSIFY and self._exhausted(CLASSIFY):
+            return []  # 大模型预算用完：分类任务留在任务库（提高预算后续跑）
+        granted = self.budget.take(stage, limit)
+        claimed = self.store.claim(self.eventName, stage, granted, by_priority=self.best_first)
+        self.budget.refund(stage, granted - len(claimed))
+        return claimed
+
+    def _prepare(self, claimed: List[Tuple[int, str]]) -> Tuple[Dict[str, Dict], Dict[str, Tuple]]:
+        """一批分类任务的邻域特征和前置筛选结果（按层分组，每组一次稀疏矩阵计算），见 pre_classifier.prepare_batch"""
+        by_depth: Dict[int, List[str]] = {}
+        for depth, addr in claimed:
+            by_depth.setdefault(depth, []).append(addr)
+        features, resolved = {}, {}
+        for depth, addresses in by_depth.items():
+            try:
+                batch_features, batch_resolved = prepare_batch(self.eventName, depth, addresses)
+            except Exception as e:
+                print(f"特征计算失败 (depth={depth})，本批全部送大模型且不带邻域特征: {e}")
+                continue
+            features.update(batch_features)
+            resolved.update(batch_resolved)
+        return features, resolved
+
+    def _submit(self, stage: str, pool, futures: Dict, capacity: int):
+        running = sum(1 for s, _, _ in futures.values() if s == stage)
+        room = capacity - running
+        if stage == CLASSIFY:
+            # 等待大模型回复的地址同样占名额，流向分析不会远远跑在大模型前面
+            waiting = sum(1 for s, _, _ in futures.values() if s == LLM_CALL)
+            room = min(room, self.llm_limits['max_in_flight'] - waiting - running)
+        claimed = self._claim(stage, room)
+        features, resolved = self._prepare(claimed) if stage == CLASSIFY and claimed else ({}, {})
+        for depth, addr in claimed:
+            if addr in resolved:
+                Is_ML, label = resolved[addr]
+                self._classified(depth, addr, (addr, Is_ML, label, 'success'))
+                continue
+            if stage == CRAWL:
+                future = pool.submit(_crawl_task, self.eventName, depth, addr,
+                                     self.store.chains(self.eventName, addr))
+            else:
+                future = pool.submit(prepare_single_address, (addr, self.eventName, depth, features.get(addr)))
+            futures[future] = (stage, depth, addr)
+
+    def _llm_result(self, addr: str, prompt: str, response_text: str) -> Tuple:
+        """大模型回复 -> 分类结果（同 process_single_address）；调用失败不落盘，由任务库重试"""
+        if response_text.startswith(LLM_FAILED_PREFIX):
+            return addr, None, None, f"error: {response_text}"
+        Is_ML, label = record_llm_verdict(addr, prompt, response_text)
+        return addr, Is_ML, label, 'success'
+
+    def _on_done(self, futures: Dict, stage: str, depth: int, addr: str, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            self._prompts.pop((depth, addr), None)
+            stage = CLASSIFY if stage == LLM_CALL else stage
+            status = self.store.fail(self.eventName, depth, stage, addr, str(e))
+            print(f"{stage} 任务失败 (depth={depth}, {addr}): {e} -> {status}")
+            return
+        if stage == CRAWL:
+            self.store.advance(self.eventName, depth, CRAWL, addr, result, CLASSIFY)
+        elif stage == CLASSIFY:
+            prompt, classified, _ = result
+            if classified is not None:
+                self._classified(depth, addr, classified)
+                return
+            if not self.budget.take(LLM_CALL, 1):
+                self.store.release(self.eventName, depth, CLASSIFY, addr)  # 预算在调用前用完
+                return
+            self._prompts[(depth, addr)] = prompt
+            futures[self.llm.submit(prompt)] = (LLM_CALL, depth, addr)
+        else:
+            prompt = self._prompts.pop((depth, addr))
+            try:
+                classified = self._llm_result(addr, prompt, result)
+            except Exception as e:
+                classified = (addr, None, None, f"error: 保存大模型结果失败: {e}")
+            self._classified(depth, addr, classified)
+
+    def _classified(self, depth: int, addr: str, result):
+        _, Is_ML, label, status = result
+        if status not in ('success', 'no_file'):
+            self.store.fail(self.eventName, depth, CLASSIFY, addr, status)
+            return
+        record = json.dumps({'Is_ML': Is_ML, 'label': label, 'status': status})
+        self.store.advance(self.eventName, depth, CLASSIFY, addr, record, EXPAND)
+
+    def _run_expand(self) -> int:
+        """在主进程中批量计算下一跳（按层分组），每个地址的展开完成与下一层爬取入队在同一事务中提交"""
+        claimed = self.store.claim(self.eventName, EXPAND, self.expand_batch, by_priority=self.best_first)
+        if not claimed:
+            return 0
+        if self.label_index is None:
+            self.label_index = build_label_index()
+        by_depth: Dict[int, List[str]] = {}
+        for depth, addr in claimed:
+            by_depth.setdefault(depth, []).append(addr)
+        # best-first：每个地址保留更多候选下一跳，由优先级和预算决定实际展开哪些
+        params = dict(max_addresses=BEST_FIRST_MAX_ADDRESSES,
+                      top_amount_ratio=BEST_FIRST_TOP_AMOUNT_RATIO) if self.best_first else {}
+        for depth, addresses in by_depth.items():
+            transfers = load_sources_transfers(self.eventName, depth, addresses)
+            if TAINT_MODEL:
+                engine = update_taint(self.eventName, depth, transfers)
+                hops = select_tainted_hops(engine, addresses, self.label_index,
+                                           max_addresses=params.get('max_addresses', DEFAULT_MAX_ADDRESSES))
+            else:
+                hops = select_next_hops(transfers, self.label_index, **params)
+            grouped = hops.groupby('source')['address'].apply(list).to_dict() if len(hops) else {}
+            amounts = hops.groupby(['source', 'address'])['value_numeric'].sum().to_dict() if len(hops) else {}
+            for addr in addresses:
+                children = grouped.get(addr, [])
+                priorities = None
+                if self.best_first and children:
+                    level = record_level(self.store.result(self.eventName, depth, CLASSIFY, addr))
+                    priorities = {c: hop_priority(amounts[(addr, c)], level, depth + 1) for c in children}
+                self.store.advance(self.eventName, depth, EXPAND, addr, str(len(children)), CRAWL,
+                                   next_depth=depth + 1, next_addresses=self.fresh_children(depth, children),
+                                   priorities=priorities)
+        return len(claimed)
+
+    # ---------- 每层收尾 ----------
+    def _open(self, counts: Dict[Tuple[int, str, str], int], depth: int, stage: str) -> bool:
+        return counts.get((depth, stage, PENDING), 0) + counts.get((depth, stage, RUNNING), 0) > 0
+
+    def _closed(self, depth: int) -> bool:
+        """该层不会再有新地址加入（上一层的下一跳已全部算完）"""
+        return depth == 0 or self.store.hook_done(self.eventName, depth - 1, 'frontier')
+
+    def _depth_hooks(self):
+        counts = self.store.counts(self.eventName)
+        depths = sorted({d for d, _, _ in counts})
+        for depth in depths:
+            if not self._closed(depth):
+                break
+            if self._open(counts, depth, CRAWL):
+                break
+            if not self.store.hook_done(self.eventName, depth, 'compact'):
+                compact_partition(self.eventName, depth)
+                self.store.mark_hook(self.eventName, depth, 'compact')
+            if self._open(counts, depth, CLASSIFY):
+                break
+            if not self.store.hook_done(self.eventName, depth, 'labels'):
+                self._save_labels(depth)
+                export_address_mapping(self.eventName)
+                self.store.mark_hook(self.eventName, depth, 'labels')
+                # 标签库已更新，下次计算下一跳时重建标签索引
+                if self.label_index is not None:
+                    self.label_index.close()
+                    self.label_index = None
+            if self._open(counts, depth, EXPAND):
+                break
+            if not self.store.hook_done(self.eventName, depth, 'frontier'):
+                self._write_frontier(depth)
+                self.store.mark_hook(self.eventName, depth, 'frontier')
+
+    def _save_labels(self, depth: int):
+        results = [(addr, r['Is_ML'], r['label'], r['status'])
+                   for addr, r in ((a, json.loads(x)) for a, x in
+                                   self.store.results(self.eventName, depth, CLASSIFY))]
+        save_classify_results(results, depth)
+
+    def _budget_hooks(self):
+        """预算用完停止时：未收尾的层也合并存储、写入已有的分类结果（不标记完成，续跑后仍按层正常收尾）"""
+        if not any(self._exhausted(stage) for stage in (CRAWL, CLASSIFY)):
+            return
+        print(f"预算已用完（{self.budget.report()}），剩余任务留在任务库中")
+        counts = self.store.counts(self.eventName)
+        for depth in sorted({d for d, _, _ in counts}):
+            if not self.store.hook_done(self.eventName, depth, 'compact'):
+                compact_partition(self.eventName, depth)
+            if not self.store.hook_done(self.eventName, depth, 'labels'):
+                self._save_labels(depth)
+        export_address_mapping(self.eventName)
+
+    def _write_frontier(self, depth: int):
+        """写出下一层地址文件（与逐层版本的 <event>_source_addr<depth+1>.csv 一致）"""
+        addresses = self.store.addresses(self.eventName, depth + 1, CRAWL)
+        print(f"第 {depth} 层完成，下一层地址 {len(addresses)} 个")
+        if addresses:
+            pd.DataFrame({'address': addresses}).to_csv(
+                SRC_ADDR_PATH + self.eventName + '_source_addr' + str(depth + 1) + '.csv', index=False)
+
+    def _has_pending(self) -> bool:
+        """还有可执行的任务（预算已用完的阶段的 pending 任务不算）"""
+        counts = self.store.counts(self.eventName)
+        return any(n > 0 for (_, stage, status), n in counts.items()
+                   if status == RUNNING or (status == PENDING and not self._exhausted(stage)))
+
+    # ---------- 主循环 ----------
+    def _open_llm(self):
+        self.llm = LLMClientThread(**self.llm_limits)
+
+    def _close_llm(self):
+        if self.llm is not None:
+            self.llm.report()
+            self.llm.close()
+            self.llm = None
+
+    def run(self):
+        self.seed()
+        resumed = self.store.reset_running(self.eventName)
+        if resumed:
+            print(f"从断点续跑：{resumed} 个中断任务重新入队")
+
+        self._open_llm()
+        try:
+            self._loop()
+        finally:
+            self._close_llm()
+        self._depth_hooks()
+        self._budget_hooks()
+        if self.label_index is not None:
+            self.label_index.close()
+            self.label_index = None
+        self.report()
+
+    def _loop(self):
+        futures: Dict = {}
+        with ThreadPoolExecutor(max_workers=self.crawl_workers) as crawl_pool, \
+                ProcessPoolExecutor(max_workers=self.classify_workers) as classify_pool:
+            while True:
+                self._submit(CRAWL, crawl_pool, futures, self.crawl_workers)
+                self._submit(CLASSIFY, classify_pool, futures, self.classify_workers * 2)
+                expanded = self._run_expand()
+                self._depth_hooks()
+
+                if not futures:
+                    if expanded == 0:
+                        if not self._has_pending():
+                            break
+                        time.sleep(0.2)
+                    continue
+                done, _ = wait(list(futures), timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, depth, addr = futures.pop(future)
+                    self._on_done(futures, stage, depth, addr, future)
+
+    def report(self):
+        counts = self.store.counts(self.eventName)
+        for depth in sorted({d for d, _, _ in counts}):
+            line = ', '.join(f"{stage}: " + '/'.join(
+                f"{status}={counts.get((depth, stage, status), 0)}" for status in (DONE, 'failed'))
+                for stage in STAGES)
+            print(f"depth {depth}: {line}")
+        if USE_PRE_CLASSIFIER:
+            print(get_pre_classifier().report())
+
+
+def run_case(eventName: str = 'bybit', max_depth: int = MAX_DEPTH, crawl_workers: int = 10, classify_workers: int = 8,
+             best_first: bool = False, crawl_budget: Optional[int] = None, llm_budget: Optional[int] = None,
+             llm_rpm: int = LLM_RPM):
+    """调度器版本的完整追踪（可重复执行，自动从断点续跑）"""
+    scheduler = PipelineScheduler(eventName, max_depth=max_depth, crawl_workers=crawl_workers,
+                                  classify_workers=classify_workers, best_first=best_first,
+                                  crawl_budget=crawl_budget, llm_budget=llm_budget, llm_rpm=llm_rpm)
+    try:
+        scheduler.run()
+    finally:
+        scheduler.store.close()
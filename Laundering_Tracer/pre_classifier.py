@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from graph_features import (FEATURE_COLUMNS, ACTIVITY_COLUMNS, USE_GRAPH_FEATURES, batch_feature_table,
+                            feature_records, get_feature_index, neighborhood_features)
+from tx_graph import get_tx_graph
+from tx_store import has_address
+from verdict import LEVEL_HIGH, LEVEL_NONE, LEVEL_LABELS
+
+###
+# 大模型前置筛选：在特征表（graph_features）上按批向量化打分，明确的地址直接给出结果，只有不确定的送大模型
+#   规则：标签库中已有的地址、灰尘地址（收到的价值极少、不来自黑客地址且没有转出）、交易所热钱包式的高扇入高扇出地址
+#   没有存储交易的地址（不在交易图中，或本身未爬取到数据）从不直接判定，交给分类阶段按 no_file 跳过
+#   模型：numpy 逻辑回归（标准化 + L2，按类别加权），用 result_process 输出的
+#         hacker_label_enriched.csv（洗钱）/ normal_label_enriched.csv（正常）在案件交易图上的特征训练
+#   阈值：在留出集上取满足 TARGET_PRECISION 的最小 high / 最大 low，p >= high 判洗钱，p <= low 判正常
+# 训练：python pre_classifier.py <eventName> [max_depth]，模型保存为 JSON；没有模型文件时只使用规则
+# 每层统计送大模型和直接判定的地址数（report），即每层节省的大模型调用
+
+USE_PRE_CLASSIFIER = True
+MODEL_PATH = 'G:/RiskTagger/pre_classifier.json'
+HACKER_ENRICHED_FILE = 'D:/FORGE2/XBlock/reference_list/hacker_label_enriched.csv'
+NORMAL_ENRICHED_FILE = 'D:/FORGE2/XBlock/reference_list/normal_label_enriched.csv'
+
+MODEL_COLUMNS = FEATURE_COLUMNS + ACTIVITY_COLUMNS
+_LOG_COLUMNS = {'in_amount', 'out_amount', 'in_count', 'out_count', 'in_degree', 'out_degree', 'active_days',
+                'two_hop_neighbors', 'flagged_neighbors_2hop'}  # 长尾分布的列取 log1p
+
+DUST_VALUE = 10.0            # 灰尘地址：转入总价值（graph_features 折算后的美元）低于该值且没有转出
+HOT_WALLET_DEGREE = 500      # 热钱包：转入来源和转出去向都不少于该数量
+HOT_WALLET_MAX_HACKER = 0.01  # 且来自黑客地址的转入比例低于该值
+TARGET_PRECISION = 0.97      # 直接判定的地址在留出集上的最低准确率
+L2 = 1e-2
+
+AUTO_ML = LEVEL_LABELS[LEVEL_HIGH]
+AUTO_NORMAL = LEVEL_LABELS[LEVEL_NONE]
+
+
+def _design(df: pd.DataFrame) -> np.ndarray:
+    x = df[MODEL_COLUMNS].to_numpy(dtype=np.float64, copy=True)
+    for j, name in enumerate(MODEL_COLUMNS):
+        if name in _LOG_COLUMNS:
+            x[:, j] = np.log1p(np.maximum(x[:, j], 0.0))
+    return x
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def fit_logistic(x: np.ndarray, y: np.ndarray, l2: float = L2, iterations: int = 50) -> Tuple[np.ndarray, float]:
+    """按类别加权的 L2 逻辑回归（牛顿法），x 已标准化"""
+    n, d = x.shape
+    pos = max(int(y.sum()), 1)
+    weights = np.where(y == 1, n / (2.0 * pos), n / (2.0 * max(n - pos, 1)))
+    xb = np.hstack([x, np.ones((n, 1))])
+    beta = np.zeros(d + 1)
+    penalty = np.full(d + 1, l2 * n)
+    penalty[-1] = 0.0
+    for _ in range(iterations):
+        p = _sigmoid(xb @ beta)
+        grad = xb.T @ (weights * (p - y)) + penalty * beta
+        hess = (xb * (weights * p * (1 - p))[:, None]).T @ xb + np.diag(penalty)
+        step = np.linalg.solve(hess + 1e-9 * np.eye(d + 1), grad)
+        beta -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return beta[:-1], float(beta[-1])
+
+
+def _thresholds(p: np.ndarray, y: np.ndarray, precision: float) -> Tuple[float, float]:
+    """(low, high)：p >= high 的洗钱占比、p <= low 的正常占比都不低于 precision；找不到时不直接判定"""
+    order = np.argsort(-p, kind='mergesort')
+    hits = np.cumsum(y[order] == 1) / np.arange(1, len(p) + 1)
+    ok = np.flatnonzero(hits >= precision)
+    high = float(p[order][ok.max()]) if len(ok) else 1.01
+    order = np.argsort(p, kind='mergesort')
+    hits = np.cumsum(y[order] == 0) / np.arange(1, len(p) + 1)
+    ok = np.flatnonzero(hits >= precision)
+    low = float(p[order][ok.max()]) if len(ok) else -0.01
+    if low >= high:
+        low, high = -0.01, 1.01
+    return low, high
+
+
+class PreClassifier:
+    """规则 + 逻辑回归的前置筛选器；decide 返回每个地址的判定，并按层累计统计"""
+
+    def __init__(self, model: Optional[Dict] = None):
+        self.model = model
+        self.stats: Dict[int, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> 'PreClassifier':
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def probability(self, df: pd.DataFrame) -> np.ndarray:
+        """洗钱概率（没有模型时为 NaN）"""
+        if self.model is None or len(df) == 0:
+            return np.full(len(df), np.nan)
+        x = (_design(df) - np.array(self.model['mean'])) / np.array(self.model['std'])
+        return _sigmoid(x @ np.array(self.model['coef']) + self.model['intercept'])
+
+    def decide(self, df: pd.DataFrame, depth: Optional[int] = None) -> pd.DataFrame:
+        """
+        df 为特征表（graph_features.neighborhood_features），返回 DataFrame[decision, Is_ML, label, reason, probability]
+        decision 为 'ml' / 'normal'（直接判定）或 'llm'（送大模型）
+        has_data 列（prepare_batch 填写）为 False 或没有任何交易的地址一律为 'llm'
+        """
+        labels = df['labels']
+        has = lambda name: labels.map(lambda ls: name in ls).to_numpy(dtype=bool)
+        p = self.probability(df)
+        decision = np.full(len(df), 'llm', dtype=object)
+        reason = np.full(len(df), '', dtype=object)
+
+        stored = (df['in_count'].to_numpy() + df['out_count'].to_numpy()) > 0
+        if 'has_data' in df.columns:
+            stored &= df['has_data'].to_numpy(dtype=bool)
+
+        def resolve(mask, value, why):
+            mask = mask & stored & (decision == 'llm')
+            decision[mask] = value
+            reason[mask] = why
+
+        resolve(has('known_hacker'), 'ml', 'rule:known_hacker')
+        resolve(has('exchange') | has('wallet') | has('known_normal'), 'normal', 'rule:labelled')
+        resolve((df['in_amount'].to_numpy() < DUST_VALUE) & (df['out_count'].to_numpy() == 0) &
+                (df['hacker_inflow_ratio'].to_numpy() == 0), 'normal', 'rule:dust')
+        resolve((df['in_degree'].to_numpy() >= HOT_WALLET_DEGREE) & (df['out_degree'].to_numpy() >= HOT_WALLET_DEGREE) &
+                (df['hacker_inflow_ratio'].to_numpy() < HOT_WALLET_MAX_HACKER), 'normal', 'rule:hot_wallet')
+        if self.model is not None:
+            resolve(p >= self.model['high'], 'ml', 'model')
+            resolve(p <= self.model['low'], 'normal', 'model')
+
+        result = pd.DataFrame({'decision': decision, 'reason': reason, 'probability': p}, index=df.index)
+        result['Is_ML'] = result['decision'] == 'ml'
+        result['label'] = np.where(result['Is_ML'], AUTO_ML, AUTO_NORMAL)
+        if depth is not None:
+            with self._lock:
+                counts = self.stats.setdefault(depth, {'ml': 0, 'normal': 0, 'llm': 0})
+                for value, n in result['decision'].value_counts().items():
+                    counts[value] += int(n)
+        return result
+
+    def report(self) -> str:
+        if self.model is not None:
+            head = f"前置筛选阈值 low={self.model['low']:.3f} high={self.model['high']:.3f}"
+        else:
+            head = "前置筛选（无模型，仅规则）"
+        lines = [head]
+        for depth in sorted(self.stats):
+            c = self.stats[depth]
+            total = sum(c.values())
+            saved = c['ml'] + c['normal']
+            lines.append(f"  depth {depth}: {total} 个地址，直接判定 洗钱={c['ml']} 正常={c['normal']}，"
+                         f"送大模型 {c['llm']}，节省 {saved / total:.1%}" if total else f"  depth {depth}: 0")
+        return '\n'.join(lines)
+
+
+_CLASSIFIER = {}
+def get_pre_classifier() -> PreClassifier:
+    pid = os.getpid()
+    if pid not in _CLASSIFIER:
+        _CLASSIFIER.clear()
+        _CLASSIFIER[pid] = PreClassifier.load()
+    return _CLASSIFIER[pid]
+
+
+def prepare_batch(eventName: str, depth: int, addresses: List[str]) -> Tuple[Dict[str, Dict], Dict[str, Tuple]]:
+    """
+    一批待分类地址的特征表只计算一次，返回 (features, resolved)：
+    features 为 Prompt 用的邻域特征 {小写地址: {...}}，resolved 为前置筛选直接判定的 {小写地址: (Is_ML, label)}
+    """
+    if not addresses or not (USE_GRAPH_FEATURES or USE_PRE_CLASSIFIER):
+        return {}, {}
+    table = batch_feature_table(eventName, depth, addresses)
+    resolved = {}
+    if USE_PRE_CLASSIFIER:
+        original = {str(a).lower(): a for a in addresses}
+        table['has_data'] = [has_address(original[addr], eventName, depth) for addr in table.index]
+        decisions = get_pre_classifier().decide(table, depth)
+        auto = decisions[decisions['decision'] != 'llm']
+        resolved = {addr: (bool(row['Is_ML']), row['label']) for addr, row in auto.iterrows()}
+    return feature_records(table.drop(index=list(resolved))), resolved
+
+
+def load_training_labels(hacker_file: str = HACKER_ENRICHED_FILE, normal_file: str = NORMAL_ENRICHED_FILE) -> pd.Series:
+    """{小写地址: 1 洗钱 / 0 正常}：hacker 文件全部为洗钱，normal 文件按大模型结果（label 列）"""
+    hacker = pd.read_csv(hacker_file, dtype=str, keep_default_na=False)
+    normal = pd.read_csv(normal_file, dtype=str, keep_default_na=False)
+    y = pd.concat([pd.Series(1, index=hacker['address'].str.strip().str.lower()),
+                   pd.Series(normal['label'].str.strip().str.lower().eq('true').astype(int).to_numpy(),
+                             index=normal['address'].str.strip().str.lower())])
+    return y[~y.index.duplicated(keep='first')]
+
+
+def train(eventName: str = 'bybit', max_depth: int = 21, path: str = MODEL_PATH, seed: int = 0) -> Dict:
+    """在案件交易图（0..max_depth 层）上为已标注地址计算特征并训练，保存模型 JSON"""
+    graph = get_tx_graph(eventName)
+    graph.load_depths(eventName, range(max_depth + 1))
+    y = load_training_labels()
+    y = y[graph.ids(y.index) >= 0]
+    if y.nunique() < 2:
+        raise ValueError(f"训练数据不足：交易图中只有 {len(y)} 个已标注地址（需要两类都有）")
+    df = neighborhood_features(graph, list(y.index), get_feature_index())
+    x, target = _design(df), y.loc[df.index].to_numpy()
+
+    rng = np.random.default_rng(seed)
+    holdout = rng.random(len(target)) < 0.3
+    mean, std = x[~holdout].mean(axis=0), x[~holdout].std(axis=0) + 1e-9
+    coef, intercept = fit_logistic((x[~holdout] - mean) / std, target[~holdout])
+    p = _sigmoid(((x - mean) / std) @ coef + intercept)
+    low, high = _thresholds(p[holdout], target[holdout], TARGET_PRECISION)
+    auto = holdout & ((p >= high) | (p <= low))
+    model = {'columns': MODEL_COLUMNS, 'mean': mean.tolist(), 'std': std.tolist(), 'coef': coef.tolist(),
+             'intercept': intercept, 'low': low, 'high': high, 'samples': int(len(target)),
+             'positives': int(target.sum()), 'holdout_accuracy': float(((p >= 0.5) == target)[holdout].mean()),
+             'holdout_auto_ratio': float(auto.sum() / max(holdout.sum(), 1))}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, indent=2)
+    return model
+
+
+if __name__ == '__main__':
+    import sys
+    event = sys.argv[1] if len(sys.argv) > 1 else 'bybit'
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 21
+    result = train(event, depth)
+    print(f"训练样本 {result['samples']}（洗钱 {result['positives']}），留出集准确率 {result['holdout_accuracy']:.3f}，"
+          f"阈值 low={result['low']:.3f} high={result['high']:.3f}，留出集直接判定比例 {result['holdout_auto_ratio']:.1%}")
+    for name, w in sorted(zip(result['columns'], result['coef']), key=lambda t: -abs(t[1])):
+        print(f"  {name}: {w:+.3f}")
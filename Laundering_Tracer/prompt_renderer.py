@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+###
+# Prompt 渲染：把 analyze_transaction_flow 的分析结果压缩为紧凑文本，按 token 预算决定写入多少条交易
+#   标量字段（统计量、标签、邻域特征）写成一行紧凑 JSON（不缩进、不留空格）
+#   交易明细写成表格：表头（列名）只出现一次，每笔交易一行逗号分隔的值，而不是每行重复键名的 JSON 对象
+# token 用 tiktoken 计数（与大模型的分词接近）；tiktoken 不可用时按字符数估算
+# 交易行按金额从大到小排列，转入、转出两张表轮流加入（先按行估算，再整体复核并补足），直到整条 Prompt 达到 PROMPT_TOKEN_BUDGET；
+# 预算充足时写入分析结果中的全部交易（最多 PROMPT_MAX_ROWS 条 / 方向），不足时从小额一端裁掉
+# 发送的每条 Prompt 记入 token 直方图（get_prompt_stats().report() 输出）
+
+PROMPT_TOKEN_BUDGET = 4000  # 单地址 Prompt（用户消息）的 token 上限
+PROMPT_MAX_ROWS = 50        # 分析结果中每个方向保留的大额交易数（与原先的 topk=50 一致；预算允许时全部写入）
+TOKEN_ENCODING = 'cl100k_base'
+CHARS_PER_TOKEN = 3         # tiktoken 不可用时按字符数估算
+
+# 交易表：(分析结果中的字段, 表名, 列)
+TX_TABLES = [
+    ('incoming_transactions', 'incoming', ['from_address', 'token_symbol', 'readable_amount', 'transaction_time']),
+    ('outgoing_transactions', 'outgoing', ['to_address', 'token_symbol', 'readable_amount', 'transaction_time']),
+]
+# 不写入 Prompt 的字段（原始地址只用于溯源，Prompt 中使用映射编号）
+SKIP_FIELDS = {'original_target_address'}
+
+HISTOGRAM_EDGES = [500, 1000, 2000, 4000, 8000, 16000]
+
+
+_ENCODER = {}
+def _encoder():
+    """tiktoken 编码器（每个进程加载一次；加载失败时返回 None，改为按字符估算）"""
+    pid = os.getpid()
+    if pid not in _ENCODER:
+        try:
+            import tiktoken
+            _ENCODER[pid] = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            print(f"tiktoken 不可用，按字符数估算 token: {e}")
+            _ENCODER[pid] = None
+    return _ENCODER[pid]
+
+
+def count_tokens(text: str) -> int:
+    encoder = _encoder()
+    if encoder is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def _cell(value) -> str:
+    text = str(value)
+    return f'"{text}"' if ',' in text or '"' in text else text
+
+
+def _table_lines(analysis: Dict) -> List[Tuple[str, str, List[str], List[str]]]:
+    """[(表名, 分析结果字段, 列, 行文本列表)]"""
+    tables = []
+    for field, name, columns in TX_TABLES:
+        rows = analysis.get(field) or []
+        lines = [','.join(_cell(row.get(col, '')) for col in columns) for row in rows]
+        tables.append((name, field, columns, lines))
+    return tables
+
+
+def _table_header(name: str, columns: List[str], shown: int, total: Optional[int]) -> str:
+    scope = f"top {shown} of {total} by amount" if total is not None and shown < total else f"all {shown}"
+    return f"{name} transactions ({scope}; columns: {','.join(columns)}):"
+
+
+def _render(scalars: str, tables, counts: List[int], totals: List[Optional[int]]) -> str:
+    parts = [scalars]
+    for (name, _, columns, lines), k, total in zip(tables, counts, totals):
+        parts.append(_table_header(name, columns, k, total))
+        parts.extend(lines[:k])
+    return '\n'.join(parts)
+
+
+def render_analysis(analysis: Dict, budget: Optional[int] = None) -> Tuple[str, int]:
+    """
+    分析结果 -> (紧凑文本, token 数)；budget 为这段文本可用的 token 数（None 不限制）
+    交易行按 (转入第 1 条, 转出第 1 条, 转入第 2 条, ...) 的顺序加入，直到超出预算
+    """
+    skip = SKIP_FIELDS | {field for field, _, _ in TX_TABLES}
+    scalars = json.dumps({k: v for k, v in analysis.items() if k not in skip}, ensure_ascii=False,
+                         separators=(',', ':'))
+    tables = _table_lines(analysis)
+    # 表头中的总数：total_incoming / total_outgoing（没有时按已有行数）
+    totals = [analysis.get('total_' + name) for name, _, _, _ in tables]
+    full = [len(lines) for _, _, _, lines in tables]
+
+    if budget is None:
+        text = _render(scalars, tables, full, totals)
+        return text, count_tokens(text)
+
+    # 逐行累加 token（每行另计换行），得到各表可写入的行数
+    used = count_tokens(_render(scalars, tables, [0] * len(tables), totals))
+    counts = [0] * len(tables)
+    costs = [[count_tokens(line) + 1 for line in lines] for _, _, _, lines in tables]
+    adding = True
+    while adding:
+        adding = False
+        for t, lines in enumerate(costs):
+            if counts[t] < len(lines) and used + lines[counts[t]] <= budget:
+                used += lines[counts[t]]
+                counts[t] += 1
+                adding = True
+    # 按行累加是估算，整体复核一次，超出时从末尾继续裁
+    text = _render(scalars, tables, counts, totals)
+    tokens = count_tokens(text)
+    while tokens > budget and any(counts):
+        t = max(range(len(counts)), key=lambda i: counts[i])
+        counts[t] -= 1
+        text = _render(scalars, tables, counts, totals)
+        tokens = count_tokens(text)
+    # 按行累加偏多（如按字符估算时每行多计 1）时还有余量，逐行补足（行数少的表先补），每次整体复核
+    adding = True
+    while adding:
+        adding = False
+        for t in sorted(range(len(counts)), key=lambda i: counts[i]):
+            if counts[t] == len(costs[t]):
+                continue
+            counts[t] += 1
+            candidate = _render(scalars, tables, counts, totals)
+            candidate_tokens = count_tokens(candidate)
+            if candidate_tokens <= budget:
+                text, tokens, adding = candidate, candidate_tokens, True
+            else:
+                counts[t] -= 1
+    return text, tokens
+
+
+class PromptStats:
+    """发送的 Prompt 的 token 数直方图（多线程共享）"""
+
+    def __init__(self, edges: List[int] = HISTOGRAM_EDGES):
+        self.edges = list(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.total = 0
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def record(self, tokens: int):
+        bucket = next((i for i, edge in enumerate(self.edges) if tokens < edge), len(self.edges))
+        with self._lock:
+            self.counts[bucket] += 1
+            self.total += tokens
+            self.max = max(self.max, tokens)
+
+    def report(self) -> Dict:
+        with self._lock:
+            counts, total, largest = list(self.counts), self.total, self.max
+        n = sum(counts)
+        if n == 0:
+            return {'prompts': 0}
+        print(f"Prompt 大小：{n} 条，平均 {total / n:.0f} token，最大 {largest} token")
+        labels = ([f"< {self.edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(self.edges, self.edges[1:])]
+                  + [f">= {self.edges[-1]}"])
+        width = max(counts)
+        for label, count in zip(labels, counts):
+            print(f"  {label:>12} | {'#' * (40 * count // width):<40} {count}")
+        return {'prompts': n, 'tokens': total, 'max': largest, 'histogram': dict(zip(labels, counts))}
+
+
+# 每个进程一份统计（进程池中的子进程各自计数）
+_STATS = {}
+def get_prompt_stats() -> PromptStats:
+    pid = os.getpid()
+    if pid not in _STATS:
+        _STATS.clear()
+        _STATS[pid] = PromptStats()
+    return _STATS[pid]
@@ -1,6 +1,7 @@
 import os
 import pandas as pd
-import json
+from verdict import parse_verdict, DIMENSIONS
+from verdict_cache import get_verdict_cache
 
 ##给洗钱账户和正常账户添加LLM结果
 
@@ -42,103 +43,32 @@ df_label['d_temporal_behavioral_signs'] = ''
 df_label['evidence_d_temporal_behavioral_signs'] = ''
 
 
-#如果是正常账户，需要补充label和tag
-def LLM_result_read(source)->tuple[bool,str]:
-    result_dir = "G:/RiskTagger/LLM_result"
-    out_path = os.path.join(result_dir, source + '.txt')
-    if os.path.exists(out_path):
-        with open(out_path, 'r', encoding='utf-8') as f:
-            response_text = f.read()
-        # 只提取“明确结论：”之后的内容
-            start = response_text.find("suspicion_level")
-        if start == -1:
-            label = "-1_unknown"
-        else:
-            # 截取结论后的一小段（比如100字符），避免扫描全文
-            conclusion_part = response_text[start:start + 35]
-            
-            #print(f"conclusion_part: {conclusion_part}")
-            if "High" in conclusion_part or "high" in conclusion_part:
-                label = "high-ML"
-            elif "Medium" in conclusion_part or "medium" in conclusion_part:
-                label = "mid-ML"
-            elif "Low" in conclusion_part or "low" in conclusion_part:
-                label = "low-ML"
-            elif "No Suspicion" in conclusion_part or "no suspicion" in conclusion_part or "No suspicion" in conclusion_part:
-                label = "No Suspicion"
-            else:
-                label = "unknown"
-            #print(f"conclusion_part: {conclusion_part}")
-            #print(f"label: {label}")
-        if label != "unknown" and label != "No Suspicion":
-            return [True,label]
-        else:
-            return [False,label]
-    
-
-
-
-# 存储从 txt 文件中提取的结果
-results = {}
-
-# 遍历 txt 文件目录
-for filename in os.listdir(txt_directory):
-    if filename.endswith('.txt'):
-        # 提取文件名中的地址（去掉 .txt）
-        address = os.path.splitext(filename)[0].lower()
-
-        filepath = os.path.join(txt_directory, filename)
-        
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 提取四个字段的 result和evidence
-            if isnormal:
-                label, tag = LLM_result_read(address)
-            a_result = data.get("a_transaction_patterns", {}).get("result", "")
-            b_result = data.get("b_fund_flows", {}).get("result", "")
-            c_result = data.get("c_associated_addresses", {}).get("result", "")
-            d_result = data.get("d_temporal_behavioral_signs", {}).get("result", "")
-
-            a_evidence = data.get("a_transaction_patterns", {}).get("evidence", "")
-            b_evidence = data.get("b_fund_flows", {}).get("evidence", "")
-            c_evidence = data.get("c_associated_addresses", {}).get("evidence", "")
-            d_evidence = data.get("d_temporal_behavioral_signs", {}).get("evidence", "")
-
-            # 存入字典
-            results[address] = {
-                # 当is normal时，补充label和tag,否则不用
-                'label': label if isnormal else None,
-                'name_tag': tag if isnormal else None,
-                'a_transaction_patterns': a_result,
-                'b_fund_flows': b_result,
-                'c_associated_addresses': c_result,
-                'd_temporal_behavioral_signs': d_result,
-                'evidence_a_transaction_patterns': a_evidence,
-                'evidence_b_fund_flows': b_evidence,
-                'evidence_c_associated_addresses': c_evidence,
-                'evidence_d_temporal_behavioral_signs': d_evidence
-            }
-        except Exception as e:
-            print(f"Error reading/parsing {filename}: {e}")
+# 读取判断记录：优先使用 verdict_cache 中已解析的记录，缺失的地址再解析旧的 txt 结果文件
+verdicts = get_verdict_cache().get_addresses(df_label['address'])
+txt_files = {os.path.splitext(name)[0].lower(): name
+             for name in os.listdir(txt_directory) if name.endswith('.txt')}
+for address in df_label['address']:
+    if address in verdicts or address not in txt_files:
+        continue
+    try:
+        with open(os.path.join(txt_directory, txt_files[address]), 'r', encoding='utf-8') as f:
+            verdicts[address] = parse_verdict(f.read())
+    except Exception as e:
+        print(f"Error reading/parsing {txt_files[address]}: {e}")
 
 # 将结果合并到 label DataFrame
-for idx, row in df_label.iterrows():
-    addr = row['address']
-    if addr in results:
-        if isnormal:
-            df_label.at[idx, 'label'] = results[addr]['label']
-            df_label.at[idx, 'name_tag'] = results[addr]['name_tag']
-        df_label.at[idx, 'a_transaction_patterns'] = results[addr]['a_transaction_patterns']
-        df_label.at[idx, 'b_fund_flows'] = results[addr]['b_fund_flows']
-        df_label.at[idx, 'c_associated_addresses'] = results[addr]['c_associated_addresses']
-        df_label.at[idx, 'd_temporal_behavioral_signs'] = results[addr]['d_temporal_behavioral_signs']
-
-        df_label.at[idx, 'evidence_a_transaction_patterns'] = results[addr]['evidence_a_transaction_patterns']
-        df_label.at[idx, 'evidence_b_fund_flows'] = results[addr]['evidence_b_fund_flows']
-        df_label.at[idx, 'evidence_c_associated_addresses'] = results[addr]['evidence_c_associated_addresses']
-        df_label.at[idx, 'evidence_d_temporal_behavioral_signs'] = results[addr]['evidence_d_temporal_behavioral_signs']
+for idx, addr in df_label['address'].items():
+    verdict = verdicts.get(addr)
+    if verdict is None:
+        continue
+    # 当is normal时，补充label和tag,否则不用
+    if isnormal:
+        df_label.at[idx, 'label'] = verdict.is_ml
+        df_label.at[idx, 'name_tag'] = verdict.label
+    # 四个维度的 result和evidence
+    for dim in DIMENSIONS:
+        df_label.at[idx, dim] = verdict.results.get(dim, '')
+        df_label.at[idx, 'evidence_' + dim] = verdict.evidence.get(dim, '')
 
 # 保存结果
 df_label.to_csv(output_file, index=False)
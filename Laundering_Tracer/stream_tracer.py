@@ -0,0 +1,324 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional
+
+from pipeline_scheduler import PipelineScheduler, _crawl_task, CRAWL, CLASSIFY, EXPAND, MAX_DEPTH
+from best_first import LLM_CALL
+from crawler_engine import USE_CRAWLER_ENGINE, get_crawler_engine
+from task_store import TASK_DB_PATH
+from verdict_cache import get_verdict_cache
+from prompt_renderer import get_prompt_stats
+from classify_accounts2 import prepare_single_address
+from LLM_detection import record_llm_verdict, LLM_FAILED_PREFIX
+from llm_client import LLM_RPM
+from batch_prompt import BATCH_MAX_ADDRESSES, pack_batches, build_batch_prompt, batch_max_tokens, record_batch
+
+###
+# 流式追踪：每个地址独立地流过 爬取 -> 流向分析(CPU) -> 大模型判断 -> 下一跳计算，
+# 不再等待整层完成。阶段之间用有界队列连接：
+#   crawl_q --爬虫线程--> analyze_q --分析线程(进程池)--> llm_q --大模型分发线程--> 任务库 expand
+# 大模型分发线程用调度器的 LLMClientThread.submit 提交请求（不等待回复，RPM/TPM 配额、退避重试由客户端处理），
+# 同时在途的请求数不超过 llm_in_flight（占满后分发线程阻塞）；回复到达后在 LLM_RECORD_WORKERS 个线程中保存判断
+# 大模型配额是整条流水线的瓶颈：llm_q 满后分析线程阻塞，analyze_q 满后爬虫线程阻塞，
+# crawl_q 满后主线程不再从任务库取新地址，反压逐级传回爬虫
+# 任务状态与 pipeline_scheduler 共用同一个任务库（可互相续跑），下一跳计算和每层收尾在主线程执行
+# 分析线程每次从 analyze_q 取一批（最多 ANALYZE_BATCH 个）地址，特征表整批计算一次，前置筛选直接判定的地址不进 llm_q
+# 分发线程取到小账户（batch_prompt.is_small）时，不等待地再取出 llm_q 中已有的小账户，打包为一个请求判断
+
+STATUS_INTERVAL = 30  # 状态输出间隔（秒）
+ANALYZE_BATCH = 16    # 分析线程一次取出的最大地址数
+LLM_RECORD_WORKERS = 4  # 保存大模型判断（写结果文件、判断缓存、任务库）的线程数
+
+_STOP = None
+
+
+class StreamTracer(PipelineScheduler):
+    """流式追踪器：爬虫、CPU 特征阶段和大模型接口同时保持忙碌"""
+
+    def __init__(self, eventName: str = 'bybit', max_depth: int = MAX_DEPTH, crawl_workers: int = 10,
+                 analyze_workers: int = 4, llm_in_flight: int = 64, llm_rpm: int = LLM_RPM,
+                 expand_batch: int = 64, db_path: str = TASK_DB_PATH, best_first: bool = False,
+                 crawl_budget: Optional[int] = None, llm_budget: Optional[int] = None):
+        super().__init__(eventName, max_depth=max_depth, crawl_workers=crawl_workers,
+                         classify_workers=analyze_workers, expand_batch=expand_batch, db_path=db_path,
+                         best_first=best_first, crawl_budget=crawl_budget, llm_budget=llm_budget,
+                         llm_rpm=llm_rpm, llm_in_flight=llm_in_flight)
+        self.analyze_workers = analyze_workers
+        self.llm_in_flight = llm_in_flight
+        self.crawl_q = queue.Queue(maxsize=crawl_workers * 2)
+        self.analyze_q = queue.Queue(maxsize=analyze_workers * 2)
+        self.llm_q = queue.Queue(maxsize=llm_in_flight * 2)
+        self.stats = {CRAWL: 0, 'analyze': 0, 'llm': 0, 'gated': 0, EXPAND: 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(llm_in_flight)  # 在途大模型请求的名额
+        self._record_pool = None
+
+    # ---------- 阶段线程 ----------
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _fail(self, stage: str, depth: int, addr: str, error: str):
+        status = self.store.fail(self.eventName, depth, stage, addr, error)
+        self._count('failed')
+        print(f"{stage} 任务失败 (depth={depth}, {addr}): {error} -> {status}")
+
+    def _finish_classify(self, depth: int, addr: str, record: Dict):
+        self.store.advance(self.eventName, depth, CLASSIFY, addr, json.dumps(record), EXPAND)
+
+    def _crawl_worker(self):
+        while True:
+            item = self.crawl_q.get()
+            if item is _STOP:
+                return
+            depth, addr = item
+            try:
+                result = _crawl_task(self.eventName, depth, addr, self.store.chains(self.eventName, addr))
+            except Exception as e:
+                self._fail(CRAWL, depth, addr, str(e))
+                continue
+            self._count(CRAWL)
+            # 爬取完成与分类任务入队在同一事务中；大模型预算已用完时分类任务留在任务库（pending）
+            start = not self._exhausted(CLASSIFY)
+            if self.store.advance(self.eventName, depth, CRAWL, addr, result, CLASSIFY, start=start) and start:
+                self.analyze_q.put((depth, addr))  # 队列满时阻塞（反压）
+
+    def _analyze_batch(self):
+        """阻塞取一个地址，再不等待地取出队列中已有的地址（最多 ANALYZE_BATCH 个）；收到停止信号返回 None"""
+        item = self.analyze_q.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        while len(batch) < ANALYZE_BATCH:
+            try:
+                item = self.analyze_q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.analyze_q.put(_STOP)  # 留给下一次取
+                break
+            batch.append(item)
+        return batch
+
+    def _analyze_worker(self):
+        while True:
+            batch = self._analyze_batch()
+            if batch is None:
+                return
+            features, resolved = self._prepare(batch)
+            for depth, addr in batch:
+                if addr in resolved:
+                    Is_ML, label = resolved[addr]
+                    self._count('gated')
+                    self._finish_classify(depth, addr, {'Is_ML': Is_ML, 'label': label, 'status': 'success'})
+                else:
+                    self._analyze(depth, addr, features.get(addr))
+
+    def _analyze(self, depth: int, addr: str, features: Optional[Dict]):
+        try:
+            prompt, result, summary = self._pool.submit(prepare_single_address,
+                                                        (addr, self.eventName, depth, features)).result()
+        except Exception as e:
+            self._fail(CLASSIFY, depth, addr, str(e))
+            return
+        self._count('analyze')
+        if result is not None:
+            _, Is_ML, label, status = result
+            self._finish_classify(depth, addr, {'Is_ML': Is_ML, 'label': label, 'status': status})
+        else:
+            self.llm_q.put((depth, addr, prompt, summary))  # 队列满时阻塞（反压）
+
+    def _llm_small_batch(self, item):
+        """以小账户 item 开头，不等待地取出 llm_q 中已有的小账户（最多 BATCH_MAX_ADDRESSES 个）；其他地址单独判断"""
+        batch, others, stop = [item], [], False
+        while len(batch) < BATCH_MAX_ADDRESSES:
+            try:
+                item = self.llm_q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            (batch if item[3] is not None else others).append(item)
+        for item in others:
+            self._llm_single(*item[:3])
+        if stop:
+            self.llm_q.put(_STOP)  # 留给下一次取
+        return batch
+
+    def _llm_dispatcher(self):
+        while True:
+            item = self.llm_q.get()
+            if item is _STOP:
+                return
+            if item[3] is None:
+                self._llm_single(*item[:3])
+                continue
+            drawn = self._llm_small_batch(item)
+            depths = {addr: depth for depth, addr, _, _ in drawn}
+            for batch in pack_batches([(addr, prompt, summary) for _, addr, prompt, summary in drawn]):
+                self._llm_batch(batch, depths)
+
+    def _request(self, prompt: str, on_reply, **kwargs):
+        """
+        占用一个在途名额后提交请求（不等待回复）；回复到达时在事件循环线程中归还名额，
+        再由保存线程调用 on_reply(回复文本)。名额在保存之前归还，保存线程中的重试不会因名额等待自身而卡住
+        """
+        self._slots.acquire()
+        try:
+            future = self.llm.submit(prompt, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(partial(self._replied, on_reply))
+
+    def _replied(self, on_reply, future):
+        self._slots.release()
+        try:
+            response_text = future.result()
+        except Exception as e:
+            response_text = f"{LLM_FAILED_PREFIX}：{e}"
+        self._record_pool.submit(self._record, on_reply, response_text)
+
+    @staticmethod
+    def _record(on_reply, response_text: str):
+        try:
+            on_reply(response_text)
+        except Exception as e:
+            print(f"保存大模型判断失败: {e}")
+
+    def _llm_single(self, depth: int, addr: str, prompt: str):
+        if not self.budget.take(LLM_CALL, 1):
+            self.store.release(self.eventName, depth, CLASSIFY, addr)  # 预算在调用前用完，留在任务库
+            return
+        self._request(prompt, partial(self._single_reply, depth, addr, prompt))
+
+    def _single_reply(self, depth: int, addr: str, prompt: str, response_text: str):
+        if response_text.startswith(LLM_FAILED_PREFIX):
+            # 调用失败不落盘，放回任务库重试
+            self._fail(CLASSIFY, depth, addr, response_text)
+            return
+        try:
+            Is_ML, label = record_llm_verdict(addr, prompt, response_text)
+        except Exception as e:
+            self._fail(CLASSIFY, depth, addr, f"保存大模型结果失败: {e}")
+            return
+        self._count('llm')
+        self._finish_classify(depth, addr, {'Is_ML': Is_ML, 'label': label, 'status': 'success'})
+
+    def _llm_batch(self, batch, depths: Dict[str, int]):
+        """一个请求判断一批小账户，回复中缺失的地址用单地址 Prompt 重试"""
+        if len(batch) == 1:
+            self._llm_single(depths[batch[0][0]], batch[0][0], batch[0][1])
+            return
+        if not self.budget.take(LLM_CALL, 1):
+            for addr, _, _ in batch:
+                self.store.release(self.eventName, depths[addr], CLASSIFY, addr)
+            return
+        prompt = build_batch_prompt(batch)
+        self._request(prompt, partial(self._batch_reply, batch, depths), max_tokens=batch_max_tokens(len(batch)))
+
+    def _batch_reply(self, batch, depths: Dict[str, int], response_text: str):
+        try:
+            done, retry = record_batch(batch, response_text)
+        except Exception as e:
+            print(f"保存批量判断结果失败，逐个重试: {e}")
+            done, retry = {}, list(batch)
+        for addr, (Is_ML, label) in done.items():
+            self._count('llm')
+            self._finish_classify(depths[addr], addr, {'Is_ML': Is_ML, 'label': label, 'status': 'success'})
+        for addr, prompt, _ in retry:
+            self._llm_single(depths[addr], addr, prompt)
+
+    # ---------- 主线程 ----------
+    def _feed(self, stage: str, q: queue.Queue):
+        """按队列剩余容量从任务库取待执行任务（新地址、重试或上次中断的任务）"""
+        room = q.maxsize - q.qsize()
+        for depth, addr in self._claim(stage, room):
+            q.put((depth, addr))
+
+    def _status(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        print(f"[stream] 队列 crawl={self.crawl_q.qsize()} analyze={self.analyze_q.qsize()} llm={self.llm_q.qsize()} | "
+              f"完成 crawl={stats[CRAWL]} analyze={stats['analyze']} llm={stats['llm']} gated={stats['gated']} "
+              f"expand={stats[EXPAND]} failed={stats['failed']}")
+        if USE_CRAWLER_ENGINE:
+            get_crawler_engine().report_keys()
+
+    def run(self):
+        self.seed()
+        resumed = self.store.reset_running(self.eventName)
+        if resumed:
+            print(f"从断点续跑：{resumed} 个中断任务重新入队")
+
+        self._open_llm()
+        try:
+            self._loop()
+        finally:
+            self._close_llm()
+        self._depth_hooks()
+        self._budget_hooks()
+        if self.label_index is not None:
+            self.label_index.close()
+            self.label_index = None
+        self._status()
+        self.report()
+        get_verdict_cache().report()  # 累计命中数包含进程池中的查询
+        get_prompt_stats().report()   # 大模型分发线程发送的 Prompt
+
+    def _loop(self):
+        workers = ([(self._crawl_worker, self.crawl_q)] * self.crawl_workers +
+                   [(self._analyze_worker, self.analyze_q)] * self.analyze_workers +
+                   [(self._llm_dispatcher, self.llm_q)])
+        threads = []
+        with ProcessPoolExecutor(max_workers=self.analyze_workers) as pool, \
+                ThreadPoolExecutor(max_workers=LLM_RECORD_WORKERS) as record_pool:
+            self._pool = pool
+            self._record_pool = record_pool
+            for target, _ in workers:
+                t = threading.Thread(target=target, daemon=True)
+                t.start()
+                threads.append(t)
+
+            last_status = time.monotonic()
+            while True:
+                self._feed(CRAWL, self.crawl_q)
+                self._feed(CLASSIFY, self.analyze_q)
+                expanded = self._run_expand()
+                self._count(EXPAND, expanded)
+                self._depth_hooks()
+
+                if time.monotonic() - last_status > STATUS_INTERVAL:
+                    self._status()
+                    last_status = time.monotonic()
+                if expanded == 0:
+                    # 队列中的任务在任务库中均为 running，没有 pending/running 任务即全部完成
+                    if not self._has_pending():
+                        break
+                    time.sleep(0.2)
+
+            for _, q in workers:
+                q.put(_STOP)
+            for t in threads:
+                t.join()
+            self._pool = None
+            self._record_pool = None
+
+
+def run_stream(eventName: str = 'bybit', max_depth: int = MAX_DEPTH, crawl_workers: int = 10,
+               analyze_workers: int = 4, llm_in_flight: int = 64, llm_rpm: int = LLM_RPM, best_first: bool = False,
+               crawl_budget: Optional[int] = None, llm_budget: Optional[int] = None):
+    """流式版本的完整追踪（与调度器版本共用任务库，可重复执行，自动从断点续跑）"""
+    tracer = StreamTracer(eventName, max_depth=max_depth, crawl_workers=crawl_workers,
+                          analyze_workers=analyze_workers, llm_in_flight=llm_in_flight, llm_rpm=llm_rpm,
+                          best_first=best_first, crawl_budget=crawl_budget, llm_budget=llm_budget)
+    try:
+        tracer.run()
+    finally:
+        tracer.store.close()
@@ -0,0 +1,291 @@
+import heapq
+import os
+from collections import deque
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from label_index import LabelIndex, LABEL_ANY
+from next_hop import TOKEN_WHITELIST, DEFAULT_MIN_AMOUNT, DEFAULT_MAX_ADDRESSES
+from tx_graph import TxGraph, get_tx_graph, update_graph
+
+###
+# 污点传播：按被盗资金在交易图上的流向计算每个地址收到的污点金额，替代固定的“前 5% 大额”规则选下一跳
+# 三种模型（均按时间顺序，只有在地址被污染之后转出的交易才可能带污点）：
+#   poison  —— 收到任何污点资金的地址整体被污染，此后的全部转出都算污点（最保守，覆盖面最大）
+#   haircut —— 每个地址按余额中的污点比例转出，转出金额 × 污点比例为污点金额（按代币分别计算余额）
+#   fifo    —— 每个地址的余额按转入顺序排队，转出先用最早转入的资金
+# 在案件的共享交易图（tx_graph，CSR 行内按时间排序）上传播，只使用白名单代币、since 之后的边；
+# poison 在新追加的边上从已有结果继续松弛；haircut / fifo 依赖全局时间顺序，图追加边后从新纳入扫描的边中
+# 最早时间之前的余额快照继续扫描（快照间隔不小于余额条目数，复制快照的总开销与扫描的边数同阶）
+# 源地址（第 0 层）的全部资金视为污点；观测到的转出超过已知余额时，缺口对源地址按污点、对其他地址按干净资金处理
+
+SRC_ADDR_PATH = 'D:/FORGE2/XBlock/src_addr_token/'
+
+POISON = 'poison'
+HAIRCUT = 'haircut'
+FIFO = 'fifo'
+MODELS = [POISON, HAIRCUT, FIFO]
+
+TAINT_MODEL = None      # 下一跳选择使用的污点模型（None 使用 next_hop 的固定规则）
+TAINT_MIN_SCORE = 0.01  # 下一跳的最低污点比例（收到的污点金额 / 收到的总金额）
+SWEEP_CHECKPOINT_EDGES = 20000  # haircut / fifo 扫描每处理这么多条边（且不少于余额条目数）保存一次余额快照
+SWEEP_MAX_CHECKPOINTS = 64
+
+_EPS = 1e-12
+_NEVER = np.iinfo(np.int64).max   # 未被污染
+_ALWAYS = np.iinfo(np.int64).min  # 源地址（未指定 since 时）
+
+
+class TaintEngine:
+    """
+    交易图上的污点传播引擎（图由调用方追加交易，引擎按需重新计算）
+    scores 返回每个地址的污点结果，edge_taint 返回每条边携带的污点金额（按图的边下标）
+    """
+
+    def __init__(self, graph: TxGraph, seeds: Iterable[str], model: str = HAIRCUT, since: Optional[int] = None,
+                 tokens: Optional[set] = TOKEN_WHITELIST):
+        if model not in MODELS:
+            raise ValueError(f"未知的污点模型: {model}")
+        self.graph = graph
+        self.model = model
+        self.since = since
+        self.tokens = tokens
+        self.seeds = np.unique(graph.intern(seeds).astype(np.int64))
+        self._seen = 0          # 上次传播时图中的边数
+        self._taint = None      # 每条边的污点金额
+        self._first = None      # 每个地址首次被污染的时间（poison 松弛的状态）
+        self._included = None   # 上次 haircut / fifo 扫描纳入的边
+        self._checkpoints = []  # [(时间, 处理完该时间及之前的边后的余额)]，按时间递增
+
+    def _usable(self) -> np.ndarray:
+        """参与传播的边：白名单代币、since 之后"""
+        _, _, token, _, ts = self.graph.edges()
+        usable = np.ones(len(ts), dtype=bool)
+        if self.tokens is not None:
+            usable &= np.isin(token, self.graph.token_ids(self.tokens))
+        if self.since is not None:
+            usable &= ts >= self.since
+        return usable
+
+    # ---------- 传播 ----------
+    def propagate(self) -> np.ndarray:
+        """重新计算（或增量更新）每条边的污点金额"""
+        src, _, _, amount, ts = self.graph.edges()
+        usable = self._usable()
+        first = self._poison(usable)
+        if self.model == POISON:
+            taint = np.where(usable & (ts >= first[src]), amount, 0.0)
+        else:
+            taint = self._sweep(first, usable)
+        self._taint = taint
+        self._seen = len(src)
+        return taint
+
+    def _poison(self, usable: np.ndarray) -> np.ndarray:
+        """每个地址首次被污染的时间：按时间顺序的最短路（从源地址出发，只走不早于当前时间的边）"""
+        src = self.graph.edges()[0]
+        first = np.full(self.graph.num_nodes, _NEVER, dtype=np.int64)
+        if self._first is not None:
+            # 边只追加：从新边的发送方继续松弛
+            first[:len(self._first)] = self._first
+            new = np.arange(self._seen, len(src))
+            heap = [(int(first[u]), int(u)) for u in np.unique(src[new[usable[new]]]) if first[u] != _NEVER]
+        else:
+            first[self.seeds] = self.since if self.since is not None else _ALWAYS
+            heap = [(int(first[u]), int(u)) for u in self.seeds]
+        heapq.heapify(heap)
+        csr = self.graph.csr
+        while heap:
+            t, u = heapq.heappop(heap)
+            if t > first[u]:
+                continue
+            for k in csr.row(u, since=t):
+                if not usable[csr.edge[k]]:
+                    continue
+                v, tv = int(csr.cols[k]), int(csr.ts[k])
+                if tv < first[v]:
+                    first[v] = tv
+                    heapq.heappush(heap, (tv, v))
+        self._first = first
+        return first
+
+    def _sweep(self, first: np.ndarray, usable: np.ndarray) -> np.ndarray:
+        """
+        haircut / fifo：按时间顺序扫描与被污染地址相关的边，逐地址、逐代币维护余额
+        图追加边后只重扫新纳入扫描的边中最早时间之后的部分（从该时间之前最后一个余额快照继续），更早的边结果不变
+        """
+        src, dst, token, amount, ts = self.graph.edges()
+        reached = first != _NEVER
+        included = usable & (reached[src] | reached[dst])  # 只会增加：边只追加，被污染的地址不会恢复
+        taint = np.zeros(len(src), dtype=np.float64)
+        state, after = {}, None
+        if self._included is not None:
+            seen = len(self._included)
+            taint[:seen] = self._taint[:seen]
+            fresh = included.copy()
+            fresh[:seen] &= ~self._included
+            if not fresh.any():
+                self._included = included
+                return taint
+            start = ts[fresh].min()
+            while self._checkpoints and self._checkpoints[-1][0] >= start:
+                self._checkpoints.pop()
+            if self._checkpoints:
+                after, snapshot = self._checkpoints[-1]
+                state = self._copy_state(snapshot)
+        edges = np.flatnonzero(included)
+        if after is not None:
+            edges = edges[ts[edges] > after]
+        edges = edges[np.lexsort((edges, ts[edges]))]
+        taint[edges] = 0.0
+
+        fifo = self.model == FIFO
+        seed = np.zeros(len(first), dtype=bool)
+        seed[self.seeds] = True
+        # state: (地址, 代币) -> haircut: [余额, 污点余额]；fifo: deque([金额, 污点金额])
+        rows = zip(edges.tolist(), src[edges].tolist(), dst[edges].tolist(), token[edges].tolist(),
+                   amount[edges].tolist(), ts[edges].tolist())
+        last, count = None, 0
+        for e, u, v, c, a, t in rows:
+            if t != last and count >= max(SWEEP_CHECKPOINT_EDGES, len(state)):
+                self._checkpoint(last, state)  # 时间为 last 及之前的边都已处理
+                count = 0
+            out = self._spend(state, (u, c), a, bool(seed[u]), fifo)  # 被污染之前余额中没有污点，结果为 0
+            taint[e] = out
+            if fifo:
+                state.setdefault((v, c), deque()).append([a, a if seed[v] else out])
+            else:
+                balance = state.setdefault((v, c), [0.0, 0.0])
+                balance[0] += a
+                balance[1] += a if seed[v] else out
+            last, count = t, count + 1
+        self._included = included
+        return taint
+
+    def _copy_state(self, state: dict) -> dict:
+        if self.model == FIFO:
+            return {key: deque([lot[:] for lot in lots]) for key, lots in state.items()}
+        return {key: balance[:] for key, balance in state.items()}
+
+    def _checkpoint(self, t: int, state: dict):
+        """保存时间 t 之后的余额快照；超过 SWEEP_MAX_CHECKPOINTS 个时隔一个丢弃一个（保留最新的）"""
+        self._checkpoints.append((t, self._copy_state(state)))
+        if len(self._checkpoints) > SWEEP_MAX_CHECKPOINTS:
+            self._checkpoints = self._checkpoints[::-2][::-1]
+
+    @staticmethod
+    def _spend(state, key, a: float, seed: bool, fifo: bool) -> float:
+        """从 key 的余额中转出 a，返回其中的污点金额"""
+        if fifo:
+            lots = state.setdefault(key, deque())
+            left, out = a, 0.0
+            while left > _EPS and lots:
+                lot = lots[0]
+                used = min(left, lot[0])
+                part = lot[1] * used / lot[0] if lot[0] > _EPS else 0.0
+                out += part
+                lot[0] -= used
+                lot[1] -= part
+                left -= used
+                if lot[0] <= _EPS:
+                    lots.popleft()
+            return out + (left if seed else 0.0)
+        balance = state.setdefault(key, [0.0, 0.0])
+        if balance[0] < a:
+            # 观测之外的资金：源地址按污点、其他地址按干净资金补足余额
+            balance[1] += (a - balance[0]) if seed else 0.0
+            balance[0] = a
+        out = balance[1] * a / balance[0] if balance[0] > _EPS else 0.0
+        balance[0] -= a
+        balance[1] = max(balance[1] - out, 0.0)
+        return out
+
+    # ---------- 结果 ----------
+    def edge_taint(self) -> np.ndarray:
+        if self._taint is None or self._seen != self.graph.num_edges or len(self._first) != self.graph.num_nodes:
+            return self.propagate()
+        return self._taint
+
+    def scores(self) -> pd.DataFrame:
+        """DataFrame[address, tainted, received, score, first_tainted]（只含收到过污点资金的地址和源地址）"""
+        taint = self.edge_taint()
+        _, dst, _, amount, _ = self.graph.edges()
+        n = self.graph.num_nodes
+        usable = self._usable()
+        tainted = np.bincount(dst, weights=taint, minlength=n)
+        received = np.bincount(dst[usable], weights=amount[usable], minlength=n)
+        score = np.divide(tainted, received, out=np.zeros(n), where=received > _EPS)
+        score[self.seeds] = 1.0
+        keep = (tainted > _EPS) | np.isin(np.arange(n), self.seeds)
+        first = np.where((self._first != _NEVER) & (self._first != _ALWAYS), self._first, -1)
+        df = pd.DataFrame({'address': self.graph.names(np.arange(n)), 'tainted': tainted, 'received': received,
+                           'score': np.minimum(score, 1.0), 'first_tainted': first})
+        return df[keep].sort_values('tainted', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    def outflows(self, sources: Iterable[str]) -> pd.DataFrame:
+        """指定地址转出的污点金额：DataFrame[source, address, tainted]，按 (source, address) 汇总"""
+        taint = self.edge_taint()
+        ids = self.graph.ids(sources)
+        edges = self.graph.out_edges(np.unique(ids[ids >= 0]))
+        edges = edges[taint[edges] > _EPS]
+        flows = self.graph.flows(edges, weights=taint)
+        return flows.rename(columns={'amount': 'tainted'})[['source', 'address', 'tainted']]
+
+def select_tainted_hops(engine: TaintEngine, sources: List[str], label_index: LabelIndex,
+                        min_amount=DEFAULT_MIN_AMOUNT, max_addresses=DEFAULT_MAX_ADDRESSES,
+                        min_score=TAINT_MIN_SCORE) -> pd.DataFrame:
+    """
+    按污点金额选下一跳（与 next_hop.select_next_hops 的输出兼容）：
+    每个源地址保留转出污点金额 >= min_amount、污点比例 >= min_score 的接收方，按污点金额取前 max_addresses 个，
+    过滤标签库中的地址；返回 DataFrame[source, address, value_numeric, score]，value_numeric 为污点金额
+    """
+    columns = ['source', 'address', 'value_numeric', 'score']
+    with engine.graph.lock:
+        flows = engine.outflows(sources)
+        if len(flows) == 0:
+            return pd.DataFrame(columns=columns)
+        scores = engine.scores().set_index('address')['score']
+    flows['score'] = flows['address'].map(scores).fillna(0.0).to_numpy()
+    if min_amount is not None:
+        flows = flows[flows['tainted'] >= float(min_amount)]
+    flows = flows[flows['score'] >= min_score]
+    flows = flows.sort_values(['source', 'tainted', 'address'], ascending=[True, False, True], kind='mergesort')
+    if max_addresses is not None:
+        flows = flows[flows.groupby('source', sort=False).cumcount() < max_addresses]
+    if len(flows) > 0:
+        flows = flows[~label_index.contains(flows['address'], LABEL_ANY)]
+    flows = flows.rename(columns={'tainted': 'value_numeric'})
+    return flows[columns].reset_index(drop=True)
+
+
+# 每个进程每个案件、每种模型一个引擎（共用案件的交易图）
+_ENGINES = {}
+def get_taint_engine(eventName: str, model: Optional[str] = None, since: Optional[int] = None) -> TaintEngine:
+    """案件的污点引擎，源地址为第 0 层的源地址文件"""
+    model = model or TAINT_MODEL or HAIRCUT
+    key = (os.getpid(), eventName, model)
+    if key not in _ENGINES:
+        seeds = pd.read_csv(SRC_ADDR_PATH + eventName + '_source_addr0.csv')['address'].astype(str)
+        _ENGINES[key] = TaintEngine(get_tx_graph(eventName), seeds, model=model, since=since)
+    return _ENGINES[key]
+
+
+def update_taint(eventName: str, depth: int, transfers: pd.DataFrame, model: Optional[str] = None,
+                 since: Optional[int] = None) -> TaintEngine:
+    """把本批交易（及之前尚未读入的层）追加到案件的交易图，返回引擎（下一跳选择前调用）"""
+    update_graph(eventName, depth, transfers)
+    return get_taint_engine(eventName, model=model, since=since)
+
+
+if __name__ == '__main__':
+    import sys
+    event = sys.argv[1] if len(sys.argv) > 1 else 'bybit'
+    max_depth = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for name in MODELS:
+        engine = get_taint_engine(event, model=name)
+        engine.graph.load_depths(event, range(max_depth + 1))
+        result = engine.scores()
+        print(f"{name}: {engine.graph.num_nodes} 个地址，{engine.graph.num_edges} 条边，{len(result)} 个被污染地址")
+        print(result.head(20).to_string(index=False))
@@ -0,0 +1,297 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+###
+# 追踪流水线的任务状态库（SQLite）
+# 每个 (event, depth, stage, address) 是一个任务，状态 pending -> running -> done/failed
+# 入队和完成都是幂等的：重复入队被忽略，重复完成不改变结果；崩溃后把 running 重置为 pending 即可续跑
+# 一个阶段完成与下一阶段入队（包括展开后下一跳的爬取任务）在同一事务中提交（advance），两步之间崩溃不会让地址断在半路
+# priority 供 best-first 模式按优先级取任务：未指定时继承同一 (event, depth, address) 其他阶段任务的优先级
+# counters 记录不对应任务的累计用量（如实际发出的大模型请求数），续跑时接着计
+# address_chains 记录地址应在哪些链上抓取（源地址来自报告的 Finding.chain，下一跳继承上一跳的链）
+
+TASK_DB_PATH = 'G:/RiskTagger/pipeline_state.sqlite'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    event    TEXT    NOT NULL,
+    depth    INTEGER NOT NULL,
+    stage    TEXT    NOT NULL,
+    address  TEXT    NOT NULL,
+    status   TEXT    NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result   TEXT,
+    updated  REAL    NOT NULL,
+    priority REAL    NOT NULL DEFAULT 0,
+    PRIMARY KEY (event, depth, stage, address)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (event, stage, status, depth);
+CREATE INDEX IF NOT EXISTS idx_tasks_address ON tasks (event, stage, address);
+CREATE TABLE IF NOT EXISTS address_chains (
+    event   TEXT NOT NULL,
+    address TEXT NOT NULL,
+    chain   TEXT NOT NULL,
+    PRIMARY KEY (event, address, chain)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    event TEXT    NOT NULL,
+    name  TEXT    NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (event, name)
+);
+CREATE TABLE IF NOT EXISTS depth_hooks (
+    event TEXT    NOT NULL,
+    depth INTEGER NOT NULL,
+    hook  TEXT    NOT NULL,
+    PRIMARY KEY (event, depth, hook)
+);
+"""
+
+# 入队（已存在的任务忽略）；优先级为 NULL 时继承同一 (event, depth, address) 其他阶段任务的优先级
+_INSERT_TASK = ('INSERT OR IGNORE INTO tasks (event, depth, stage, address, updated, priority) '
+                'VALUES (?, ?, ?, ?, ?, COALESCE(?, (SELECT MAX(priority) FROM tasks '
+                'WHERE event=? AND depth=? AND address=?), 0))')
+# pending -> running
+_START_TASK = ('UPDATE tasks SET status=?, attempts=attempts+1, updated=? '
+               'WHERE event=? AND depth=? AND stage=? AND address=? AND status=?')
+# 标记完成（已完成的不再改动）
+_COMPLETE_TASK = ('UPDATE tasks SET status=?, result=?, updated=? '
+                  'WHERE event=? AND depth=? AND stage=? AND address=? AND status!=?')
+# 下一跳继承上一跳的链
+_INHERIT_CHAINS = ('INSERT OR IGNORE INTO address_chains (event, address, chain) '
+                   'SELECT event, ?, chain FROM address_chains WHERE event=? AND address=?')
+
+
+def _task_rows(event: str, depth: int, stage: str, addresses: Iterable[str], priorities: Optional[Dict[str, float]],
+               now: float) -> List[Tuple]:
+    """_INSERT_TASK 的参数行"""
+    priorities = {a.lower(): p for a, p in (priorities or {}).items()}
+    return [(event, depth, stage, a.lower(), now, priorities.get(a.lower()), event, depth, a.lower())
+            for a in addresses]
+
+
+class TaskStore:
+    """任务状态库，线程安全（单连接加锁）"""
+
+    def __init__(self, db_path: str = TASK_DB_PATH, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        columns = [r[1] for r in self._conn.execute('PRAGMA table_info(tasks)').fetchall()]
+        if 'priority' not in columns:
+            self._conn.execute('ALTER TABLE tasks ADD COLUMN priority REAL NOT NULL DEFAULT 0')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks (event, stage, status, priority)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务（调用方持有锁）：出错时回滚，连接不会停留在未结束的写事务中而挡住其他进程"""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def add(self, event: str, depth: int, stage: str, addresses: Iterable[str],
+            priorities: Optional[Dict[str, float]] = None) -> int:
+        """批量入队（已存在的任务忽略），返回新增任务数；priorities 为 {地址: 优先级}，未给出的继承其他阶段"""
+        rows = _task_rows(event, depth, stage, addresses, priorities, time.time())
+        with self._lock:
+            before = self._conn.total_changes
+            with self._transaction():
+                self._conn.executemany(_INSERT_TASK, rows)
+            return self._conn.total_changes - before
+
+    def advance(self, event: str, depth: int, stage: str, address: str, result: Optional[str],
+                next_stage: str, start: bool = False, next_depth: Optional[int] = None,
+                next_addresses: Optional[Iterable[str]] = None,
+                priorities: Optional[Dict[str, float]] = None) -> bool:
+        """
+        标记完成并在同一事务中把下一阶段任务入队，首次完成返回 True
+        默认入队同一地址同一层的 next_stage 任务（start=True 时直接标记为 running）；
+        给出 next_addresses 时改为入队这些地址（下一跳）在 next_depth 层的 next_stage 任务，
+        priorities 为 {地址: 优先级}，下一跳继承该地址的链
+        complete 和 add 分两次提交时，崩溃在两者之间会留下已完成却没有下一阶段任务的地址，续跑也接不上
+        """
+        address = address.lower()
+        now = time.time()
+        with self._lock:
+            with self._transaction():
+                cur = self._conn.execute(_COMPLETE_TASK, (DONE, result, now, event, depth, stage, address, DONE))
+                first = cur.rowcount > 0
+                if first and next_addresses is None:
+                    self._conn.execute(_INSERT_TASK, (event, depth, next_stage, address, now, None,
+                                                      event, depth, address))
+                    if start:
+                        self._conn.execute(_START_TASK, (RUNNING, now, event, depth, next_stage, address, PENDING))
+                elif first:
+                    children = [a.lower() for a in next_addresses]
+                    self._conn.executemany(_INHERIT_CHAINS, [(c, event, address) for c in children])
+                    self._conn.executemany(_INSERT_TASK, _task_rows(event, next_depth, next_stage, children,
+                                                                    priorities, now))
+            return first
+
+    def claim(self, event: str, stage: str, limit: int, by_priority: bool = False) -> List[Tuple[int, str]]:
+        """取出最多 limit 个待执行任务（浅层优先，by_priority 时优先级高的优先）并标记为 running，返回 [(depth, address)]"""
+        if limit <= 0:
+            return []
+        order = 'priority DESC, depth, rowid' if by_priority else 'depth, rowid'
+        with self._lock:
+            with self._transaction():
+                rows = self._conn.execute(
+                    'SELECT depth, address FROM tasks WHERE event=? AND stage=? AND status=? '
+                    f'ORDER BY {order} LIMIT ?', (event, stage, PENDING, limit)).fetchall()
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE tasks SET status=?, attempts=attempts+1, updated=? '
+                    'WHERE event=? AND depth=? AND stage=? AND address=?',
+                    [(RUNNING, now, event, d, stage, a) for d, a in rows])
+            return rows
+
+    def complete(self, event: str, depth: int, stage: str, address: str, result: Optional[str] = None) -> bool:
+        """标记完成（幂等），首次完成返回 True"""
+        with self._lock:
+            cur = self._conn.execute(_COMPLETE_TASK, (DONE, result, time.time(), event, depth, stage,
+                                                      address.lower(), DONE))
+            return cur.rowcount > 0
+
+    def release(self, event: str, depth: int, stage: str, address: str):
+        """把已取出但未执行的任务放回 pending（不计入尝试次数），例如预算在执行前用完"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE tasks SET status=?, attempts=MAX(attempts-1, 0), updated=? '
+                'WHERE event=? AND depth=? AND stage=? AND address=? AND status=?',
+                (PENDING, time.time(), event, depth, stage, address.lower(), RUNNING))
+
+    def fail(self, event: str, depth: int, stage: str, address: str, error: str = '') -> str:
+        """任务失败：未超过重试次数时放回 pending，否则标记 failed，返回新状态"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT attempts FROM tasks WHERE event=? AND depth=? AND stage=? AND address=?',
+                (event, depth, stage, address.lower())).fetchone()
+            status = PENDING if row is not None and row[0] < self.max_attempts else FAILED
+            self._conn.execute(
+                'UPDATE tasks SET status=?, result=?, updated=? '
+                'WHERE event=? AND depth=? AND stage=? AND address=? AND status!=?',
+                (status, error, time.time(), event, depth, stage, address.lower(), DONE))
+            return status
+
+    def reset_running(self, event: str) -> int:
+        """续跑：把上次中断时仍为 running 的任务放回 pending"""
+        with self._lock:
+            cur = self._conn.execute('UPDATE tasks SET status=? WHERE event=? AND status=?',
+                                     (PENDING, event, RUNNING))
+            return cur.rowcount
+
+    def counts(self, event: str) -> Dict[Tuple[int, str, str], int]:
+        """{(depth, stage, status): 任务数}"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT depth, stage, status, COUNT(*) FROM tasks WHERE event=? GROUP BY depth, stage, status',
+                (event,)).fetchall()
+        return {(d, s, st): n for d, s, st, n in rows}
+
+    def results(self, event: str, depth: int, stage: str, status: str = DONE) -> List[Tuple[str, Optional[str]]]:
+        """某层某阶段的 [(address, result)]"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT address, result FROM tasks WHERE event=? AND depth=? AND stage=? AND status=? ORDER BY rowid',
+                (event, depth, stage, status)).fetchall()
+
+    def result(self, event: str, depth: int, stage: str, address: str) -> Optional[str]:
+        """单个已完成任务的结果"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM tasks WHERE event=? AND depth=? AND stage=? AND address=? AND status=?',
+                (event, depth, stage, address.lower(), DONE)).fetchone()
+        return row[0] if row is not None else None
+
+    def attempts(self, event: str, stage: str) -> int:
+        """某阶段累计执行次数（含失败重试），用于全局预算"""
+        with self._lock:
+            row = self._conn.execute('SELECT COALESCE(SUM(attempts), 0) FROM tasks WHERE event=? AND stage=?',
+                                     (event, stage)).fetchone()
+        return int(row[0])
+
+    def bump(self, event: str, name: str, n: int = 1):
+        """累加计数"""
+        with self._lock:
+            self._conn.execute('INSERT INTO counters (event, name, value) VALUES (?, ?, ?) '
+                               'ON CONFLICT (event, name) DO UPDATE SET value=value+excluded.value', (event, name, n))
+
+    def counter(self, event: str, name: str) -> int:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM counters WHERE event=? AND name=?', (event, name)).fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def addresses(self, event: str, depth: int, stage: str) -> List[str]:
+        """某层某阶段的全部任务地址（任意状态，按入队顺序）"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT address FROM tasks WHERE event=? AND depth=? AND stage=? ORDER BY rowid',
+                (event, depth, stage)).fetchall()
+        return [r[0] for r in rows]
+
+    def known(self, event: str, stage: str, addresses: Iterable[str]) -> set:
+        """已在任意层出现过该阶段任务的地址"""
+        addresses = list({a.lower() for a in addresses})
+        found = set()
+        with self._lock:
+            for i in range(0, len(addresses), 500):
+                chunk = addresses[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT DISTINCT address FROM tasks WHERE event=? AND stage=? AND address IN ({marks})',
+                    [event, stage] + chunk).fetchall()
+                found.update(r[0] for r in rows)
+        return found
+
+    def has_tasks(self, event: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM tasks WHERE event=? LIMIT 1', (event,)).fetchone() is not None
+
+    def set_chains(self, event: str, chains: Dict[str, Iterable[str]]) -> int:
+        """记录 {地址: 链名列表}（已记录的忽略），返回新增条数"""
+        rows = [(event, a.lower(), c) for a, cs in chains.items() for c in dict.fromkeys(cs)]
+        if not rows:
+            return 0
+        with self._lock:
+            before = self._conn.total_changes
+            with self._transaction():
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO address_chains (event, address, chain) VALUES (?, ?, ?)', rows)
+            return self._conn.total_changes - before
+
+    def chains(self, event: str, address: str) -> List[str]:
+        """地址记录的链，没有记录时返回空列表（按地址格式路由）"""
+        with self._lock:
+            rows = self._conn.execute('SELECT chain FROM address_chains WHERE event=? AND address=? ORDER BY chain',
+                                      (event, address.lower())).fetchall()
+        return [r[0] for r in rows]
+
+    def hook_done(self, event: str, depth: int, hook: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM depth_hooks WHERE event=? AND depth=? AND hook=?',
+                                      (event, depth, hook)).fetchone() is not None
+
+    def mark_hook(self, event: str, depth: int, hook: str):
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO depth_hooks (event, depth, hook) VALUES (?, ?, ?)',
+                               (event, depth, hook))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+###
+# 测试直接导入 Laundering_Tracer 下的模块（与脚本的运行方式一致）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,123 @@
+import json
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+import address_mapping_store as ams
+from address_mapping_store import AddressMappingStore
+
+###
+# 地址映射库：多进程 / 多线程并发分配编号不冲突、JSON 导出导入往返、导入失败回滚
+
+EVENT = 'case'
+
+
+def addr(n: int) -> str:
+    return '0x' + f'{n:040x}'
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(ams, 'MAPPING_PATH', str(tmp_path))
+    store = AddressMappingStore(str(tmp_path / 'mapping.sqlite'))
+    yield store
+    store.close()
+
+
+def _map_in_process(db_path, addresses, queue):
+    store = AddressMappingStore(db_path)
+    try:
+        result = {}
+        for i in range(0, len(addresses), 7):  # 分多次事务，与其他进程交错
+            result.update(store.map_addresses(EVENT, addresses[i:i + 7]))
+        queue.put(result)
+    finally:
+        store.close()
+
+
+def _check_ids(store, results):
+    mapping = store.load(EVENT)
+    ids = [info['mapped_id'] for info in mapping.values()]
+    assert ids == [f'[Addr-{n}]' for n in range(1, len(mapping) + 1)]  # 连续且不重复
+    for result in results:
+        assert all(mapping[a]['mapped_id'] == m for a, m in result.items())
+    return mapping
+
+
+def test_concurrent_processes(store):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    # 各进程的地址部分重叠，顺序不同
+    batches = [[addr(i) for i in range(k * 30, k * 30 + 60)][::1 if k % 2 else -1] for k in range(4)]
+    workers = [ctx.Process(target=_map_in_process, args=(store.db_path, b, queue)) for b in batches]
+    for w in workers:
+        w.start()
+    results = [queue.get(timeout=60) for _ in workers]
+    for w in workers:
+        w.join(timeout=60)
+        assert w.exitcode == 0
+    mapping = _check_ids(store, results)
+    assert set(mapping) == {a for b in batches for a in b}
+
+
+def test_concurrent_threads(store):
+    results = []
+
+    def run(k):
+        results.append(store.map_addresses(EVENT, [addr(i) for i in range(k * 10, k * 10 + 40)]))
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(_check_ids(store, results)) == 90
+
+
+def test_mapping_is_stable(store):
+    first = store.map_addresses(EVENT, [addr(1).upper().replace('0X', '0x'), addr(2)])
+    assert store.map_addresses(EVENT, [addr(2), addr(3), addr(1)]) == {
+        addr(2): first[addr(2)], addr(3): '[Addr-3]', addr(1): first[addr(1)]}
+    assert store.map_addresses('other', [addr(3)]) == {addr(3): '[Addr-1]'}  # 事件之间独立编号
+
+
+def test_export_import_round_trip(store, tmp_path):
+    mixed = '0x' + f'{0xabc:040X}'
+    store.map_addresses(EVENT, [addr(5), mixed, addr(7)])
+    assert store.export_json(EVENT) == 3
+    with open(ams.mapping_json_path(EVENT), encoding='utf-8') as f:
+        exported = json.load(f)
+    assert exported[addr(0xabc)] == {'mapped_id': '[Addr-2]', 'original': mixed}
+
+    # 新库首次使用该事件时自动导入导出的 JSON，编号与原始写法不变，之后接着分配
+    fresh = AddressMappingStore(str(tmp_path / 'fresh.sqlite'))
+    try:
+        assert fresh.load(EVENT) == store.load(EVENT)
+        assert fresh.map_addresses(EVENT, [addr(8)]) == {addr(8): '[Addr-4]'}
+        # 重复导入不改变已有编号
+        assert fresh.import_json(EVENT) == 3
+        assert list(fresh.load(EVENT)) == [addr(5), addr(0xabc), addr(7), addr(8)]
+    finally:
+        fresh.close()
+
+
+def test_import_rolls_back(store, tmp_path):
+    path = tmp_path / 'bad.json'
+    path.write_text(json.dumps({addr(1): {'mapped_id': '[Addr-1]', 'original': addr(1)},
+                                addr(2): {'mapped_id': '[Addr-2]', 'original': {'not': 'text'}}}))
+    with pytest.raises(sqlite3.Error):
+        store.import_json(EVENT, str(path))
+    assert not store._conn.in_transaction
+    assert len(store.load(EVENT)) == 0  # 整批回滚
+    assert store.map_addresses(EVENT, [addr(3)]) == {addr(3): '[Addr-1]'}
+
+
+def test_auto_import_retried_after_failure(store, tmp_path):
+    with open(ams.mapping_json_path(EVENT), 'w', encoding='utf-8') as f:
+        json.dump({addr(1): {'mapped_id': '[Addr-1]', 'original': ['bad']}}, f)
+    with pytest.raises(sqlite3.Error):
+        store.load(EVENT)
+    with open(ams.mapping_json_path(EVENT), 'w', encoding='utf-8') as f:
+        json.dump({addr(1): {'mapped_id': '[Addr-9]', 'original': addr(1)}}, f)
+    assert store.map_addresses(EVENT, [addr(1), addr(2)]) == {addr(1): '[Addr-9]', addr(2): '[Addr-10]'}
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+import LLM_detection
+from LLM_detection import cached_llm_verdict, verdict_key
+from batch_prompt import BUDGET_EXHAUSTED, build_batch_prompt, classify_batches, record_batch
+from best_first import TraceBudget, LLM_CALL
+from task_store import TaskStore
+from verdict_cache import VerdictCache
+
+###
+# 小账户批量判断：逐地址判断按该地址自己的单地址 Prompt 写入判断缓存；批量请求与缺失地址的重试都计入大模型预算
+
+EVENT = 'case'
+
+
+def item(n: int):
+    addr = f'0x{n:040x}'
+    summary = {'target_address': f'[Addr-{n}]', 'total_transactions': 2, 'total_incoming': 1}
+    return addr, f'single prompt for {addr}', summary
+
+
+def reply(*levels) -> str:
+    return json.dumps({'verdicts': [{'address': f'[Addr-{n}]', 'suspicion_level': level} for n, level in levels]})
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = VerdictCache(str(tmp_path / 'verdicts.sqlite'))
+    monkeypatch.setattr(LLM_detection, 'get_verdict_cache', lambda: cache)
+    monkeypatch.setattr(LLM_detection, 'LLM_RESULT_PATH', str(tmp_path) + '/')
+    yield cache
+    cache.close()
+
+
+class FakeClient:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def complete(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.replies.pop(0)
+
+
+def test_record_batch_keys_on_single_prompt(cache):
+    items = [item(1), item(2), item(3)]
+    done, retry = record_batch(items, reply((1, 'High'), (2, 'No Suspicion'), (2, 'Low'), (9, 'High')))
+    assert done == {items[0][0]: (True, 'high-ML')}
+    assert retry == items[1:]  # 重复和缺失的地址单独重试
+    # 同一地址下次按单地址 Prompt 查询即可命中，批量 Prompt 不作为键
+    assert cache.get(verdict_key(items[0][1]))[0].suspicion_level == 'High'
+    assert cache.get(verdict_key(build_batch_prompt(items))) is None
+    assert cached_llm_verdict(items[0][0], items[0][1]) == [True, 'high-ML']
+    assert cache.get_address(items[0][0]).suspicion_level == 'High'
+
+
+def test_classify_batches_charges_retries(cache, tmp_path):
+    store = TaskStore(str(tmp_path / 'tasks.sqlite'))
+    try:
+        items = [item(1), item(2), item(3)]
+        client = FakeClient([reply((1, 'Low')), '{"suspicion_level": "Medium"}'])
+        budget = TraceBudget(store, EVENT, {LLM_CALL: 2})
+        results = asyncio.run(classify_batches(client, items, budget=budget))
+        # 批量请求 1 次 + 第一个缺失地址的重试 1 次，第二个缺失地址的重试超出预算
+        assert len(client.prompts) == 2 and client.prompts[1] == items[1][1]
+        assert sorted(results) == sorted([(items[0][0], True, 'low-ML', 'success'),
+                                          (items[1][0], True, 'mid-ML', 'success'),
+                                          (items[2][0], None, None, BUDGET_EXHAUSTED)])
+        assert budget.exhausted(LLM_CALL) and store.counter(EVENT, LLM_CALL) == 2
+    finally:
+        store.close()
+
+
+def test_classify_batches_unbudgeted(cache):
+    items = [item(1), item(2)]
+    client = FakeClient([reply((1, 'Low'), (2, 'High'))])
+    results = asyncio.run(classify_batches(client, items))
+    assert sorted(r[1:] for r in results) == [(True, 'high-ML', 'success'), (True, 'low-ML', 'success')]
+    assert len(client.prompts) == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from best_first import TraceBudget, hop_priority, record_level, LLM_CALL
+from task_store import TaskStore
+from verdict import LEVEL_HIGH, LEVEL_MEDIUM, LEVEL_LOW, LEVEL_NONE, LEVEL_UNKNOWN
+
+###
+# best-first 追踪：下一跳优先级的排序、全局预算的用尽与续跑
+
+EVENT = 'case'
+CRAWL = 'crawl'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(str(tmp_path / 'tasks.sqlite'))
+    yield store
+    store.close()
+
+
+def test_hop_priority_order():
+    # 金额越大、上一跳越可疑、跳数越少，优先级越高
+    assert hop_priority(1e6, LEVEL_LOW, 2) > hop_priority(1e3, LEVEL_LOW, 2) > hop_priority(0, LEVEL_LOW, 2)
+    levels = [LEVEL_HIGH, LEVEL_MEDIUM, LEVEL_LOW, LEVEL_NONE]
+    scores = [hop_priority(100, level, 2) for level in levels]
+    assert scores == sorted(scores, reverse=True) and len(set(scores)) == len(scores)
+    assert hop_priority(100, LEVEL_MEDIUM, 1) > hop_priority(100, LEVEL_MEDIUM, 2)
+    # 未判断按低可疑处理，负金额按 0 处理
+    assert hop_priority(100, LEVEL_UNKNOWN, 2) == hop_priority(100, LEVEL_LOW, 2)
+    assert hop_priority(-5, LEVEL_NONE, 1) == hop_priority(0, LEVEL_NONE, 1)
+
+
+def test_record_level():
+    assert record_level('{"Is_ML": true, "label": "high-ML", "status": "success"}') == LEVEL_HIGH
+    assert record_level('{"Is_ML": false, "label": "No Suspicion", "status": "success"}') == LEVEL_NONE
+    assert record_level(None) == LEVEL_UNKNOWN
+    assert record_level('not json') == LEVEL_UNKNOWN
+
+
+def test_budget_exhaustion(store):
+    budget = TraceBudget(store, EVENT, {CRAWL: 5, LLM_CALL: 3})
+    assert budget.take(CRAWL, 4) == 4
+    assert not budget.exhausted(CRAWL)
+    assert budget.take(CRAWL, 4) == 1
+    assert budget.exhausted(CRAWL) and budget.take(CRAWL, 1) == 0
+    budget.refund(CRAWL, 2)  # 批准后没有那么多待执行任务
+    assert not budget.exhausted(CRAWL) and budget.take(CRAWL, 5) == 2
+    assert budget.take(LLM_CALL, 2) == 2 and budget.take(LLM_CALL, 2) == 1
+    assert budget.exhausted(LLM_CALL)
+
+
+def test_budget_unlimited(store):
+    budget = TraceBudget(store, EVENT, {CRAWL: None, LLM_CALL: None})
+    assert budget.take(CRAWL, 1000) == 1000 and budget.take(LLM_CALL, 1000) == 1000
+    assert not budget.exhausted(CRAWL) and not budget.exhausted(LLM_CALL)
+
+
+def test_budget_resume(store):
+    # 爬取按任务库中的尝试次数、大模型按 counters 表续计
+    store.add(EVENT, 0, CRAWL, ['0xa', '0xb', '0xc'])
+    store.claim(EVENT, CRAWL, 2)
+    budget = TraceBudget(store, EVENT, {CRAWL: 3, LLM_CALL: 4})
+    assert budget.take(LLM_CALL, 3) == 3
+    budget.refund(LLM_CALL, 1)
+
+    resumed = TraceBudget(store, EVENT, {CRAWL: 3, LLM_CALL: 4})
+    assert resumed.used == {CRAWL: 2, LLM_CALL: 2}
+    assert resumed.take(CRAWL, 5) == 1 and resumed.exhausted(CRAWL)
+    assert resumed.take(LLM_CALL, 5) == 2 and resumed.exhausted(LLM_CALL)
+    # 提高预算后续跑
+    raised = TraceBudget(store, EVENT, {CRAWL: 10, LLM_CALL: 10})
+    assert not raised.exhausted(CRAWL) and raised.used[LLM_CALL] == 4
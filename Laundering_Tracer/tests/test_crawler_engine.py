@@ -0,0 +1,35 @@
+import pytest
+
+from crawler_engine import CrawlerEngine
+from fetch_backends import NATIVE_CONTRACT, make_backend
+from key_pool import KeyPool
+from next_hop import TOKEN_WHITELISTS
+
+###
+# 抓取引擎下推的代币白名单：每条链只用该链自己的合约，没有配置的链只抓原生币
+
+CHAINS = ('ethereum', 'bsc', 'polygon', 'tron')
+
+
+@pytest.fixture
+def engine():
+    keys = KeyPool(['test'])
+    engine = CrawlerEngine(write_csv=False, allowed_tokens=TOKEN_WHITELISTS,
+                           backends={chain: make_backend(chain, keys) for chain in CHAINS})
+    yield engine
+    engine.close()
+
+
+def test_tokens_per_chain(engine):
+    assert engine._tokens('ethereum') == TOKEN_WHITELISTS['ethereum']
+    assert engine._tokens('bsc') == TOKEN_WHITELISTS['bsc']
+    assert engine._tokens('tron') == TOKEN_WHITELISTS['tron']
+    assert engine._tokens('polygon') == {NATIVE_CONTRACT}
+    # 其他链的合约不出现在以太坊的查询范围中
+    others = (TOKEN_WHITELISTS['bsc'] | TOKEN_WHITELISTS['tron']) - {NATIVE_CONTRACT}
+    assert not others & set(engine._scope('ethereum').split(';')[0][len('tokens='):].split(','))
+
+
+def test_unrestricted(engine):
+    engine.allowed_tokens = None
+    assert all(engine._tokens(chain) is None for chain in CHAINS)
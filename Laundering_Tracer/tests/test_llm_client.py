@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import llm_client
+from llm_client import AsyncLLMClient, LLMClientThread
+
+###
+# 异步大模型客户端：token 计数不在事件循环线程中执行，submit 不等待回复
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=' {"suspicion_level": "Low"} ')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """记录 count_tokens 在哪些线程中被调用"""
+    threads = []
+
+    def count_tokens(text):
+        threads.append(threading.current_thread())
+        return len(text)
+    monkeypatch.setattr(llm_client, 'count_tokens', count_tokens)
+    return threads
+
+
+def fake_client(client: AsyncLLMClient) -> FakeCompletions:
+    completions = FakeCompletions()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions), close=client.client.close)
+    return completions
+
+
+def test_submit_counts_in_caller_thread(counted):
+    llm = LLMClientThread(api_key='test', base_url='http://localhost')
+    try:
+        completions = fake_client(llm.client)
+        future = llm.submit('prompt', max_tokens=10)
+        assert future.result(timeout=5) == '{"suspicion_level": "Low"}'
+        assert completions.calls == 1
+        assert counted and all(t is threading.current_thread() for t in counted)
+    finally:
+        llm.close()
+
+
+def test_async_complete_counts_off_loop(counted):
+    llm = LLMClientThread(api_key='test', base_url='http://localhost')
+    try:
+        fake_client(llm.client)
+        future = asyncio.run_coroutine_threadsafe(llm.client.complete('prompt'), llm.loop)
+        assert future.result(timeout=5) == '{"suspicion_level": "Low"}'
+        assert counted and all(t is not llm._thread for t in counted)
+    finally:
+        llm.close()
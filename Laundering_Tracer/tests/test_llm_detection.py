@@ -0,0 +1,141 @@
+import statistics
+from collections import defaultdict
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import LLM_detection
+from address_mapping_store import AddressMappingStore
+from LLM_detection import analyze_transaction_flow, format_time
+from prompt_renderer import PROMPT_MAX_ROWS
+from token_amount import FRAC_SCALE, format_amount
+
+###
+# 交易流向分析（analyze_transaction_flow）：按列向量化的统计量与逐笔循环的原实现一致
+# （字典列表与列式表两种输入、地址编号顺序、前 k 大交易与相等时的顺序、金额统计、频率、出入度）
+
+EVENT = 'case'
+TARGET = '0x' + 'Ab' * 20
+
+
+def reference_flow(transactions, target_addr, topk):
+    """原实现：逐笔构造字典、累加 Python 列表后用 statistics 计算（只保留与结果比较相关的部分）"""
+    mapping = {}
+
+    def mapped(addr):
+        if addr.lower() not in mapping:
+            mapping[addr.lower()] = f"[Addr-{len(mapping) + 1}]"
+        return mapping[addr.lower()]
+
+    result = {"target_address": mapped(target_addr), "total_transactions": len(transactions),
+              "total_incoming": 0, "total_outgoing": 0}
+    target = target_addr.lower()
+    in_from, out_to, related, tokens = set(), set(), set(), set()
+    in_amounts, out_amounts, times, raw_in, raw_out = [], [], [], [], []
+    in_value, out_value = defaultdict(int), defaultdict(int)
+    for tx in transactions:
+        exact = tx["amount_int"] * FRAC_SCALE + tx["amount_frac"]
+        amount_str = format_amount(tx["amount_int"], tx["amount_frac"], places=6, strip=True)
+        from_mapped, to_mapped = mapped(tx["address_from"]), mapped(tx["address_to"])
+        row = {"token_symbol": tx["symbol"], "readable_amount": amount_str,
+               "transaction_time": format_time(tx["timestamp"])}
+        if tx["address_to"].lower() == target:
+            result["total_incoming"] += 1
+            in_value[tx["symbol"]] += exact
+            in_amounts.append(exact / FRAC_SCALE)
+            times.append(tx["timestamp"])
+            raw_in.append((exact, {"from_address": from_mapped, **row}))
+            related.add(from_mapped)
+            in_from.add(from_mapped)
+        if tx["address_from"].lower() == target:
+            result["total_outgoing"] += 1
+            out_value[tx["symbol"]] += exact
+            out_amounts.append(exact / FRAC_SCALE)
+            times.append(tx["timestamp"])
+            raw_out.append((exact, {"to_address": to_mapped, **row}))
+            related.add(to_mapped)
+            out_to.add(to_mapped)
+        tokens.add(tx["symbol"])
+    raw_in.sort(key=lambda x: x[0], reverse=True)
+    raw_out.sort(key=lambda x: x[0], reverse=True)
+    result["incoming_transactions"] = [r for _, r in raw_in[:topk]]
+    result["outgoing_transactions"] = [r for _, r in raw_out[:topk]]
+    result["total_token_types"] = tokens
+    result["total_in_value"] = {s: e / FRAC_SCALE for s, e in in_value.items()}
+    result["total_out_value"] = {s: e / FRAC_SCALE for s, e in out_value.items()}
+    result["in_degree"], result["out_degree"] = len(in_from), len(out_to)
+    result["unique_counterparties"] = len(related)
+    result["in_out_ratio"] = round(len(out_to) / len(in_from), 3) if in_from else float('inf')
+    result["in_transaction_frequency"] = result["out_transaction_frequency"] = 0.0
+    if times:
+        days = max((max(times) - min(times)) / (24 * 3600), 1)
+        result["in_transaction_frequency"] = round(result["total_incoming"] / days, 3)
+        result["out_transaction_frequency"] = round(result["total_outgoing"] / days, 3)
+    for side, large, amounts in (("in", "large_incoming_ratio", in_amounts),
+                                 ("out", "large_outgoing_ratio", out_amounts)):
+        result[f"avg_{side}_amount"] = result[f"median_{side}_amount"] = result[f"std_{side}_amount"] = 0.0
+        result[large] = 0.0
+        if amounts:
+            result[f"avg_{side}_amount"] = round(statistics.mean(amounts), 6)
+            result[f"median_{side}_amount"] = round(statistics.median(amounts), 6)
+            if len(amounts) > 1:
+                result[f"std_{side}_amount"] = round(statistics.stdev(amounts), 6)
+            result[large] = round(sum(1 for a in amounts if a >= 1000) / len(amounts), 3)
+    return result, mapping
+
+
+def transfers(n: int, seed: int):
+    rng = np.random.default_rng(seed)
+    peers = ['0x' + f'{i:040x}' for i in range(1, 25)]
+    peers[3] = peers[3].upper().replace('0X', '0x')  # 大小写不同的同一类地址
+    rows = []
+    for i in range(n):
+        peer = peers[int(rng.integers(len(peers)))]
+        kind = int(rng.integers(10))
+        src, dst = (peer, TARGET) if kind < 5 else (TARGET, peer) if kind < 9 else (TARGET, TARGET.lower())
+        whole = int(rng.choice([0, 1, 999, 1000, 1000, 25000, int(rng.integers(0, 5000))]))
+        frac = int(rng.choice([0, FRAC_SCALE // 2, int(rng.integers(0, FRAC_SCALE))]))
+        rows.append({"address_from": src, "address_to": dst, "symbol": ['USDT', 'USDC', 'WETH'][i % 3],
+                     "decimals": 18, "timestamp": 1700000000 + int(rng.integers(0, 30 * 86400)),
+                     "amount_int": whole, "amount_frac": frac})
+    return rows
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = AddressMappingStore(str(tmp_path / 'mapping.sqlite'))
+    monkeypatch.setattr(LLM_detection, 'get_mapping_store', lambda: store)
+    yield store
+    store.close()
+
+
+def compare(actual, expected):
+    assert set(actual["total_token_types"]) == expected.pop("total_token_types")
+    for key, value in expected.items():
+        assert actual[key] == (pytest.approx(value, rel=1e-12) if isinstance(value, float) else value), key
+
+
+@pytest.mark.parametrize('n, seed, topk', [(0, 0, 5), (1, 1, 5), (2, 2, 1), (60, 3, 10), (400, 4, PROMPT_MAX_ROWS)])
+def test_matches_loop(store, n, seed, topk):
+    rows = transfers(n, seed)
+    expected, mapping = reference_flow(rows, TARGET, topk)
+    compare(analyze_transaction_flow(rows, TARGET, EVENT, topk=topk), expected)
+    # 地址编号的分配顺序与原实现相同（核心地址最先，每笔先 from 后 to）
+    assert {a: info["mapped_id"] for a, info in store.load(EVENT).items()} == mapping
+
+
+def test_table_input_matches_loop(store):
+    rows = transfers(200, 7)
+    expected, _ = reference_flow(rows, TARGET, 20)
+    table = pa.Table.from_pylist(rows)
+    compare(analyze_transaction_flow(table, TARGET, EVENT, topk=20), expected)
+
+
+def test_ties_keep_input_order(store):
+    rows = [{"address_from": '0x' + f'{i:040x}', "address_to": TARGET, "symbol": 'USDT', "decimals": 6,
+             "timestamp": 1700000000 + i, "amount_int": 1000 if i % 2 else 5, "amount_frac": 0} for i in range(1, 9)]
+    result = analyze_transaction_flow(rows, TARGET, EVENT, topk=3)
+    assert [r["from_address"] for r in result["incoming_transactions"]] == ['[Addr-2]', '[Addr-4]', '[Addr-6]']
+    assert result["large_incoming_ratio"] == 0.5 and result["in_out_ratio"] == 0.0
+    assert result["total_in_value"] == {'USDT': 4020.0} and result["std_out_amount"] == 0.0
@@ -0,0 +1,159 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from label_index import LabelIndex, LABEL_EXCHANGE, LABEL_HACKER
+from next_hop import select_next_hops, TOKEN_WHITELIST, TOKEN_WHITELISTS, NATIVE_TOKEN
+from token_amount import threshold_limbs, to_limbs, AMOUNT_INT_MAX
+
+###
+# 批量下一跳选择（next_hop.select_next_hops）与逐地址路径（discover_address_token3.process_single_address）一致：
+# 白名单、最小金额、前 5% 大额、前 3 个地址、标签库过滤、金额相同时的顺序
+
+USDT = '0xdac17f958d2ee523a2206206994597c13d831ec7'
+ETH = '0x0000000000000000000000000000000000000000'
+JUNK = '0x00000000000000000000000000000000deadbeef'  # 不在白名单中
+FRAC = 10 ** 18
+
+
+def addr(n: int) -> str:
+    return '0x' + f'{n:040x}'
+
+
+def tx(source, to, amount, contract=USDT, sender=None):
+    """一笔转账；amount 为代币单位（可带小数，按 18 位小数精确拆分）"""
+    whole, frac = threshold_limbs(amount)
+    return {'source': source, 'address_from': sender or source, 'address_to': to, 'contract_address': contract,
+            'amount_int': whole, 'amount_frac': frac}
+
+
+# 源地址编号 1xx，下一跳编号 2xx / 6xx，带标签的地址 5xx
+S_JUNK, S_BASIC, S_TOP, S_TIE, S_LABEL, S_FRAC, S_MIXED = (addr(100 + i) for i in range(7))
+LABELED_EXCHANGE = addr(501)
+LABELED_HACKER = addr(502)
+
+
+def _transfers() -> pd.DataFrame:
+    rows = []
+    # 只有非白名单代币转出：不向下扩展（转入记录也不算）
+    rows += [tx(S_JUNK, addr(200 + i), 1000, contract=JUNK) for i in range(5)]
+    rows += [tx(S_JUNK, S_JUNK, 500, sender=addr(299))]
+    # 少量交易：低于最小金额的被过滤，前 5% 至少保留 1 笔
+    rows += [tx(S_BASIC, addr(210), 9.999999), tx(S_BASIC, addr(211), 10), tx(S_BASIC, addr(212), 50)]
+    # 60 笔不同金额：前 5% 保留 3 笔，按接收方汇总后取前 3 个地址
+    rng = np.random.default_rng(7)
+    amounts = rng.permutation(np.arange(11, 71))
+    rows += [tx(S_TOP, addr(220 + i % 8), float(a), contract=USDT if i % 2 else ETH) for i, a in enumerate(amounts)]
+    rows += [tx(S_TOP, addr(219), 5.0)] * 5  # 低于最小金额
+    # 金额全部相同：前 5% 按原始顺序保留，接收方汇总相同时按地址排序取前 3 个
+    rows += [tx(S_TIE, addr(240 + (7 * i) % 10), 50) for i in range(100)]
+    # 最大的接收方带标签：过滤后不补位
+    rows += [tx(S_LABEL, LABELED_EXCHANGE, 1000), tx(S_LABEL, LABELED_HACKER, 900), tx(S_LABEL, addr(260), 800)]
+    rows += [tx(S_LABEL, addr(600 + i), 20 + i) for i in range(57)]
+    # 只有小数部分不同
+    rows += [tx(S_FRAC, addr(270), 10.25), tx(S_FRAC, addr(271), 10.5), tx(S_FRAC, addr(272), 10.125)]
+    # 有白名单转出时非白名单代币的转出同样参与筛选
+    rows += [tx(S_MIXED, addr(280), 20), tx(S_MIXED, addr(281), 5000, contract=JUNK)]
+    return pd.DataFrame(rows)
+
+
+SOURCES = [S_JUNK, S_BASIC, S_TOP, S_TIE, S_LABEL, S_FRAC, S_MIXED]
+
+
+@pytest.fixture(scope='module')
+def label_index():
+    index = LabelIndex.build({LABEL_EXCHANGE: [LABELED_EXCHANGE], LABEL_HACKER: [LABELED_HACKER]})
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def per_address(monkeypatch, tmp_path, label_index):
+    """逐地址路径：交易从上面的 DataFrame 读取，结果文件写入临时目录"""
+    monkeypatch.chdir(tmp_path)  # 导入时会按相对路径创建 D:/... 目录
+    module = importlib.import_module('discover_address_token3')
+    transfers = _transfers()
+    monkeypatch.setattr(module, 'load_address_transfers',
+                        lambda a, *args, **kwargs: transfers[transfers['source'] == a].drop(columns='source'))
+    monkeypatch.setattr(module, 'label_index', label_index)
+    monkeypatch.setattr(module, 'filter_path', str(tmp_path) + '/')
+
+    def run(source):
+        result = module.process_single_address((source, source, 10, 3, 0.05, 'test', 0))
+        return set() if result is None else set(result)
+    return run
+
+
+def _batch(label_index, **kwargs):
+    hops = select_next_hops(_transfers(), label_index, **kwargs)
+    return {s: set(hops.loc[hops['source'] == s, 'address']) for s in SOURCES}
+
+
+@pytest.mark.parametrize('source', SOURCES)
+def test_matches_per_address(per_address, label_index, source):
+    assert _batch(label_index)[source] == per_address(source)
+
+
+def test_expected_hops(label_index):
+    batch = _batch(label_index)
+    assert batch[S_JUNK] == set()
+    assert batch[S_BASIC] == {addr(212)}
+    # 60 笔中最大的 3 笔：70、69、68
+    top = _transfers()
+    top = top[(top['source'] == S_TOP) & (top['amount_int'] >= 68)]
+    assert batch[S_TOP] == set(top['address_to'])
+    # 前 5 笔的接收方：240、247、244、241、248，汇总相同取地址最小的 3 个
+    assert batch[S_TIE] == {addr(240), addr(241), addr(244)}
+    assert batch[S_LABEL] == {addr(260)}
+    assert batch[S_FRAC] == {addr(271)}
+    assert batch[S_MIXED] == {addr(281)}
+
+
+def test_rows_and_amounts(label_index):
+    hops = select_next_hops(_transfers(), label_index)
+    assert list(hops.columns) == ['source', 'address', 'amount_int', 'amount_frac', 'value_numeric']
+    frac = hops[hops['source'] == S_FRAC].iloc[0]
+    assert (frac['amount_int'], frac['amount_frac']) == (10, FRAC // 2)
+    assert frac['value_numeric'] == pytest.approx(10.5)
+    # 保留的是前 5% 的交易中发往前 3 个接收方的那几笔
+    assert (hops['source'] == S_TIE).sum() == 3
+
+
+def test_parameters(label_index):
+    batch = _batch(label_index, min_amount=None, max_addresses=None, top_amount_ratio=1.0)
+    assert batch[S_BASIC] == {addr(210), addr(211), addr(212)}
+    assert batch[S_LABEL] == {addr(260)} | {addr(600 + i) for i in range(57)}
+    assert len(batch[S_TOP]) == 9
+    assert _batch(label_index, max_addresses=1)[S_TIE] == {addr(240)}
+
+
+def test_overflow_ranked_by_value(label_index):
+    # 两笔都超过 AMOUNT_INT_MAX 而截断：按 value 列的原始金额排序，保留真正更大的一笔
+    values, decimals = [2 * 10 ** 40, 3 * 10 ** 40, 10 ** 19], [18, 18, 18]
+    whole, frac, overflow = to_limbs(values, decimals)
+    df = pd.DataFrame({'source': S_BASIC, 'address_from': S_BASIC, 'address_to': [addr(290), addr(291), addr(292)],
+                       'contract_address': USDT, 'value': values, 'decimals': decimals, 'amount_int': whole,
+                       'amount_frac': frac, 'value_overflow': overflow})
+    assert df['amount_int'].tolist()[:2] == [AMOUNT_INT_MAX] * 2
+    hops = select_next_hops(df, label_index, max_addresses=1, top_amount_ratio=1.0)
+    assert hops['address'].tolist() == [addr(291)]
+    assert hops['amount_int'].tolist() == [3 * 10 ** 22]
+    assert hops['value_numeric'].tolist() == pytest.approx([3e22])
+
+
+def test_empty(label_index):
+    assert len(select_next_hops(pd.DataFrame(columns=_transfers().columns), label_index)) == 0
+    only_junk = _transfers()
+    assert len(select_next_hops(only_junk[only_junk['source'] == S_JUNK], label_index)) == 0
+
+
+def test_other_chain_contracts_not_whitelisted(label_index):
+    # 以太坊路径只认以太坊合约：BSC、Tron 的 USDT 合约地址在以太坊上不是白名单代币
+    bsc_usdt = sorted(TOKEN_WHITELISTS['bsc'] - {NATIVE_TOKEN})[0]
+    tron_usdt = sorted(TOKEN_WHITELISTS['tron'] - {NATIVE_TOKEN})[0]
+    assert bsc_usdt not in TOKEN_WHITELIST and tron_usdt not in TOKEN_WHITELIST
+    df = pd.DataFrame([tx(addr(110), addr(290), 1000, contract=bsc_usdt),
+                       tx(addr(111), addr(291), 1000, contract=tron_usdt)])
+    assert len(select_next_hops(df, label_index)) == 0
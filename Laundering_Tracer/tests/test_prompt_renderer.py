@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import prompt_renderer
+from prompt_renderer import render_analysis, count_tokens, PromptStats
+
+###
+# Prompt 渲染（prompt_renderer）：按 token 预算贪心写入交易行，结果不超过预算、保留金额最大的行、两个方向轮流加入
+
+
+@pytest.fixture(autouse=True)
+def char_estimate(monkeypatch):
+    # 按字符数估算 token，结果与是否安装 tiktoken 无关
+    monkeypatch.setattr(prompt_renderer, '_ENCODER', {os.getpid(): None})
+
+
+def analysis(n_in: int = 30, n_out: int = 20):
+    """分析结果中的交易已按金额从大到小排列；两个方向的行等宽"""
+    incoming = [{'from_address': f'[Addr-{i + 100}]', 'token_symbol': 'USDT', 'readable_amount': 900.0 - i,
+                 'transaction_time': f'2024-01-01 00:{i:02d}:00'} for i in range(n_in)]
+    outgoing = [{'to_address': f'[Addr-{i + 200}]', 'token_symbol': 'USDT', 'readable_amount': 500.0 - i,
+                 'transaction_time': f'2024-01-02 00:{i:02d}:00'} for i in range(n_out)]
+    return {'target_address': '[Addr-1]', 'original_target_address': '0xabc', 'total_incoming': n_in + 5,
+            'total_outgoing': n_out, 'incoming_transactions': incoming, 'outgoing_transactions': outgoing}
+
+
+def rows(text: str, name: str):
+    lines = text.split('\n')
+    start = next(i for i, line in enumerate(lines) if line.startswith(f"{name} transactions"))
+    out = []
+    for line in lines[start + 1:]:
+        if ' transactions (' in line:
+            break
+        out.append(line)
+    return out
+
+
+def test_unlimited_writes_everything():
+    a = analysis()
+    text, tokens = render_analysis(a)
+    assert tokens == count_tokens(text)
+    assert len(rows(text, 'incoming')) == 30 and len(rows(text, 'outgoing')) == 20
+    assert 'incoming transactions (top 30 of 35 by amount;' in text
+    assert 'outgoing transactions (all 20;' in text
+    assert '0xabc' not in text  # 原始地址不写入
+    assert text.split('\n')[0].startswith('{"target_address":"[Addr-1]",')
+
+
+@pytest.mark.parametrize('budget', [150, 300, 500, 700])
+def test_budget_keeps_top_rows(budget):
+    a = analysis()
+    text, tokens = render_analysis(a, budget)
+    assert tokens == count_tokens(text) <= budget
+    incoming, outgoing = rows(text, 'incoming'), rows(text, 'outgoing')
+    assert 0 < len(incoming) < 30
+    # 保留的是金额最大的行（分析结果的前缀），裁掉的是小额一端
+    assert incoming == render_analysis(a)[0].split('\n')[2:2 + len(incoming)]
+    assert [float(r.split(',')[2]) for r in incoming] == [900.0 - i for i in range(len(incoming))]
+    assert [float(r.split(',')[2]) for r in outgoing] == [500.0 - i for i in range(len(outgoing))]
+    # 两个方向轮流加入
+    assert len(outgoing) == 20 or len(incoming) - len(outgoing) in (0, 1)
+    assert f'incoming transactions (top {len(incoming)} of 35 by amount;' in text
+    # 贪心：任一方向再多写一行就会超出预算
+    scalars, tables = text.split('\n')[0], prompt_renderer._table_lines(a)
+    totals = [35, 20]
+    for extra in ([1, 0], [0, 1]):
+        counts = [len(incoming) + extra[0], len(outgoing) + extra[1]]
+        if all(k <= len(t[3]) for k, t in zip(counts, tables)):
+            assert count_tokens(prompt_renderer._render(scalars, tables, counts, totals)) > budget
+
+
+def test_budget_grows_monotonically():
+    a = analysis()
+    kept = [len(rows(render_analysis(a, b)[0], 'incoming')) for b in (100, 200, 400, 800)]
+    assert kept == sorted(kept)
+    # 预算足够时与不限制时相同
+    assert render_analysis(a, 10 ** 6) == render_analysis(a)
+
+
+def test_budget_below_scalars():
+    text, tokens = render_analysis(analysis(), 5)
+    assert rows(text, 'incoming') == [] and rows(text, 'outgoing') == []
+    assert tokens == count_tokens(text)  # 标量部分总会写入
+
+
+def test_cells_with_commas_are_quoted():
+    a = analysis(1, 0)
+    a['incoming_transactions'][0]['token_symbol'] = 'A,B "x"'
+    text, _ = render_analysis(a)
+    assert rows(text, 'incoming') == ['[Addr-100],"A,B "x"",900.0,2024-01-01 00:00:00']
+
+
+def test_prompt_stats_histogram():
+    stats = PromptStats(edges=[100, 1000])
+    for tokens in (50, 100, 999, 5000):
+        stats.record(tokens)
+    report = stats.report()
+    assert report['histogram'] == {'< 100': 1, '100-1000': 2, '>= 1000': 1}
+    assert report['max'] == 5000 and report['tokens'] == 6149
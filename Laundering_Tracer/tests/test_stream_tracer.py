@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import pipeline_scheduler
+import stream_tracer
+from label_index import LabelIndex
+from pipeline_scheduler import CRAWL, CLASSIFY, EXPAND
+from stream_tracer import StreamTracer
+from task_store import DONE
+from visited_set import VisitedSet
+
+###
+# 流式追踪：用假的爬虫、流向分析和大模型跑完整条流水线，每个地址都经过 爬取 -> 分析 -> 判断 -> 下一跳，且能结束
+
+EVENT = 'case'
+HOPS = {'0xa': ['0xb', '0xc', '0xd'], '0xb': ['0xe', '0xc'], '0xc': ['0xf'], '0xd': ['0xg'], '0xe': ['0xh']}
+GATED = {'0xd'}   # 流向分析直接得出结果，不调用大模型
+IN_FLIGHT = 2
+
+
+class FakeLLM:
+    """submit 立即返回 Future，回复在另一个线程中稍后到达；记录同时在途的请求数"""
+
+    def __init__(self):
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, prompt, **kwargs):
+        future = Future()
+        with self._lock:
+            self.prompts.append(prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        def reply():
+            with self._lock:
+                self.in_flight -= 1
+            future.set_result('{"suspicion_level": "Low"}')
+        threading.Timer(0.01, reply).start()
+        return future
+
+
+@pytest.fixture
+def tracer(tmp_path, monkeypatch):
+    crawled = []
+    visited = VisitedSet(str(tmp_path / 'visited.sqlite'))
+    monkeypatch.setattr(pipeline_scheduler, 'get_visited_set', lambda: visited)
+    monkeypatch.setattr(pipeline_scheduler, 'load_sources_transfers', lambda event, depth, sources: sources)
+    monkeypatch.setattr(pipeline_scheduler, 'select_next_hops', lambda sources, label_index, **kwargs: pd.DataFrame(
+        [(s, c, 1.0) for s in sources for c in HOPS.get(s, [])], columns=['source', 'address', 'value_numeric']))
+    monkeypatch.setattr(pipeline_scheduler, 'compact_partition', lambda event, depth: None)
+    monkeypatch.setattr(pipeline_scheduler, 'save_classify_results', lambda results, depth: None)
+    monkeypatch.setattr(pipeline_scheduler, 'export_address_mapping', lambda event: None)
+    monkeypatch.setattr(pipeline_scheduler, 'build_label_index', lambda: LabelIndex.build({}))
+    monkeypatch.setattr(pipeline_scheduler, 'SRC_ADDR_PATH', str(tmp_path) + '/')
+    monkeypatch.setattr(stream_tracer, 'USE_CRAWLER_ENGINE', False)
+    monkeypatch.setattr(stream_tracer, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(stream_tracer, '_crawl_task', lambda event, depth, addr, chains: crawled.append(addr) or '1')
+    monkeypatch.setattr(stream_tracer, 'prepare_single_address', lambda args: (
+        (None, (args[0], False, 'No Suspicion', 'success'), None) if args[0] in GATED
+        else (f'prompt {args[0]}', None, None)))
+    monkeypatch.setattr(stream_tracer, 'record_llm_verdict', lambda addr, prompt, response: (True, 'low-ML'))
+
+    tracer = StreamTracer(EVENT, max_depth=2, crawl_workers=2, analyze_workers=2, llm_in_flight=IN_FLIGHT,
+                          db_path=str(tmp_path / 'tasks.sqlite'))
+    tracer.crawled = crawled
+    monkeypatch.setattr(tracer, '_prepare', lambda claimed: ({}, {}))
+    monkeypatch.setattr(tracer, 'seed', lambda: tracer.store.add(EVENT, 0, CRAWL, ['0xa']))
+    tracer.llm = FakeLLM()
+    yield tracer
+    if tracer.label_index is not None:
+        tracer.label_index.close()
+    tracer.store.close()
+    visited.close()
+
+
+def test_every_address_flows_through_all_stages(tracer):
+    tracer.seed()
+    runner = threading.Thread(target=tracer._loop, daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive(), '流水线没有结束'
+
+    expected = {0: ['0xa'], 1: ['0xb', '0xc', '0xd'], 2: ['0xe', '0xf', '0xg']}  # 0xc 只在第 1 层；第 3 层超过最大层数
+    for depth, addresses in expected.items():
+        for stage in (CRAWL, CLASSIFY, EXPAND):
+            assert sorted(a for a, _ in tracer.store.results(EVENT, depth, stage, DONE)) == addresses, (depth, stage)
+    assert tracer.store.addresses(EVENT, 3, CRAWL) == []
+    assert sorted(tracer.crawled) == sorted(sum(expected.values(), []))
+    assert sorted(tracer.llm.prompts) == [f'prompt {a}' for a in ['0xa', '0xb', '0xc', '0xe', '0xf', '0xg']]
+    assert 0 < tracer.llm.max_in_flight <= IN_FLIGHT
+    assert tracer.stats['llm'] == 6 and tracer.stats['failed'] == 0
+    # 每层收尾都已执行
+    assert all(tracer.store.hook_done(EVENT, depth, 'frontier') for depth in expected)
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import taint
+from label_index import LabelIndex, LABEL_EXCHANGE
+from taint import TaintEngine, select_tainted_hops, POISON, HAIRCUT, FIFO
+from tx_graph import TxGraph
+
+###
+# 污点传播（taint）与交易图（tx_graph）：玩具图上逐边的污点金额、poison 的增量松弛、
+# haircut / fifo 增量扫描与重新计算一致、k_hop / flows
+
+TOKEN = '0xdac17f958d2ee523a2206206994597c13d831ec7'
+
+# 源地址 s；x 是干净资金；a 在 t=0 时先转出了一笔（早于被污染，缺口按干净资金补足）
+#   e0: s -> a 100 @1    e1: x -> a 100 @2    e2: a -> b 50 @3
+#   e3: a -> c 100 @4    e4: b -> d 50 @5     e5: a -> e 20 @0
+TOY = [('s', 'a', 100, 1), ('x', 'a', 100, 2), ('a', 'b', 50, 3),
+       ('a', 'c', 100, 4), ('b', 'd', 50, 5), ('a', 'e', 20, 0)]
+
+EXPECTED = {
+    # 被污染之后的全部转出
+    POISON: [100, 0, 50, 100, 50, 0],
+    # a 的余额 200 中 100 为污点：转出按 1/2 比例带污点
+    HAIRCUT: [100, 0, 25, 50, 25, 0],
+    # a 先转出最早转入的 100（全部为污点），之后才是 x 的干净资金
+    FIFO: [100, 0, 50, 50, 50, 0],
+}
+
+
+def frame(edges, start: int = 0) -> pd.DataFrame:
+    """(发送方, 接收方, 金额, 时间) -> tx_store 格式的交易"""
+    return pd.DataFrame({
+        'hash': [f'h{start + i}' for i in range(len(edges))],
+        'address_from': [e[0] for e in edges], 'address_to': [e[1] for e in edges],
+        'contract_address': [e[4] if len(e) > 4 else TOKEN for e in edges],
+        'value': [str(e[2]) for e in edges], 'token_id': [''] * len(edges),
+        'amount_int': np.array([e[2] for e in edges], dtype=np.int64),
+        'amount_frac': np.zeros(len(edges), dtype=np.int64),
+        'timestamp': np.array([e[3] for e in edges], dtype=np.int64)})
+
+
+def graph(*batches) -> TxGraph:
+    g = TxGraph()
+    start = 0
+    for edges in batches:
+        g.add_transfers(frame(edges, start))
+        start += len(edges)
+    return g
+
+
+@pytest.mark.parametrize('model', [POISON, HAIRCUT, FIFO])
+def test_edge_taint(model):
+    engine = TaintEngine(graph(TOY), ['s'], model=model)
+    assert engine.edge_taint().tolist() == pytest.approx(EXPECTED[model])
+
+
+def test_scores_haircut():
+    engine = TaintEngine(graph(TOY), ['s'], model=HAIRCUT)
+    scores = engine.scores().set_index('address')
+    assert scores.loc['a', 'tainted'] == pytest.approx(100)
+    assert scores.loc['a', 'received'] == pytest.approx(200)
+    assert scores.loc[['a', 'b', 'c', 'd'], 'score'].tolist() == pytest.approx([0.5] * 4)
+    assert scores.loc['s', 'score'] == 1.0
+    assert 'e' not in scores.index and 'x' not in scores.index
+    assert scores.loc['b', 'first_tainted'] == 3
+
+
+def test_since_and_tokens():
+    # since 之前的边不参与传播；非白名单代币的边不带污点
+    edges = TOY + [('a', 'f', 30, 6, '0x00000000000000000000000000000000deadbeef')]
+    engine = TaintEngine(graph(edges), ['s'], model=POISON, since=2)
+    assert engine.edge_taint().tolist() == pytest.approx([0, 0, 0, 0, 0, 0, 0])
+    engine = TaintEngine(graph(edges), ['s'], model=POISON)
+    assert engine.edge_taint()[-1] == 0
+
+
+def test_poison_incremental():
+    # 第二批的 s -> c @2 让 c 提前被污染，c -> f @3 随之带污点（从已有结果继续松弛）
+    later = [('s', 'c', 10, 2), ('c', 'f', 30, 3), ('f', 'g', 5, 2)]
+    g = graph(TOY)
+    engine = TaintEngine(g, ['s'], model=POISON)
+    engine.edge_taint()
+    first_before = engine._first.copy()
+    g.add_transfers(frame(later, len(TOY)))
+    incremental = engine.edge_taint()
+
+    fresh = TaintEngine(graph(TOY, later), ['s'], model=POISON)
+    assert incremental.tolist() == fresh.edge_taint().tolist()
+    assert engine._first.tolist() == fresh._first.tolist()
+    assert incremental[len(TOY):].tolist() == [10, 30, 0]  # f 在 t=3 才被污染，f -> g @2 不带污点
+    c = g.ids(['c'])[0]
+    assert first_before[c] == 4 and engine._first[c] == 2
+
+
+def _random_batches(rng, n_batches: int = 6):
+    batches = [[(f'n{rng.integers(40)}', f'n{rng.integers(40)}', int(rng.integers(1, 100)),
+                 int(rng.integers(0, 1000))) for _ in range(400)]]
+    for _ in range(n_batches):
+        lo = int(rng.integers(0, 900))
+        batches.append([(f'n{rng.integers(60)}', f'n{rng.integers(60)}', int(rng.integers(1, 100)),
+                         int(rng.integers(lo, 1000))) for _ in range(80)])
+    return batches
+
+
+@pytest.mark.parametrize('model', [POISON, HAIRCUT, FIFO])
+@pytest.mark.parametrize('checkpoint', [10, 100000])
+def test_incremental_matches_fresh(monkeypatch, model, checkpoint):
+    """追加若干批边后，增量结果（poison 松弛、haircut / fifo 从快照继续扫描）与整体重新计算一致"""
+    monkeypatch.setattr(taint, 'SWEEP_CHECKPOINT_EDGES', checkpoint)
+    batches = _random_batches(np.random.default_rng(checkpoint))
+    seeds = ['n0', 'n1']
+    g = TxGraph()
+    engine = TaintEngine(g, seeds, model=model)
+    start = 0
+    for i, edges in enumerate(batches):
+        g.add_transfers(frame(edges, start))
+        start += len(edges)
+        fresh = TaintEngine(graph(*batches[:i + 1]), seeds, model=model)
+        assert engine.edge_taint() == pytest.approx(fresh.edge_taint(), abs=1e-9)
+
+
+def test_outflows_and_selected_hops():
+    engine = TaintEngine(graph(TOY), ['s'], model=HAIRCUT)
+    flows = engine.outflows(['a']).sort_values('address').reset_index(drop=True)
+    assert flows['address'].tolist() == ['b', 'c']  # a -> e 不带污点
+    assert flows['tainted'].tolist() == pytest.approx([25, 50])
+
+    labeled, empty = LabelIndex.build({LABEL_EXCHANGE: ['c']}), LabelIndex.build({})
+    try:
+        hops = select_tainted_hops(engine, ['a'], labeled, min_amount=10, max_addresses=2)
+        assert hops['address'].tolist() == ['b']  # c 带标签
+        assert hops['value_numeric'].tolist() == pytest.approx([25])
+        hops = select_tainted_hops(engine, ['a'], empty, min_amount=30)
+        assert hops['address'].tolist() == ['c']
+        hops = select_tainted_hops(engine, ['a'], empty, min_amount=10, max_addresses=1)
+        assert hops['address'].tolist() == ['c']
+    finally:
+        labeled.close()
+        empty.close()
+
+
+def test_k_hop():
+    g = graph(TOY)
+    names = lambda ids: sorted(g.names(ids))
+    nodes, edges = g.k_hop(['s'], 1)
+    assert names(nodes) == ['a', 's'] and edges.tolist() == [0]
+    nodes, edges = g.k_hop(['s'], 2, direction='out')
+    assert names(nodes) == ['a', 'b', 'c', 'e', 's'] and sorted(edges.tolist()) == [0, 2, 3, 5]
+    nodes, edges = g.k_hop(['a'], 1, direction='in')
+    assert names(nodes) == ['a', 's', 'x'] and sorted(edges.tolist()) == [0, 1]
+    nodes, edges = g.k_hop(['missing'], 3)
+    assert len(nodes) == 0 and len(edges) == 0
+
+
+def test_flows():
+    g = graph(TOY + [('a', 'b', 7, 8)])
+    flows = g.flows().set_index(['source', 'address'])
+    assert flows.loc[('a', 'b'), 'amount'] == 57 and flows.loc[('a', 'b'), 'count'] == 2
+    assert len(flows) == 6
+    weights = np.arange(g.num_edges, dtype=np.float64)
+    flows = g.flows(np.array([2, 6]), weights=weights)
+    assert flows[['source', 'address']].values.tolist() == [['a', 'b']]
+    assert flows['amount'].tolist() == [8.0] and flows['count'].tolist() == [2]
+    assert len(g.flows(np.zeros(0, dtype=np.int64))) == 0
+
+
+def test_duplicate_transfers_ignored():
+    g = graph(TOY)
+    assert g.add_transfers(frame(TOY)) == 0  # 同一笔转账在发送方、接收方的记录中各出现一次
+    assert g.num_edges == len(TOY)
@@ -0,0 +1,217 @@
+import pandas as pd
+import pytest
+
+import pipeline_scheduler
+import visited_set
+from label_index import LabelIndex
+from pipeline_scheduler import PipelineScheduler, CRAWL, CLASSIFY, EXPAND
+from task_store import TaskStore, PENDING, RUNNING, DONE, FAILED
+from visited_set import VisitedSet
+
+###
+# 任务状态库（task_store）与调度器的任务 DAG：取任务的顺序、失败重试、放回、断点续跑、
+# advance 的幂等与原子性（出错回滚、不留下未结束的写事务）、crawl -> classify -> expand -> 下一层 crawl
+
+EVENT = 'case'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(str(tmp_path / 'tasks.sqlite'), max_attempts=2)
+    yield store
+    store.close()
+
+
+def status(store, depth, stage, addr):
+    return {a: s for a, s in store._conn.execute(
+        'SELECT address, status FROM tasks WHERE event=? AND depth=? AND stage=?', (EVENT, depth, stage))}.get(addr)
+
+
+def test_add_is_idempotent(store):
+    assert store.add(EVENT, 0, CRAWL, ['0xA', '0xb']) == 2
+    assert store.add(EVENT, 0, CRAWL, ['0xa', '0xc']) == 1
+    assert store.addresses(EVENT, 0, CRAWL) == ['0xa', '0xb', '0xc']
+
+
+def test_claim_order(store):
+    store.add(EVENT, 1, CRAWL, ['0xd1'])
+    store.add(EVENT, 0, CRAWL, ['0xa', '0xb', '0xc'], priorities={'0xb': 5.0, '0xc': 9.0})
+    # 浅层优先、同层按入队顺序
+    assert store.claim(EVENT, CRAWL, 2) == [(0, '0xa'), (0, '0xb')]
+    assert status(store, 0, CRAWL, '0xa') == RUNNING
+    assert store.claim(EVENT, CRAWL, 5) == [(0, '0xc'), (1, '0xd1')]
+    assert store.claim(EVENT, CRAWL, 5) == []
+    assert store.claim(EVENT, CRAWL, 0) == []
+
+
+def test_claim_by_priority(store):
+    store.add(EVENT, 0, CRAWL, ['0xa', '0xb', '0xc'], priorities={'0xb': 5.0, '0xc': 9.0})
+    store.add(EVENT, 1, CRAWL, ['0xd1'], priorities={'0xd1': 7.0})
+    assert store.claim(EVENT, CRAWL, 3, by_priority=True) == [(0, '0xc'), (1, '0xd1'), (0, '0xb')]
+
+
+def test_fail_retries_then_fails(store):
+    store.add(EVENT, 0, CRAWL, ['0xa'])
+    store.claim(EVENT, CRAWL, 1)
+    assert store.fail(EVENT, 0, CRAWL, '0xa', 'timeout') == PENDING
+    assert store.claim(EVENT, CRAWL, 1) == [(0, '0xa')]
+    assert store.fail(EVENT, 0, CRAWL, '0xa', 'timeout') == FAILED
+    assert store.claim(EVENT, CRAWL, 1) == []
+    assert store.attempts(EVENT, CRAWL) == 2
+    assert store.results(EVENT, 0, CRAWL, FAILED) == [('0xa', 'timeout')]
+
+
+def test_release_does_not_count_attempt(store):
+    store.add(EVENT, 0, CLASSIFY, ['0xa'])
+    store.claim(EVENT, CLASSIFY, 1)
+    store.release(EVENT, 0, CLASSIFY, '0xa')
+    assert status(store, 0, CLASSIFY, '0xa') == PENDING
+    assert store.attempts(EVENT, CLASSIFY) == 0
+
+
+def test_reset_running_resumes(store):
+    store.add(EVENT, 0, CRAWL, ['0xa', '0xb'])
+    store.claim(EVENT, CRAWL, 2)
+    store.complete(EVENT, 0, CRAWL, '0xb', '3')
+    assert store.reset_running(EVENT) == 1  # 中断时仍在执行的任务
+    assert store.claim(EVENT, CRAWL, 5) == [(0, '0xa')]
+    assert store.result(EVENT, 0, CRAWL, '0xb') == '3'
+
+
+def test_advance_same_address(store):
+    store.add(EVENT, 0, CRAWL, ['0xa'], priorities={'0xa': 4.0})
+    store.claim(EVENT, CRAWL, 1)
+    assert store.advance(EVENT, 0, CRAWL, '0xA', '10', CLASSIFY, start=True)
+    assert status(store, 0, CLASSIFY, '0xa') == RUNNING
+    # 重复完成不改变结果、不重复入队
+    assert not store.advance(EVENT, 0, CRAWL, '0xa', '99', CLASSIFY)
+    assert store.result(EVENT, 0, CRAWL, '0xa') == '10'
+    assert store.attempts(EVENT, CLASSIFY) == 1
+    # 下一阶段继承优先级
+    assert store._conn.execute('SELECT priority FROM tasks WHERE stage=?', (CLASSIFY,)).fetchone()[0] == 4.0
+
+
+def test_advance_next_hops(store):
+    store.set_chains(EVENT, {'0xa': ['eth', 'bsc']})
+    store.add(EVENT, 0, EXPAND, ['0xa'])
+    store.claim(EVENT, EXPAND, 1)
+    assert store.advance(EVENT, 0, EXPAND, '0xa', '2', CRAWL, next_depth=1, next_addresses=['0xB', '0xc'],
+                         priorities={'0xb': 3.0})
+    assert status(store, 0, EXPAND, '0xa') == DONE
+    assert store.addresses(EVENT, 1, CRAWL) == ['0xb', '0xc']
+    assert store.claim(EVENT, CRAWL, 2, by_priority=True) == [(1, '0xb'), (1, '0xc')]
+    assert store.chains(EVENT, '0xb') == ['bsc', 'eth'] and store.chains(EVENT, '0xc') == ['bsc', 'eth']
+
+
+def test_advance_rolls_back(store):
+    store.add(EVENT, 0, EXPAND, ['0xa'])
+    store.claim(EVENT, EXPAND, 1)
+    with pytest.raises(Exception):
+        # 下一跳写入失败：展开的完成一并回滚
+        store.advance(EVENT, 0, EXPAND, '0xa', '1', CRAWL, next_depth=1, next_addresses=['0xb'],
+                      priorities={'0xb': object()})
+    assert not store._conn.in_transaction
+    assert status(store, 0, EXPAND, '0xa') == RUNNING
+    assert store.addresses(EVENT, 1, CRAWL) == []
+    assert store.advance(EVENT, 0, EXPAND, '0xa', '1', CRAWL, next_depth=1, next_addresses=['0xb'])
+
+
+def test_claim_rolls_back(store, monkeypatch):
+    store.add(EVENT, 0, CRAWL, ['0xa'])
+    monkeypatch.setattr('time.time', lambda: object())  # 写入 updated 时出错
+    with pytest.raises(Exception):
+        store.claim(EVENT, CRAWL, 1)
+    monkeypatch.undo()
+    assert not store._conn.in_transaction
+    assert status(store, 0, CRAWL, '0xa') == PENDING
+    other = TaskStore(store.db_path)
+    try:
+        assert other.add(EVENT, 0, CRAWL, ['0xz']) == 1  # 其他连接可以写入
+    finally:
+        other.close()
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    """调度器：任务库、已访问集合在临时目录，下一跳由 HOPS 给出"""
+    visited = VisitedSet(str(tmp_path / 'visited.sqlite'))
+    monkeypatch.setattr(visited_set, 'get_visited_set', lambda: visited)
+    monkeypatch.setattr(pipeline_scheduler, 'get_visited_set', lambda: visited)
+    monkeypatch.setattr(pipeline_scheduler, 'load_sources_transfers', lambda event, depth, sources: sources)
+    monkeypatch.setattr(pipeline_scheduler, 'select_next_hops', lambda sources, label_index, **kwargs: pd.DataFrame(
+        [(s, c, v) for s in sources for c, v in HOPS.get(s, [])], columns=['source', 'address', 'value_numeric']))
+    scheduler = PipelineScheduler(EVENT, max_depth=2, db_path=str(tmp_path / 'tasks.sqlite'))
+    scheduler.label_index = LabelIndex.build({})
+    yield scheduler
+    scheduler.label_index.close()
+    scheduler.store.close()
+    visited.close()
+
+
+HOPS = {'0xa': [('0xb', 50.0), ('0xc', 20.0)], '0xb': [('0xc', 5.0), ('0xd', 9.0)], '0xd': [('0xe', 1.0)]}
+
+
+def _classify(scheduler, depth, addr):
+    scheduler.store.claim(EVENT, CLASSIFY, 10)
+    scheduler._classified(depth, addr, (addr, False, 'No Suspicion', 'success'))
+
+
+def test_dag_transitions(scheduler):
+    store = scheduler.store
+    store.add(EVENT, 0, CRAWL, ['0xa'])
+    assert store.claim(EVENT, CRAWL, 10) == [(0, '0xa')]
+    store.advance(EVENT, 0, CRAWL, '0xa', '12', CLASSIFY)
+    assert store.claim(EVENT, EXPAND, 10) == []
+    _classify(scheduler, 0, '0xa')
+    assert scheduler._run_expand() == 1
+    assert status(store, 0, EXPAND, '0xa') == DONE
+    assert store.result(EVENT, 0, EXPAND, '0xa') == '2'
+    assert store.addresses(EVENT, 1, CRAWL) == ['0xb', '0xc']
+
+    for addr in ('0xb', '0xc'):
+        store.claim(EVENT, CRAWL, 10)
+        store.advance(EVENT, 1, CRAWL, addr, '1', CLASSIFY)
+        _classify(scheduler, 1, addr)
+    assert scheduler._run_expand() == 2
+    # 0xc 已在第 1 层出现过，不再入队第 2 层
+    assert store.addresses(EVENT, 2, CRAWL) == ['0xd']
+    assert store.result(EVENT, 1, EXPAND, '0xb') == '2'
+
+    store.claim(EVENT, CRAWL, 10)
+    store.advance(EVENT, 2, CRAWL, '0xd', '1', CLASSIFY)
+    _classify(scheduler, 2, '0xd')
+    assert scheduler._run_expand() == 1
+    assert store.addresses(EVENT, 3, CRAWL) == []  # 超过最大层数
+    assert not scheduler._has_pending()
+
+
+def test_expand_resumes_after_crash(scheduler, monkeypatch):
+    store = scheduler.store
+    store.add(EVENT, 0, EXPAND, ['0xa'])
+    original = store.advance
+
+    def crash(*args, **kwargs):
+        raise RuntimeError('crash')
+    monkeypatch.setattr(store, 'advance', crash)
+    with pytest.raises(RuntimeError):
+        scheduler._run_expand()
+    # 崩溃前已领取了已访问集合中的下一跳，但展开与入队都没有提交
+    assert status(store, 0, EXPAND, '0xa') == RUNNING
+    assert store.addresses(EVENT, 1, CRAWL) == []
+
+    monkeypatch.setattr(store, 'advance', original)
+    assert store.reset_running(EVENT) == 1
+    assert scheduler._run_expand() == 1
+    assert store.addresses(EVENT, 1, CRAWL) == ['0xb', '0xc']
+
+
+@pytest.mark.parametrize('best_first, first', [(False, '0xa'), (True, '0xb')])
+def test_expand_claim_order(scheduler, best_first, first):
+    scheduler.best_first = best_first
+    scheduler.expand_batch = 1
+    store = scheduler.store
+    store.add(EVENT, 0, EXPAND, ['0xa'], priorities={'0xa': 1.0})
+    store.add(EVENT, 1, EXPAND, ['0xb'], priorities={'0xb': 5.0})
+    # best-first 按优先级展开，逐层模式按层
+    assert scheduler._run_expand() == 1
+    assert [a for a in ('0xa', '0xb') if status(store, 0 if a == '0xa' else 1, EXPAND, a) == DONE] == [first]
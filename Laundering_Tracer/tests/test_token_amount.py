@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from token_amount import (split_amount, split_exact, to_limbs, exact_limbs, resolve_overflow, group_sum, sum_limbs,
+                          topk, ge, format_amount, FRAC_SCALE, AMOUNT_INT_MAX)
+
+###
+# 精确金额（token_amount）：溢出截断与按原始金额恢复、超过 18 位小数、分组求和进位、前 k 大的相等顺序、格式化截断
+
+UINT256_MAX = 2 ** 256 - 1
+HALF = FRAC_SCALE // 2
+
+
+@pytest.mark.parametrize('value, decimals, expected', [
+    (10 ** 18, 18, (1, 0, False)),
+    (1, 18, (0, 1, False)),
+    (123456789, 6, (123, 456789 * 10 ** 12, False)),
+    (5, 0, (5, 0, False)),
+    (5, -2, (500, 0, False)),
+    (0, 18, (0, 0, False)),
+    # 超过 18 位小数：多出的位截断（不四舍五入）
+    (10 ** 19 + 9, 19, (1, 0, False)),
+    (1234567890123456789012345, 24, (1, 234567890123456789, False)),
+    (999999999999999999999, 21, (0, 999999999999999999, False)),
+    # 整数部分上限：等于上限不截断，超过上限饱和为 (AMOUNT_INT_MAX, 0)
+    (AMOUNT_INT_MAX * 10 ** 18 + 5, 18, (AMOUNT_INT_MAX, 5, False)),
+    ((AMOUNT_INT_MAX + 1) * 10 ** 18, 18, (AMOUNT_INT_MAX, 0, True)),
+    (AMOUNT_INT_MAX + 1, 0, (AMOUNT_INT_MAX, 0, True)),
+    (UINT256_MAX, 18, (AMOUNT_INT_MAX, 0, True)),
+    (UINT256_MAX, 30, (AMOUNT_INT_MAX, 0, True)),
+    (str(UINT256_MAX), '6', (AMOUNT_INT_MAX, 0, True)),
+])
+def test_split_amount(value, decimals, expected):
+    assert split_amount(value, decimals) == expected
+
+
+def test_split_exact_does_not_saturate():
+    assert split_exact(UINT256_MAX, 18) == divmod(UINT256_MAX, FRAC_SCALE)
+    assert split_exact((AMOUNT_INT_MAX + 1) * 10 ** 18 + 7, 18) == (AMOUNT_INT_MAX + 1, 7)
+    assert split_exact(5, -2) == (500, 0)
+
+
+def _overflow_frame():
+    values = [3 * 10 ** 40, 10 ** 19, 2 * 10 ** 40 + 5 * 10 ** 17, 7]
+    decimals = [18, 18, 18, 0]
+    whole, frac, overflow = to_limbs(values, decimals)
+    return pd.DataFrame({'key': ['a', 'b', 'a', 'b'], 'value': values, 'decimals': decimals,
+                         'amount_int': whole, 'amount_frac': frac, 'value_overflow': overflow})
+
+
+def test_exact_limbs_from_value():
+    df = _overflow_frame()
+    assert df['amount_int'].tolist() == [AMOUNT_INT_MAX, 10, AMOUNT_INT_MAX, 7]
+    whole, frac = exact_limbs(df['amount_int'], df['amount_frac'], df['value_overflow'], df['value'], df['decimals'])
+    assert whole.tolist() == [3 * 10 ** 22, 10, 2 * 10 ** 22, 7]
+    assert frac.tolist() == [0, 0, 5 * 10 ** 17, 0]
+    # 没有溢出时原样返回
+    whole, _ = exact_limbs(df['amount_int'][1:2], df['amount_frac'][1:2], [False], [10 ** 19], [18])
+    assert whole.dtype == np.int64
+
+
+def test_resolve_overflow_sums_and_ranks():
+    df = resolve_overflow(_overflow_frame())
+    sums = group_sum(df, ['key'])
+    assert [(int(w), int(f)) for w, f in zip(sums['amount_int'], sums['amount_frac'])] == [
+        (5 * 10 ** 22, 5 * 10 ** 17), (17, 0)]
+    assert sum_limbs(df['amount_int'].to_numpy(), df['amount_frac'].to_numpy()) == (5 * 10 ** 22 + 17, 5 * 10 ** 17)
+    assert topk(df['amount_int'].to_numpy(), df['amount_frac'].to_numpy(), 2).tolist() == [0, 2]
+    assert ge(df['amount_int'], df['amount_frac'], 3 * 10 ** 22).tolist() == [True, False, False, False]
+    plain = _overflow_frame().drop(columns='value_overflow')
+    assert resolve_overflow(plain) is plain
+
+
+def test_to_limbs_matches_split_amount():
+    values = [10 ** 18, UINT256_MAX, 1, 1234567890123456789012345]
+    decimals = [18, 18, 0, 24]
+    whole, frac, overflow = to_limbs(values, decimals)
+    assert list(zip(whole.tolist(), frac.tolist(), overflow.tolist())) == [
+        split_amount(v, d) for v, d in zip(values, decimals)]
+    assert whole.dtype == np.int64 and frac.dtype == np.int64
+    empty = to_limbs([], [])
+    assert all(len(a) == 0 for a in empty)
+
+
+# (行 [(分组键, 整数部分, 小数部分)], 期望 {分组键: (整数部分, 小数部分)})
+GROUP_SUM_CASES = [
+    ([('a', 1, 6 * 10 ** 17), ('a', 2, 7 * 10 ** 17)], {'a': (4, 3 * 10 ** 17)}),
+    ([('a', 0, HALF), ('a', 0, HALF), ('b', 3, 1)], {'a': (1, 0), 'b': (3, 1)}),
+    # 1000 笔接近 1 的小数：直接相加会超出 int64，分高低两段求和后进位
+    ([('a', 0, FRAC_SCALE - 1)] * 1000, {'a': (999, FRAC_SCALE - 1000)}),
+    ([('a', AMOUNT_INT_MAX, FRAC_SCALE - 1)] * 1000, {'a': (1000 * AMOUNT_INT_MAX + 999, FRAC_SCALE - 1000)}),
+    ([('a', 5, 0), ('b', 0, 10 ** 9 - 1), ('b', 0, 1)], {'a': (5, 0), 'b': (0, 10 ** 9)}),
+]
+
+
+@pytest.mark.parametrize('rows, expected', GROUP_SUM_CASES)
+def test_group_sum(rows, expected):
+    df = pd.DataFrame(rows, columns=['key', 'amount_int', 'amount_frac'])
+    sums = group_sum(df, ['key'])
+    assert list(sums['key']) == sorted(expected)
+    assert {k: (int(w), int(f)) for k, w, f in sums[['key', 'amount_int', 'amount_frac']].itertuples(index=False)} \
+        == expected
+    assert (sums['amount_frac'] < FRAC_SCALE).all()
+
+
+@pytest.mark.parametrize('rows, expected', GROUP_SUM_CASES)
+def test_sum_limbs(rows, expected):
+    whole = np.array([w for _, w, _ in rows], dtype=np.int64)
+    frac = np.array([f for _, _, f in rows], dtype=np.int64)
+    total = (sum(w for w, _ in expected.values()), sum(f for _, f in expected.values()))
+    total = (total[0] + total[1] // FRAC_SCALE, total[1] % FRAC_SCALE)
+    assert sum_limbs(whole, frac) == total
+
+
+@pytest.mark.parametrize('whole, frac, k, expected', [
+    ([5, 7, 7, 7, 3], [0, 0, 0, 0, 0], 2, [1, 2]),            # 相等时保持原顺序
+    ([5, 5, 5], [1, 3, 3], 2, [1, 2]),                          # 整数部分相同，按小数部分
+    ([7, 7, 7, 1], [1, 3, 2, 0], 1, [1]),                       # 候选集合中有整数部分相同但更小的
+    ([1, 2, 3], [0, 0, 0], 5, [2, 1, 0]),                       # k 超过长度
+    ([4, 4, 4, 4], [0, 0, 0, 0], 3, [0, 1, 2]),
+    ([AMOUNT_INT_MAX, AMOUNT_INT_MAX, 0], [0, 1, FRAC_SCALE - 1], 2, [1, 0]),
+    ([2, 9, 2, 9, 2], [5, 0, 5, 0, 6], 4, [1, 3, 4, 0]),
+])
+def test_topk(whole, frac, k, expected):
+    assert topk(np.array(whole, dtype=np.int64), np.array(frac, dtype=np.int64), k).tolist() == expected
+
+
+@pytest.mark.parametrize('whole, frac, threshold, expected', [
+    (10, 0, 10, True),
+    (9, FRAC_SCALE - 1, 10, False),
+    (0, HALF, '0.5', True),
+    (0, HALF - 1, '0.5', False),
+    (AMOUNT_INT_MAX, 0, 10 ** 15, True),
+])
+def test_ge(whole, frac, threshold, expected):
+    assert ge(np.array([whole]), np.array([frac]), threshold).tolist() == [expected]
+
+
+@pytest.mark.parametrize('whole, frac, kwargs, expected', [
+    (1, FRAC_SCALE - 1, {}, '1.999999'),                        # 截断，不进位
+    (0, 1, {'places': 18}, '0.000000000000000001'),
+    (0, 1, {'places': 17}, '0.00000000000000000'),
+    (1234567, HALF, {'places': 2, 'thousands': True}, '1,234,567.50'),
+    (10, HALF, {'strip': True}, '10.5'),
+    (10, 0, {'strip': True}, '10'),
+    (10, HALF, {'places': 0}, '10'),
+    (AMOUNT_INT_MAX, 0, {'thousands': True}, '1,000,000,000,000,000.000000'),
+    (AMOUNT_INT_MAX, FRAC_SCALE - 1, {'places': 18}, '1000000000000000.999999999999999999'),
+])
+def test_format_amount(whole, frac, kwargs, expected):
+    assert format_amount(whole, frac, **kwargs) == expected
@@ -0,0 +1,95 @@
+import os
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+import tx_store
+from token_amount import AMOUNT_INT_MAX, FRAC_SCALE
+from tx_store import (import_csv_tree, merge_address, compact_partition, load_address_table, load_address_transfers,
+                      load_depth_transfers, has_address, partition_depths)
+
+###
+# 列式交易存储（tx_store）：CSV 导入与读取往返、判重追加、分区合并、未指定层时在冷进程中查找磁盘分区
+
+EVENT = 'case'
+USDT = '0xdAC17F958D2ee523a2206206994597C13D831ec7'
+A = '0x00000000000000000000000000000000000000Aa'
+B = '0x00000000000000000000000000000000000000bb'
+HUGE = '9' * 80  # 超过 decimal256 的 76 位精度
+
+ROWS = [
+    # hash, from, to, value, timestamp, block, contract, symbol, decimals
+    ('0x01', A, B, str(1234567 * 10 ** 12), '100', '10', USDT, 'USDT', '18'),
+    ('0x02', B, A, '2500000', '200', '20', USDT, 'USDT', '6'),
+    ('0x03', A, B, '0', '300', '30', USDT, 'USDT', '6'),
+    ('0x04', A, B, HUGE, '400', '40', USDT, 'SPAM', '18'),
+    ('0x04', A, A, '5', '400', '40', USDT, 'USDT', '0'),  # 同一哈希下的另一笔转账
+]
+
+
+def write_csv(addr: str, rows):
+    path = os.path.join(tx_store.BLOCKSCAN_PATH, addr.lower(), 'AccountTransferItem.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = pd.DataFrame(rows, columns=['hash', 'address_from', 'address_to', 'value', 'timestamp', 'block_number',
+                                     'contract_address', 'symbol', 'decimals'])
+    df['token_id'] = ''
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(tx_store, 'BLOCKSCAN_PATH', str(tmp_path / 'blockscan') + '/')
+    monkeypatch.setattr(tx_store, 'TX_STORE_PATH', str(tmp_path / 'tx_store') + '/')
+    monkeypatch.setattr(tx_store, '_PARTITION_CACHE', {})
+
+
+def test_import_round_trip():
+    write_csv(A, ROWS)
+    assert import_csv_tree(EVENT, 0, addresses=[A.lower(), A.lower()]) == len(ROWS)
+    df = load_address_transfers(A, EVENT, 0, nonzero=False)
+    assert df['hash'].tolist() == [r[0] for r in ROWS]
+    # 地址统一小写，源地址列为被爬取的地址
+    assert set(df['source']) == {A.lower()}
+    assert df['address_from'].tolist() == [r[1].lower() for r in ROWS]
+    assert set(df['contract_address']) == {USDT.lower()}
+    assert df['value'].tolist()[:3] == [Decimal(r[3]) for r in ROWS[:3]]
+    assert df['timestamp'].tolist() == [100, 200, 300, 400, 400]
+    assert df['decimals'].tolist() == [18, 6, 6, 18, 0]
+    # 缩放后的精确金额；超出精度的金额截断并标记
+    assert list(zip(df['amount_int'], df['amount_frac'])) == [
+        (1, 234567 * 10 ** 12), (2, FRAC_SCALE // 2), (0, 0), (AMOUNT_INT_MAX, 0), (5, 0)]
+    assert df['value_overflow'].tolist() == [False, False, False, True, False]
+    assert df['value'][3] == tx_store.VALUE_MAX
+    # 默认过滤零值交易
+    assert len(load_address_transfers(A, EVENT, 0)) == len(ROWS) - 1
+
+
+def test_merge_dedup():
+    write_csv(A, ROWS)
+    import_csv_tree(EVENT, 0, addresses=[A.lower()])
+    assert merge_address(EVENT, 0, A) == 0  # 重复导入不追加
+    extra = ('0x05', A, B, '7', '500', '50', USDT, 'USDT', '0')
+    write_csv(A, ROWS + [extra, extra])  # 新记录在同一批中重复两次
+    assert merge_address(EVENT, 0, A) == 1
+    assert merge_address(EVENT, 0, A) == 0
+    assert len(load_address_transfers(A, EVENT, 0, nonzero=False)) == len(ROWS) + 1
+    write_csv(B, [ROWS[1]])
+    assert merge_address(EVENT, 0, B) == 1  # 同一笔转账出现在另一个源地址下，各自保留
+    assert compact_partition(EVENT, 0) == len(ROWS) + 2
+    depth = load_depth_transfers(EVENT, 0, nonzero=False)
+    assert depth.groupby('source').size().to_dict() == {A.lower(): len(ROWS) + 1, B.lower(): 1}
+
+
+def test_lookup_without_depth_in_cold_process():
+    write_csv(A, ROWS)
+    import_csv_tree(EVENT, 3, addresses=[A.lower()])
+    os.remove(write_csv(A, []))
+    tx_store._PARTITION_CACHE.clear()  # 新进程：还没有加载任何分区
+    assert partition_depths(EVENT) == [3]
+    table = load_address_table(A, EVENT)
+    assert table.num_rows == len(ROWS) - 1
+    assert load_address_table(B, EVENT).num_rows == 0
+    assert load_address_table(A, 'other').num_rows == 0
+    assert has_address(A, EVENT, 3) and not has_address(A, EVENT)
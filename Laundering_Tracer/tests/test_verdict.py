@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+from verdict import (Verdict, parse_verdict, normalize_level, _scan_level, DIMENSIONS, LEVELS,
+                     LEVEL_HIGH, LEVEL_MEDIUM, LEVEL_LOW, LEVEL_NONE, LEVEL_UNKNOWN, LEVEL_MISSING)
+
+###
+# 大模型回复的解析（verdict）：JSON / 代码块 / 非 JSON 回退、等级归一化、旧 txt 结果的扫描、二进制序列化往返
+
+FULL = {
+    'suspicion_level': 'High',
+    'a_transaction_patterns': {'result': 'Yes', 'evidence': '12 transfers of 9,999 USDT within 3 minutes'},
+    'b_fund_flows': {'result': 'Yes', 'evidence': 'pooled from addr_3, addr_4 then dispersed'},
+    'c_associated_addresses': {'result': 'No', 'evidence': ''},
+    'd_temporal_behavioral_signs': {'result': 'Unclear', 'evidence': '凌晨集中转出'},
+}
+
+
+def _check_full(verdict: Verdict):
+    assert verdict.suspicion_level == LEVEL_HIGH
+    assert verdict.structured
+    assert verdict.results == {dim: FULL[dim]['result'] for dim in DIMENSIONS}
+    assert verdict.evidence == {dim: FULL[dim]['evidence'] for dim in DIMENSIONS}
+
+
+@pytest.mark.parametrize('text', [
+    json.dumps(FULL),
+    json.dumps(FULL, indent=2, ensure_ascii=False),
+    '```json\n' + json.dumps(FULL, ensure_ascii=False) + '\n```',
+    '```\n' + json.dumps(FULL, indent=2) + '\n```\n',
+    'Here is my assessment:\n' + json.dumps(FULL) + '\nLet me know if you need more.',
+])
+def test_parse_json(text):
+    _check_full(parse_verdict(text))
+
+
+def test_parse_key_variants():
+    data = {'Suspicion Level': ' medium ', 'B Fund Flows': 'pass-through within one block'}
+    verdict = parse_verdict(json.dumps(data))
+    assert verdict.suspicion_level == LEVEL_MEDIUM and verdict.structured
+    # 维度给出字符串而不是 {result, evidence}；缺失的维度为空
+    assert verdict.results['b_fund_flows'] == 'pass-through within one block'
+    assert verdict.evidence['b_fund_flows'] == ''
+    assert verdict.results['a_transaction_patterns'] == '' and verdict.evidence['a_transaction_patterns'] == ''
+
+
+@pytest.mark.parametrize('data, level', [
+    ({k: v for k, v in FULL.items() if k != 'suspicion_level'}, LEVEL_MISSING),
+    ({}, LEVEL_MISSING),
+    ({'suspicion_level': None}, LEVEL_UNKNOWN),
+    ({'suspicion_level': 'unsure'}, LEVEL_UNKNOWN),
+])
+def test_parse_missing_level(data, level):
+    verdict = parse_verdict(json.dumps(data))
+    assert verdict.suspicion_level == level
+    assert verdict.structured and not verdict.parsed
+
+
+@pytest.mark.parametrize('text', [
+    '### Conclusion\nThe address shows a high risk of laundering.',
+    json.dumps({k: v for k, v in FULL.items() if k != 'suspicion_level'}),
+])
+def test_legacy_missing_level(text):
+    # 与原有口径一致：结果文件中没有 suspicion_level 字段时标签为 -1_unknown，计为洗钱
+    verdict = parse_verdict(text)
+    assert verdict.label == '-1_unknown' and verdict.is_ml
+    # 有字段但识别不出等级：unknown，不计为洗钱
+    verdict = parse_verdict('suspicion_level: unclear')
+    assert verdict.label == 'unknown' and not verdict.is_ml
+
+
+@pytest.mark.parametrize('text, level', [
+    ('suspicion_level: High\nThe address pools funds ...', LEVEL_HIGH),
+    ('**suspicion_level**: Low', LEVEL_LOW),
+    ('"suspicion_level": "No Suspicion", "a_transaction_patterns": {', LEVEL_NONE),  # 截断的 JSON
+    ('The account looks normal.', LEVEL_MISSING),
+    ('', LEVEL_MISSING),
+])
+def test_parse_fallback(text, level):
+    verdict = parse_verdict(text)
+    assert verdict.suspicion_level == level
+    assert not verdict.structured
+    assert verdict.results == {} and verdict.evidence == {}
+
+
+@pytest.mark.parametrize('text, level', [
+    ('High', LEVEL_HIGH),
+    (' HIGH risk ', LEVEL_HIGH),
+    ('Medium', LEVEL_MEDIUM),
+    ('mid', LEVEL_MEDIUM),
+    ('Low-Medium', LEVEL_MEDIUM),
+    ('low', LEVEL_LOW),
+    ('No Suspicion', LEVEL_NONE),
+    ('No suspicion (low)', LEVEL_NONE),
+    ('none', LEVEL_NONE),
+    ('No', LEVEL_NONE),
+    ('', LEVEL_UNKNOWN),
+    ('unknown', LEVEL_UNKNOWN),
+])
+def test_normalize_level(text, level):
+    assert normalize_level(text) == level
+
+
+@pytest.mark.parametrize('text, level', [
+    # JSON 模式之前保存的 txt 结果：只看 "suspicion_level" 之后的 20 个字符
+    ('### Conclusion\nsuspicion_level: Medium\n\nReasons ...', LEVEL_MEDIUM),
+    ('suspicion_level = "high"', LEVEL_HIGH),
+    ('suspicion_level' + ' ' * 20 + 'High', LEVEL_UNKNOWN),
+    ('no level here, high volume', LEVEL_MISSING),
+    ('first mention of suspicion_level: Low; later suspicion_level: High', LEVEL_LOW),
+])
+def test_scan_level(text, level):
+    assert _scan_level(text) == level
+
+
+@pytest.mark.parametrize('level, label, is_ml', [
+    (LEVEL_HIGH, 'high-ML', True),
+    (LEVEL_MEDIUM, 'mid-ML', True),
+    (LEVEL_LOW, 'low-ML', True),
+    (LEVEL_NONE, 'No Suspicion', False),
+    (LEVEL_UNKNOWN, 'unknown', False),
+    (LEVEL_MISSING, '-1_unknown', True),
+])
+def test_label(level, label, is_ml):
+    verdict = Verdict(level)
+    assert verdict.label == label and verdict.is_ml == is_ml
+
+
+@pytest.mark.parametrize('verdict', [
+    parse_verdict(json.dumps(FULL)),
+    parse_verdict('suspicion_level: Low'),
+    Verdict(LEVEL_NONE, {dim: '' for dim in DIMENSIONS}, {dim: 'x' * 100000 for dim in DIMENSIONS}, True),
+] + [Verdict(level, {dim: level for dim in DIMENSIONS}, {dim: '证据 ✓' for dim in DIMENSIONS}) for level in LEVELS])
+def test_bytes_round_trip(verdict):
+    restored = Verdict.from_bytes(verdict.to_bytes())
+    assert restored.suspicion_level == verdict.suspicion_level
+    assert restored.structured == verdict.structured
+    # 缺失的维度序列化为空字符串
+    assert restored.results == {dim: verdict.results.get(dim, '') for dim in DIMENSIONS}
+    assert restored.evidence == {dim: verdict.evidence.get(dim, '') for dim in DIMENSIONS}
+    assert restored.to_bytes() == verdict.to_bytes()
+
+
+def test_from_bytes_rejects_other_data():
+    with pytest.raises(ValueError):
+        Verdict.from_bytes(b'XX1' + Verdict(LEVEL_HIGH).to_bytes()[3:])
@@ -0,0 +1,70 @@
+import pytest
+
+import LLM_detection
+from LLM_detection import cached_llm_verdict, record_llm_verdict, verdict_key
+from verdict import Verdict, LEVEL_LOW, LEVEL_UNKNOWN, LEVEL_MISSING
+from verdict_cache import VerdictCache, normalize_prompt
+
+###
+# 判断缓存：地址编号归一化后跨地址共用判断、没有可疑等级的判断不缓存
+
+LOW = '{"suspicion_level": "Low"}'
+
+
+def prompt(core: int, peers) -> str:
+    rows = '\n'.join(f'in,[Addr-{p}],100.5,USDT' for p in peers)
+    return f'Is the core address [Addr-{core}] laundering?\n{{"target_address":"[Addr-{core}]"}}\n{rows}'
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = VerdictCache(str(tmp_path / 'verdicts.sqlite'))
+    monkeypatch.setattr(LLM_detection, 'get_verdict_cache', lambda: cache)
+    monkeypatch.setattr(LLM_detection, 'LLM_RESULT_PATH', str(tmp_path) + '/')
+    yield cache
+    cache.close()
+
+
+def test_normalize_prompt():
+    assert normalize_prompt(prompt(7, [3, 12, 3])) == prompt(0, [1, 2, 1]).replace('[Addr-0]', '[Core]').replace(
+        '[Addr-1]', '[Peer-1]').replace('[Addr-2]', '[Peer-2]')
+    assert normalize_prompt('no ids') == 'no ids'
+
+
+def test_key_shared_across_addresses():
+    # 编号不同、结构相同：同一个键
+    assert verdict_key(prompt(7, [3, 12, 3])) == verdict_key(prompt(40, [41, 2, 41]))
+    # 对手方的出现方式不同（重复的是另一个地址）、核心地址作为对手方出现：键不同
+    assert verdict_key(prompt(7, [3, 12, 3])) != verdict_key(prompt(7, [3, 12, 12]))
+    assert verdict_key(prompt(7, [3, 12])) != verdict_key(prompt(7, [7, 12]))
+
+
+def test_cross_address_hit(cache):
+    assert record_llm_verdict('0xa', prompt(7, [3, 12]), LOW) == [True, 'low-ML']
+    assert cached_llm_verdict('0xb', prompt(40, [41, 2])) == [True, 'low-ML']
+    assert cache.get_address('0xb').suspicion_level == LEVEL_LOW
+
+
+def test_unknown_not_cached(cache):
+    record_llm_verdict('0xa', prompt(1, [2]), LOW)
+    assert cache.get_address('0xa') is not None
+    # 同一地址的新判断无法解析：不缓存，去掉旧的关联，下游改读结果文件
+    assert record_llm_verdict('0xa', prompt(1, [2, 3]), '{"suspicion_level": "unsure"}') == [False, 'unknown']
+    assert cache.get(verdict_key(prompt(1, [2, 3]))) is None
+    assert cache.get_address('0xa') is None
+    assert cached_llm_verdict('0xa', prompt(1, [2, 3])) is None
+    assert record_llm_verdict('0xb', prompt(4, [5, 6, 7]), 'I cannot decide.') == [True, '-1_unknown']
+    assert cache.get(verdict_key(prompt(4, [5, 6, 7]))) is None
+    assert not cache.put('k', 'model', Verdict(LEVEL_UNKNOWN), 'x')
+    assert not cache.put('k', 'model', Verdict(LEVEL_MISSING), 'x')
+
+
+def test_legacy_unknown_rows_ignored(cache):
+    # 旧版本写入的 Unknown 判断：不命中，evict 时删除
+    cache._conn.execute(
+        'INSERT INTO verdicts (key, model, version, is_ml, label, record, response, created) VALUES (?,?,?,?,?,?,?,?)',
+        ('old', 'model', cache.version, 0, 'unknown', Verdict(LEVEL_UNKNOWN).to_bytes(), 'x', 1e18))
+    cache.link('0xc', 'old')
+    assert cache.get('old') is None
+    assert cache.get_address('0xc') is None
+    assert cache.evict() == 1
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from label_index import address_keys
+from visited_set import BloomFilter, VisitedSet
+
+###
+# 跨层去重的已访问集合：布隆过滤器误判时落到 SQLite 精确确认、同一层重复 claim 幂等、其他层不再入队、
+# 多个连接（进程）同时 claim、超过容量后重建
+
+EVENT = 'case'
+
+
+def addr(n: int) -> str:
+    return '0x' + f'{n:040x}'
+
+
+@pytest.fixture
+def visited(tmp_path):
+    visited = VisitedSet(str(tmp_path / 'visited.sqlite'), capacity=64)
+    yield visited
+    visited.close()
+
+
+def test_bloom_no_false_negatives():
+    bloom = BloomFilter(capacity=1000)
+    keys = address_keys([addr(i) for i in range(1000)])
+    bloom.add(keys)
+    assert bloom.contains(keys).all()
+    others = bloom.contains(address_keys([addr(10 ** 6 + i) for i in range(10000)]))
+    assert others.mean() < 0.01
+
+
+def test_false_positive_falls_through(visited):
+    visited.claim(EVENT, 0, [addr(1)])
+    # 布隆过滤器全部判为“可能见过”：没见过的地址经精确查询后照常记录
+    visited._bloom(EVENT).bits[:] = 0xFF
+    assert visited.claim(EVENT, 1, [addr(1), addr(2), addr(3)]) == [addr(2), addr(3)]
+    assert visited.first_depths(EVENT, [addr(1), addr(2), addr(4)]) == {addr(1): 0, addr(2): 1}
+    assert visited.count(EVENT) == 3
+
+
+def test_claim_same_depth_is_idempotent(visited):
+    mixed = '0x' + f'{0xabc:040X}'  # 大小写不同视为同一地址
+    assert visited.claim(EVENT, 2, [addr(1), mixed, addr(1)]) == [addr(1), addr(0xabc)]
+    # 重算同一层（重跑、崩溃续跑）：首次出现在该层的地址仍然返回
+    assert visited.claim(EVENT, 2, [addr(0xabc), addr(3), addr(1)]) == [addr(0xabc), addr(3), addr(1)]
+    assert visited.count(EVENT) == 3
+
+
+def test_claim_other_depth(visited):
+    visited.claim(EVENT, 1, [addr(1), addr(2)])
+    assert visited.claim(EVENT, 2, [addr(2), addr(3)]) == [addr(3)]
+    assert visited.claim(EVENT, 0, [addr(1)]) == []  # 较浅的层后到也不改写首次出现的层
+    assert visited.first_depths(EVENT, [addr(1), addr(2), addr(3)]) == {addr(1): 1, addr(2): 1, addr(3): 2}
+    # 事件之间互不影响
+    assert visited.claim('other', 5, [addr(1)]) == [addr(1)]
+
+
+def test_claim_raced_by_other_connection(visited):
+    other = VisitedSet(visited.db_path)
+    try:
+        visited.claim(EVENT, 0, [addr(9)])  # 建好本连接的布隆过滤器
+        assert other.claim(EVENT, 1, [addr(1), addr(2)]) == [addr(1), addr(2)]
+        # 本连接的布隆过滤器没有见过 addr(1)、addr(2)：插入被忽略后按库中记录判断
+        assert visited.claim(EVENT, 2, [addr(1), addr(3)]) == [addr(3)]
+        assert visited.claim(EVENT, 1, [addr(2)]) == [addr(2)]
+    finally:
+        other.close()
+
+
+def test_bloom_rebuilt_past_capacity(visited):
+    addresses = [addr(i) for i in range(500)]
+    for i in range(0, 500, 50):
+        assert visited.claim(EVENT, 1, addresses[i:i + 50]) == addresses[i:i + 50]
+    assert visited._bloom(EVENT).capacity >= 500
+    assert visited.claim(EVENT, 2, addresses) == []
+    assert np.all(visited._bloom(EVENT).contains(address_keys(addresses)))
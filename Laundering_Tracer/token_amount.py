@@ -0,0 +1,171 @@
+from decimal import Decimal
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+###
+# 精确代币金额：原始 uint256 金额按 decimals 缩放后存为两个 int64 分量
+#   amount_int  = 整数部分（代币单位）
+#   amount_frac = 小数部分 × 10^18（统一 18 位小数，不同代币可直接比较）
+# 缩放、求和、阈值比较、前 k 大全部在整数上向量化完成，不经过 float 或字符串
+# 精度上限：整数部分超过 AMOUNT_INT_MAX 时截断并标记 value_overflow，第 18 位之后的小数截断（不四舍五入）
+# 被截断的记录以 tx_store 的 value 列（decimal256 原始金额）为准：resolve_overflow 按原始金额重新拆分，
+# 整数部分为不截断的 Python 整数（object 列），求和、比较、排序、格式化照常使用
+# value 列本身最多 76 位，超出的原始金额（只有垃圾代币）在导入时已截断为 76 个 9
+
+FRAC_DIGITS = 18
+FRAC_SCALE = 10 ** FRAC_DIGITS
+# 整数部分上限：超出视为溢出并截断（仅垃圾代币会出现），留出余量保证分组求和不溢出 int64
+AMOUNT_INT_MAX = 10 ** 15
+_HALF = 10 ** 9  # 小数部分拆成高低两段各 9 位再求和，避免 int64 溢出
+
+Number = Union[int, float, str, Decimal]
+
+
+def split_exact(value: int, decimals: int) -> Tuple[int, int]:
+    """原始金额 -> (整数部分, 小数部分×10^18)，整数部分不截断"""
+    value = int(value)
+    decimals = int(decimals)
+    if decimals <= 0:
+        return value * 10 ** (-decimals), 0
+    whole, rem = divmod(value, 10 ** decimals)
+    if decimals <= FRAC_DIGITS:
+        return whole, rem * 10 ** (FRAC_DIGITS - decimals)
+    return whole, rem // 10 ** (decimals - FRAC_DIGITS)  # 超过 18 位小数的部分截断
+
+
+def split_amount(value: int, decimals: int) -> Tuple[int, int, bool]:
+    """原始金额 -> (整数部分, 小数部分×10^18, 是否溢出截断)"""
+    whole, frac = split_exact(value, decimals)
+    if whole > AMOUNT_INT_MAX:
+        return AMOUNT_INT_MAX, 0, True
+    return whole, frac, False
+
+
+def to_limbs(values: Iterable[int], decimals: Iterable[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """批量拆分原始金额（导入时执行一次），返回 (amount_int, amount_frac, overflow)"""
+    parts = [split_amount(v, d) for v, d in zip(values, decimals)]
+    if not parts:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, bool)
+    whole, frac, overflow = zip(*parts)
+    return np.array(whole, np.int64), np.array(frac, np.int64), np.array(overflow, bool)
+
+
+def exact_limbs(whole, frac, overflow, value, decimals) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    溢出截断的记录按原始金额（value）重新拆分；没有溢出时原样返回 int64 数组，
+    否则整数部分为 object 数组（Python 整数，不截断）
+    """
+    whole = np.asarray(whole, np.int64)
+    frac = np.asarray(frac, np.int64)
+    rows = np.flatnonzero(np.asarray(overflow, bool))
+    if len(rows) == 0:
+        return whole, frac
+    whole = whole.astype(object)
+    frac = frac.copy()
+    value = np.asarray(value, dtype=object)
+    decimals = np.asarray(decimals)
+    for i in rows:
+        whole[i], frac[i] = split_exact(value[i], decimals[i])
+    return whole, frac
+
+
+def resolve_overflow(df: pd.DataFrame, whole: str = 'amount_int', frac: str = 'amount_frac') -> pd.DataFrame:
+    """tx_store 的记录：value_overflow 为真的行以 value 列为准（没有这几列或没有溢出时原样返回）"""
+    if 'value_overflow' not in df.columns or not df['value_overflow'].any():
+        return df
+    w, f = exact_limbs(df[whole], df[frac], df['value_overflow'], df['value'], df['decimals'])
+    return df.assign(**{whole: w, frac: f})
+
+
+def threshold_limbs(amount: Number) -> Tuple[int, int]:
+    """阈值（如 10、'0.5'）转为 (整数部分, 小数部分×10^18)"""
+    d = Decimal(str(amount))
+    whole = int(d // 1)
+    frac = int((d - whole) * FRAC_SCALE)
+    return whole, frac
+
+
+def ge(whole: np.ndarray, frac: np.ndarray, amount: Number) -> np.ndarray:
+    """金额 >= amount（精确比较）"""
+    tw, tf = threshold_limbs(amount)
+    whole = np.asarray(whole)
+    frac = np.asarray(frac)
+    return (whole > tw) | ((whole == tw) & (frac >= tf))
+
+
+def normalize(whole: np.ndarray, frac_hi: np.ndarray, frac_lo: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """把分段求和后的小数进位回整数部分"""
+    frac_hi = frac_hi + frac_lo // _HALF
+    frac_lo = frac_lo % _HALF
+    whole = whole + frac_hi // _HALF
+    frac_hi = frac_hi % _HALF
+    return whole, frac_hi * _HALF + frac_lo
+
+
+def _whole_dtype(whole: np.ndarray):
+    """整数部分的求和类型：含不截断的 Python 整数（exact_limbs）时按 object 求和"""
+    return object if whole.dtype == object else np.int64
+
+
+def sum_limbs(whole: np.ndarray, frac: np.ndarray) -> Tuple[int, int]:
+    """精确求和，返回 (整数部分, 小数部分×10^18)"""
+    whole = np.asarray(whole)
+    frac = np.asarray(frac, np.int64)
+    w, f = normalize(int(np.sum(whole, dtype=_whole_dtype(whole))), int(np.sum(frac // _HALF, dtype=np.int64)),
+                     int(np.sum(frac % _HALF, dtype=np.int64)))
+    return int(w), int(f)
+
+
+def group_sum(df: pd.DataFrame, keys, whole: str = 'amount_int', frac: str = 'amount_frac') -> pd.DataFrame:
+    """按 keys 分组精确求和，返回含 keys 与 whole/frac 两列的 DataFrame"""
+    tmp = df[list(keys)].copy()
+    dtype = _whole_dtype(df[whole].to_numpy())
+    tmp[whole] = df[whole].to_numpy(dtype)
+    tmp['_hi'] = df[frac].to_numpy(np.int64) // _HALF
+    tmp['_lo'] = df[frac].to_numpy(np.int64) % _HALF
+    sums = tmp.groupby(list(keys), sort=True)[[whole, '_hi', '_lo']].sum().reset_index()
+    w, f = normalize(sums[whole].to_numpy(dtype), sums['_hi'].to_numpy(np.int64), sums['_lo'].to_numpy(np.int64))
+    sums[whole] = w
+    sums[frac] = f
+    return sums.drop(columns=['_hi', '_lo'])
+
+
+def argsort_desc(whole: np.ndarray, frac: np.ndarray) -> np.ndarray:
+    """按金额降序的稳定排序下标（相等时保持原顺序）"""
+    return np.lexsort((-np.asarray(frac), -np.asarray(whole)))
+
+
+def topk(whole: np.ndarray, frac: np.ndarray, k: int) -> np.ndarray:
+    """前 k 大金额的下标（降序，相等时保持原顺序）"""
+    n = len(whole)
+    if k >= n:
+        return argsort_desc(whole, frac)
+    # 先按整数部分粗选候选集合（包含与第 k 名整数部分相同的全部记录），再精确排序
+    kth = np.partition(np.asarray(whole), n - k)[n - k]
+    cand = np.flatnonzero(np.asarray(whole) >= kth)
+    order = cand[argsort_desc(np.asarray(whole)[cand], np.asarray(frac)[cand])]
+    return order[:k]
+
+
+def to_float(whole, frac):
+    """转为浮点数（仅用于展示和统计量）"""
+    return np.asarray(whole, np.float64) + np.asarray(frac, np.float64) / FRAC_SCALE
+
+
+def format_amount(whole: int, frac: int, places: int = 6, thousands: bool = False, strip: bool = False) -> str:
+    """精确格式化金额（截断到 places 位小数）"""
+    whole = int(whole)
+    text = f"{whole:,}" if thousands else str(whole)
+    if places > 0:
+        digits = f"{int(frac):0{FRAC_DIGITS}d}"[:places]
+        text = text + "." + digits
+        if strip:
+            text = text.rstrip('0').rstrip('.')
+    return text
+
+
+def amount_decimal(value: int, decimals: int) -> Decimal:
+    """原始金额转精确 Decimal（value / 10^decimals）"""
+    return Decimal(int(value)).scaleb(-int(decimals))
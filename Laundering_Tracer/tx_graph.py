@@ -0,0 +1,273 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from token_amount import resolve_overflow, to_float
+from tx_store import load_depth_transfers
+
+###
+# 内存交易图：下一跳选择、污点传播、特征提取、解释共用，不必每个阶段重新读 CSV、按字符串比较 address_from / address_to
+# 地址和代币合约驻留为 int32 编号；边为 NumPy 数组（src、dst、token、amount、timestamp），每层交易读入后追加
+# 同一笔转账在发送方和接收方的记录中各出现一次，按判重键（与 tx_store.DEDUP_KEY 相同）只保留一条
+# 邻接表按需重建：CSR 按发送方分组、CSC 按接收方分组，组内均按时间排序
+# 边只追加不删除，边的下标在图的生命周期内不变（其他模块可以按下标缓存边上的结果）
+# 多个线程共用一张图时，追加和读取都在 graph.lock 内进行（update_graph 已加锁）
+
+_KEY_COLUMNS = ['hash', 'address_from', 'address_to', 'contract_address', 'value', 'token_id']
+
+
+class Adjacency:
+    """压缩邻接表：indptr[n+1]，行 u 的边为 edge[indptr[u]:indptr[u+1]]（原始边下标，按时间排序）"""
+
+    def __init__(self, n: int, rows: np.ndarray, cols: np.ndarray, ts: np.ndarray):
+        self.edge = np.lexsort((ts, rows))
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+        self.cols = cols[self.edge]
+        self.ts = ts[self.edge]
+
+    def row(self, u: int, since: Optional[int] = None) -> np.ndarray:
+        """行 u 中时间 >= since 的边在 edge / cols / ts 中的位置"""
+        start, stop = self.indptr[u], self.indptr[u + 1]
+        if since is not None:
+            start += np.searchsorted(self.ts[start:stop], since, side='left')
+        return np.arange(start, stop)
+
+    def rows(self, nodes: np.ndarray) -> np.ndarray:
+        """多行的全部边（原始边下标）"""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        starts, stops = self.indptr[nodes], self.indptr[nodes + 1]
+        lengths = stops - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.edge[offsets + np.arange(lengths.sum())]
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+
+class TxGraph:
+    """一个案件的交易图（本身不加锁，跨线程使用时持有 lock）"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._token_ids: Dict[str, int] = {}
+        self._token_names: List[str] = []
+        self._keys = set()
+        self._chunks = []
+        self._edges = None
+        self._csr = None
+        self._csc = None
+        self.depths = set()  # 已整层读入的层
+
+    # ---------- 编号 ----------
+    def _intern(self, addr: str) -> int:
+        i = self._ids.get(addr)
+        if i is None:
+            i = self._ids[addr] = len(self._names)
+            self._names.append(addr)
+        return i
+
+    def intern(self, addresses: Iterable[str]) -> np.ndarray:
+        """地址 -> 编号（不存在的地址加入图中，作为孤立点）"""
+        return np.array([self._intern(str(a).lower()) for a in addresses], dtype=np.int32)
+
+    def ids(self, addresses: Iterable[str]) -> np.ndarray:
+        """地址 -> 编号，图中没有的地址为 -1"""
+        return np.array([self._ids.get(str(a).lower(), -1) for a in addresses], dtype=np.int32)
+
+    def names(self, ids: Iterable[int]) -> np.ndarray:
+        return np.array([self._names[i] for i in np.asarray(ids, dtype=np.int64).tolist()], dtype=object)
+
+    def token_ids(self, contracts: Iterable[str]) -> np.ndarray:
+        """代币合约 -> 编号（图中没有的合约忽略）"""
+        return np.array([self._token_ids[c] for c in contracts if c in self._token_ids], dtype=np.int32)
+
+    def token_names(self) -> List[str]:
+        """代币合约（下标为编号）"""
+        return list(self._token_names)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self._names)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edges()[0])
+
+    # ---------- 追加 ----------
+    def add_transfers(self, transfers: pd.DataFrame) -> int:
+        """追加一批交易（tx_store 读出的 DataFrame），返回新增的边数"""
+        if len(transfers) == 0:
+            return 0
+        df = transfers[transfers['address_from'] != transfers['address_to']]
+        if len(df) == 0:
+            return 0
+        keys = df['hash'].astype(str)
+        for column in _KEY_COLUMNS[1:]:
+            keys = keys + '|' + df[column].fillna('').astype(str)
+        known = self._keys
+        fresh = np.array([k not in known for k in keys], dtype=bool) & ~keys.duplicated().to_numpy()
+        if not fresh.any():
+            return 0
+        df = df[fresh]
+        self._keys.update(keys[fresh])
+
+        src = self.intern(df['address_from'])
+        dst = self.intern(df['address_to'])
+        token = np.array([self._token_ids.setdefault(c, len(self._token_ids)) for c in df['contract_address']],
+                         dtype=np.int32)
+        self._token_names.extend(list(self._token_ids)[len(self._token_names):])
+        df = resolve_overflow(df)
+        amount = np.asarray(to_float(df['amount_int'], df['amount_frac']), dtype=np.float64)
+        ts = df['timestamp'].to_numpy(dtype=np.int64)
+        self._chunks.append((src, dst, token, amount, ts))
+        self._csr = self._csc = None
+        return len(src)
+
+    def load_depths(self, eventName: str, depths: Iterable[int]) -> int:
+        """整层读入尚未读入的层，返回新增的边数"""
+        added = 0
+        for depth in depths:
+            if depth not in self.depths:
+                added += self.add_transfers(load_depth_transfers(eventName, depth))
+                self.depths.add(depth)
+        return added
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(src, dst, token, amount, timestamp)，按追加顺序"""
+        if self._chunks:
+            parts = ([self._edges] if self._edges is not None else []) + self._chunks
+            self._edges = tuple(np.concatenate(cols) for cols in zip(*parts))
+            self._chunks = []
+        if self._edges is None:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty, empty, np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+        return self._edges
+
+    # ---------- 邻接 ----------
+    @property
+    def csr(self) -> Adjacency:
+        """按发送方分组（转出）"""
+        if self._csr is None:
+            src, dst, _, _, ts = self.edges()
+            self._csr = Adjacency(self.num_nodes, src, dst, ts)
+        return self._csr
+
+    @property
+    def csc(self) -> Adjacency:
+        """按接收方分组（转入）"""
+        if self._csc is None:
+            src, dst, _, _, ts = self.edges()
+            self._csc = Adjacency(self.num_nodes, dst, src, ts)
+        return self._csc
+
+    def out_edges(self, nodes) -> np.ndarray:
+        return self.csr.rows(nodes)
+
+    def in_edges(self, nodes) -> np.ndarray:
+        return self.csc.rows(nodes)
+
+    def neighbors(self, addr: str, direction: str = 'out') -> List[str]:
+        """地址的交易对手（direction 为 'out'、'in' 或 'both'）"""
+        u = self.ids([addr])
+        if u[0] < 0:
+            return []
+        src, dst, _, _, _ = self.edges()
+        found = []
+        if direction in ('out', 'both'):
+            found.append(dst[self.out_edges(u)])
+        if direction in ('in', 'both'):
+            found.append(src[self.in_edges(u)])
+        return list(self.names(np.unique(np.concatenate(found))))
+
+    def k_hop(self, addresses: Iterable[str], k: int, direction: str = 'both') -> Tuple[np.ndarray, np.ndarray]:
+        """从 addresses 出发 k 跳内的地址编号和它们之间的边下标"""
+        src, dst, _, _, _ = self.edges()
+        seen = np.zeros(self.num_nodes, dtype=bool)
+        frontier = self.ids(addresses)
+        frontier = np.unique(frontier[frontier >= 0])
+        seen[frontier] = True
+        for _ in range(k):
+            reached = []
+            if direction in ('out', 'both'):
+                reached.append(dst[self.out_edges(frontier)])
+            if direction in ('in', 'both'):
+                reached.append(src[self.in_edges(frontier)])
+            frontier = np.unique(np.concatenate(reached)) if reached else np.zeros(0, dtype=np.int32)
+            frontier = frontier[~seen[frontier]]
+            if len(frontier) == 0:
+                break
+            seen[frontier] = True
+        nodes = np.flatnonzero(seen)
+        return nodes, np.flatnonzero(seen[src] & seen[dst])
+
+    def subgraph(self, addresses: Iterable[str], k: int = 1, direction: str = 'both') -> pd.DataFrame:
+        """k 跳子图的边（DataFrame[address_from, address_to, contract_address, amount, timestamp]）"""
+        _, edges = self.k_hop(addresses, k, direction)
+        return self.edge_frame(edges)
+
+    def edge_frame(self, edges: Optional[np.ndarray] = None) -> pd.DataFrame:
+        src, dst, token, amount, ts = self.edges()
+        if edges is None:
+            edges = np.arange(len(src))
+        tokens = np.array(self._token_names, dtype=object)
+        return pd.DataFrame({'address_from': self.names(src[edges]), 'address_to': self.names(dst[edges]),
+                             'contract_address': tokens[token[edges]] if len(edges) else [],
+                             'amount': amount[edges], 'timestamp': ts[edges]})
+
+    # ---------- 汇总 ----------
+    def flows(self, edges: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        按 (发送方, 接收方) 汇总的资金流：DataFrame[source, address, amount, count]
+        edges 为参与汇总的边下标（默认全部），weights 为每条边的权重（默认金额，可传入污点金额等）
+        """
+        src, dst, _, amount, _ = self.edges()
+        if edges is None:
+            edges = np.arange(len(src))
+        weights = amount if weights is None else weights
+        if len(edges) == 0:
+            return pd.DataFrame(columns=['source', 'address', 'amount', 'count'])
+        pair = src[edges].astype(np.int64) * self.num_nodes + dst[edges]
+        pairs, inverse = np.unique(pair, return_inverse=True)
+        totals = np.bincount(inverse, weights=weights[edges])
+        counts = np.bincount(inverse)
+        n = self.num_nodes
+        return pd.DataFrame({'source': self.names(pairs // n), 'address': self.names(pairs % n),
+                             'amount': totals, 'count': counts})
+
+    def node_flows(self) -> pd.DataFrame:
+        """每个地址的转入 / 转出金额和笔数：DataFrame[address, in_amount, out_amount, in_count, out_count]"""
+        src, dst, _, amount, _ = self.edges()
+        n = self.num_nodes
+        return pd.DataFrame({'address': np.array(self._names, dtype=object),
+                             'in_amount': np.bincount(dst, weights=amount, minlength=n),
+                             'out_amount': np.bincount(src, weights=amount, minlength=n),
+                             'in_count': np.bincount(dst, minlength=n), 'out_count': np.bincount(src, minlength=n)})
+
+
+# 每个进程每个案件一张图
+_GRAPHS = {}
+_GRAPHS_LOCK = threading.Lock()
+def get_tx_graph(eventName: str) -> TxGraph:
+    key = (os.getpid(), eventName)
+    with _GRAPHS_LOCK:
+        if key not in _GRAPHS:
+            _GRAPHS[key] = TxGraph()
+        return _GRAPHS[key]
+
+
+def update_graph(eventName: str, depth: int, transfers: Optional[pd.DataFrame] = None) -> TxGraph:
+    """读入第 depth 层之前尚未读入的层并追加本批交易（第 depth 层的部分源地址），返回案件的交易图"""
+    graph = get_tx_graph(eventName)
+    with graph.lock:
+        graph.load_depths(eventName, range(depth))
+        if transfers is not None:
+            graph.add_transfers(transfers)
+    return graph
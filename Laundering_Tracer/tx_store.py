@@ -0,0 +1,437 @@
+import os
+import glob
+import uuid
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from token_amount import to_limbs
+
+###
+# 列式交易存储：用 Parquet 替代 blockscan_data/<addr>/AccountTransferItem.csv
+# 目录结构：TX_STORE_PATH/event=<eventName>/depth=<depth>/part-*.parquet
+# 每个分区保存该层所有源地址（source 列）的转账记录，按 source 排序，读取时一次加载整层
+# 一次性导入：python tx_store.py <eventName> [depth ...]
+
+BLOCKSCAN_PATH = 'G:/RiskTagger/blockscan_data/'  # 爬虫输出的 CSV 目录（导入来源）
+TX_STORE_PATH = 'G:/RiskTagger/tx_store/'  # 列式存储根目录
+SRC_ADDR_PATH = 'D:/FORGE2/XBlock/src_addr_token/'  # 每层源地址列表
+
+# decimal256 最大精度为 76 位，uint256 最多 78 位；超出部分截断为最大值并标记 value_overflow
+# amount_int / amount_frac 为按 decimals 缩放后的精确金额（见 token_amount），导入时计算一次；
+# 缩放后整数部分超出 AMOUNT_INT_MAX 时同样截断并标记 value_overflow，读取方以 value 列为准（token_amount.resolve_overflow）
+VALUE_PRECISION = 76
+VALUE_MAX = Decimal(10 ** VALUE_PRECISION - 1)
+
+ADDRESS_TYPE = pa.dictionary(pa.int32(), pa.string())
+TRANSFER_SCHEMA = pa.schema([
+    ("source", ADDRESS_TYPE),            # 被爬取的地址（该记录所属的 CSV）
+    ("hash", pa.string()),
+    ("address_from", ADDRESS_TYPE),
+    ("address_to", ADDRESS_TYPE),
+    ("value", pa.decimal256(VALUE_PRECISION, 0)),  # 原始金额（未按 decimals 缩放）
+    ("value_overflow", pa.bool_()),
+    ("amount_int", pa.int64()),          # 缩放后金额的整数部分
+    ("amount_frac", pa.int64()),         # 缩放后金额的小数部分 × 10^18
+    ("timestamp", pa.int64()),
+    ("block_number", pa.int64()),
+    ("contract_address", ADDRESS_TYPE),
+    ("symbol", ADDRESS_TYPE),
+    ("decimals", pa.int16()),
+    ("token_id", pa.string()),
+])
+
+# 同一笔转账的判重键（一个交易哈希下可能有多笔代币转账，仅凭哈希不足以判重）
+DEDUP_KEY = ['hash', 'address_from', 'address_to', 'contract_address', 'value', 'token_id']
+
+# 分区缓存：(eventName, depth) -> (按 source 排序的 Table, {source: (start, stop)})
+_PARTITION_CACHE: Dict[Tuple[str, int], Tuple[pa.Table, Dict[str, Tuple[int, int]]]] = {}
+
+
+def partition_path(eventName: str, depth: int) -> str:
+    return os.path.join(TX_STORE_PATH, f'event={eventName}', f'depth={depth}')
+
+
+def partition_depths(eventName: str) -> List[int]:
+    """磁盘上该案件已有的分区层号（升序）"""
+    depths = []
+    for path in glob.glob(os.path.join(TX_STORE_PATH, f'event={eventName}', 'depth=*')):
+        suffix = os.path.basename(path)[len('depth='):]
+        if suffix.isdigit():
+            depths.append(int(suffix))
+    return sorted(depths)
+
+
+def _read_transfer_csv(addr: str) -> pd.DataFrame:
+    """读取爬虫输出的原始 CSV（仅导入和兜底时使用），全部按字符串读入"""
+    file_path = os.path.join(BLOCKSCAN_PATH, addr, 'AccountTransferItem.csv')
+    if not os.path.exists(file_path):
+        return pd.DataFrame()
+    try:
+        return pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding='utf-8')
+    except (pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        print(f"读取 {file_path} 失败: {e}")
+        return pd.DataFrame()
+
+
+def _parse_value(s: str) -> Tuple[Decimal, bool]:
+    s = s.strip()
+    if not s.isdigit():
+        return Decimal(0), False
+    if len(s) > VALUE_PRECISION:
+        return VALUE_MAX, True
+    return Decimal(s), False
+
+
+def frame_to_table(source: str, df: pd.DataFrame) -> pa.Table:
+    """把一个地址的原始 CSV 记录转换为带类型的 Arrow 表（地址统一小写）"""
+    n = len(df)
+    if n == 0:
+        return TRANSFER_SCHEMA.empty_table()
+
+    def col(name: str) -> List[str]:
+        return df[name].astype(str).str.strip().tolist() if name in df.columns else [''] * n
+
+    def lower_col(name: str) -> List[str]:
+        return [v.lower() for v in col(name)]
+
+    def int_col(name: str) -> List[int]:
+        return [int(v) if v.lstrip('-').isdigit() else 0 for v in col(name)]
+
+    parsed = [_parse_value(v) for v in col('value')]
+    decimals = int_col('decimals')
+    amount_int, amount_frac, amount_overflow = to_limbs([int(v) for v, _ in parsed], decimals)
+    arrays = [
+        pa.array([source.lower()] * n, pa.string()).dictionary_encode(),
+        pa.array(col('hash'), pa.string()),
+        pa.array(lower_col('address_from'), pa.string()).dictionary_encode(),
+        pa.array(lower_col('address_to'), pa.string()).dictionary_encode(),
+        pa.array([v for v, _ in parsed], pa.decimal256(VALUE_PRECISION, 0)),
+        pa.array([o or bool(a) for (_, o), a in zip(parsed, amount_overflow)], pa.bool_()),
+        pa.array(amount_int, pa.int64()),
+        pa.array(amount_frac, pa.int64()),
+        pa.array(int_col('timestamp'), pa.int64()),
+        pa.array(int_col('block_number'), pa.int64()),
+        pa.array(lower_col('contract_address'), pa.string()).dictionary_encode(),
+        pa.array(col('symbol'), pa.string()).dictionary_encode(),
+        pa.array(decimals, pa.int16()),
+        pa.array(col('token_id'), pa.string()),
+    ]
+    return pa.Table.from_arrays(arrays, schema=TRANSFER_SCHEMA)
+
+
+def _write_part(eventName: str, depth: int, table: pa.Table, name: Optional[str] = None) -> str:
+    out_dir = partition_path(eventName, depth)
+    os.makedirs(out_dir, exist_ok=True)
+    if name is None:
+        name = f'part-{uuid.uuid4().hex}.parquet'
+    out_path = os.path.join(out_dir, name)
+    # 先写临时文件再替换，避免读到半个文件
+    tmp_path = out_path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, out_path)
+    _PARTITION_CACHE.pop((eventName, depth), None)
+    return out_path
+
+
+def append_transfers(eventName: str, depth: int, table: pa.Table) -> Optional[str]:
+    """向 (event, depth) 分区追加一批转账记录（新的 part 文件）"""
+    if table.num_rows == 0:
+        return None
+    return _write_part(eventName, depth, table.cast(TRANSFER_SCHEMA))
+
+
+def import_csv_tree(eventName: str = 'bybit', depth: int = 0, addresses: Optional[List[str]] = None) -> int:
+    """
+    一次性导入：把该层源地址对应的 AccountTransferItem.csv 合并写入列式存储
+    重复执行会覆盖该层的导入文件（part-import.parquet），返回导入的记录数
+    """
+    if addresses is None:
+        src_file = SRC_ADDR_PATH + eventName + '_source_addr' + str(depth) + '.csv'
+        if not os.path.exists(src_file):
+            print(f"源地址文件不存在: {src_file}")
+            return 0
+        addresses = list(pd.read_csv(src_file)['address'].astype(str).str.lower())
+
+    tables = []
+    for addr in dict.fromkeys(addresses):
+        df = _read_transfer_csv(addr)
+        if len(df) > 0:
+            tables.append(frame_to_table(addr, df))
+    if not tables:
+        print(f"{eventName} 第 {depth} 层无可导入的交易文件")
+        return 0
+
+    table = pa.concat_tables(tables, promote_options='permissive').cast(TRANSFER_SCHEMA)
+    _write_part(eventName, depth, table, name='part-import.parquet')
+    print(f"{eventName} 第 {depth} 层导入 {len(tables)} 个地址，共 {table.num_rows} 条交易")
+    return table.num_rows
+
+
+def _with_amount_limbs(table: pa.Table) -> pa.Table:
+    """旧版分区文件没有 amount_int/amount_frac 列时补算"""
+    if 'amount_int' in table.column_names:
+        return table.select(TRANSFER_SCHEMA.names)
+    values = [int(v) for v in table.column('value').to_pylist()]
+    amount_int, amount_frac, _ = to_limbs(values, table.column('decimals').to_pylist())
+    table = table.append_column('amount_int', pa.array(amount_int, pa.int64()))
+    table = table.append_column('amount_frac', pa.array(amount_frac, pa.int64()))
+    return table.select(TRANSFER_SCHEMA.names)
+
+
+def csv_max_block(data) -> Optional[int]:
+    """CSV（路径或已读入的 DataFrame）中的最高区块号，没有记录时返回 None"""
+    df = pd.read_csv(data, dtype=str, keep_default_na=False, encoding='utf-8') if isinstance(data, str) else data
+    if len(df) == 0 or 'block_number' not in df.columns:
+        return None
+    blocks = pd.to_numeric(df['block_number'], errors='coerce').dropna()
+    return int(blocks.max()) if len(blocks) > 0 else None
+
+
+def read_csv_or_empty(path: str) -> pd.DataFrame:
+    try:
+        return pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8')
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return pd.DataFrame()
+
+
+def merge_transfer_csv(file_path: str, delta_file: str) -> Tuple[int, Optional[int]]:
+    """
+    把增量爬取的 CSV 追加进已有的 AccountTransferItem.csv（按 DEDUP_KEY 去重，已有记录不改动）
+    返回 (新增记录数, 合并后的最高区块号)
+    """
+    return append_transfer_csv(file_path, read_csv_or_empty(delta_file))
+
+
+def append_transfer_csv(file_path: str, new: pd.DataFrame) -> Tuple[int, Optional[int]]:
+    """把一批记录（字符串列的 DataFrame）去重后追加进 CSV，返回 (新增记录数, 合并后的最高区块号)"""
+    old = read_csv_or_empty(file_path)
+    if len(new) == 0:
+        return 0, csv_max_block(old)
+    if len(old.columns) == 0:
+        old = pd.DataFrame(columns=new.columns)
+    key = [c for c in DEDUP_KEY if c in old.columns and c in new.columns]
+
+    def row_keys(df: pd.DataFrame) -> pd.Series:
+        cols = [df[c].astype(str).str.strip().str.lower() for c in key]
+        return cols[0].str.cat(cols[1:], sep='|')
+
+    new_keys = row_keys(new)
+    fresh = ~new_keys.isin(set(row_keys(old))) & ~new_keys.duplicated()
+    added = new[fresh.to_numpy()].reindex(columns=old.columns, fill_value='')
+    if len(added) > 0:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_header = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        added.to_csv(file_path, mode='a', header=write_header, index=False, encoding='utf-8')
+    return len(added), csv_max_block(pd.concat([old, added], ignore_index=True))
+
+
+def _dedup_keys(table: pa.Table) -> pa.ChunkedArray:
+    columns = [pc.cast(table.column(c), pa.string()) for c in DEDUP_KEY]
+    return pc.binary_join_element_wise(*columns, '|')
+
+
+def merge_address(eventName: str, depth: int, addr: str, table: Optional[pa.Table] = None) -> int:
+    """
+    把单个地址的转账记录合并进 (event, depth) 分区：与分区中该地址已有的记录按 DEDUP_KEY 去重，
+    只把新记录写成一个新的 part 文件（只追加，不改写已有文件），返回新增记录数
+    table 为 None 时读取该地址的原始 CSV
+    """
+    return merge_addresses(eventName, depth, {addr: table})[addr.lower()]
+
+
+def merge_addresses(eventName: str, depth: int, tables: Dict[str, Optional[pa.Table]]) -> Dict[str, int]:
+    """
+    批量版 merge_address：分区只加载一次，所有地址的新记录写成一个 part 文件
+    （每写一个文件分区缓存都会失效，逐地址写入时每次都要重新加载整个分区）
+    返回 {小写地址: 新增记录数}
+    """
+    partition, offsets = _load_partition(eventName, depth)
+    added: Dict[str, int] = {}
+    fresh_tables = []
+    for addr, table in tables.items():
+        addr = addr.lower()
+        if table is None:
+            table = frame_to_table(addr, _read_transfer_csv(addr))
+        added[addr] = 0
+        if table.num_rows == 0:
+            continue
+        table = table.cast(TRANSFER_SCHEMA)
+
+        keys = _dedup_keys(table)
+        first = ~pd.Index(keys.to_numpy()).duplicated(keep='first')
+        table = table.filter(pa.array(first))
+        keys = keys.filter(pa.array(first))
+
+        if addr in offsets:
+            start, stop = offsets[addr]
+            existing = _dedup_keys(partition.slice(start, stop - start))
+            fresh = pc.invert(pc.is_in(keys, value_set=existing.combine_chunks()))
+            table = table.filter(fresh)
+        if table.num_rows > 0:
+            added[addr] = table.num_rows
+            fresh_tables.append((addr, table))
+    if len(fresh_tables) == 1:
+        addr, table = fresh_tables[0]
+        _write_part(eventName, depth, table, name=f'part-addr-{addr}-{uuid.uuid4().hex[:8]}.parquet')
+    elif fresh_tables:
+        table = pa.concat_tables([t for _, t in fresh_tables]).cast(TRANSFER_SCHEMA)
+        _write_part(eventName, depth, table, name=f'part-batch-{uuid.uuid4().hex[:8]}.parquet')
+    return added
+
+
+def import_address(eventName: str, depth: int, addr: str) -> int:
+    """导入单个地址刚爬取的 CSV（流水线逐地址调用，重复导入只追加新记录），返回新增记录数"""
+    return merge_address(eventName, depth, addr)
+
+
+def compact_partition(eventName: str, depth: int) -> int:
+    """把分区中的多个 part 文件合并为一个（逐地址导入完成后调用），返回记录数"""
+    files = sorted(glob.glob(os.path.join(partition_path(eventName, depth), 'part-*.parquet')))
+    if len(files) <= 1:
+        return 0
+    table, _ = _load_partition(eventName, depth)
+    name = f'part-compact-{uuid.uuid4().hex}.parquet'
+    _write_part(eventName, depth, table, name=name)
+    for f in files:
+        os.remove(f)
+    _PARTITION_CACHE.pop((eventName, depth), None)
+    return table.num_rows
+
+
+def _load_partition(eventName: str, depth: int) -> Tuple[pa.Table, Dict[str, Tuple[int, int]]]:
+    key = (eventName, depth)
+    if key in _PARTITION_CACHE:
+        return _PARTITION_CACHE[key]
+
+    files = sorted(glob.glob(os.path.join(partition_path(eventName, depth), 'part-*.parquet')))
+    if files:
+        tables = [_with_amount_limbs(pq.read_table(f)) for f in files]
+        table = pa.concat_tables(tables, promote_options='permissive')
+        table = table.cast(TRANSFER_SCHEMA)
+    else:
+        table = TRANSFER_SCHEMA.empty_table()
+
+    # 按 source 排序并记录每个 source 的行区间，按地址读取时直接切片
+    offsets: Dict[str, Tuple[int, int]] = {}
+    if table.num_rows > 0:
+        sources = table.column('source').cast(pa.string())
+        order = pc.sort_indices(sources, sort_keys=[('', 'ascending')])
+        table = table.take(order)
+        sources = sources.take(order).to_numpy(zero_copy_only=False)
+        bounds = [0] + list(np.flatnonzero(sources[1:] != sources[:-1]) + 1) + [len(sources)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            offsets[sources[start]] = (int(start), int(stop))
+
+    _PARTITION_CACHE[key] = (table, offsets)
+    return table, offsets
+
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    """Arrow 表转 DataFrame，字典列还原为普通字符串列，value 为精确整数（Decimal）"""
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(pa.string())
+        columns[name] = column
+    return pa.table(columns).to_pandas()
+
+
+def _nonzero(table: pa.Table) -> pa.Table:
+    zero = pa.scalar(Decimal(0), pa.decimal256(VALUE_PRECISION, 0))
+    return table.filter(pc.not_equal(table.column('value'), zero))
+
+
+def load_depth_table(eventName: str, depth: int, sources: Optional[List[str]] = None,
+                     nonzero: bool = True) -> pa.Table:
+    """读取一整层的转账记录（Arrow 表），可选只保留指定源地址"""
+    table, _ = _load_partition(eventName, depth)
+    if sources is not None:
+        wanted = pa.array([s.lower() for s in sources], pa.string())
+        table = table.filter(pc.is_in(table.column('source').cast(pa.string()), value_set=wanted))
+    return _nonzero(table) if nonzero else table
+
+
+def load_depth_transfers(eventName: str, depth: int, sources: Optional[List[str]] = None,
+                         nonzero: bool = True) -> pd.DataFrame:
+    """读取一整层的转账记录（DataFrame）"""
+    return to_frame(load_depth_table(eventName, depth, sources=sources, nonzero=nonzero))
+
+
+def load_sources_transfers(eventName: str, depth: int, sources: List[str], nonzero: bool = True) -> pd.DataFrame:
+    """读取一层中指定源地址的转账记录；不在分区中的地址兜底读取原始 CSV"""
+    table = load_depth_table(eventName, depth, sources=sources, nonzero=nonzero)
+    _, offsets = _load_partition(eventName, depth)
+    missing = [s for s in sources if s.lower() not in offsets]
+    extra = [frame_to_table(s, _read_transfer_csv(s)) for s in missing]
+    extra = [t for t in extra if t.num_rows > 0]
+    if extra:
+        extra = pa.concat_tables(extra, promote_options='permissive').cast(TRANSFER_SCHEMA)
+        table = pa.concat_tables([table, _nonzero(extra) if nonzero else extra], promote_options='permissive')
+    return to_frame(table)
+
+
+def load_address_table(addr: str, eventName: str = 'bybit', depth: Optional[int] = None,
+                       nonzero: bool = True) -> pa.Table:
+    """
+    读取单个地址的转账记录（Arrow 表）
+    优先从 (event, depth) 分区读取；depth 为 None 时依次查找该案件的所有分区（先查已加载的，再按层号读取磁盘上的）；
+    都没有时兜底读取原始 CSV
+    """
+    addr = addr.lower()
+    if depth is not None:
+        candidates = [(eventName, depth)]
+    else:
+        candidates = [key for key in _PARTITION_CACHE if key[0] == eventName]
+        candidates += [(eventName, dep) for dep in partition_depths(eventName) if (eventName, dep) not in candidates]
+
+    for event, dep in candidates:
+        table, offsets = _load_partition(event, dep)
+        if addr in offsets:
+            start, stop = offsets[addr]
+            table = table.slice(start, stop - start)
+            return _nonzero(table) if nonzero else table
+
+    table = frame_to_table(addr, _read_transfer_csv(addr))
+    return _nonzero(table) if nonzero else table
+
+
+def load_address_transfers(addr: str, eventName: str = 'bybit', depth: Optional[int] = None,
+                           nonzero: bool = True) -> pd.DataFrame:
+    """读取单个地址的转账记录（DataFrame），列名与 AccountTransferItem.csv 一致"""
+    return to_frame(load_address_table(addr, eventName, depth, nonzero=nonzero))
+
+
+def in_partition(eventName: str, depth: int, addr: str) -> bool:
+    """地址在 (event, depth) 分区中是否已有记录"""
+    _, offsets = _load_partition(eventName, depth)
+    return addr.lower() in offsets
+
+
+def has_address(addr: str, eventName: str = 'bybit', depth: Optional[int] = None) -> bool:
+    """地址是否已有交易数据（存储或原始 CSV 中）"""
+    if depth is not None and in_partition(eventName, depth, addr):
+        return True
+    return os.path.exists(os.path.join(BLOCKSCAN_PATH, addr, 'AccountTransferItem.csv'))
+
+
+if __name__ == '__main__':
+    import sys
+    event = sys.argv[1] if len(sys.argv) > 1 else 'bybit'
+    if len(sys.argv) > 2:
+        depths = [int(d) for d in sys.argv[2:]]
+    else:
+        depths = []
+        prefix = SRC_ADDR_PATH + event + '_source_addr'
+        for f in glob.glob(prefix + '*.csv'):
+            suffix = f[len(prefix):-len('.csv')]
+            if suffix.isdigit():
+                depths.append(int(suffix))
+    for dep in sorted(depths):
+        import_csv_tree(event, dep)
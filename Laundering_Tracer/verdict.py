@@ -0,0 +1,137 @@
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+###
+# 大模型判断结果的统一格式：请求时开启 JSON 模式（response_format=json_object），
+# 回复只在这里解析一次，得到类型化的 Verdict；之后各阶段直接读取记录（二进制序列化后存入 verdict_cache），
+# 不再各自扫描文本里 "suspicion_level" 之后的几十个字符
+# 回复中根本没有 suspicion_level 字段时（LEVEL_MISSING）沿用原有口径：标签 -1_unknown，计为洗钱（Is_ML=True）；
+# 有该字段但无法识别等级时为 LEVEL_UNKNOWN（标签 unknown，不计为洗钱）
+
+LEVEL_HIGH = 'High'
+LEVEL_MEDIUM = 'Medium'
+LEVEL_LOW = 'Low'
+LEVEL_NONE = 'No Suspicion'
+LEVEL_UNKNOWN = 'Unknown'
+LEVEL_MISSING = 'Missing'  # 回复中没有 suspicion_level 字段
+
+LEVELS = [LEVEL_UNKNOWN, LEVEL_NONE, LEVEL_LOW, LEVEL_MEDIUM, LEVEL_HIGH, LEVEL_MISSING]  # 下标即二进制编码
+LEVEL_LABELS = {LEVEL_HIGH: 'high-ML', LEVEL_MEDIUM: 'mid-ML', LEVEL_LOW: 'low-ML',
+                LEVEL_NONE: 'No Suspicion', LEVEL_UNKNOWN: 'unknown', LEVEL_MISSING: '-1_unknown'}
+UNPARSED_LEVELS = (LEVEL_UNKNOWN, LEVEL_MISSING)  # 没有得到可疑等级（不写入判断缓存）
+
+# 四个风险维度（与 Prompt 中的 JSON 输出格式一致）
+DIMENSIONS = ['a_transaction_patterns', 'b_fund_flows', 'c_associated_addresses', 'd_temporal_behavioral_signs']
+
+_MAGIC = b'VD1'
+_HEAD = struct.Struct('<3sBB')
+_LEN = struct.Struct('<I')
+
+
+@dataclass
+class Verdict:
+    """单个地址的大模型判断结果"""
+    suspicion_level: str = LEVEL_UNKNOWN
+    results: Dict[str, str] = field(default_factory=dict)    # 维度 -> result
+    evidence: Dict[str, str] = field(default_factory=dict)   # 维度 -> evidence
+    structured: bool = False  # 是否从 JSON 解析（False 表示回退到文本扫描）
+
+    @property
+    def label(self) -> str:
+        return LEVEL_LABELS[self.suspicion_level]
+
+    @property
+    def is_ml(self) -> bool:
+        return self.suspicion_level in (LEVEL_HIGH, LEVEL_MEDIUM, LEVEL_LOW, LEVEL_MISSING)
+
+    @property
+    def parsed(self) -> bool:
+        return self.suspicion_level not in UNPARSED_LEVELS
+
+    def to_bytes(self) -> bytes:
+        """二进制序列化：头部（魔数、等级编码、标志）+ 8 个长度前缀的 UTF-8 字符串"""
+        parts = [_HEAD.pack(_MAGIC, LEVELS.index(self.suspicion_level), int(self.structured))]
+        for dim in DIMENSIONS:
+            for text in (self.results.get(dim, ''), self.evidence.get(dim, '')):
+                raw = text.encode('utf-8')
+                parts.append(_LEN.pack(len(raw)))
+                parts.append(raw)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Verdict':
+        magic, level, structured = _HEAD.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError('不是 Verdict 记录')
+        offset = _HEAD.size
+        verdict = cls(LEVELS[level], structured=bool(structured))
+        for dim in DIMENSIONS:
+            for target in (verdict.results, verdict.evidence):
+                (n,) = _LEN.unpack_from(data, offset)
+                offset += _LEN.size
+                target[dim] = data[offset:offset + n].decode('utf-8')
+                offset += n
+        return verdict
+
+
+def normalize_level(text: str) -> str:
+    """把模型给出的等级文本归一化为 LEVELS 之一"""
+    s = str(text).strip().lower()
+    if 'no suspicion' in s or s in ('none', 'no'):
+        return LEVEL_NONE
+    if 'high' in s:
+        return LEVEL_HIGH
+    if 'medium' in s or s == 'mid':
+        return LEVEL_MEDIUM
+    if 'low' in s:
+        return LEVEL_LOW
+    return LEVEL_UNKNOWN
+
+
+def extract_json(response_text: str) -> Optional[dict]:
+    """回复中的 JSON 对象（兼容代码块标记和前后多余文字），没有时返回 None"""
+    text = response_text.strip()
+    if text.startswith('```'):
+        # 去掉 ```json ... ``` 代码块标记
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    for candidate in (text, text[text.find('{'):text.rfind('}') + 1]):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
+
+
+def _scan_level(response_text: str) -> str:
+    # 非 JSON 回复（JSON 模式之前保存的旧结果）：沿用原有的 "suspicion_level" 之后 35 个字符的扫描
+    start = response_text.find('suspicion_level')
+    if start == -1:
+        return LEVEL_MISSING
+    return normalize_level(response_text[start + len('suspicion_level'):start + 35])
+
+
+def parse_verdict(response_text: str) -> Verdict:
+    """解析大模型回复（唯一的解析入口）"""
+    data = extract_json(response_text)
+    if data is None:
+        return Verdict(_scan_level(response_text))
+    fields = {str(k).strip().lower().replace(' ', '_'): v for k, v in data.items()}
+    if 'suspicion_level' not in fields:
+        level = LEVEL_MISSING
+    else:
+        level = normalize_level(fields['suspicion_level'] or '')  # null 视为无法识别
+    verdict = Verdict(level, structured=True)
+    for dim in DIMENSIONS:
+        value = fields.get(dim, {})
+        if isinstance(value, dict):
+            verdict.results[dim] = str(value.get('result', ''))
+            verdict.evidence[dim] = str(value.get('evidence', ''))
+        else:
+            verdict.results[dim] = str(value)
+            verdict.evidence[dim] = ''
+    return verdict
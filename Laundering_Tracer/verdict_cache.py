@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+from multiprocessing import util
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from verdict import Verdict, LEVEL_LABELS, UNPARSED_LEVELS
+
+###
+# 大模型判断结果缓存（内容寻址）：键为 sha256(模型, temperature, 对话消息[系统提示 + 归一化后的 Prompt])
+# 值为已解析的判断记录（verdict.Verdict 的二进制序列化）和原始回复，存放在本地 SQLite
+# 另记录 地址 -> 键 的对应关系，下游（分类、result_process）按地址直接读取判断记录
+# Prompt 模板或系统提示一改，键随之改变，旧结果不会再被命中
+# 归一化（normalize_prompt）：Prompt 中的地址编号 [Addr-N] 按首次出现的顺序换成角色占位符
+# （第一个为核心地址 [Core]，其余依次为 [Peer-1]、[Peer-2]…），编号只是事件内的发现顺序，
+# 换掉后不同地址的特征摘要结构相同即共用同一结果（命中时复用的原始回复中仍是首次判断时的编号）
+# 没有得到可疑等级（Unknown / Missing，见 verdict）的判断不缓存，下次重新调用大模型
+# 失效方式：TTL 过期，或提升 CACHE_VERSION 使旧版本全部失效
+# 命中统计（cache_stats 与每条的 hits）先在内存中累计，每 STATS_FLUSH_LOOKUPS 次查询、report / close 或进程退出时写入
+
+VERDICT_CACHE_PATH = 'G:/RiskTagger/verdict_cache.sqlite'
+CACHE_VERSION = 2     # 判断口径变化（如标签解析规则）时手动提升；2: JSON 模式 + Verdict 记录
+VERDICT_TTL = None    # 过期时间（秒），None 表示不过期
+STATS_FLUSH_LOOKUPS = 1000  # 命中统计每累计这么多次查询写入一次
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key      TEXT    PRIMARY KEY,
+    model    TEXT    NOT NULL,
+    version  INTEGER NOT NULL,
+    is_ml    INTEGER NOT NULL,
+    label    TEXT    NOT NULL,
+    record   BLOB,
+    response TEXT    NOT NULL,
+    created  REAL    NOT NULL,
+    hits     INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_verdicts_created ON verdicts (created);
+CREATE TABLE IF NOT EXISTS address_verdicts (
+    address TEXT PRIMARY KEY,
+    key     TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name  TEXT    PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+_ADDR_ID = re.compile(r'\[Addr-\d+\]')
+_UNPARSED_LABELS = tuple(LEVEL_LABELS[level] for level in UNPARSED_LEVELS)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """地址编号按首次出现的顺序换成角色占位符：[Core]、[Peer-1]、[Peer-2]…"""
+    roles = {}
+
+    def role(match) -> str:
+        if match.group(0) not in roles:
+            roles[match.group(0)] = f"[Peer-{len(roles)}]" if roles else '[Core]'
+        return roles[match.group(0)]
+    return _ADDR_ID.sub(role, prompt)
+
+
+def cache_key(model: str, temperature: float, messages: List[Dict]) -> str:
+    """sha256(模型, temperature, 对话消息)"""
+    payload = json.dumps({'model': model, 'temperature': temperature, 'messages': messages},
+                         ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class VerdictCache:
+    """判断结果缓存，线程安全；多进程通过 SQLite WAL 共享"""
+
+    def __init__(self, db_path: str = VERDICT_CACHE_PATH, version: int = CACHE_VERSION,
+                 ttl: Optional[float] = VERDICT_TTL):
+        self.db_path = db_path
+        self.version = version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._pending = {'hits': 0, 'misses': 0}  # 尚未写入 cache_stats 的计数
+        self._key_hits = {}                        # 键 -> 尚未写入的命中次数
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        columns = [r[1] for r in self._conn.execute('PRAGMA table_info(verdicts)').fetchall()]
+        if 'record' not in columns:
+            # 版本 1 的库没有 record 列，补上（旧条目版本不符，不会被命中）
+            self._conn.execute('ALTER TABLE verdicts ADD COLUMN record BLOB')
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+    def _expired_before(self) -> float:
+        return time.time() - self.ttl if self.ttl is not None else float('-inf')
+
+    def _count(self, key: Optional[str]):
+        """在内存中记录一次查询（key 为 None 表示未命中），调用方持有锁"""
+        if key is None:
+            self.misses += 1
+            self._pending['misses'] += 1
+        else:
+            self.hits += 1
+            self._pending['hits'] += 1
+            self._key_hits[key] = self._key_hits.get(key, 0) + 1
+        if self._pending['hits'] + self._pending['misses'] >= STATS_FLUSH_LOOKUPS:
+            self._flush()
+
+    def _flush(self):
+        """把内存中的命中统计在一个事务中写入，调用方持有锁"""
+        if not self._pending['hits'] and not self._pending['misses']:
+            return
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._conn.executemany('INSERT INTO cache_stats (name, value) VALUES (?, ?) '
+                                   'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                                   [(name, n) for name, n in self._pending.items() if n])
+            self._conn.executemany('UPDATE verdicts SET hits = hits + ? WHERE key=?',
+                                   [(n, key) for key, n in self._key_hits.items()])
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._pending = {'hits': 0, 'misses': 0}
+        self._key_hits = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _valid(self, row) -> bool:
+        """row 为 (record, version, created, label)；没有可疑等级的判断（旧版本写入的）不算命中"""
+        return (row is not None and row[0] is not None and row[1] == self.version and
+                row[2] >= self._expired_before() and row[3] not in _UNPARSED_LABELS)
+
+    def get(self, key: str) -> Optional[Tuple[Verdict, str]]:
+        """命中返回 (Verdict, 原始回复)，未命中、过期、版本不符或没有可疑等级的判断返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT record, version, created, label, response FROM verdicts WHERE key=?',
+                                     (key,)).fetchone()
+            if not self._valid(row):
+                self._count(None)
+                return None
+            self._count(key)
+        return Verdict.from_bytes(row[0]), row[4]
+
+    def put(self, key: str, model: str, verdict: Verdict, response: str) -> bool:
+        """写入一条判断，返回是否写入（没有可疑等级的判断不缓存）"""
+        if not verdict.parsed:
+            return False
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO verdicts (key, model, version, is_ml, label, record, response, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, model, self.version, int(verdict.is_ml), verdict.label, verdict.to_bytes(), response,
+                 time.time()))
+        return True
+
+    def link(self, address: str, key: str):
+        """记录地址当前使用的判断结果"""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO address_verdicts (address, key, updated) VALUES (?, ?, ?)',
+                               (address.lower(), key, time.time()))
+
+    def unlink(self, address: str):
+        """地址的最新判断没有缓存（没有可疑等级）时去掉旧的关联，下游改读结果文件"""
+        with self._lock:
+            self._conn.execute('DELETE FROM address_verdicts WHERE address=?', (address.lower(),))
+
+    def get_addresses(self, addresses: Iterable[str]) -> Dict[str, Verdict]:
+        """按地址批量读取判断记录（不计入命中统计）"""
+        addresses = list({a.lower() for a in addresses})
+        found = {}
+        with self._lock:
+            for i in range(0, len(addresses), 500):
+                chunk = addresses[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    'SELECT a.address, v.record, v.version, v.created, v.label FROM address_verdicts a '
+                    f'JOIN verdicts v ON v.key = a.key WHERE a.address IN ({marks})', chunk).fetchall()
+                for address, record, version, created, label in rows:
+                    if self._valid((record, version, created, label)):
+                        found[address] = Verdict.from_bytes(record)
+        return found
+
+    def get_address(self, address: str) -> Optional[Verdict]:
+        return self.get_addresses([address]).get(address.lower())
+
+    def evict(self) -> int:
+        """删除过期、旧版本和没有可疑等级的结果，返回删除条数"""
+        with self._lock:
+            cur = self._conn.execute('DELETE FROM verdicts WHERE version != ? OR created < ? OR label IN (?, ?)',
+                                     (self.version, self._expired_before(), *_UNPARSED_LABELS))
+            self._conn.execute('DELETE FROM address_verdicts WHERE key NOT IN (SELECT key FROM verdicts)')
+            return cur.rowcount
+
+    def report(self) -> Dict:
+        with self._lock:
+            self._flush()
+            total = dict(self._conn.execute('SELECT name, value FROM cache_stats').fetchall())
+            size = self._conn.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        print(f"判断缓存：本次命中 {self.hits}，未命中 {self.misses}（命中率 {rate:.1%}）；"
+              f"累计命中 {total.get('hits', 0)}，未命中 {total.get('misses', 0)}；缓存条目 {size}")
+        return {'hits': self.hits, 'misses': self.misses, 'total_hits': total.get('hits', 0),
+                'total_misses': total.get('misses', 0), 'entries': size}
+
+
+# 每个进程一个缓存连接（进程池中 fork 出的子进程重新打开），进程退出时写入未写入的命中统计
+_CACHE = {}
+def get_verdict_cache() -> VerdictCache:
+    pid = os.getpid()
+    if pid not in _CACHE:
+        _CACHE.clear()
+        _CACHE[pid] = VerdictCache()
+        util.Finalize(_CACHE[pid], _CACHE[pid].flush, exitpriority=10)
+    return _CACHE[pid]
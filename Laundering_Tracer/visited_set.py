@@ -0,0 +1,159 @@
+import math
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from label_index import address_keys, _hash, _split_keys
+
+###
+# 跨层去重的已访问地址集合：一个案件（event）内每个地址只在第一次出现的层入队一次
+# 精确集合存放在 SQLite（event, address, first_depth），进程内每个事件一个布隆过滤器（首次使用时从库中重建），
+# 查询整列向量化：布隆过滤器判为“一定没见过”的地址不查库，可能见过的再到库中精确确认
+# claim 是幂等的：同一层重新计算下一跳（重跑、崩溃续跑）时，首次出现在该层的地址仍会返回，不会丢失
+
+VISITED_DB_PATH = 'G:/RiskTagger/visited.sqlite'
+BLOOM_CAPACITY = 1 << 16   # 布隆过滤器初始容量（地址数），超过后容量加倍并从库中重建
+BLOOM_ERROR_RATE = 0.001   # 误判率（误判只会多一次精确查询，不影响结果）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS visited (
+    event       TEXT    NOT NULL,
+    address     TEXT    NOT NULL,
+    first_depth INTEGER NOT NULL,
+    PRIMARY KEY (event, address)
+);
+"""
+
+
+class BloomFilter:
+    """按 20 字节地址键的布隆过滤器（双重哈希，位数组大小为 2 的幂）"""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = 1 << (bits - 1).bit_length()
+        self.mask = np.uint64(self.size - 1)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = np.zeros(self.size // 8, dtype=np.uint8)
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        k0, k1, k2 = _split_keys(keys)
+        h1 = _hash(k0, k1, k2)
+        h2 = _hash(k1, k2, k0) | np.uint64(1)
+        i = np.arange(self.hashes, dtype=np.uint64)
+        return (h1[:, None] + i[None, :] * h2[:, None]) & self.mask
+
+    def add(self, keys: np.ndarray):
+        if len(keys) == 0:
+            return
+        pos = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, (pos >> np.uint64(3)).astype(np.int64),
+                         (np.uint8(1) << (pos & np.uint64(7)).astype(np.uint8)))
+        self.count += len(keys)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        if len(keys) == 0:
+            return np.zeros(0, dtype=bool)
+        pos = self._positions(keys)
+        hit = (self.bits[(pos >> np.uint64(3)).astype(np.int64)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return hit.all(axis=1)
+
+
+class VisitedSet:
+    """已访问地址集合，线程安全；多进程通过 SQLite 事务保证每个地址只记录一个首次出现的层"""
+
+    def __init__(self, db_path: str = VISITED_DB_PATH, capacity: int = BLOOM_CAPACITY):
+        self.db_path = db_path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._blooms: Dict[str, BloomFilter] = {}
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _bloom(self, event: str) -> BloomFilter:
+        """事件的布隆过滤器：首次使用或超过容量时从库中重建"""
+        bloom = self._blooms.get(event)
+        if bloom is None or bloom.count > bloom.capacity:
+            rows = [r[0] for r in self._conn.execute('SELECT address FROM visited WHERE event=?', (event,))]
+            capacity = max(self.capacity, bloom.capacity if bloom is not None else 0)
+            while capacity < 2 * len(rows):
+                capacity *= 2
+            bloom = BloomFilter(capacity)
+            bloom.add(address_keys(rows))
+            self._blooms[event] = bloom
+        return bloom
+
+    def _exact(self, event: str, addresses: List[str]) -> Dict[str, int]:
+        found = {}
+        for i in range(0, len(addresses), 500):
+            chunk = addresses[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            found.update(self._conn.execute(
+                f'SELECT address, first_depth FROM visited WHERE event=? AND address IN ({marks})',
+                [event] + chunk).fetchall())
+        return found
+
+    def first_depths(self, event: str, addresses: Iterable[str]) -> Dict[str, int]:
+        """{小写地址: 首次出现的层}，未访问过的地址不在结果中"""
+        addresses = list(dict.fromkeys(a.lower() for a in addresses))
+        with self._lock:
+            maybe = self._bloom(event).contains(address_keys(addresses))
+            return self._exact(event, [a for a, m in zip(addresses, maybe) if m])
+
+    def claim(self, event: str, depth: int, addresses: Iterable[str]) -> List[str]:
+        """
+        记录本层的候选地址，返回应在本层入队的地址（保持顺序）：
+        之前没有见过的（记为首次出现在 depth），以及之前已记为首次出现在 depth 的（重算同一层时幂等）
+        """
+        addresses = list(dict.fromkeys(a.lower() for a in addresses))
+        if not addresses:
+            return []
+        with self._lock:
+            bloom = self._bloom(event)
+            maybe = bloom.contains(address_keys(addresses))
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 布隆过滤器判为可能见过的地址精确确认；其他进程新写入的地址由 INSERT OR IGNORE 的结果识别
+                seen = self._exact(event, [a for a, m in zip(addresses, maybe) if m])
+                inserted = set()
+                for addr in addresses:
+                    if addr in seen:
+                        continue
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO visited (event, address, first_depth) VALUES (?, ?, ?)',
+                        (event, addr, depth))
+                    if cursor.rowcount == 1:
+                        inserted.add(addr)
+                raced = [a for a in addresses if a not in seen and a not in inserted]
+                if raced:
+                    seen.update(self._exact(event, raced))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            bloom.add(address_keys(sorted(inserted)))
+        return [a for a in addresses if a in inserted or seen.get(a) == depth]
+
+    def count(self, event: str) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM visited WHERE event=?', (event,)).fetchone()[0]
+
+
+# 每个进程一个连接
+_VISITED = {}
+def get_visited_set() -> VisitedSet:
+    pid = os.getpid()
+    if pid not in _VISITED:
+        _VISITED.clear()
+        _VISITED[pid] = VisitedSet()
+    return _VISITED[pid]